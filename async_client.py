@@ -0,0 +1,575 @@
+"""
+Asyncio client for Gemini 2.5 Flash Image
+Coroutine counterpart to ImageGenerationClient for use inside event loops
+"""
+
+
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List, Optional, Dict, Any, Tuple
+
+
+from cache import GenerationCache, request_fingerprint
+from config import (
+   API_BASE_URL,
+   DEFAULT_MODEL,
+   USE_HTTP2,
+   ASYNC_MAX_IN_FLIGHT,
+   ImageConfig
+)
+from file_registry import ReferenceFileRegistry, is_expired_handle_error
+from image_client import ImageGenerationClient
+from scheduler import RequestScheduler
+from single_flight import SingleFlight
+from hedging import HedgingPolicy
+from budget import RequestBudget
+from endpoints import Endpoint, EndpointPool
+from transcode import Transcoder
+from metrics import Metrics
+from profiling import Profiler
+from session_manager import Session, SessionManager, SessionConfig
+from transport import AsyncHTTPTransport, TransportError, TransportResponse
+
+
+
+
+class AsyncImageGenerationClient:
+   """
+   Async client for Gemini 2.5 Flash Image generation
+  
+   generate, generate_with_reference, edit_image, fuse_images and
+   generate_with_session are coroutines. HTTP runs on the event loop via
+   httpx; base64 encoding/decoding, disk writes and PIL work run in a
+   thread pool so the loop stays responsive with many requests in flight.
+  
+   Payload building, caching, result assembly and sessions are delegated
+   to a wrapped ImageGenerationClient (self.client), which is configured
+   with the same components but never sends generateContent itself.
+  
+   Usage:
+       async with AsyncImageGenerationClient(api_key) as client:
+           results = await asyncio.gather(*(client.generate(p) for p in prompts))
+   """
+  
+   def __init__(
+       self,
+       api_key: str,
+       base_url: str = API_BASE_URL,
+       model: str = DEFAULT_MODEL,
+       default_config: Optional[ImageConfig] = None,
+       transport: Optional[AsyncHTTPTransport] = None,
+       http2: bool = USE_HTTP2,
+       max_in_flight: int = ASYNC_MAX_IN_FLIGHT,
+       executor: Optional[ThreadPoolExecutor] = None,
+       scheduler: Optional[RequestScheduler] = None,
+       cache: Optional[GenerationCache] = None,
+       file_registry: Optional[ReferenceFileRegistry] = None,
+       single_flight: Optional[SingleFlight] = None,
+       hedging: Optional[HedgingPolicy] = None,
+       endpoints: Optional[EndpointPool] = None,
+       budget: Optional[RequestBudget] = None,
+       transcoder: Optional[Transcoder] = None,
+       metrics: Optional[Metrics] = None,
+       profiler: Optional[Profiler] = None,
+       session_manager: Optional[SessionManager] = None
+   ):
+       """
+       Initialize async image generation client
+      
+       Args:
+           api_key: Google API key
+           base_url: API base URL
+           model: Model name (default: gemini-2.5-flash-image-preview)
+           default_config: Default image generation configuration
+           transport: Async HTTP transport (a pooled httpx transport if None)
+           http2: Use HTTP/2 multiplexing for the default transport
+           max_in_flight: Max concurrent API requests across all calls
+           executor: Thread pool for encoding, decoding and PIL work
+           scheduler: Optional RequestScheduler for rate limiting and retries
+           cache: Optional GenerationCache for identical requests
+           file_registry: Optional ReferenceFileRegistry to send references by URI
+           single_flight: SingleFlight group for coalescing identical concurrent requests
+           hedging: Optional HedgingPolicy for duplicating slow requests
+           endpoints: Optional EndpointPool for multi-endpoint failover
+           budget: RequestBudget for pre-flight token/size checks
+           transcoder: Transcoder converting returned images to config.output_format
+           metrics: Optional Metrics for per-stage timing spans
+           profiler: Profiler wrapping sampled generate/generate_with_session calls
+           session_manager: SessionManager for create/load_session
+       """
+       self.client = ImageGenerationClient(
+           api_key,
+           base_url,
+           model,
+           default_config,
+           stream_responses=False,
+           scheduler=scheduler,
+           cache=cache,
+           file_registry=file_registry,
+           single_flight=single_flight,
+           hedging=hedging,
+           endpoints=endpoints,
+           budget=budget,
+           transcoder=transcoder,
+           metrics=metrics,
+           profiler=profiler,
+           session_manager=session_manager
+       )
+       self.max_in_flight = max_in_flight
+       self._async_transport = transport
+       self._http2 = http2
+       self._executor = executor or ThreadPoolExecutor(
+           max_workers=min(32, max_in_flight),
+           thread_name_prefix="image-io"
+       )
+       self._owns_executor = executor is None
+       self._semaphore: Optional[asyncio.Semaphore] = None
+  
+   @property
+   def model(self) -> str:
+       """Model name"""
+       return self.client.model
+  
+   @property
+   def default_config(self) -> ImageConfig:
+       """Configuration used when a call passes none"""
+       return self.client.default_config
+  
+   @property
+   def async_transport(self) -> AsyncHTTPTransport:
+       """Shared async HTTP transport (created on first use)"""
+       if self._async_transport is None:
+           self._async_transport = AsyncHTTPTransport(
+               pool_size=self.max_in_flight,
+               http2=self._http2
+           )
+       return self._async_transport
+  
+   async def aclose(self):
+       """Close pooled connections and the worker thread pool"""
+       if self._async_transport is not None:
+           await self._async_transport.close()
+       if self._owns_executor:
+           self._executor.shutdown(wait=False)
+       self.client.close()
+  
+   async def __aenter__(self):
+       return self
+  
+   async def __aexit__(self, exc_type, exc_value, traceback):
+       await self.aclose()
+  
+   async def _run_blocking(self, func, *args, **kwargs):
+       """Run blocking (CPU or disk) work in the worker thread pool (in the caller's context)"""
+       loop = asyncio.get_running_loop()
+       context = contextvars.copy_context()
+       return await loop.run_in_executor(self._executor, partial(context.run, func, *args, **kwargs))
+  
+   async def _post_generate_content_async(self, payload: Dict[str, Any]) -> TransportResponse:
+       """
+       Send a generateContent request, bounded by max_in_flight
+      
+       Raises:
+           TransportError: On connection errors, timeouts or non-2xx status
+       """
+       client = self.client
+       if self._semaphore is None:
+           self._semaphore = asyncio.Semaphore(self.max_in_flight)
+      
+       async def send_to(endpoint: Endpoint) -> TransportResponse:
+           async with self._semaphore:
+               started = time.perf_counter()
+               with client._span("request"):
+                   response = await self.async_transport.post(
+                       f"{endpoint.base_url}/models/{client.model}:generateContent",
+                       json_body=payload,
+                       headers=client._api_headers(endpoint.api_key)
+                   )
+               client._record_transfer(response, time.perf_counter() - started, stream=False)
+               return response
+      
+       async def send() -> TransportResponse:
+           if client.endpoints is not None:
+               return await client.endpoints.call_async(send_to)
+           return await send_to(Endpoint(client.base_url))
+      
+       async def send_scheduled() -> TransportResponse:
+           if client.scheduler is not None:
+               return await client.scheduler.call_async(client.model, send)
+           return await send()
+      
+       async def send_hedged() -> TransportResponse:
+           if client.hedging is not None:
+               return await client.hedging.call_async(send_scheduled)
+           return await send_scheduled()
+      
+       try:
+           return await send_hedged()
+       except TransportError as e:
+           # A file_data handle may have expired server-side: re-upload and resend once
+           if (
+               client.file_registry is None
+               or not is_expired_handle_error(e, payload)
+               or not await self._run_blocking(client.file_registry.refresh_payload, payload)
+           ):
+               raise
+       return await send_hedged()
+  
+   async def generate(
+       self,
+       prompt: str,
+       config: Optional[ImageConfig] = None,
+       reference_images: Optional[List[str]] = None,
+       save_to: Optional[str] = None
+   ) -> Dict[str, Any]:
+       """
+       Generate image(s) from text prompt
+      
+       Args:
+           prompt: Text description of the image to generate
+           config: Image generation configuration (uses default if None)
+           reference_images: Optional list of reference image paths (max 3)
+           save_to: Optional output path (auto-generated if None)
+          
+       Returns:
+           Dict with generation results
+       """
+       client = self.client
+       config = config or client.default_config
+       started = time.perf_counter()
+      
+       # The profile covers the loop thread, so coroutines running meanwhile show up in it
+       with client._call_tags(config, reference_images), client.profiler.profile("generate"):
+           if config.num_images > 1:
+               result = await self._generate_many_async(prompt, config, reference_images, save_to)
+           else:
+               result = await self._generate_single_async(prompt, config, reference_images, save_to)
+           client._record_generation(result, started)
+       return result
+  
+   async def _generate_many_async(
+       self,
+       prompt: str,
+       config: ImageConfig,
+       reference_images: Optional[List[str]] = None,
+       save_to: Optional[str] = None
+   ) -> Dict[str, Any]:
+       """
+       Generate config.num_images images concurrently and gather them in order
+      
+       With config.multi_candidate one call asks for all images as candidates;
+       whatever it does not deliver is fanned out.
+       """
+       client = self.client
+       # Per-call bound, as the sync fan-out's thread pool (max_in_flight is process-wide)
+       concurrency = asyncio.Semaphore(config.max_concurrency)
+      
+       async def run(img_num: int) -> Dict[str, Any]:
+           current_save_to, name_suffix = client._variation_target(save_to, img_num)
+          
+           async with concurrency:
+               started = time.perf_counter()
+               single_result = await self._generate_single_async(
+                   prompt, config, reference_images, current_save_to, name_suffix=name_suffix
+               )
+           single_result["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+           return single_result
+      
+       started = time.perf_counter()
+       results: List[Dict[str, Any]] = [{} for _ in range(config.num_images)]
+       if client._use_candidates(config):
+           for img_num, single_result in (await self._generate_candidates_async(
+               prompt, config, reference_images, save_to
+           )).items():
+               results[img_num] = single_result
+      
+       remaining = [img_num for img_num in range(config.num_images) if not results[img_num]]
+       for img_num, single_result in zip(remaining, await asyncio.gather(*(run(img_num) for img_num in remaining))):
+           results[img_num] = single_result
+       total_elapsed = round(time.perf_counter() - started, 3)
+      
+       return client._combine_results(prompt, config, reference_images, results, total_elapsed)
+  
+   async def _generate_candidates_async(
+       self,
+       prompt: str,
+       config: ImageConfig,
+       reference_images: Optional[List[str]],
+       save_to: Optional[str]
+   ) -> Dict[int, Dict[str, Any]]:
+       """Request every uncached variation as a candidate of one call"""
+       client = self.client
+       started = time.perf_counter()
+       results: Dict[int, Dict[str, Any]] = {}
+       pending: List[Tuple[int, Optional[str], str, Optional[str]]] = []
+       try:
+           image_paths, results, pending = await self._run_blocking(
+               client._prepare_candidates, prompt, config, reference_images, save_to
+           )
+           if len(pending) > 1:
+               request_config, budget_report, payload = await self._run_blocking(
+                   client._candidates_payload, prompt, config, image_paths, len(pending)
+               )
+               response = await self._post_generate_content_async(payload)
+               response_data = await self._run_blocking(client._parse_response, response)
+               results.update(await self._run_blocking(
+                   client._save_candidates,
+                   response_data, pending, prompt, request_config, reference_images, budget_report
+               ))
+       except TransportError as e:
+           results.update(client._candidate_request_failed(e, pending, prompt))
+       except Exception:
+           # Invalid references, budget errors etc.: the fan-out reports them per image
+           return {}
+      
+       elapsed = round(time.perf_counter() - started, 3)
+       for single_result in results.values():
+           single_result["elapsed_seconds"] = elapsed
+       return results
+  
+   async def _save_response_images_async(
+       self,
+       response_data: Dict[str, Any],
+       config: ImageConfig,
+       save_to: Optional[str],
+       name_suffix: str
+   ) -> List[Dict[str, Any]]:
+       """Resolve output paths and decode/save every returned image off the loop"""
+       client = self.client
+       jobs = []
+       for part_index, base64_string, num_parts, num_image_parts in client._iter_inline_images(response_data):
+           output_path = client._resolve_output_path(
+               config, save_to, name_suffix, part_index, num_parts, num_image_parts
+           )
+           jobs.append(self._run_blocking(client._save_image, base64_string, output_path, config))
+       return list(await asyncio.gather(*jobs))
+  
+   async def _generate_single_async(
+       self,
+       prompt: str,
+       config: ImageConfig,
+       reference_images: Optional[List[str]] = None,
+       save_to: Optional[str] = None,
+       name_suffix: str = ""
+   ) -> Dict[str, Any]:
+       """Generate a single image"""
+       client = self.client
+       try:
+           image_paths = await self._run_blocking(client._validate_references, reference_images)
+          
+           cache_key, cached_result = await self._run_blocking(
+               client._lookup_cache, prompt, config, image_paths, reference_images, save_to, name_suffix
+           )
+           if cached_result is not None:
+               return cached_result
+          
+           if client.single_flight is None:
+               return await self._request_and_save_async(
+                   prompt, config, image_paths, reference_images, save_to, name_suffix, cache_key
+               )
+          
+           # Identical requests already in flight share one API call
+           flight_key = cache_key or await self._run_blocking(
+               request_fingerprint, client.model, prompt, image_paths, config, variant=name_suffix
+           )
+           result, shared = await client.single_flight.do_async(
+               flight_key,
+               lambda: self._request_and_save_async(
+                   prompt, config, image_paths, reference_images, save_to, name_suffix, cache_key
+               )
+           )
+           if shared:
+               return await self._run_blocking(
+                   client._shared_result, result, prompt, config, reference_images, save_to, name_suffix
+               )
+           return result
+      
+       except TransportError as e:
+           return {
+               "success": False,
+               "error": f"API request failed: {str(e)}",
+               "prompt": prompt
+           }
+       except Exception as e:
+           return {
+               "success": False,
+               "error": str(e),
+               "prompt": prompt
+           }
+  
+   async def _request_and_save_async(
+       self,
+       prompt: str,
+       config: ImageConfig,
+       image_paths: List[str],
+       reference_images: Optional[List[str]],
+       save_to: Optional[str],
+       name_suffix: str,
+       cache_key: Optional[str]
+   ) -> Dict[str, Any]:
+       """Send one generateContent request and save the returned images"""
+       client = self.client
+       config, budget_report = await self._run_blocking(client._check_budget, prompt, config, image_paths)
+       payload = await self._run_blocking(client._build_payload, prompt, config, image_paths)
+      
+       response = await self._post_generate_content_async(payload)
+       response_data = await self._run_blocking(client._parse_response, response)
+      
+       generated_files = await self._save_response_images_async(
+           response_data, config, save_to, name_suffix
+       )
+      
+       return await self._run_blocking(
+           client._finish_result,
+           response_data, generated_files, prompt, config, reference_images, cache_key, budget_report
+       )
+  
+   async def generate_with_reference(
+       self,
+       prompt: str,
+       reference_images: List[str],
+       config: Optional[ImageConfig] = None
+   ) -> Dict[str, Any]:
+       """Generate image with reference images (editing, fusion, consistency)"""
+       return await self.generate(
+           prompt=prompt,
+           config=config,
+           reference_images=reference_images
+       )
+  
+   async def edit_image(
+       self,
+       image_path: str,
+       edit_prompt: str,
+       config: Optional[ImageConfig] = None
+   ) -> Dict[str, Any]:
+       """Edit an existing image with natural language instructions"""
+       return await self.generate_with_reference(
+           prompt=edit_prompt,
+           reference_images=[image_path],
+           config=config
+       )
+  
+   async def fuse_images(
+       self,
+       image_paths: List[str],
+       fusion_prompt: str,
+       config: Optional[ImageConfig] = None
+   ) -> Dict[str, Any]:
+       """Fuse multiple images together (max 3)"""
+       if len(image_paths) < 2:
+           return {
+               "success": False,
+               "error": "Need at least 2 images to fuse"
+           }
+      
+       return await self.generate_with_reference(
+           prompt=fusion_prompt,
+           reference_images=image_paths,
+           config=config
+       )
+  
+   # ========================================================================
+   # Sessions (stored through the wrapped client's SessionManager)
+   # ========================================================================
+  
+   def create_session(self, config: Optional[SessionConfig] = None) -> Session:
+       """Create new session for maintaining context"""
+       return self.client.create_session(config)
+  
+   def load_session(self, session_id: str) -> Session:
+       """Load existing session"""
+       return self.client.load_session(session_id)
+  
+   def list_sessions(self) -> List[Dict[str, Any]]:
+       """List all available sessions"""
+       return self.client.list_sessions()
+  
+   def delete_session(self, session_id: str):
+       """Delete a session"""
+       self.client.delete_session(session_id)
+  
+   def cleanup_old_sessions(self, hours: int = 24) -> int:
+       """Clean up sessions older than specified hours (returns the number deleted)"""
+       return self.client.cleanup_old_sessions(hours)
+  
+   async def generate_with_session(
+       self,
+       session: Session,
+       prompt: str,
+       config: Optional[ImageConfig] = None,
+       reference_images: Optional[List[str]] = None,
+       use_session_history: bool = True
+   ) -> Dict[str, Any]:
+       """
+       Generate image within a session to maintain context
+      
+       Calls on the same session should be awaited one after another;
+       the session itself is not safe for concurrent mutation.
+       """
+       client = self.client
+       config = config or client.default_config
+       with client._call_tags(config, reference_images, session.session_id):
+           with client.profiler.profile("generate_with_session"):
+               started = time.perf_counter()
+               result = await self._generate_in_session_async(
+                   session, prompt, config, reference_images, use_session_history
+               )
+           client._record_generation(result, started)
+       return result
+  
+   async def _generate_in_session_async(
+       self,
+       session: Session,
+       prompt: str,
+       config: ImageConfig,
+       reference_images: Optional[List[str]],
+       use_session_history: bool
+   ) -> Dict[str, Any]:
+       """Body of generate_with_session (run with the session's metric tags)"""
+       client = self.client
+       # Add user message to session
+       session.add_message("user", prompt)
+      
+       try:
+           image_paths = await self._run_blocking(client._validate_references, reference_images)
+          
+           # Add references to session (copies files, so off the loop)
+           for image_path in image_paths:
+               await self._run_blocking(session.add_reference_image, image_path)
+          
+           config, _ = await self._run_blocking(client._check_budget, prompt, config, image_paths)
+           payload = await self._run_blocking(client._build_payload, prompt, config, image_paths)
+          
+           response = await self._post_generate_content_async(payload)
+           response_data = await self._run_blocking(client._parse_response, response)
+          
+           if response_data.get("candidates"):
+               generated_files = []
+               for part_index, base64_string, num_parts, _ in client._iter_inline_images(response_data):
+                   output_path = client._session_output_path(session, config, part_index, num_parts)
+                   saved = await self._run_blocking(client._save_image, base64_string, output_path, config)
+                   session.add_generated_image(saved["file_path"], copy_to_session=False)
+                   generated_files.append(saved)
+              
+               return await self._run_blocking(
+                   client._finish_session_generation,
+                   session, prompt, config, reference_images, generated_files, response_data
+               )
+           else:
+               return {
+                   "success": False,
+                   "error": "No images generated in response",
+                   "session_id": session.session_id
+               }
+      
+       except Exception as e:
+           return {
+               "success": False,
+               "error": str(e),
+               "session_id": session.session_id,
+               "prompt": prompt
+           }
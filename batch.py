@@ -0,0 +1,343 @@
+"""
+Batch job mode for large submissions
+Whole comic plans go out as one JSONL batch instead of dozens of interactive calls
+"""
+
+
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+
+from config import (
+   DEFAULT_BATCHES_DIR,
+   BATCH_POLL_INTERVAL,
+   BATCH_SUCCEEDED_STATE,
+   BATCH_FAILED_STATE,
+   BATCH_TERMINAL_STATES,
+   TIMESTAMP_FORMAT,
+   ImageConfig
+)
+from file_registry import files_upload_url, upload_file
+from results import GenerationResult
+from transport import TransportError
+
+
+
+
+def files_download_url(base_url: str, file_name: str) -> str:
+   """
+   Derive the media download URL for a Files API resource
+  
+   https://host/prefix/v1beta + files/abc -> https://host/prefix/download/v1beta/files/abc:download?alt=media
+   """
+   prefix, version = base_url.rstrip('/').rsplit('/', 1)
+   return f"{prefix}/download/{version}/{file_name}:download?alt=media"
+
+
+
+
+def iter_jsonl_lines(chunks) -> Iterator[bytes]:
+   """Split a stream of byte chunks into complete lines (pieces joined once per line)"""
+   pending: List[bytes] = []
+   for chunk in chunks:
+       *lines, rest = chunk.split(b"\n")
+       for line in lines:
+           pending.append(line)
+           line = b"".join(pending)
+           pending = []
+           if line.strip():
+               yield line
+       pending.append(rest)
+   line = b"".join(pending)
+   if line.strip():
+       yield line
+
+
+
+
+def _config_to_dict(config: ImageConfig) -> Dict[str, Any]:
+   """Fields needed to save results the same way an interactive call would"""
+   return {
+       "aspect_ratio": config.aspect_ratio,
+       "output_dir": config.output_dir,
+       "organize_by_date": config.organize_by_date,
+       "output_format": config.output_format,
+       "output_quality": config.output_quality,
+       "lossless": config.lossless
+   }
+
+
+
+
+class BatchJob:
+   """
+   A submitted batch of generateContent requests
+  
+   The job manifest (batch name, request keys, prompts and output
+   settings) is written next to the JSONL input, so a job submitted in
+   one run can be resumed with BatchJob.load() in another.
+  
+   Usage:
+       job = client.submit_batch([
+           {"key": "cover", "prompt": cover_prompt, "reference_images": sheets},
+           {"key": "p1_panel1", "prompt": panel_prompt, "save_to": "p1_p1.png"}
+       ])
+       results = job.wait()   # {key: result dict}
+   """
+  
+   def __init__(self, client, name: str, manifest_path: str, requests: Dict[str, Dict[str, Any]]):
+       """
+       Initialize job handle (use ImageGenerationClient.submit_batch or BatchJob.load)
+      
+       Args:
+           client: ImageGenerationClient used for polling and saving images
+           name: Batch resource name (e.g. batches/abc123)
+           manifest_path: Path of the job manifest
+           requests: Request metadata by key
+       """
+       self.client = client
+       self.name = name
+       self.manifest_path = manifest_path
+       self.requests = requests
+       self.state: Optional[str] = None
+       self.status: Dict[str, Any] = {}
+  
+   @classmethod
+   def load(cls, client, manifest_path: str) -> "BatchJob":
+       """Re-attach to a job from its manifest"""
+       with open(manifest_path, 'r', encoding='utf-8') as f:
+           manifest = json.load(f)
+       return cls(client, manifest["name"], manifest_path, manifest["requests"])
+  
+   @property
+   def done(self) -> bool:
+       return self.state in BATCH_TERMINAL_STATES
+  
+   def _headers(self) -> Dict[str, str]:
+       return {"x-goog-api-key": self.client.api_key}
+  
+   def refresh(self) -> str:
+       """
+       Fetch the job's current state
+      
+       Returns:
+           Batch state (e.g. BATCH_STATE_RUNNING)
+       """
+       response = self.client.transport.get(
+           f"{self.client.base_url}/{self.name}",
+           headers=self._headers()
+       )
+       self.status = response.json()
+       metadata = self.status.get("metadata", {})
+       self.state = metadata.get("state") or self.status.get("state")
+       if self.status.get("done") and self.state is None:
+           self.state = BATCH_SUCCEEDED_STATE if "response" in self.status else BATCH_FAILED_STATE
+       return self.state
+  
+   def wait(
+       self,
+       poll_interval: float = BATCH_POLL_INTERVAL,
+       timeout: Optional[float] = None
+   ) -> Dict[str, Dict[str, Any]]:
+       """
+       Poll until the job finishes, then download and save every result
+      
+       Args:
+           poll_interval: Seconds between status checks
+           timeout: Give up after this many seconds (None waits indefinitely)
+          
+       Returns:
+           Result dicts by request key
+          
+       Raises:
+           TimeoutError: If the job is still running after timeout
+           RuntimeError: If the job ended in a state other than succeeded
+       """
+       started = time.monotonic()
+       while self.refresh() not in BATCH_TERMINAL_STATES:
+           if timeout is not None and time.monotonic() - started > timeout:
+               raise TimeoutError(f"Batch {self.name} still {self.state} after {timeout}s")
+           time.sleep(poll_interval)
+      
+       if self.state != BATCH_SUCCEEDED_STATE:
+           error = self.status.get("error", {}).get("message", "")
+           raise RuntimeError(f"Batch {self.name} ended in {self.state} {error}".strip())
+       return dict(self.results())
+  
+   def _responses_file(self) -> Optional[str]:
+       response = self.status.get("response") or {}
+       output = self.status.get("metadata", {}).get("output") or {}
+       return response.get("responsesFile") or output.get("responsesFile")
+  
+   def results(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+       """
+       Stream results of a finished job, saving images as each line arrives
+      
+       Yields:
+           Tuples of (request key, result dict shaped like generate())
+       """
+       responses_file = self._responses_file()
+       if responses_file is None:
+           raise RuntimeError(f"Batch {self.name} has no responses file")
+      
+       response = self.client.transport.get(
+           files_download_url(self.client.base_url, responses_file),
+           headers=self._headers(),
+           stream=True
+       )
+       try:
+           for line in iter_jsonl_lines(response.iter_chunks()):
+               entry = json.loads(line)
+               key = entry.get("key") or entry.get("metadata", {}).get("key")
+               yield key, self._save_result(key, entry)
+       finally:
+           response.close()
+  
+   def _save_result(self, key: str, entry: Dict[str, Any]) -> Union[GenerationResult, Dict[str, Any]]:
+       """Save the images of one batch response line"""
+       request = self.requests.get(key)
+       if request is None:
+           return {"success": False, "error": f"Unknown batch key: {key}"}
+       if "error" in entry or "response" not in entry:
+           return {
+               "success": False,
+               "error": entry.get("error", {}).get("message", "No response for request"),
+               "prompt": request["prompt"]
+           }
+      
+       config = ImageConfig(**request["config"])
+       response_data = entry["response"]
+       generated_files = []
+       for part_index, base64_string, num_parts, num_image_parts in self.client._iter_inline_images(response_data):
+           output_path = self.client._resolve_output_path(
+               config, request.get("save_to"), request.get("name_suffix", ""),
+               part_index, num_parts, num_image_parts
+           )
+           generated_files.append(self.client._save_image(base64_string, output_path, config))
+      
+       if not generated_files:
+           return {
+               "success": False,
+               "error": "No images generated in response",
+               "prompt": request["prompt"]
+           }
+      
+       return GenerationResult(
+           request["prompt"],
+           {
+               "aspect_ratio": config.aspect_ratio,
+               "num_images": 1
+           },
+           request.get("reference_images"),
+           generated_files,
+           usage_metadata=response_data.get("usageMetadata"),
+           layout=self.client._part_layout(response_data)
+       )
+
+
+
+
+def submit_batch(
+   client,
+   requests: List[Dict[str, Any]],
+   display_name: Optional[str] = None,
+   batches_dir: str = DEFAULT_BATCHES_DIR
+) -> BatchJob:
+   """
+   Write requests to a JSONL file, upload it and create a batch job
+  
+   Args:
+       client: ImageGenerationClient (model, base URL, payload building)
+       requests: Dicts with "prompt" and optionally "key", "config"
+           (ImageConfig), "reference_images" and "save_to". Requests with
+           config.num_images > 1 expand into one batch line per image
+       display_name: Batch name shown by the API
+       batches_dir: Directory for the JSONL input and job manifest
+      
+   Returns:
+       BatchJob handle (call wait() to collect results)
+      
+   Raises:
+       ValueError: If a request is invalid or keys collide
+       TransportError: If uploading or creating the batch fails
+   """
+   os.makedirs(batches_dir, exist_ok=True)
+   batch_id = f"{datetime.now().strftime(TIMESTAMP_FORMAT)}_{uuid.uuid4().hex[:6]}"
+   display_name = display_name or f"batch_{batch_id}"
+   jsonl_path = os.path.join(batches_dir, f"{batch_id}.jsonl")
+   manifest_path = os.path.join(batches_dir, f"{batch_id}.json")
+  
+   manifest_requests: Dict[str, Dict[str, Any]] = {}
+   with open(jsonl_path, 'w', encoding='utf-8') as f:
+       for index, request in enumerate(requests):
+           if not request.get("prompt"):
+               raise ValueError(f"Batch request {index} has no prompt")
+           config = request.get("config") or client.default_config
+           image_paths = client._validate_references(request.get("reference_images"))
+           config, _ = client._check_budget(request["prompt"], config, image_paths)
+           payload = client._build_payload(request["prompt"], config, image_paths)
+          
+           base_key = str(request.get("key", index))
+           for img_num in range(config.num_images):
+               key = base_key if config.num_images == 1 else f"{base_key}#{img_num + 1}"
+               if key in manifest_requests:
+                   raise ValueError(f"Duplicate batch key: {key}")
+               save_to = request.get("save_to")
+               if save_to and config.num_images > 1:
+                   base, ext = os.path.splitext(save_to)
+                   save_to = f"{base}_{img_num + 1}{ext}"
+              
+               f.write(json.dumps({"key": key, "request": payload}, ensure_ascii=False) + "\n")
+               manifest_requests[key] = {
+                   "prompt": request["prompt"],
+                   "config": _config_to_dict(config),
+                   "reference_images": request.get("reference_images") or [],
+                   "save_to": save_to,
+                   "name_suffix": f"{index}_{img_num + 1}" if config.num_images > 1 else str(index)
+               }
+  
+   with open(jsonl_path, 'rb') as f:
+       data = f.read()
+   file_info = upload_file(
+       client.transport,
+       files_upload_url(client.base_url),
+       client.api_key,
+       data,
+       "application/jsonl",
+       display_name
+   )
+  
+   response = client.transport.post(
+       f"{client.base_url}/models/{client.model}:batchGenerateContent",
+       json_body={
+           "batch": {
+               "display_name": display_name,
+               "input_config": {"file_name": file_info["name"]}
+           }
+       },
+       headers={
+           "x-goog-api-key": client.api_key,
+           "Content-Type": "application/json"
+       }
+   )
+   name = response.json().get("name")
+   if not name:
+       raise TransportError("Batch creation response did not include a batch name")
+  
+   with open(manifest_path, 'w', encoding='utf-8') as f:
+       json.dump({
+           "name": name,
+           "display_name": display_name,
+           "model": client.model,
+           "input_file": file_info["name"],
+           "jsonl_path": jsonl_path,
+           "created_at": datetime.now().isoformat(),
+           "requests": manifest_requests
+       }, f, indent=2, ensure_ascii=False)
+  
+   print(f"📦 Submitted {len(manifest_requests)} requests as {name}")
+   return BatchJob(client, name, manifest_path, manifest_requests)
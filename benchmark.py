@@ -0,0 +1,604 @@
+"""
+Offline benchmark suite for the image generation client
+Runs client scenarios against mock_server.py and reports throughput, latency, memory and CPU
+
+Usage:
+   python benchmark.py
+   python benchmark.py --scenario fanout --latency 2 --error-rate 0.05
+   python benchmark.py --compare generated/benchmarks/<earlier run>.json
+   python benchmark.py --startup-only --max-import-ms 100
+
+Every scenario runs in a fresh process against a mock server in another
+process, so peak RSS and CPU time belong to the client alone. The image,
+latency and error draws are seeded: with the same settings, runs on
+different commits see the same server behaviour and their results (saved
+with the commit hash) can be compared directly.
+
+Every run also measures cold start: importing image_client and utils (and
+constructing a client) in fresh interpreters. It fails with exit status 1
+if an import loads PIL or an HTTP stack, constructing a client writes to
+disk, or the median import time exceeds --max-import-ms, so it can guard
+startup in CI on its own (--startup-only, no mock server needed).
+"""
+
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+from stats import percentile
+
+
+
+
+DEFAULT_BENCHMARK_DIR = "generated/benchmarks"
+DEFAULT_ITERATIONS = 20
+DEFAULT_CONCURRENCY = 4
+DEFAULT_FANOUT_IMAGES = 4
+DEFAULT_SESSION_TURNS = 10
+DEFAULT_IMAGE_MB = 1.5
+DEFAULT_LATENCY = 0.5
+DEFAULT_LATENCY_SPREAD = 0.3
+
+
+# Metrics compared by --compare, and whether higher is better
+COMPARED_METRICS = {
+   "requests_per_second": True,
+   "images_per_second": True,
+   "p50_seconds": False,
+   "p95_seconds": False,
+   "p99_seconds": False,
+   "peak_rss_mb": False,
+   "cpu_ms_per_image": False
+}
+
+
+# A call sample: (seconds, images requested, images returned)
+CallSample = Tuple[float, int, int]
+
+
+# Cold start: modules measured, fresh interpreters per module, and the guard
+STARTUP_MODULES = ["image_client", "utils"]
+DEFAULT_STARTUP_RUNS = 15
+DEFAULT_MAX_IMPORT_MS = 120.0
+# Loaded on first use only; importing a measured module must not pull them in
+LAZY_MODULES = ["PIL", "requests", "urllib3", "httpx", "asyncio", "cProfile", "pstats", "sqlite3"]
+
+# Startup metrics compared by --compare (lower is better)
+COMPARED_STARTUP_METRICS = ["import_ms", "construct_ms", "process_ms"]
+
+
+
+
+# ============================================================================
+# Scenarios (run inside the benchmark worker process)
+# ============================================================================
+
+
+
+
+def _timed(func: Callable[[], Dict[str, Any]], images: int) -> CallSample:
+   started = time.perf_counter()
+   result = func()
+   seconds = time.perf_counter() - started
+   returned = len(result.get("generated_images") or []) if result.get("success") else 0
+   return seconds, images, returned
+
+
+
+
+def scenario_single(client, options: Dict[str, Any], workdir: str) -> List[CallSample]:
+   """Independent one-image generate() calls, options["concurrency"] at a time"""
+   from config import ImageConfig
+  
+   config = ImageConfig(output_dir=os.path.join(workdir, "images"))
+  
+   def call(i: int) -> CallSample:
+       return _timed(lambda: client.generate(f"A lighthouse at dusk, variation {i}", config), 1)
+  
+   with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+       return list(executor.map(call, range(options["iterations"])))
+
+
+
+
+def scenario_fanout(client, options: Dict[str, Any], workdir: str) -> List[CallSample]:
+   """generate() with num_images > 1, one API call per image"""
+   from config import ImageConfig
+  
+   config = ImageConfig(
+       output_dir=os.path.join(workdir, "images"),
+       num_images=options["fanout_images"],
+       max_concurrency=options["concurrency"],
+       multi_candidate=False
+   )
+   iterations = max(1, options["iterations"] // options["fanout_images"])
+   return [
+       _timed(lambda: client.generate(f"A market street, take {i}", config), options["fanout_images"])
+       for i in range(iterations)
+   ]
+
+
+
+
+def scenario_session(client, options: Dict[str, Any], workdir: str) -> List[CallSample]:
+   """Consecutive generate_with_session() turns in one session"""
+   from config import ImageConfig
+  
+   config = ImageConfig(output_dir=os.path.join(workdir, "images"))
+   session = client.create_session()
+   return [
+       _timed(lambda: client.generate_with_session(session, f"Next scene, turn {i}", config), 1)
+       for i in range(options["session_turns"])
+   ]
+
+
+
+
+def synthetic_plan(pages: int = 2, panels_per_page: int = 4, characters: int = 2) -> Dict[str, Any]:
+   """A comic plan in the page*.json layout (character sheets, then panels referencing them)"""
+   names = [f"Character{i + 1}" for i in range(characters)]
+   return {
+       "comic_info": {"title": "Benchmark", "aspect_ratio": "2:3"},
+       "characters": [
+           {
+               "id": i + 1,
+               "name": name,
+               "reference_prompt": {"prompt": f"Character reference sheet for {name}, full body, white background"}
+           }
+           for i, name in enumerate(names)
+       ],
+       "pages": [
+           {
+               "page_number": page + 1,
+               "panels": [
+                   {
+                       "panel_number": panel + 1,
+                       "characters_in_panel": names[:1 + (panel % characters)],
+                       "panel_prompt": {"prompt": f"Page {page + 1}, panel {panel + 1}: the characters talk"}
+                   }
+                   for panel in range(panels_per_page)
+               ]
+           }
+           for page in range(pages)
+       ]
+   }
+
+
+
+
+def scenario_comic(client, options: Dict[str, Any], workdir: str) -> List[CallSample]:
+   """
+   A full comic-plan run
+  
+   Character sheets are generated first; each page then runs in its own
+   session with the sheets of the characters in a panel as references.
+   """
+   from config import ImageConfig
+  
+   if options.get("plan"):
+       with open(options["plan"], 'r', encoding='utf-8') as f:
+           plan = json.load(f)
+   else:
+       plan = synthetic_plan()
+   aspect_ratio = plan.get("comic_info", {}).get("aspect_ratio", "2:3")
+   config = ImageConfig(aspect_ratio=aspect_ratio, output_dir=os.path.join(workdir, "images"))
+  
+   samples = []
+   sheets: Dict[str, str] = {}
+   for character in plan.get("characters", []):
+       holder: Dict[str, Any] = {}
+      
+       def sheet() -> Dict[str, Any]:
+           holder["result"] = client.generate(
+               character["reference_prompt"]["prompt"],
+               config,
+               save_to=f"character_sheet_{character['id']}.png"
+           )
+           return holder["result"]
+      
+       samples.append(_timed(sheet, 1))
+       if holder["result"].get("success"):
+           sheets[character["name"]] = holder["result"]["generated_images"][0]["file_path"]
+  
+   for page in plan.get("pages", []):
+       session = client.create_session()
+       for panel in page.get("panels", []):
+           references = [sheets[name] for name in panel.get("characters_in_panel", []) if name in sheets][:3]
+           samples.append(_timed(
+               lambda: client.generate_with_session(
+                   session, panel["panel_prompt"]["prompt"], config, reference_images=references or None
+               ),
+               1
+           ))
+   return samples
+
+
+
+
+SCENARIOS = {
+   "single": scenario_single,
+   "fanout": scenario_fanout,
+   "session": scenario_session,
+   "comic": scenario_comic
+}
+
+
+
+
+def _peak_rss_mb() -> float:
+   # ru_maxrss is in kilobytes on Linux and bytes on macOS
+   peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+   return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+
+
+def _cpu_seconds() -> float:
+   usage = [resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)]
+   return sum(u.ru_utime + u.ru_stime for u in usage)
+
+
+
+
+def run_scenario(name: str, base_url: str, options: Dict[str, Any]) -> Dict[str, Any]:
+   """
+   Run one scenario (in a fresh worker process)
+  
+   Returns:
+       Dict with wall time, call samples and process peak RSS/CPU
+   """
+   from image_client import ImageGenerationClient
+   from session_manager import SessionManager
+  
+   workdir = tempfile.mkdtemp(prefix=f"bench_{name}_", dir=options["output_dir"])
+   client = ImageGenerationClient(
+       "benchmark-key",
+       base_url=base_url,
+       session_manager=SessionManager(os.path.join(workdir, "sessions"))
+   )
+  
+   rss_before = _peak_rss_mb()
+   cpu_before = _cpu_seconds()
+   started = time.perf_counter()
+   try:
+       samples = SCENARIOS[name](client, options, workdir)
+   finally:
+       client.close()
+   wall = time.perf_counter() - started
+   cpu = _cpu_seconds() - cpu_before
+  
+   if not options.get("keep_output"):
+       shutil.rmtree(workdir, ignore_errors=True)
+   return {
+       "wall_seconds": wall,
+       "cpu_seconds": cpu,
+       "samples": samples,
+       "peak_rss_mb": _peak_rss_mb(),
+       "rss_growth_mb": _peak_rss_mb() - rss_before
+   }
+
+
+
+
+# ============================================================================
+# Cold start
+# ============================================================================
+
+
+
+
+# Runs in a fresh interpreter with an empty working directory
+STARTUP_PROBE = """
+import json, os, sys, time
+started = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+if {module!r} == "image_client":
+   image_client.ImageGenerationClient("benchmark-key")
+constructed = time.perf_counter()
+print(json.dumps({{
+   "import_ms": (imported - started) * 1000,
+   "construct_ms": (constructed - imported) * 1000,
+   "lazy_loaded": sorted(name for name in {lazy!r} if name in sys.modules),
+   "created": sorted(os.listdir("."))
+}}))
+"""
+
+
+
+
+def measure_startup(module: str, runs: int) -> Dict[str, Any]:
+   """
+   Time importing a module (and constructing a client) in fresh interpreters
+  
+   Returns:
+       Median import/construct/process milliseconds, plus the lazy modules
+       loaded and the files created by any run
+   """
+   here = os.path.dirname(os.path.abspath(__file__))
+   env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get("PYTHONPATH")])))
+   code = STARTUP_PROBE.format(module=module, lazy=LAZY_MODULES)
+   samples = []
+   lazy_loaded, created = set(), set()
+   for _ in range(runs):
+       workdir = tempfile.mkdtemp(prefix="bench_startup_")
+       try:
+           started = time.perf_counter()
+           output = subprocess.run(
+               [sys.executable, "-c", code], cwd=workdir, env=env, capture_output=True, text=True, check=True
+           ).stdout
+           process_ms = (time.perf_counter() - started) * 1000
+       finally:
+           shutil.rmtree(workdir, ignore_errors=True)
+       probe = json.loads(output.strip().splitlines()[-1])
+       samples.append((probe["import_ms"], probe["construct_ms"], process_ms))
+       lazy_loaded.update(probe["lazy_loaded"])
+       created.update(probe["created"])
+   return {
+       "runs": runs,
+       "import_ms": round(percentile([s[0] for s in samples], 0.5), 2),
+       "construct_ms": round(percentile([s[1] for s in samples], 0.5), 2),
+       "process_ms": round(percentile([s[2] for s in samples], 0.5), 2),
+       "lazy_loaded": sorted(lazy_loaded),
+       "created": sorted(created)
+   }
+
+
+
+
+def check_startup(startup: Dict[str, Dict[str, Any]], max_import_ms: float) -> List[str]:
+   """Startup regressions (empty if every module is within the guard)"""
+   problems = []
+   for module, metrics in startup.items():
+       if metrics["lazy_loaded"]:
+           problems.append(f"importing {module} loads {', '.join(metrics['lazy_loaded'])}")
+       if metrics["created"]:
+           problems.append(f"starting {module} creates {', '.join(metrics['created'])}")
+       if metrics["import_ms"] > max_import_ms:
+           problems.append(f"importing {module} takes {metrics['import_ms']}ms (limit {max_import_ms}ms)")
+   return problems
+
+
+
+
+def run_startup(args: argparse.Namespace) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+   """Measure and check the cold start of every STARTUP_MODULES entry"""
+   print(f"\n▶️  startup ({args.startup_runs} fresh interpreters per module)")
+   startup = {}
+   for module in STARTUP_MODULES:
+       startup[module] = measure_startup(module, args.startup_runs)
+       metrics = startup[module]
+       print(f"   {module}: import {metrics['import_ms']}ms, construct {metrics['construct_ms']}ms, "
+             f"process {metrics['process_ms']}ms")
+   problems = check_startup(startup, args.max_import_ms)
+   for problem in problems:
+       print(f"   ❌ {problem}")
+   return startup, problems
+
+
+
+
+# ============================================================================
+# Driver
+# ============================================================================
+
+
+
+
+def start_mock_server(args: argparse.Namespace) -> Tuple[subprocess.Popen, str]:
+   """Start mock_server.py in its own process and return it with its base URL"""
+   command = [
+       sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_server.py"),
+       "--port", "0",
+       "--latency", str(args.latency),
+       "--latency-distribution", args.latency_distribution,
+       "--latency-spread", str(args.latency_spread),
+       "--error-rate", str(args.error_rate),
+       "--error-status", str(args.error_status),
+       "--image-mb", str(args.image_mb),
+       "--seed", str(args.seed)
+   ]
+   server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+   line = server.stdout.readline()
+   if "http://" not in line:
+       server.kill()
+       raise RuntimeError(f"Mock server did not start: {line!r}")
+   return server, line.split(" at ", 1)[1].strip()
+
+
+
+
+def server_stats(base_url: str) -> Dict[str, int]:
+   """Request counters of the running mock server"""
+   root = base_url.rsplit("/", 1)[0]
+   with urllib.request.urlopen(f"{root}/mock/stats") as response:
+       return json.loads(response.read())
+
+
+
+
+def summarize(run: Dict[str, Any], requests: int) -> Dict[str, Any]:
+   """Turn a scenario run into the reported metrics"""
+   samples = run["samples"]
+   seconds = [s for s, _, _ in samples]
+   images = sum(returned for _, _, returned in samples)
+   requested = sum(wanted for _, wanted, _ in samples)
+   wall = run["wall_seconds"]
+   return {
+       "calls": len(samples),
+       "requests": requests,
+       "images": images,
+       "failed_images": requested - images,
+       "wall_seconds": round(wall, 3),
+       "requests_per_second": round(requests / wall, 3),
+       "images_per_second": round(images / wall, 3),
+       "p50_seconds": round(percentile(seconds, 0.5), 4),
+       "p95_seconds": round(percentile(seconds, 0.95), 4),
+       "p99_seconds": round(percentile(seconds, 0.99), 4),
+       "peak_rss_mb": round(run["peak_rss_mb"], 1),
+       "rss_growth_mb": round(run["rss_growth_mb"], 1),
+       "cpu_ms_per_image": round(run["cpu_seconds"] * 1000 / images, 2) if images else None
+   }
+
+
+
+
+def git_commit() -> Optional[str]:
+   """Short hash of HEAD (with -dirty for uncommitted changes), None outside git"""
+   here = os.path.dirname(os.path.abspath(__file__))
+   try:
+       commit = subprocess.run(
+           ["git", "rev-parse", "--short", "HEAD"], cwd=here, capture_output=True, text=True, check=True
+       ).stdout.strip()
+       dirty = subprocess.run(
+           ["git", "status", "--porcelain", "--untracked-files=no"], cwd=here, capture_output=True, text=True
+       ).stdout.strip()
+   except (OSError, subprocess.CalledProcessError):
+       return None
+   return f"{commit}-dirty" if dirty else commit
+
+
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]):
+   """Print each scenario's metrics next to a baseline report"""
+   print(f"\n📊 Compared with {baseline.get('commit')} ({baseline.get('timestamp')})")
+   if baseline.get("settings") != report["settings"]:
+       print("⚠️  Settings differ from the baseline; numbers are not directly comparable")
+   for name, metrics in report["scenarios"].items():
+       before = baseline.get("scenarios", {}).get(name)
+       if before is None:
+           continue
+       print(f"  {name}")
+       for key, higher_is_better in COMPARED_METRICS.items():
+           old, new = before.get(key), metrics.get(key)
+           if not old or new is None:
+               continue
+           change = (new - old) / old * 100
+           better = change > 0 if higher_is_better else change < 0
+           marker = "✅" if better else ("❌" if abs(change) >= 5 else "  ")
+           print(f"    {marker} {key:<20} {old:>10} → {new:<10} ({change:+.1f}%)")
+   for module, metrics in report.get("startup", {}).items():
+       before = baseline.get("startup", {}).get(module)
+       if before is None:
+           continue
+       print(f"  startup {module}")
+       for key in COMPARED_STARTUP_METRICS:
+           old, new = before.get(key), metrics.get(key)
+           if not old or new is None:
+               continue
+           change = (new - old) / old * 100
+           marker = "✅" if change < 0 else ("❌" if change >= 5 else "  ")
+           print(f"    {marker} {key:<20} {old:>10} → {new:<10} ({change:+.1f}%)")
+
+
+
+
+def main():
+   parser = argparse.ArgumentParser(description="Offline client benchmarks against a mock generateContent server")
+   parser.add_argument("--scenario", action="append", choices=list(SCENARIOS),
+                       help="Scenario to run (repeatable; all if omitted)")
+   parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS,
+                       help="Images per single/fanout scenario")
+   parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+   parser.add_argument("--fanout-images", type=int, default=DEFAULT_FANOUT_IMAGES)
+   parser.add_argument("--session-turns", type=int, default=DEFAULT_SESSION_TURNS)
+   parser.add_argument("--plan", help="Comic plan JSON for the comic scenario (synthetic if omitted)")
+   parser.add_argument("--image-mb", type=float, default=DEFAULT_IMAGE_MB)
+   parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="Median server latency")
+   parser.add_argument("--latency-distribution", default="lognormal")
+   parser.add_argument("--latency-spread", type=float, default=DEFAULT_LATENCY_SPREAD)
+   parser.add_argument("--error-rate", type=float, default=0.0)
+   parser.add_argument("--error-status", type=int, default=503)
+   parser.add_argument("--seed", type=int, default=1234)
+   parser.add_argument("--output", help="Report path (generated/benchmarks/<commit>_<time>.json if omitted)")
+   parser.add_argument("--compare", help="Earlier report to compare against")
+   parser.add_argument("--keep-output", action="store_true", help="Keep generated images and sessions")
+   parser.add_argument("--startup-runs", type=int, default=DEFAULT_STARTUP_RUNS,
+                       help="Fresh interpreters per module for the cold start measurement")
+   parser.add_argument("--max-import-ms", type=float, default=DEFAULT_MAX_IMPORT_MS,
+                       help="Fail if a module's median import time exceeds this")
+   parser.add_argument("--startup-only", action="store_true", help="Only measure and check cold start")
+   args = parser.parse_args()
+  
+   scenarios = [] if args.startup_only else (args.scenario or list(SCENARIOS))
+   settings = {
+       key: getattr(args, key)
+       for key in (
+           "iterations", "concurrency", "fanout_images", "session_turns", "plan", "image_mb",
+           "latency", "latency_distribution", "latency_spread", "error_rate", "error_status", "seed"
+       )
+   }
+   os.makedirs(DEFAULT_BENCHMARK_DIR, exist_ok=True)
+   options = dict(settings, output_dir=DEFAULT_BENCHMARK_DIR, keep_output=args.keep_output)
+  
+   startup, problems = run_startup(args)
+   results = {}
+   if scenarios:
+       server, base_url = start_mock_server(args)
+       print(f"\n🧪 Mock server at {base_url} ({args.image_mb}MB images, "
+             f"{args.latency}s {args.latency_distribution} latency, {args.error_rate:.0%} errors)")
+   try:
+       for name in scenarios:
+           print(f"\n▶️  {name}")
+           requests_before = server_stats(base_url)["generate_requests"]
+           # A fresh process per scenario keeps peak RSS and CPU time separate
+           with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+               run = executor.submit(run_scenario, name, base_url, options).result()
+           requests = server_stats(base_url)["generate_requests"] - requests_before
+           results[name] = summarize(run, requests)
+           metrics = results[name]
+           print(f"   {metrics['requests_per_second']} req/s, {metrics['images_per_second']} img/s, "
+                 f"p50 {metrics['p50_seconds']}s / p95 {metrics['p95_seconds']}s / p99 {metrics['p99_seconds']}s, "
+                 f"peak RSS {metrics['peak_rss_mb']}MB, CPU {metrics['cpu_ms_per_image']}ms/image")
+           if metrics["failed_images"]:
+               print(f"   ⚠️  {metrics['failed_images']} image(s) failed")
+   finally:
+       if scenarios:
+           server.terminate()
+           server.wait()
+  
+   commit = git_commit()
+   timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+   report = {
+       "commit": commit,
+       "timestamp": timestamp,
+       "python": platform.python_version(),
+       "platform": platform.platform(),
+       "cpu_count": os.cpu_count(),
+       "settings": settings,
+       "startup": startup,
+       "scenarios": results
+   }
+   output = args.output or os.path.join(DEFAULT_BENCHMARK_DIR, f"{commit or 'nogit'}_{timestamp}.json")
+   with open(output, 'w', encoding='utf-8') as f:
+       json.dump(report, f, indent=2)
+   print(f"\n💾 Report saved to {output}")
+  
+   if args.compare:
+       with open(args.compare, 'r', encoding='utf-8') as f:
+           compare(report, json.load(f))
+  
+   if problems:
+       print(f"\n❌ Startup guard failed ({len(problems)} problem(s))")
+       sys.exit(1)
+
+
+
+
+if __name__ == "__main__":
+   main()
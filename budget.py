@@ -0,0 +1,305 @@
+"""
+Pre-flight request budgeting
+Estimates input tokens and request bytes locally so oversized requests fail before the round trip
+"""
+
+
+import base64
+import copy
+import json
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+
+from config import (
+   MAX_INPUT_TOKENS,
+   MAX_INPUT_IMAGES,
+   MAX_INLINE_REQUEST_SIZE_MB,
+   MAX_TOTAL_INPUT_SIZE_MB,
+   CHARS_PER_TOKEN,
+   NON_ASCII_CHARS_PER_TOKEN,
+   IMAGE_TOKENS_PER_TILE,
+   IMAGE_TILE_SIZE,
+   IMAGE_SMALL_EDGE,
+   IMAGE_HEADER_READ_BYTES,
+   MIN_SHRINK_BYTES,
+   ImageConfig,
+   ReferenceUploadConfig
+)
+from image_metadata import get_image_metadata, parse_image_header
+from reference_optimizer import optimize_reference
+
+
+
+
+# Bytes of the payload around the prompt and images (contents, parts, generationConfig)
+REQUEST_OVERHEAD_BYTES = 256
+
+
+# Base64 characters decoded to find an image header (a multiple of 4)
+HEADER_BASE64_CHARS = IMAGE_HEADER_READ_BYTES // 3 * 4
+
+
+
+
+class BudgetExceededError(ValueError):
+   """A request is estimated to exceed the model's input limits"""
+  
+   def __init__(self, message: str, report: Dict[str, Any]):
+       super().__init__(message)
+       self.report = report
+
+
+
+
+def estimate_text_tokens(text: str) -> int:
+   """
+   Estimate the token count of a prompt
+  
+   ASCII is counted at CHARS_PER_TOKEN characters per token and everything
+   else (Vietnamese diacritics, CJK, emoji) at NON_ASCII_CHARS_PER_TOKEN,
+   which errs on the high side for non-English prompts.
+   """
+   ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+   other_chars = len(text) - ascii_chars
+   return math.ceil(ascii_chars / CHARS_PER_TOKEN + other_chars / NON_ASCII_CHARS_PER_TOKEN)
+
+
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+   """Tokens for one image: a single tile when small, else one per IMAGE_TILE_SIZE tile"""
+   if width <= IMAGE_SMALL_EDGE and height <= IMAGE_SMALL_EDGE:
+       return IMAGE_TOKENS_PER_TILE
+   tiles = math.ceil(width / IMAGE_TILE_SIZE) * math.ceil(height / IMAGE_TILE_SIZE)
+   return tiles * IMAGE_TOKENS_PER_TILE
+
+
+
+
+def _estimate_reference(image_path: str, options: Optional[ReferenceUploadConfig]) -> Dict[str, Any]:
+   """Size and tokens of a reference as it would be sent inline (encodings are cached)"""
+   encoded = optimize_reference(image_path, options)
+   header = parse_image_header(base64.b64decode(encoded.base64_data[:HEADER_BASE64_CHARS]))
+   if header is None:
+       # Unknown layout: assume the worst case of a maximum-size upload
+       tokens = estimate_image_tokens(IMAGE_TILE_SIZE * 2, IMAGE_TILE_SIZE * 2)
+   else:
+       tokens = estimate_image_tokens(header["width"], header["height"])
+   return {
+       "path": image_path,
+       "size_bytes": encoded.size_bytes,
+       "base64_bytes": len(encoded.base64_data),
+       "tokens": tokens
+   }
+
+
+
+
+def _estimate_uploaded_reference(image_path: str, options: Optional[ReferenceUploadConfig]) -> Dict[str, Any]:
+   """
+   Size and tokens of a reference sent as a file URI, from its header and stat alone
+  
+   Nothing is decoded or encoded: the file's own size is an upper bound for
+   the upload, and its dimensions are scaled to options.max_long_edge the
+   way the optimizer would.
+   """
+   metadata = get_image_metadata(image_path)
+   width, height = metadata["width"], metadata["height"]
+   if options is not None and options.max_long_edge is not None and max(width, height) > options.max_long_edge:
+       scale = options.max_long_edge / max(width, height)
+       width, height = max(1, round(width * scale)), max(1, round(height * scale))
+   return {
+       "path": image_path,
+       "size_bytes": metadata["size_bytes"],
+       "base64_bytes": 4 * math.ceil(metadata["size_bytes"] / 3),
+       "tokens": estimate_image_tokens(width, height)
+   }
+
+
+
+
+class RequestBudget:
+   """
+   Pre-flight limits for generateContent requests
+  
+   Before a request is sent its input tokens (text plus image tiles) and
+   body size are estimated. A request over a limit raises
+   BudgetExceededError without touching the network, unless auto_shrink is
+   set and tightening the reference upload options (long edge for tokens,
+   per-image bytes for size) brings it back under. The usage report is
+   attached to results as "budget".
+   """
+  
+   def __init__(
+       self,
+       max_input_tokens: int = MAX_INPUT_TOKENS,
+       max_request_mb: float = MAX_INLINE_REQUEST_SIZE_MB,
+       max_total_input_mb: float = MAX_TOTAL_INPUT_SIZE_MB,
+       max_images: int = MAX_INPUT_IMAGES,
+       auto_shrink: bool = False
+   ):
+       """
+       Initialize budget
+      
+       Args:
+           max_input_tokens: Token limit for prompt plus images
+           max_request_mb: Limit for the request body with inline images
+           max_total_input_mb: Limit for all input including uploaded files
+           max_images: Maximum reference images per request
+           auto_shrink: Downscale/recompress references to fit instead of rejecting
+       """
+       self.max_input_tokens = max_input_tokens
+       self.max_request_bytes = int(max_request_mb * 1024 * 1024)
+       self.max_total_input_bytes = int(max_total_input_mb * 1024 * 1024)
+       self.max_images = max_images
+       self.auto_shrink = auto_shrink
+  
+   def estimate(
+       self,
+       prompt: str,
+       image_paths: List[str],
+       upload_options: Optional[ReferenceUploadConfig] = None,
+       inline: bool = True
+   ) -> Dict[str, Any]:
+       """
+       Estimate a request's usage
+      
+       Args:
+           prompt: Text prompt
+           image_paths: Reference image paths
+           upload_options: Reference optimization settings the request will use
+           inline: Whether images travel in the body (False with a file registry,
+               in which case references are sized from their headers, not encoded)
+          
+       Returns:
+           Usage report dict
+       """
+       estimate_reference = _estimate_reference if inline else _estimate_uploaded_reference
+       images = [estimate_reference(path, upload_options) for path in image_paths]
+       text_tokens = estimate_text_tokens(prompt)
+       image_tokens = sum(image["tokens"] for image in images)
+       text_bytes = len(json.dumps(prompt))
+       image_bytes = sum(image["base64_bytes"] for image in images) if inline else 0
+       input_tokens = text_tokens + image_tokens
+       request_bytes = REQUEST_OVERHEAD_BYTES + text_bytes + image_bytes
+       total_input_bytes = text_bytes + sum(image["size_bytes"] for image in images)
+       return {
+           "input_tokens": input_tokens,
+           "text_tokens": text_tokens,
+           "image_tokens": image_tokens,
+           "max_input_tokens": self.max_input_tokens,
+           "token_usage": round(input_tokens / self.max_input_tokens, 3),
+           "request_bytes": request_bytes,
+           "max_request_bytes": self.max_request_bytes,
+           "size_usage": round(request_bytes / self.max_request_bytes, 3),
+           "total_input_bytes": total_input_bytes,
+           "num_images": len(images),
+           "images": images,
+           "inline": inline,
+           "shrunk": False
+       }
+  
+   def problems(self, report: Dict[str, Any]) -> List[str]:
+       """List the limits a usage report exceeds (empty if it fits)"""
+       problems = []
+       if report["num_images"] > self.max_images:
+           problems.append(f"{report['num_images']} reference images (max {self.max_images})")
+       if report["input_tokens"] > self.max_input_tokens:
+           problems.append(
+               f"~{report['input_tokens']:,} input tokens "
+               f"({report['text_tokens']:,} text + {report['image_tokens']:,} image, "
+               f"max {self.max_input_tokens:,})"
+           )
+       if report["request_bytes"] > self.max_request_bytes:
+           problems.append(
+               f"~{report['request_bytes'] / (1024 * 1024):.1f}MB request body "
+               f"(max {self.max_request_bytes / (1024 * 1024):.0f}MB)"
+           )
+       if report["total_input_bytes"] > self.max_total_input_bytes:
+           problems.append(
+               f"~{report['total_input_bytes'] / (1024 * 1024):.1f}MB total input "
+               f"(max {self.max_total_input_bytes / (1024 * 1024):.0f}MB)"
+           )
+       return problems
+  
+   def _shrink_options(
+       self,
+       report: Dict[str, Any],
+       base: Optional[ReferenceUploadConfig]
+   ) -> Optional[ReferenceUploadConfig]:
+       """Tighter upload options aimed at fitting report's request (None if hopeless)"""
+       num_images = report["num_images"]
+       if num_images == 0 or num_images > self.max_images:
+           return None
+       base = base or ReferenceUploadConfig()
+       max_long_edge = base.max_long_edge
+       max_bytes = base.max_bytes
+      
+       if report["input_tokens"] > self.max_input_tokens:
+           # A k x k tile grid fits in a square of k tiles per side
+           tiles = (self.max_input_tokens - report["text_tokens"]) // (num_images * IMAGE_TOKENS_PER_TILE)
+           if tiles < 1:
+               return None
+           edge = IMAGE_TILE_SIZE * math.isqrt(tiles)
+           max_long_edge = min(max_long_edge or edge, edge)
+      
+       if report["request_bytes"] > self.max_request_bytes:
+           if not report["inline"]:
+               # Only the prompt is in the body
+               return None
+           image_base64 = sum(image["base64_bytes"] for image in report["images"])
+           available = self.max_request_bytes - (report["request_bytes"] - image_base64)
+           # Base64 inflates by 4/3
+           per_image = available * 3 // 4 // num_images
+           if per_image < MIN_SHRINK_BYTES:
+               return None
+           max_bytes = min(max_bytes or per_image, per_image)
+      
+       return ReferenceUploadConfig(
+           max_long_edge=max_long_edge,
+           format=base.format,
+           quality=base.quality,
+           max_bytes=max_bytes,
+           min_quality=base.min_quality
+       )
+  
+   def check(
+       self,
+       prompt: str,
+       config: ImageConfig,
+       image_paths: List[str],
+       inline: bool = True
+   ) -> Tuple[ImageConfig, Dict[str, Any]]:
+       """
+       Validate a request against the budget, shrinking references if allowed
+      
+       Args:
+           prompt: Text prompt
+           config: Image generation configuration
+           image_paths: Validated reference image paths
+           inline: Whether images travel in the body (False with a file registry)
+          
+       Returns:
+           Tuple of (config to send with, usage report). The config is a copy
+           with tighter upload_options when references were shrunk
+          
+       Raises:
+           BudgetExceededError: If the request cannot be brought under the limits
+       """
+       report = self.estimate(prompt, image_paths, config.upload_options, inline)
+       problems = self.problems(report)
+       if not problems:
+           return config, report
+      
+       if self.auto_shrink:
+           options = self._shrink_options(report, config.upload_options)
+           if options is not None:
+               shrunk = self.estimate(prompt, image_paths, options, inline)
+               if not self.problems(shrunk):
+                   shrunk["shrunk"] = True
+                   config = copy.copy(config)
+                   config.upload_options = options
+                   return config, shrunk
+      
+       raise BudgetExceededError(f"Request exceeds input budget: {'; '.join(problems)}", report)
@@ -0,0 +1,319 @@
+"""
+Content-addressed on-disk cache for generation results
+Re-running the same prompt + references + config returns saved images instantly
+"""
+
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+
+from config import (
+   DEFAULT_CACHE_DIR,
+   CACHE_MAX_SIZE_MB,
+   CACHE_MAX_AGE_HOURS,
+   CACHE_EVICT_TO,
+   ImageConfig
+)
+from reference_optimizer import reference_digest
+
+
+
+
+# ImageConfig fields that change what the API returns (or how it is saved)
+CACHE_KEY_CONFIG_FIELDS = ["aspect_ratio", "output_format", "output_quality", "lossless"]
+
+ENTRY_FILE = "entry.json"
+
+
+
+
+def normalize_prompt(prompt: str) -> str:
+   """Normalize prompt text for hashing (unicode form, line endings, outer whitespace)"""
+   prompt = unicodedata.normalize("NFC", prompt)
+   prompt = prompt.replace("\r\n", "\n").replace("\r", "\n")
+   return "\n".join(line.rstrip() for line in prompt.strip().split("\n"))
+
+
+
+
+def request_fingerprint(
+   model: str,
+   prompt: str,
+   reference_images: Optional[List[str]],
+   config: ImageConfig,
+   variant: str = ""
+) -> str:
+   """
+   Build a stable fingerprint for a generation request
+  
+   Args:
+       model: Model name
+       prompt: Text prompt (normalized before hashing)
+       reference_images: Reference image paths (hashed by content, not path,
+           via the optimizer's memoized digests)
+       config: Image configuration (only fields that affect output)
+       variant: Distinguishes variations of the same request (e.g. image index)
+      
+   Returns:
+       Hex SHA-256 fingerprint
+   """
+   key_data = {
+       "model": model,
+       "prompt": normalize_prompt(prompt),
+       "references": [reference_digest(path) for path in reference_images or []],
+       "config": {field: getattr(config, field) for field in CACHE_KEY_CONFIG_FIELDS},
+       "upload": config.upload_options.to_dict() if config.upload_options else None,
+       "variant": variant
+   }
+   encoded = json.dumps(key_data, sort_keys=True, ensure_ascii=False).encode("utf-8")
+   return hashlib.sha256(encoded).hexdigest()
+
+
+
+
+class GenerationCache:
+   """
+   On-disk cache of generated images keyed by request fingerprint
+  
+   Layout: <cache_dir>/<key[:2]>/<key>/ holds copies of the images plus
+   entry.json (image info and part layout). Entries older than max_age_hours
+   are ignored and removed; when the cache grows past max_size_mb the least
+   recently used entries are evicted.
+  
+   The cache's size is kept as a running total (from one directory scan
+   on the first write), so a write only rescans the directory when it
+   takes the cache over the cap; eviction then frees space down to
+   CACHE_EVICT_TO of the cap, so a full cache is not rescanned on every
+   write.
+   """
+  
+   def __init__(
+       self,
+       cache_dir: str = DEFAULT_CACHE_DIR,
+       max_size_mb: float = CACHE_MAX_SIZE_MB,
+       max_age_hours: float = CACHE_MAX_AGE_HOURS
+   ):
+       """
+       Initialize cache
+      
+       Args:
+           cache_dir: Directory for cached entries
+           max_size_mb: Size cap before LRU eviction
+           max_age_hours: Entries older than this are treated as misses
+       """
+       self.cache_dir = cache_dir
+       self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+       self.max_age_seconds = max_age_hours * 3600
+       self._lock = threading.Lock()
+       # Bytes on disk (None until the first write scans the directory)
+       self._total_bytes: Optional[int] = None
+       self.stats = {
+           "hits": 0,
+           "misses": 0,
+           "writes": 0,
+           "evictions": 0,
+           "expirations": 0
+       }
+  
+   def _entry_path(self, key: str) -> str:
+       return os.path.join(self.cache_dir, key[:2], key)
+  
+   def _entry_size(self, entry_dir: str) -> int:
+       try:
+           return sum(entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file())
+       except FileNotFoundError:
+           return 0
+  
+   def _add_bytes(self, amount: int):
+       with self._lock:
+           if self._total_bytes is not None:
+               self._total_bytes = max(0, self._total_bytes + amount)
+  
+   def _expired(self, entry: Dict[str, Any], now: float) -> bool:
+       """Whether an entry is past max_age_hours (measured from its created_at)"""
+       return now - entry.get("created_at", 0) > self.max_age_seconds
+  
+   def _remove_entry(self, entry_dir: str):
+       size = self._entry_size(entry_dir)
+       shutil.rmtree(entry_dir, ignore_errors=True)
+       self._add_bytes(-size)
+  
+   def get(self, key: str) -> Optional[Dict[str, Any]]:
+       """
+       Look up a cache entry
+      
+       Returns:
+           Entry dict with "images" (each with cached file_path, part layout
+           and info), or None on miss
+       """
+       entry_dir = self._entry_path(key)
+       entry_file = os.path.join(entry_dir, ENTRY_FILE)
+       try:
+           with open(entry_file, 'r') as f:
+               entry = json.load(f)
+       except (OSError, ValueError):
+           self._count("misses")
+           return None
+      
+       if self._expired(entry, time.time()):
+           self._remove_entry(entry_dir)
+           self._count("expirations")
+           self._count("misses")
+           return None
+      
+       for image in entry["images"]:
+           image["file_path"] = os.path.join(entry_dir, image["filename"])
+           if not os.path.exists(image["file_path"]):
+               self._remove_entry(entry_dir)
+               self._count("misses")
+               return None
+      
+       # Mark as recently used for LRU eviction
+       os.utime(entry_file)
+       self._count("hits")
+       return entry
+  
+   def put(
+       self,
+       key: str,
+       generated_images: List[Dict[str, Any]],
+       extra: Optional[Dict[str, Any]] = None
+   ):
+       """
+       Store generated images under key
+      
+       Args:
+           key: Request fingerprint
+           generated_images: Dicts with file_path, info and part layout
+               (part_index, num_parts, num_image_parts)
+           extra: Additional JSON-serializable data to keep with the entry
+       """
+       entry_dir = self._entry_path(key)
+       tmp_dir = f"{entry_dir}.tmp{threading.get_ident()}"
+       shutil.rmtree(tmp_dir, ignore_errors=True)
+       os.makedirs(tmp_dir, exist_ok=True)
+      
+       images = []
+       for i, image in enumerate(generated_images):
+           filename = f"{i}{os.path.splitext(image['file_path'])[1]}"
+           shutil.copy2(image["file_path"], os.path.join(tmp_dir, filename))
+           images.append({
+               "filename": filename,
+               "part_index": image.get("part_index", i),
+               "num_parts": image.get("num_parts", len(generated_images)),
+               "num_image_parts": image.get("num_image_parts", len(generated_images)),
+               "info": image.get("info", {})
+           })
+      
+       entry = {
+           "key": key,
+           "created_at": time.time(),
+           "images": images
+       }
+       entry.update(extra or {})
+       with open(os.path.join(tmp_dir, ENTRY_FILE), 'w') as f:
+           json.dump(entry, f, ensure_ascii=False)
+      
+       # Swap in the complete entry
+       size = self._entry_size(tmp_dir)
+       self._remove_entry(entry_dir)
+       os.replace(tmp_dir, entry_dir)
+       self._count("writes")
+      
+       with self._lock:
+           seeded = self._total_bytes is not None
+       if not seeded:
+           # First write: one scan seeds the running total (and evicts if needed)
+           self.evict()
+           return
+       self._add_bytes(size)
+       with self._lock:
+           over_cap = self._total_bytes > self.max_size_bytes
+       if over_cap:
+           self.evict()
+  
+   def evict(self) -> int:
+       """
+       Remove expired entries, then least recently used ones until under the size cap
+      
+       Once over the cap, entries are removed down to CACHE_EVICT_TO of it.
+       Scans the whole directory and resets the running size total. Expired
+       entries are counted in stats["expirations"], size evictions in
+       stats["evictions"].
+      
+       Returns:
+           Number of entries removed
+       """
+       if not os.path.exists(self.cache_dir):
+           with self._lock:
+               self._total_bytes = 0
+           return 0
+      
+       entries = []
+       total_size = 0
+       now = time.time()
+       expired = 0
+       evicted = 0
+       for shard in os.listdir(self.cache_dir):
+           shard_path = os.path.join(self.cache_dir, shard)
+           if not os.path.isdir(shard_path):
+               continue
+           for key in os.listdir(shard_path):
+               entry_dir = os.path.join(shard_path, key)
+               entry_file = os.path.join(entry_dir, ENTRY_FILE)
+               if not os.path.exists(entry_file):
+                   continue
+               last_used = os.path.getmtime(entry_file)
+               try:
+                   with open(entry_file, 'r') as f:
+                       entry = json.load(f)
+               except (OSError, ValueError):
+                   # Unreadable entries are never served: drop them with the expired ones
+                   entry = {}
+               if self._expired(entry, now):
+                   shutil.rmtree(entry_dir, ignore_errors=True)
+                   expired += 1
+                   continue
+               size = self._entry_size(entry_dir)
+               entries.append((last_used, size, entry_dir))
+               total_size += size
+      
+       entries.sort()
+       target = self.max_size_bytes if total_size <= self.max_size_bytes else self.max_size_bytes * CACHE_EVICT_TO
+       for _, size, entry_dir in entries:
+           if total_size <= target:
+               break
+           shutil.rmtree(entry_dir, ignore_errors=True)
+           total_size -= size
+           evicted += 1
+      
+       with self._lock:
+           self._total_bytes = total_size
+           self.stats["expirations"] += expired
+           self.stats["evictions"] += evicted
+       return expired + evicted
+  
+   def clear(self):
+       """Remove every cached entry"""
+       shutil.rmtree(self.cache_dir, ignore_errors=True)
+       with self._lock:
+           self._total_bytes = 0
+  
+   def _count(self, key: str, amount: int = 1):
+       with self._lock:
+           self.stats[key] += amount
+  
+   def get_stats(self) -> Dict[str, Any]:
+       """Get hit/miss counters"""
+       with self._lock:
+           stats = dict(self.stats)
+       lookups = stats["hits"] + stats["misses"]
+       stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+       return stats
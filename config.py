@@ -5,7 +5,7 @@ Configuration settings for Gemini 2.5 Flash Image generation
 
 
 import os
-from typing import List
+from typing import Any, Dict, List, Optional
 
 
 # API Configuration
@@ -14,6 +14,13 @@ API_BASE_URL= "https://api.thucchien.ai/gemini/v1beta"
 
 DEFAULT_MODEL = "gemini-2.5-flash-image-preview"
 
+# Endpoint pool for failover (used by EndpointPool.from_config). Entries with
+# api_key_env are skipped when that environment variable is not set.
+API_ENDPOINTS = [
+   {"name": "proxy", "base_url": API_BASE_URL},
+   {"name": "google", "base_url": "https://generativelanguage.googleapis.com/v1beta", "api_key_env": "GEMINI_API_KEY"}
+]
+
 
 # Image Generation Settings
 SUPPORTED_ASPECT_RATIOS: List[str] = [
@@ -37,6 +44,17 @@ MAX_INPUT_IMAGES = 3        # Maximum reference images per prompt
 MAX_IMAGE_SIZE_MB = 7       # Maximum size per image
 MAX_OUTPUT_IMAGES = 10      # Maximum images to generate per prompt
 MAX_TOTAL_INPUT_SIZE_MB = 500
+MAX_INLINE_REQUEST_SIZE_MB = 20   # Whole generateContent body with inline images
+
+
+# Request Budget Settings (used by RequestBudget pre-flight checks)
+PREFLIGHT_BUDGET_CHECK = True     # Estimate tokens/bytes and reject oversized requests locally
+CHARS_PER_TOKEN = 4.0             # ASCII text
+NON_ASCII_CHARS_PER_TOKEN = 1.0   # Accented/CJK characters tokenize much less densely
+IMAGE_TOKENS_PER_TILE = 258       # Images up to IMAGE_SMALL_EDGE px cost one tile
+IMAGE_TILE_SIZE = 768             # Larger images are split into tiles of this size
+IMAGE_SMALL_EDGE = 384
+MIN_SHRINK_BYTES = 16 * 1024      # Smallest per-image byte budget auto-shrink will target
 
 
 # Supported image formats
@@ -52,10 +70,124 @@ DEFAULT_ASPECT_RATIO = "1:1"
 DEFAULT_NUM_IMAGES = 1
 
 
+# Output Transcoding Settings (used by Transcoder)
+OUTPUT_FORMATS = ["png", "jpeg", "webp"]
+DEFAULT_OUTPUT_QUALITY = 90   # JPEG/WebP quality (WebP effort when lossless)
+TRANSCODE_WORKERS = None      # Transcoding processes (None = CPU count, 0 = in-process)
+
+
+# Concurrency Settings
+DEFAULT_MAX_CONCURRENCY = 4  # Max in-flight API calls when num_images > 1
+MULTI_CANDIDATE_REQUESTS = False # num_images > 1: ask for every image in one call (candidateCount)
+POST_PROCESS_WORKERS = 4     # Decode/write/info threads used by PostProcessor
+
+
+# HTTP Transport Settings
+DEFAULT_CONNECT_TIMEOUT = 10   # Seconds to establish a connection
+DEFAULT_READ_TIMEOUT = 180     # Seconds to wait for response bytes (generation is slow)
+USE_HTTP2 = False              # HTTP/2 multiplexing (requires httpx[http2])
+ASYNC_MAX_IN_FLIGHT = 64       # Max concurrent requests per AsyncImageGenerationClient
+STREAM_RESPONSES = False       # Decode images to disk while the response downloads
+COALESCE_IDENTICAL_REQUESTS = False  # Share one API call between identical in-flight requests
+
+
+# Rate Limiting & Retry Settings (used by RequestScheduler)
+DEFAULT_REQUESTS_PER_MINUTE = 30   # Per-model admission rate
+DEFAULT_REQUEST_BURST = 5          # Requests allowed back-to-back
+MAX_RETRIES = 5                    # Retries after the first attempt
+RETRY_BASE_DELAY = 2.0             # Seconds, doubled per retry (with jitter)
+RETRY_MAX_DELAY = 60.0             # Backoff cap in seconds
+RETRYABLE_STATUS_CODES = [429, 500, 502, 503, 504]
+
+
+# Hedged Request Settings (used by HedgingPolicy, opt-in)
+HEDGE_PERCENTILE = 0.9     # Hedge calls still running past this latency percentile
+HEDGE_MIN_SAMPLES = 20     # Observed calls needed before hedging starts
+HEDGE_MAX_RATE = 0.1       # At most this fraction of requests is duplicated
+HEDGE_WINDOW = 200         # Recent latencies kept for the percentile
+HEDGE_MIN_DELAY = 5.0      # Never hedge sooner than this (seconds)
+
+
+# Endpoint Failover Settings (used by EndpointPool)
+CIRCUIT_FAILURE_THRESHOLD = 5   # Consecutive faults that trip an endpoint
+CIRCUIT_OPEN_SECONDS = 30       # Minimum time a tripped endpoint is out of rotation
+ENDPOINT_PROBE_INTERVAL = 10    # Seconds between background health probes
+ENDPOINT_PROBE_TIMEOUT = 10     # Connect/read timeout of a health probe
+LATENCY_EWMA_ALPHA = 0.2        # Weight of the newest latency sample in routing
+
+
+# Result Cache Settings (used by GenerationCache)
+DEFAULT_CACHE_DIR = "generated/cache"
+CACHE_MAX_SIZE_MB = 2048       # Evict least recently used entries above this
+CACHE_MAX_AGE_HOURS = 24 * 30  # Entries older than this are misses
+CACHE_EVICT_TO = 0.9           # Eviction frees space down to this fraction of the cap
+CACHE_POLICIES = ["use", "refresh", "bypass"]
+DEFAULT_CACHE_POLICY = "use"
+REFERENCE_CACHE_MAX_MB = 64    # In-memory cap for encoded reference images
+
+
+# Reference Upload Optimization (used when ImageConfig.upload_options is set)
+UPLOAD_FORMATS = ["jpeg", "webp", "png"]
+DEFAULT_UPLOAD_FORMAT = "jpeg"
+DEFAULT_UPLOAD_QUALITY = 85
+MIN_UPLOAD_QUALITY = 50        # Lowest quality tried when meeting a byte budget
+
+
+# Reference File Handles (used by ReferenceFileRegistry)
+FILES_UPLOAD_URL = None               # None derives <host>/upload/<version>/files from API_BASE_URL
+FILE_HANDLE_TTL_HOURS = 48            # Fallback when the server omits expirationTime
+FILE_HANDLE_REFRESH_MARGIN_MINUTES = 30  # Re-upload handles this close to expiry
+DEFAULT_FILE_REGISTRY_PATH = "generated/cache/file_handles.json"
+
+
+# Batch Job Settings (used by ImageGenerationClient.submit_batch)
+DEFAULT_BATCHES_DIR = "generated/batches"  # JSONL inputs and job manifests
+BATCH_POLL_INTERVAL = 30                   # Seconds between status checks
+BATCH_SUCCEEDED_STATE = "BATCH_STATE_SUCCEEDED"
+BATCH_FAILED_STATE = "BATCH_STATE_FAILED"
+BATCH_TERMINAL_STATES = [
+   BATCH_SUCCEEDED_STATE,
+   BATCH_FAILED_STATE,
+   "BATCH_STATE_CANCELLED",
+   "BATCH_STATE_EXPIRED"
+]
+
+
+# Result Settings (used by GenerationResult)
+RAW_RESPONSE_MODES = ["discard", "spill", "keep"]
+DEFAULT_RAW_RESPONSE_MODE = "discard"   # Results keep paths, info and usage, not the raw payload
+DEFAULT_SPILL_DIR = "generated/spill"   # Raw payloads written for raw_response="spill"
+
+
+# Image Metadata Settings (used by utils.get_image_info)
+IMAGE_HEADER_READ_BYTES = 64 * 1024   # Bytes read from a file to parse its header
+IMAGE_METADATA_CACHE_SIZE = 4096      # Entries kept, keyed by (path, mtime, size)
+
+
+# Metrics Settings (used by Metrics sinks)
+DEFAULT_METRICS_DIR = "generated/metrics"   # JSONL traces and Prometheus text files
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120]
+METRICS_LABELS = ["model", "aspect_ratio", "references"]   # Histogram/Prometheus labels (session_id is trace-only)
+METRICS_SAMPLE_WINDOW = 1000                # Recent durations kept per series for percentiles
+
+
+# Profiling Settings (used by Profiler, opt-in)
+PROFILE_MODES = ["cpu", "memory"]
+PROFILE_MODE = os.environ.get("IMAGEGEN_PROFILE", "")   # "cpu", "memory" or "cpu,memory" ("" = off)
+PROFILE_EVERY_N = int(os.environ.get("IMAGEGEN_PROFILE_EVERY", "1"))   # Profile one call in N
+DEFAULT_PROFILES_DIR = os.environ.get("IMAGEGEN_PROFILE_DIR", "generated/profiles")
+PROFILE_TOP_FUNCTIONS = 30     # Functions listed in each cProfile summary
+PROFILE_TOP_ALLOCATIONS = 25   # Allocation sites listed in each tracemalloc report
+
+
 # Session Settings
 MAX_SESSION_HISTORY = 10     # Maximum messages to keep in session history
 SESSION_TIMEOUT_HOURS = 24   # Auto-cleanup sessions older than this
 AUTO_SAVE_REFERENCES = True  # Save reference images in session folder
+SESSION_JOURNAL_COMPACT_EVENTS = 200  # Journal events before compacting into session.json
+SESSION_JOURNAL_FSYNC = False         # fsync every journal append (survives power loss, slower)
+USE_SESSION_CATALOG = True            # Keep session summaries in an SQLite index (list/count/cleanup)
+SESSION_CATALOG_FILE = "catalog.sqlite3"
 
 
 # File naming
@@ -80,7 +212,14 @@ class ImageConfig:
        output_dir: str = DEFAULT_OUTPUT_DIR,
        save_references: bool = AUTO_SAVE_REFERENCES,
        organize_by_date: bool = True,
-       output_format: str = "png"
+       output_format: str = "png",
+       max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+       cache_policy: str = DEFAULT_CACHE_POLICY,
+       upload_options: Optional["ReferenceUploadConfig"] = None,
+       output_quality: int = DEFAULT_OUTPUT_QUALITY,
+       lossless: bool = False,
+       multi_candidate: bool = MULTI_CANDIDATE_REQUESTS,
+       raw_response: str = DEFAULT_RAW_RESPONSE_MODE
    ):
        """
        Initialize image generation configuration
@@ -92,6 +231,20 @@ class ImageConfig:
            save_references: Whether to save reference images
            organize_by_date: Organize output by date folders
            output_format: Output image format (png, jpeg, webp)
+           max_concurrency: Max parallel API calls when num_images > 1 (1 = sequential)
+           cache_policy: Result cache behaviour when the client has a cache:
+               "use" (read and write), "refresh" (regenerate and overwrite),
+               "bypass" (neither read nor write)
+           upload_options: Downscale/recompress reference images before upload
+               (None sends the original files)
+           output_quality: Encoder quality for jpeg/webp output (1-100)
+           lossless: Save webp output losslessly (archival copies)
+           multi_candidate: For num_images > 1, request all images as candidates
+               of one call (one upload of prompt and references); falls back to
+               one call per image if the model refuses or returns fewer
+           raw_response: What results hold of the raw generateContent payload:
+               "discard" (usage metadata only), "spill" (written to a file in
+               DEFAULT_SPILL_DIR and loaded on access) or "keep" (in memory)
        """
        if aspect_ratio not in SUPPORTED_ASPECT_RATIOS:
            raise ValueError(f"Aspect ratio must be one of {SUPPORTED_ASPECT_RATIOS}")
@@ -99,15 +252,87 @@ class ImageConfig:
        if not 1 <= num_images <= MAX_OUTPUT_IMAGES:
            raise ValueError(f"num_images must be between 1 and {MAX_OUTPUT_IMAGES}")
       
-       if output_format not in ["png", "jpeg", "jpg", "webp"]:
+       if output_format not in OUTPUT_FORMATS + ["jpg"]:
            raise ValueError("output_format must be png, jpeg, or webp")
       
+       if not 1 <= output_quality <= 100:
+           raise ValueError("output_quality must be between 1 and 100")
+      
+       if max_concurrency < 1:
+           raise ValueError("max_concurrency must be at least 1")
+      
+       if cache_policy not in CACHE_POLICIES:
+           raise ValueError(f"cache_policy must be one of {CACHE_POLICIES}")
+      
+       if raw_response not in RAW_RESPONSE_MODES:
+           raise ValueError(f"raw_response must be one of {RAW_RESPONSE_MODES}")
+      
        self.aspect_ratio = aspect_ratio
        self.num_images = num_images
        self.output_dir = output_dir
        self.save_references = save_references
        self.organize_by_date = organize_by_date
        self.output_format = "jpeg" if output_format == "jpg" else output_format
+       self.max_concurrency = max_concurrency
+       self.cache_policy = cache_policy
+       self.upload_options = upload_options
+       self.output_quality = output_quality
+       self.lossless = lossless
+       self.multi_candidate = multi_candidate
+       self.raw_response = raw_response
+
+
+
+
+class ReferenceUploadConfig:
+   """Configuration for optimizing reference images before upload"""
+  
+   def __init__(
+       self,
+       max_long_edge: Optional[int] = None,
+       format: str = DEFAULT_UPLOAD_FORMAT,
+       quality: int = DEFAULT_UPLOAD_QUALITY,
+       max_bytes: Optional[int] = None,
+       min_quality: int = MIN_UPLOAD_QUALITY
+   ):
+       """
+       Initialize reference upload configuration
+      
+       The original files are never modified; optimized variants are built
+       in memory and cached by content hash.
+      
+       Args:
+           max_long_edge: Downscale so the longer side is at most this many pixels
+           format: Upload format (jpeg, webp, png)
+           quality: Encoder quality for jpeg/webp (1-100)
+           max_bytes: Byte budget per image; quality and then size are reduced to fit
+           min_quality: Lowest quality tried before downscaling further
+       """
+       format = "jpeg" if format == "jpg" else format
+       if format not in UPLOAD_FORMATS:
+           raise ValueError(f"format must be one of {UPLOAD_FORMATS}")
+      
+       if not 1 <= quality <= 100 or not 1 <= min_quality <= quality:
+           raise ValueError("quality must be 1-100 and min_quality must not exceed it")
+      
+       if max_long_edge is not None and max_long_edge < 16:
+           raise ValueError("max_long_edge must be at least 16 pixels")
+      
+       self.max_long_edge = max_long_edge
+       self.format = format
+       self.quality = quality
+       self.max_bytes = max_bytes
+       self.min_quality = min_quality
+  
+   def to_dict(self) -> Dict[str, Any]:
+       """Settings as a dict (used in cache keys)"""
+       return {
+           "max_long_edge": self.max_long_edge,
+           "format": self.format,
+           "quality": self.quality,
+           "max_bytes": self.max_bytes,
+           "min_quality": self.min_quality
+       }
 
 
 
@@ -126,7 +351,7 @@ class SessionConfig:
        Initialize session configuration
       
        Args:
-           max_history: Maximum messages to keep in history
+           max_history: Maximum messages to keep in history (0 keeps all)
            save_references: Save reference images with session
            auto_cleanup: Automatically clean up old sessions
            timeout_hours: Hours before session is considered stale
@@ -0,0 +1,54 @@
+"""
+Shared pytest fixtures
+The offline tests run against mock_server instead of the real API
+"""
+
+
+import sys
+from pathlib import Path
+
+
+import pytest
+
+
+# Add this directory to the path so the tests can import the client modules
+sys.path.insert(0, str(Path(__file__).parent))
+
+
+from mock_server import MockGeminiServer, MockGeminiState
+
+
+
+
+# Manual scripts that call the real API (run them directly, not under pytest)
+collect_ignore = [
+   "test_character_generation.py",
+   "test_gen.py",
+   "test_gen_p2.py",
+   "test_gen_v2.py",
+   "test_gen_v3.py",
+   "test_generation_with_reference.py",
+   "test_generation_with_reference_merge.py",
+   "test_image_editing.py"
+]
+
+
+
+
+@pytest.fixture(scope="session")
+def mock_gemini():
+   """A mock Gemini server on a free port, shared by the whole test run"""
+   server = MockGeminiServer(port=0).start()
+   try:
+       yield server
+   finally:
+       server.stop()
+
+
+
+
+@pytest.fixture
+def mock_api(mock_gemini):
+   """The mock server with fresh state (files, counters, no latency or errors) for one test"""
+   mock_gemini.state = MockGeminiState()
+   return mock_gemini
@@ -0,0 +1,361 @@
+"""
+Multi-endpoint failover for API requests
+Health tracking, per-endpoint circuit breakers and latency-weighted routing
+"""
+
+
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+from config import (
+   API_ENDPOINTS,
+   CIRCUIT_FAILURE_THRESHOLD,
+   CIRCUIT_OPEN_SECONDS,
+   ENDPOINT_PROBE_INTERVAL,
+   ENDPOINT_PROBE_TIMEOUT,
+   LATENCY_EWMA_ALPHA
+)
+from transport import HTTPTransport, TransportError
+
+
+
+
+CLOSED = "closed"   # Healthy: receives traffic
+OPEN = "open"       # Tripped: no traffic until a background probe succeeds
+
+
+
+
+def is_endpoint_failure(error: TransportError) -> bool:
+   """Connection errors, timeouts and 5xx count against an endpoint's health"""
+   return error.status_code is None or error.status_code >= 500
+
+
+
+
+class Endpoint:
+   """One upstream API base URL with its circuit breaker and latency estimate"""
+  
+   def __init__(self, base_url: str, api_key: Optional[str] = None, name: Optional[str] = None):
+       """
+       Initialize endpoint
+      
+       Args:
+           base_url: API base URL (e.g. https://host/v1beta)
+           api_key: Key for this endpoint (None uses the client's key)
+           name: Label for stats (defaults to the base URL)
+       """
+       self.base_url = base_url.rstrip('/')
+       self.api_key = api_key
+       self.name = name or self.base_url
+       self.state = CLOSED
+       self.consecutive_failures = 0
+       self.opened_at = 0.0
+       self.latency: Optional[float] = None
+       self.in_flight = 0
+       self.stats = {
+           "requests": 0,
+           "successes": 0,
+           "failures": 0,
+           "trips": 0
+       }
+
+
+
+
+class EndpointPool:
+   """
+   Routes requests across several API endpoints
+  
+   - Each request goes to a healthy endpoint picked at random, weighted by
+     inverse latency (EWMA) and current load, so a slow upstream gets less
+     traffic without being dropped
+   - Connection errors, timeouts and 5xx fail over to the next endpoint
+     within the same attempt; 429 fails over without counting as a fault
+   - failure_threshold consecutive faults trip an endpoint's breaker; it
+     gets no traffic until a background probe succeeds (after open_seconds)
+   - If every breaker is open, the endpoint tripped longest ago is tried
+     anyway rather than failing outright
+  
+   file_data URIs from ReferenceFileRegistry belong to the endpoint they
+   were uploaded to, so use inline references with a multi-endpoint pool.
+   """
+  
+   def __init__(
+       self,
+       endpoints: List[Endpoint],
+       failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+       open_seconds: float = CIRCUIT_OPEN_SECONDS,
+       probe_interval: float = ENDPOINT_PROBE_INTERVAL,
+       ewma_alpha: float = LATENCY_EWMA_ALPHA,
+       probe_transport: Optional[HTTPTransport] = None
+   ):
+       """
+       Initialize pool
+      
+       Args:
+           endpoints: Endpoints in preference order
+           failure_threshold: Consecutive faults that trip a breaker
+           open_seconds: Minimum time a tripped endpoint stays out of rotation
+           probe_interval: Seconds between background probe rounds
+           ewma_alpha: Weight of the newest latency sample
+           probe_transport: Transport for health probes (a small pool with
+               short timeouts, created on first probe and closed by close(), if None)
+       """
+       if not endpoints:
+           raise ValueError("EndpointPool needs at least one endpoint")
+      
+       self.endpoints = endpoints
+       self.failure_threshold = failure_threshold
+       self.open_seconds = open_seconds
+       self.probe_interval = probe_interval
+       self.ewma_alpha = ewma_alpha
+       self.probe_transport = probe_transport
+       self._owns_probe_transport = probe_transport is None
+       self.default_api_key: Optional[str] = None
+       self._lock = threading.Lock()
+       self._probe_thread: Optional[threading.Thread] = None
+       self._stop = threading.Event()
+       self.stats = {
+           "requests": 0,
+           "failovers": 0,
+           "probes": 0,
+           "readmitted": 0
+       }
+  
+   @classmethod
+   def from_config(cls, endpoints: Optional[List[Dict[str, Any]]] = None, **kwargs) -> "EndpointPool":
+       """
+       Build a pool from API_ENDPOINTS-style dicts
+      
+       Entries have base_url and optionally api_key or api_key_env; entries
+       whose api_key_env variable is unset are skipped.
+       """
+       pool = []
+       for entry in endpoints if endpoints is not None else API_ENDPOINTS:
+           api_key = entry.get("api_key")
+           if entry.get("api_key_env"):
+               api_key = os.environ.get(entry["api_key_env"])
+               if not api_key:
+                   continue
+           pool.append(Endpoint(entry["base_url"], api_key, entry.get("name")))
+       return cls(pool, **kwargs)
+  
+   def _weight(self, endpoint: Endpoint, fallback_latency: float) -> float:
+       latency = endpoint.latency if endpoint.latency is not None else fallback_latency
+       return 1.0 / (max(latency, 0.001) * (1 + endpoint.in_flight))
+  
+   def choose(self, exclude: Optional[List[Endpoint]] = None) -> Optional[Endpoint]:
+       """
+       Pick an endpoint for the next attempt
+      
+       Args:
+           exclude: Endpoints already tried for this request
+          
+       Returns:
+           Endpoint, or None if every endpoint was excluded
+       """
+       exclude = exclude or []
+       with self._lock:
+           candidates = [e for e in self.endpoints if e not in exclude]
+           if not candidates:
+               return None
+           healthy = [e for e in candidates if e.state == CLOSED]
+           if not healthy:
+               # Everything is tripped: try the one that has been out longest
+               chosen = min(candidates, key=lambda e: e.opened_at)
+           else:
+               known = [e.latency for e in healthy if e.latency is not None]
+               # Unmeasured endpoints are assumed as fast as the best known one
+               fallback = min(known) if known else 1.0
+               weights = [self._weight(e, fallback) for e in healthy]
+               chosen = random.choices(healthy, weights=weights)[0]
+           chosen.in_flight += 1
+           chosen.stats["requests"] += 1
+           return chosen
+  
+   def _release(self, endpoint: Endpoint, latency: Optional[float], error: Optional[TransportError]):
+       """Record the outcome of one attempt"""
+       with self._lock:
+           endpoint.in_flight -= 1
+           if error is None:
+               endpoint.stats["successes"] += 1
+               endpoint.consecutive_failures = 0
+               if endpoint.state == OPEN:
+                   # Served a request while everything was tripped: it is back
+                   endpoint.state = CLOSED
+                   self.stats["readmitted"] += 1
+               if endpoint.latency is None:
+                   endpoint.latency = latency
+               else:
+                   endpoint.latency += self.ewma_alpha * (latency - endpoint.latency)
+               return
+           if not is_endpoint_failure(error):
+               return
+           endpoint.stats["failures"] += 1
+           endpoint.consecutive_failures += 1
+           if endpoint.state == CLOSED and endpoint.consecutive_failures >= self.failure_threshold:
+               endpoint.state = OPEN
+               endpoint.opened_at = time.monotonic()
+               endpoint.stats["trips"] += 1
+               print(f"⚠️  Endpoint {endpoint.name} tripped after {endpoint.consecutive_failures} failures")
+       self._ensure_prober()
+  
+   def _should_fail_over(self, error: TransportError) -> bool:
+       return is_endpoint_failure(error) or error.status_code == 429
+  
+   def call(self, send: Callable[[Endpoint], Any]) -> Any:
+       """
+       Run send(endpoint), failing over across endpoints
+      
+       Args:
+           send: Callable performing one HTTP attempt against an endpoint
+          
+       Returns:
+           Whatever send() returns
+          
+       Raises:
+           TransportError: The last error once every endpoint has been tried,
+               or immediately for errors that are not the endpoint's fault
+       """
+       self._count("requests")
+       tried: List[Endpoint] = []
+       while True:
+           endpoint = self.choose(exclude=tried)
+           tried.append(endpoint)
+           started = time.perf_counter()
+           try:
+               result = send(endpoint)
+           except TransportError as e:
+               self._release(endpoint, None, e)
+               if not self._should_fail_over(e) or len(tried) == len(self.endpoints):
+                   raise
+               self._count("failovers")
+               continue
+           self._release(endpoint, time.perf_counter() - started, None)
+           return result
+  
+   async def call_async(self, send: Callable[[Endpoint], Awaitable[Any]]) -> Any:
+       """Coroutine version of call() for AsyncImageGenerationClient"""
+       self._count("requests")
+       tried: List[Endpoint] = []
+       while True:
+           endpoint = self.choose(exclude=tried)
+           tried.append(endpoint)
+           started = time.perf_counter()
+           try:
+               result = await send(endpoint)
+           except TransportError as e:
+               self._release(endpoint, None, e)
+               if not self._should_fail_over(e) or len(tried) == len(self.endpoints):
+                   raise
+               self._count("failovers")
+               continue
+           self._release(endpoint, time.perf_counter() - started, None)
+           return result
+  
+   def _count(self, key: str, amount: int = 1):
+       with self._lock:
+           self.stats[key] += amount
+  
+   def _ensure_prober(self):
+       """Start the background probe thread once an endpoint has tripped"""
+       with self._lock:
+           if self._stop.is_set():
+               return
+           if self._probe_thread is not None and self._probe_thread.is_alive():
+               return
+           if not any(e.state == OPEN for e in self.endpoints):
+               return
+           self._probe_thread = threading.Thread(
+               target=self._probe_loop, name="endpoint-probe", daemon=True
+           )
+           self._probe_thread.start()
+  
+   def _probe_loop(self):
+       """Probe tripped endpoints until all are re-admitted (or the pool is closed)"""
+       while not self._stop.wait(self.probe_interval):
+           with self._lock:
+               due = [
+                   e for e in self.endpoints
+                   if e.state == OPEN and time.monotonic() - e.opened_at >= self.open_seconds
+               ]
+               if not any(e.state == OPEN for e in self.endpoints):
+                   return
+           for endpoint in due:
+               if self._stop.is_set():
+                   return
+               self.probe(endpoint)
+  
+   def _get_probe_transport(self) -> HTTPTransport:
+       with self._lock:
+           if self.probe_transport is None:
+               self.probe_transport = HTTPTransport(
+                   pool_size=len(self.endpoints),
+                   connect_timeout=ENDPOINT_PROBE_TIMEOUT,
+                   read_timeout=ENDPOINT_PROBE_TIMEOUT
+               )
+           return self.probe_transport
+  
+   def probe(self, endpoint: Endpoint) -> bool:
+       """
+       Send a cheap request (list one model) and re-admit the endpoint if it answers 2xx
+      
+       Any error, including a 4xx such as a bad key or a 429, keeps the
+       breaker open until the next probe round.
+      
+       Returns:
+           True if the endpoint is healthy
+       """
+       self._count("probes")
+       api_key = endpoint.api_key or self.default_api_key
+       try:
+           response = self._get_probe_transport().get(
+               f"{endpoint.base_url}/models?pageSize=1",
+               headers={"x-goog-api-key": api_key} if api_key else None
+           )
+           response.close()
+           healthy = 200 <= response.status_code < 300
+       except TransportError:
+           healthy = False
+       if not healthy:
+           with self._lock:
+               endpoint.opened_at = time.monotonic()
+           return False
+       with self._lock:
+           endpoint.state = CLOSED
+           endpoint.consecutive_failures = 0
+           self.stats["readmitted"] += 1
+       print(f"✅ Endpoint {endpoint.name} re-admitted")
+       return True
+  
+   def close(self):
+       """Stop background probing, wait for the probe thread and close the probe transport it created"""
+       self._stop.set()
+       with self._lock:
+           probe_thread, self._probe_thread = self._probe_thread, None
+       if probe_thread is not None and probe_thread is not threading.current_thread():
+           probe_thread.join()
+       if self._owns_probe_transport and self.probe_transport is not None:
+           self.probe_transport.close()
+           self.probe_transport = None
+  
+   def get_stats(self) -> Dict[str, Any]:
+       """Get pool counters and per-endpoint health"""
+       with self._lock:
+           stats = dict(self.stats)
+           stats["endpoints"] = [
+               {
+                   "name": e.name,
+                   "state": e.state,
+                   "latency_ewma": round(e.latency, 3) if e.latency is not None else None,
+                   "in_flight": e.in_flight,
+                   **e.stats
+               }
+               for e in self.endpoints
+           ]
+       return stats
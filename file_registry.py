@@ -0,0 +1,379 @@
+"""
+Upload-once registry for reference images
+Each unique image is uploaded to the Files API once and then sent by URI
+"""
+
+
+import base64
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+
+from config import (
+   API_BASE_URL,
+   FILES_UPLOAD_URL,
+   FILE_HANDLE_TTL_HOURS,
+   FILE_HANDLE_REFRESH_MARGIN_MINUTES,
+   DEFAULT_FILE_REGISTRY_PATH,
+   ReferenceUploadConfig
+)
+from reference_optimizer import optimize_reference
+from transport import HTTPTransport, TransportError
+
+
+
+
+# Status codes returned when a file_data URI has expired or been deleted
+# (a 400 only counts when its error message names one of the request's files)
+EXPIRED_HANDLE_STATUS_CODES = [403, 404]
+
+
+
+
+def files_upload_url(base_url: str) -> str:
+   """
+   Derive the media upload endpoint from an API base URL
+  
+   https://host/prefix/v1beta -> https://host/prefix/upload/v1beta/files
+   """
+   prefix, version = base_url.rstrip('/').rsplit('/', 1)
+   return f"{prefix}/upload/{version}/files"
+
+
+
+
+def is_expired_handle_error(error: TransportError, payload: Dict[str, Any]) -> bool:
+   """
+   Whether a failed generateContent call may be fixed by re-uploading its references
+  
+   True for 403/404 on a request with file_data parts, and for a 400 whose
+   error body mentions one of those files (other 400s are prompt or
+   validation errors that a re-upload would not fix).
+   """
+   file_uris = [
+       part["file_data"]["file_uri"]
+       for content in payload.get("contents", [])
+       for part in content.get("parts", [])
+       if "file_data" in part
+   ]
+   if not file_uris:
+       return False
+   if error.status_code in EXPIRED_HANDLE_STATUS_CODES:
+       return True
+   if error.status_code == 400 and error.body:
+       # Errors name files by URI or by resource name (files/<id>)
+       return any(
+           uri in error.body or f"files/{uri.rsplit('/', 1)[-1]}" in error.body
+           for uri in file_uris
+       )
+   return False
+
+
+
+
+def parse_expiration_time(value: Optional[str]) -> Optional[float]:
+   """
+   Parse an RFC 3339 timestamp (e.g. 2025-10-27T10:00:00.123456789Z) to epoch seconds
+  
+   Returns:
+       Epoch seconds, or None if missing/invalid
+   """
+   if not value:
+       return None
+   # Trim nanoseconds to microseconds and normalize the UTC suffix
+   value = re.sub(r"(\.\d{6})\d+", r"\1", value).replace("Z", "+00:00")
+   try:
+       return datetime.fromisoformat(value).timestamp()
+   except ValueError:
+       return None
+
+
+
+
+def upload_file(
+   transport: HTTPTransport,
+   upload_url: str,
+   api_key: str,
+   data: bytes,
+   mime_type: str,
+   display_name: str
+) -> Dict[str, Any]:
+   """
+   Upload bytes to the Files API with the resumable protocol (start, then upload+finalize)
+  
+   Args:
+       transport: HTTP transport to send the requests through
+       upload_url: Files upload endpoint
+       api_key: Google API key
+       data: File contents
+       mime_type: MIME type of data
+       display_name: Human-readable file name
+      
+   Returns:
+       The server's file resource (name, uri, mimeType, expirationTime, ...)
+      
+   Raises:
+       TransportError: If either request fails or the response has no URI
+   """
+   start = transport.request(
+       "POST",
+       upload_url,
+       json_body={"file": {"display_name": display_name}},
+       headers={
+           "x-goog-api-key": api_key,
+           "X-Goog-Upload-Protocol": "resumable",
+           "X-Goog-Upload-Command": "start",
+           "X-Goog-Upload-Header-Content-Length": str(len(data)),
+           "X-Goog-Upload-Header-Content-Type": mime_type,
+           "Content-Type": "application/json"
+       }
+   )
+   session_url = start.headers.get("X-Goog-Upload-URL")
+   start.close()
+   if not session_url:
+       raise TransportError("Upload start response did not include X-Goog-Upload-URL")
+  
+   response = transport.request(
+       "POST",
+       session_url,
+       data=data,
+       headers={
+           "x-goog-api-key": api_key,
+           "X-Goog-Upload-Offset": "0",
+           "X-Goog-Upload-Command": "upload, finalize",
+           "Content-Length": str(len(data))
+       }
+   )
+   file_info = response.json().get("file", {})
+   if not file_info.get("uri"):
+       raise TransportError("Upload response did not include a file URI")
+   return file_info
+
+
+
+
+class ReferenceFileRegistry:
+   """
+   Registry of uploaded reference images and their file_data URIs
+  
+   Images are keyed by content hash (plus upload settings when references
+   are optimized), so the same character sheet under different paths is
+   uploaded once. Handles are persisted to a JSON file and reused across
+   runs until they come within the refresh margin of expiry, at which
+   point they are uploaded again transparently. Safe to share between
+   threads and clients.
+   """
+  
+   def __init__(
+       self,
+       api_key: str,
+       upload_url: Optional[str] = FILES_UPLOAD_URL,
+       base_url: str = API_BASE_URL,
+       registry_path: Optional[str] = DEFAULT_FILE_REGISTRY_PATH,
+       transport: Optional[HTTPTransport] = None,
+       refresh_margin_minutes: float = FILE_HANDLE_REFRESH_MARGIN_MINUTES
+   ):
+       """
+       Initialize registry
+      
+       Args:
+           api_key: Google API key
+           upload_url: Files upload endpoint (derived from base_url if None)
+           base_url: API base URL used to derive the upload endpoint
+           registry_path: JSON file for persisting handles (None keeps them in memory)
+           transport: HTTP transport for uploads (a small pooled transport if None)
+           refresh_margin_minutes: Re-upload handles expiring within this window
+       """
+       self.api_key = api_key
+       self.upload_url = upload_url or files_upload_url(base_url)
+       self.registry_path = registry_path
+       self.transport = transport or HTTPTransport(pool_size=2)
+       self.refresh_margin_seconds = refresh_margin_minutes * 60
+      
+       self._handles: Dict[str, Dict[str, Any]] = {}
+       self._lock = threading.Lock()
+       self._key_locks: Dict[str, threading.Lock] = {}
+       self.stats = {
+           "hits": 0,
+           "uploads": 0,
+           "refreshes": 0,
+           "uploaded_bytes": 0
+       }
+       self._load()
+  
+   @staticmethod
+   def _key(sha256: str, options: Optional[ReferenceUploadConfig]) -> str:
+       if options is None:
+           return sha256
+       return f"{sha256}:{json.dumps(options.to_dict(), sort_keys=True)}"
+  
+   def _load(self):
+       """Read persisted handles, dropping expired ones"""
+       if not self.registry_path or not os.path.exists(self.registry_path):
+           return
+       try:
+           with open(self.registry_path, 'r') as f:
+               handles = json.load(f)
+       except (OSError, ValueError):
+           return
+       now = time.time()
+       self._handles = {
+           key: handle for key, handle in handles.items()
+           if handle.get("expires_at", 0) > now
+       }
+  
+   def _save(self):
+       """Persist handles atomically (caller holds the lock)"""
+       if not self.registry_path:
+           return
+       os.makedirs(os.path.dirname(self.registry_path) or ".", exist_ok=True)
+       tmp_path = f"{self.registry_path}.tmp{threading.get_ident()}"
+       with open(tmp_path, 'w') as f:
+           json.dump(self._handles, f, indent=2)
+       os.replace(tmp_path, self.registry_path)
+  
+   def _is_fresh(self, handle: Optional[Dict[str, Any]]) -> bool:
+       return handle is not None and handle["expires_at"] - time.time() > self.refresh_margin_seconds
+  
+   def get_file_part(
+       self,
+       image_path: str,
+       options: Optional[ReferenceUploadConfig] = None
+   ) -> Dict[str, Any]:
+       """
+       Get a file_data request part for a reference image, uploading it if needed
+      
+       Args:
+           image_path: Path to image file
+           options: Upload settings (the optimized variant is what gets uploaded)
+          
+       Returns:
+           {"file_data": {"mime_type": ..., "file_uri": ...}}
+          
+       Raises:
+           TransportError: If the upload fails
+       """
+       encoded = optimize_reference(image_path, options)
+       key = self._key(encoded.sha256, options)
+      
+       with self._lock:
+           handle = self._handles.get(key)
+           if self._is_fresh(handle):
+               self.stats["hits"] += 1
+               return self._file_part(handle)
+           key_lock = self._key_locks.setdefault(key, threading.Lock())
+      
+       # One upload per image even when several threads miss at once
+       with key_lock:
+           with self._lock:
+               handle = self._handles.get(key)
+               if self._is_fresh(handle):
+                   self.stats["hits"] += 1
+                   return self._file_part(handle)
+               refreshing = handle is not None
+          
+           data = base64.b64decode(encoded.base64_data)
+           handle = self._upload(data, encoded.mime_type, os.path.basename(image_path))
+           handle["source_path"] = os.path.abspath(image_path)
+           handle["options"] = options.to_dict() if options else None
+          
+           with self._lock:
+               self._handles[key] = handle
+               self.stats["uploads"] += 1
+               self.stats["uploaded_bytes"] += len(data)
+               if refreshing:
+                   self.stats["refreshes"] += 1
+               self._save()
+       return self._file_part(handle)
+  
+   @staticmethod
+   def _file_part(handle: Dict[str, Any]) -> Dict[str, Any]:
+       return {
+           "file_data": {
+               "mime_type": handle["mime_type"],
+               "file_uri": handle["uri"]
+           }
+       }
+  
+   def _upload(self, data: bytes, mime_type: str, display_name: str) -> Dict[str, Any]:
+       """
+       Upload image bytes and build a registry handle
+      
+       Returns:
+           Handle dict with uri, name, mime_type and expires_at
+       """
+       file_info = upload_file(
+           self.transport, self.upload_url, self.api_key, data, mime_type, display_name
+       )
+       expires_at = parse_expiration_time(file_info.get("expirationTime"))
+       return {
+           "uri": file_info["uri"],
+           "name": file_info.get("name"),
+           "mime_type": file_info.get("mimeType", mime_type),
+           "expires_at": expires_at or time.time() + FILE_HANDLE_TTL_HOURS * 3600,
+           "uploaded_at": time.time()
+       }
+  
+   def invalidate_uris(self, uris: List[str]) -> int:
+       """
+       Forget handles the server no longer accepts
+      
+       Returns:
+           Number of handles removed
+       """
+       uris = set(uris)
+       with self._lock:
+           stale = [key for key, handle in self._handles.items() if handle["uri"] in uris]
+           for key in stale:
+               # Keep the entry as expired so the next upload counts as a refresh
+               self._handles[key] = dict(self._handles[key], expires_at=0)
+           if stale:
+               self._save()
+       return len(stale)
+  
+   def refresh_payload(self, payload: Dict[str, Any]) -> bool:
+       """
+       Re-upload every file_data reference in a payload and swap in new URIs
+      
+       Used after the server rejects a request whose handles expired early.
+      
+       Returns:
+           True if any reference was replaced
+       """
+       file_parts = [
+           part["file_data"]
+           for content in payload.get("contents", [])
+           for part in content.get("parts", [])
+           if "file_data" in part
+       ]
+       if not file_parts:
+           return False
+      
+       self.invalidate_uris([part["file_uri"] for part in file_parts])
+       with self._lock:
+           by_uri = {handle["uri"]: handle for handle in self._handles.values()}
+       for part in file_parts:
+           handle = by_uri.get(part["file_uri"])
+           if handle is None or not os.path.exists(handle["source_path"]):
+               return False
+           options = ReferenceUploadConfig(**handle["options"]) if handle["options"] else None
+           part.update(self.get_file_part(handle["source_path"], options)["file_data"])
+       return True
+  
+   def clear(self):
+       """Forget all handles"""
+       with self._lock:
+           self._handles.clear()
+           self._save()
+  
+   def get_stats(self) -> Dict[str, Any]:
+       """Get upload counters"""
+       with self._lock:
+           stats = dict(self.stats)
+           stats["handles"] = len(self._handles)
+       return stats
@@ -0,0 +1,231 @@
+"""
+Hedged requests to cut tail latency
+A duplicate request is fired when a call runs past a latency percentile
+"""
+
+
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+from config import (
+   HEDGE_PERCENTILE,
+   HEDGE_MIN_SAMPLES,
+   HEDGE_MAX_RATE,
+   HEDGE_WINDOW,
+   HEDGE_MIN_DELAY
+)
+from stats import percentile
+
+
+
+
+class HedgingPolicy:
+   """
+   Opt-in hedging for generateContent calls
+  
+   Latencies of recent successful calls are kept in a sliding window.
+   Once at least min_samples are known, a call still running after the
+   window's percentile (but never sooner than min_delay) triggers one
+   duplicate request; whichever finishes first wins. The loser is
+   cancelled on asyncio and released when it lands on threads (a blocking
+   requests call cannot be aborted), which is also when the latency saved
+   is measured. Hedges are capped at max_rate of all requests, since each
+   one is a billed generation.
+  
+   Share one policy across clients hitting the same endpoint so they
+   learn from the same latency window.
+   """
+  
+   def __init__(
+       self,
+       percentile: float = HEDGE_PERCENTILE,
+       min_samples: int = HEDGE_MIN_SAMPLES,
+       max_rate: float = HEDGE_MAX_RATE,
+       window: int = HEDGE_WINDOW,
+       min_delay: float = HEDGE_MIN_DELAY
+   ):
+       """
+       Initialize policy
+      
+       Args:
+           percentile: Latency percentile (0-1) after which to hedge
+           min_samples: Observed calls needed before hedging starts
+           max_rate: Maximum fraction of requests that may be hedged
+           window: Number of recent latencies kept
+           min_delay: Never hedge before this many seconds
+       """
+       if not 0 < percentile < 1:
+           raise ValueError("percentile must be between 0 and 1")
+       if not 0 <= max_rate <= 1:
+           raise ValueError("max_rate must be between 0 and 1")
+      
+       self.percentile = percentile
+       self.min_samples = min_samples
+       self.max_rate = max_rate
+       self.min_delay = min_delay
+       self._latencies: deque = deque(maxlen=window)
+       self._lock = threading.Lock()
+       self._executor: Optional[ThreadPoolExecutor] = None
+       self.stats = {
+           "requests": 0,
+           "hedged": 0,
+           "hedge_wins": 0,
+           "primary_wins": 0,
+           "rate_capped": 0,
+           "latency_saved_seconds": 0.0
+       }
+  
+   def _count(self, key: str, amount: float = 1):
+       with self._lock:
+           self.stats[key] += amount
+  
+   def record(self, latency: float):
+       """Add the latency of a completed call to the window"""
+       with self._lock:
+           self._latencies.append(latency)
+  
+   def hedge_delay(self) -> Optional[float]:
+       """
+       Seconds to wait before hedging a new call
+      
+       Returns:
+           Delay, or None while too few latencies have been observed
+       """
+       with self._lock:
+           if len(self._latencies) < self.min_samples:
+               return None
+           samples = list(self._latencies)
+       return max(self.min_delay, percentile(samples, self.percentile))
+  
+   def _acquire_hedge(self) -> bool:
+       """Take a hedge slot if the hedge rate stays under max_rate"""
+       with self._lock:
+           if self.stats["hedged"] + 1 > self.max_rate * self.stats["requests"]:
+               self.stats["rate_capped"] += 1
+               return False
+           self.stats["hedged"] += 1
+           return True
+  
+   @property
+   def executor(self) -> ThreadPoolExecutor:
+       """Threads running primary and hedge requests for call()"""
+       with self._lock:
+           if self._executor is None:
+               self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+           return self._executor
+  
+   def _timed(self, send: Callable[[], Any]) -> Callable[[], Any]:
+       def run():
+           started = time.perf_counter()
+           result = send()
+           self.record(time.perf_counter() - started)
+           return result
+       return run
+  
+   def call(self, send: Callable[[], Any]) -> Any:
+       """
+       Run send(), hedging it if it runs past the latency percentile
+      
+       Args:
+           send: Callable performing one request and returning a response with close()
+          
+       Returns:
+           The first successful response
+       """
+       self._count("requests")
+       delay = self.hedge_delay()
+       if delay is None:
+           return self._timed(send)()
+      
+       started = time.perf_counter()
+       # Each send runs in a copy of the caller's context (metric call tags)
+       primary = self.executor.submit(contextvars.copy_context().run, self._timed(send))
+       done, _ = wait([primary], timeout=delay)
+       if done or not self._acquire_hedge():
+           return primary.result()
+      
+       hedge = self.executor.submit(contextvars.copy_context().run, self._timed(send))
+       done, _ = wait([primary, hedge], return_when=FIRST_COMPLETED)
+       first = primary if primary in done else hedge
+       other = hedge if first is primary else primary
+       if first.exception() is not None:
+           # The first to finish failed: fall back to the other one
+           first, other = other, first
+           if first.exception() is not None:
+               return other.result()
+      
+       won_at = time.perf_counter() - started
+       self._count("hedge_wins" if first is hedge else "primary_wins")
+       # requests cannot abort a blocking call: release the loser when it lands
+       other.add_done_callback(lambda loser: self._discard(loser, first is hedge, won_at, started))
+       return first.result()
+  
+   def _discard(self, loser: Future, hedge_won: bool, won_at: float, started: float):
+       if loser.exception() is None:
+           loser.result().close()
+           if hedge_won:
+               self._count("latency_saved_seconds", max(0.0, time.perf_counter() - started - won_at))
+  
+   async def call_async(self, send: Callable[[], Awaitable[Any]]) -> Any:
+       """Coroutine version of call(); the losing request is cancelled"""
+       import asyncio
+      
+       self._count("requests")
+       delay = self.hedge_delay()
+      
+       async def timed() -> Any:
+           started = time.perf_counter()
+           result = await send()
+           self.record(time.perf_counter() - started)
+           return result
+      
+       if delay is None:
+           return await timed()
+      
+       started = time.perf_counter()
+       primary = asyncio.ensure_future(timed())
+       done, _ = await asyncio.wait([primary], timeout=delay)
+       if done or not self._acquire_hedge():
+           return await primary
+      
+       hedge = asyncio.ensure_future(timed())
+       pending = {primary, hedge}
+       try:
+           while pending:
+               done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+               for task in done:
+                   if task.exception() is None:
+                       self._count("hedge_wins" if task is hedge else "primary_wins")
+                       return task.result()
+           # Both failed: surface the primary's error
+           return primary.result()
+       finally:
+           for task in pending:
+               task.cancel()
+           if primary in pending:
+               # Keep the slow primary in the window (as a lower bound) so the percentile stays honest
+               self.record(time.perf_counter() - started)
+  
+   def close(self):
+       """Stop the hedging threads (a later call starts new ones)"""
+       with self._lock:
+           executor, self._executor = self._executor, None
+       if executor is not None:
+           executor.shutdown(wait=False)
+  
+   def get_stats(self) -> Dict[str, Any]:
+       """Get hedging counters and recent latency percentiles"""
+       with self._lock:
+           stats = dict(self.stats)
+           samples = list(self._latencies)
+       stats["latency_saved_seconds"] = round(stats["latency_saved_seconds"], 3)
+       stats["hedge_rate"] = round(stats["hedged"] / stats["requests"], 3) if stats["requests"] else 0.0
+       if samples:
+           for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+               stats[f"latency_{name}"] = round(percentile(samples, fraction), 3)
+       return stats
@@ -5,23 +5,49 @@ Supports text-to-image, image-to-image, multi-image fusion, and sessions
 
 
 import os
-import requests
-import base64
-from typing import List, Optional, Dict, Any
+import time
+import shutil
+import threading
+import contextvars
+from contextlib import nullcontext
+from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional, Dict, Any, Tuple, Union
 
 
 from config import (
    API_BASE_URL,
    DEFAULT_MODEL,
    DEFAULT_IMAGES_DIR,
+   USE_HTTP2,
+   STREAM_RESPONSES,
+   COALESCE_IDENTICAL_REQUESTS,
+   PREFLIGHT_BUDGET_CHECK,
    ImageConfig
 )
+from transport import HTTPTransport, TransportError, TransportResponse, create_transport
+from streaming import stream_decode_response
+from scheduler import RequestScheduler
+from cache import GenerationCache, request_fingerprint
+from reference_optimizer import optimize_reference
+from file_registry import ReferenceFileRegistry, is_expired_handle_error
+from batch import BatchJob, submit_batch
+from single_flight import SingleFlight
+from hedging import HedgingPolicy
+from endpoints import EndpointPool
+from post_processing import PostProcessor, resolve_result
+from budget import RequestBudget
+from transcode import Transcoder, get_transcoder
+from metrics import Metrics, call_tags, current_call_tags
+from profiling import Profiler, get_profiler
+from results import GenerationResult
 from utils import (
-   encode_image_to_base64,
-   decode_base64_to_image,
+   decode_base64_data,
+   write_image_bytes,
    validate_reference_images,
    generate_filename,
    organize_output_path,
+   match_format_extension,
    get_image_info
 )
 from session_manager import Session, SessionManager, SessionConfig
@@ -29,6 +55,14 @@ from session_manager import Session, SessionManager, SessionConfig
 
 
 
+# Models that refused or ignored candidateCount. Shared by every client in the
+# process so each new client does not pay for the rejected call again.
+_single_candidate_models = set()
+_single_candidate_lock = threading.Lock()
+
+
+
+
 class ImageGenerationClient:
    """
    Client for Gemini 2.5 Flash Image generation
@@ -46,7 +80,22 @@ class ImageGenerationClient:
        api_key: str,
        base_url: str = API_BASE_URL,
        model: str = DEFAULT_MODEL,
-       default_config: Optional[ImageConfig] = None
+       default_config: Optional[ImageConfig] = None,
+       transport: Optional[HTTPTransport] = None,
+       http2: bool = USE_HTTP2,
+       stream_responses: bool = STREAM_RESPONSES,
+       scheduler: Optional[RequestScheduler] = None,
+       cache: Optional[GenerationCache] = None,
+       file_registry: Optional[ReferenceFileRegistry] = None,
+       single_flight: Optional[SingleFlight] = None,
+       hedging: Optional[HedgingPolicy] = None,
+       endpoints: Optional[EndpointPool] = None,
+       post_processor: Optional[PostProcessor] = None,
+       budget: Optional[RequestBudget] = None,
+       transcoder: Optional[Transcoder] = None,
+       metrics: Optional[Metrics] = None,
+       profiler: Optional[Profiler] = None,
+       session_manager: Optional[SessionManager] = None
    ):
        """
        Initialize image generation client
@@ -56,20 +105,232 @@ class ImageGenerationClient:
            base_url: API base URL
            model: Model name (default: gemini-2.5-flash-image-preview)
            default_config: Default image generation configuration
+           transport: HTTP transport to send requests through (a pooled
+               keep-alive transport sized to max_concurrency if None)
+           http2: Use HTTP/2 multiplexing for the default transport
+           stream_responses: Decode images straight to disk while the response
+               downloads instead of parsing the whole body in memory
+           scheduler: Optional RequestScheduler for rate limiting and retries
+               of 429/5xx responses (share one across clients on the same quota)
+           cache: Optional GenerationCache; identical requests (model, prompt,
+               reference bytes, aspect ratio, format) are served from disk.
+               Controlled per call by ImageConfig.cache_policy
+           file_registry: Optional ReferenceFileRegistry; references are uploaded
+               once and sent as file_data URIs instead of inline base64
+           single_flight: SingleFlight group for coalescing identical concurrent
+               requests (a per-client group if None and COALESCE_IDENTICAL_REQUESTS)
+           hedging: Optional HedgingPolicy; slow calls get a duplicate request
+               and the first response wins
+           endpoints: Optional EndpointPool; generateContent calls are routed
+               across its endpoints with failover (base_url still serves
+               batch and file uploads)
+           post_processor: Optional PostProcessor; decoding, writing and
+               inspecting images runs on its workers so the request thread
+               can start the next call (see generate(wait=False))
+           budget: RequestBudget for pre-flight token/size checks (default
+               limits if None and PREFLIGHT_BUDGET_CHECK); requests over it
+               fail locally or have their references shrunk to fit
+           transcoder: Transcoder converting returned images to
+               config.output_format (the process-wide one if None)
+           metrics: Optional Metrics; every stage of a generation (validate,
+               budget, encode, server wait, download, decode, transcode,
+               write, ...) is recorded as a timing span tagged with model,
+               aspect ratio, reference count and session id
+           profiler: Profiler wrapping sampled generate/generate_with_session
+               calls in cProfile/tracemalloc (the process-wide one, set up
+               from IMAGEGEN_PROFILE, if None)
+           session_manager: SessionManager for create/load_session (one on
+               DEFAULT_SESSIONS_DIR, created on first session use, if None)
        """
        self.api_key = api_key
        self.base_url = base_url.rstrip('/')
        self.model = model
        self.default_config = default_config or ImageConfig()
-       self.session_manager = SessionManager()
+       self._transport = transport
+       self._http2 = http2
+       self.stream_responses = stream_responses
+       self.scheduler = scheduler
+       self.cache = cache
+       self.file_registry = file_registry
+       if single_flight is None and COALESCE_IDENTICAL_REQUESTS:
+           single_flight = SingleFlight()
+       self.single_flight = single_flight
+       self.hedging = hedging
+       self.endpoints = endpoints
+       self.post_processor = post_processor
+       if budget is None and PREFLIGHT_BUDGET_CHECK:
+           budget = RequestBudget()
+       self.budget = budget
+       self.transcoder = transcoder or get_transcoder()
+       self.metrics = metrics
+       self.profiler = profiler or get_profiler()
+       if endpoints is not None and endpoints.default_api_key is None:
+           endpoints.default_api_key = api_key
+       self._session_manager = session_manager
+  
+   @property
+   def transport(self) -> HTTPTransport:
+       """Shared HTTP transport (created on first use)"""
+       if self._transport is None:
+           self._transport = create_transport(
+               pool_size=self.default_config.max_concurrency,
+               http2=self._http2
+           )
+       return self._transport
+  
+   @property
+   def session_manager(self) -> SessionManager:
+       """Session store (created on first use, so clients that never use sessions touch no disk)"""
+       if self._session_manager is None:
+           self._session_manager = SessionManager()
+       return self._session_manager
+  
+   def close(self):
+       """
+       Release the client's resources
+      
+       Finishes queued post-processing, stops the post-processing and
+       hedging threads and endpoint probing, and closes pooled HTTP
+       connections and the session catalog. Components passed in are
+       closed too, so do not share them with clients still in use.
+       """
+       if self.post_processor is not None:
+           self.post_processor.close()
+       if self.hedging is not None:
+           self.hedging.close()
+       if self.endpoints is not None:
+           self.endpoints.close()
+       if self._transport is not None:
+           self._transport.close()
+       if self._session_manager is not None:
+           self._session_manager.close()
+  
+   def __enter__(self):
+       return self
+  
+   def __exit__(self, exc_type, exc_value, traceback):
+       self.close()
+  
+   def _api_headers(self, api_key: Optional[str] = None) -> Dict[str, str]:
+       """Request headers for a generateContent call (api_key overrides the client's key)"""
+       return {
+           "x-goog-api-key": api_key or self.api_key,
+           "Content-Type": "application/json"
+       }
+  
+   def _span(self, stage: str, **tags):
+       """Timing span for one stage (a no-op without metrics)"""
+       if self.metrics is None:
+           return nullcontext()
+       return self.metrics.span(stage, **tags)
+  
+   def _call_tags(
+       self,
+       config: ImageConfig,
+       reference_images: Optional[List[str]],
+       session_id: Optional[str] = None
+   ):
+       """Tag the spans of one generation call (a no-op without metrics)"""
+       if self.metrics is None:
+           return nullcontext()
+       tags = {
+           "model": self.model,
+           "aspect_ratio": config.aspect_ratio,
+           "references": len(reference_images or [])
+       }
+       if session_id is not None:
+           tags["session_id"] = session_id
+       return call_tags(**tags)
+  
+   def _record_transfer(self, response: TransportResponse, elapsed: float, stream: bool):
+       """Split a request's time into server wait and body download"""
+       if self.metrics is None or response.wait_seconds is None:
+           return
+       self.metrics.record("server_wait", response.wait_seconds)
+       if not stream:
+           # A streamed body downloads during the "stream" stage instead
+           self.metrics.record("download", max(elapsed - response.wait_seconds, 0.0))
+  
+   def _record_generation(self, result: Union[Dict[str, Any], Future], started: float):
+       """Record a whole generate() call once its result is ready"""
+       if self.metrics is None:
+           return
+       tags = current_call_tags()
+      
+       def record(outcome: Dict[str, Any]):
+           self.metrics.record(
+               "generate", time.perf_counter() - started, bool(outcome.get("success")), **tags
+           )
+      
+       if isinstance(result, Future):
+           result.add_done_callback(
+               lambda future: record(future.result() if future.exception() is None else {})
+           )
+       else:
+           record(result)
+  
+   def _parse_response(self, response: TransportResponse) -> Dict[str, Any]:
+       """Read and parse a generateContent response body"""
+       with self._span("parse"):
+           return response.json()
+  
+   def _post_generate_content(self, payload: Dict[str, Any], stream: bool = False) -> TransportResponse:
+       """
+       Send a generateContent request through the shared transport
+      
+       With stream=True the body is left unread so it can be consumed
+       incrementally via iter_chunks().
+      
+       Raises:
+           TransportError: On connection errors, timeouts or non-2xx status
+       """
+       def send_to(base_url: str, api_key: Optional[str]) -> TransportResponse:
+           started = time.perf_counter()
+           with self._span("request"):
+               response = self.transport.post(
+                   f"{base_url}/models/{self.model}:generateContent",
+                   json_body=payload,
+                   headers=self._api_headers(api_key),
+                   stream=stream
+               )
+           self._record_transfer(response, time.perf_counter() - started, stream)
+           return response
+      
+       def send() -> TransportResponse:
+           if self.endpoints is not None:
+               return self.endpoints.call(lambda endpoint: send_to(endpoint.base_url, endpoint.api_key))
+           return send_to(self.base_url, None)
+      
+       def send_scheduled() -> TransportResponse:
+           if self.scheduler is not None:
+               return self.scheduler.call(self.model, send)
+           return send()
+      
+       def send_hedged() -> TransportResponse:
+           if self.hedging is not None:
+               return self.hedging.call(send_scheduled)
+           return send_scheduled()
+      
+       try:
+           return send_hedged()
+       except TransportError as e:
+           # A file_data handle may have expired server-side: re-upload and resend once
+           if (
+               self.file_registry is None
+               or not is_expired_handle_error(e, payload)
+               or not self.file_registry.refresh_payload(payload)
+           ):
+               raise
+       return send_hedged()
   
    def generate(
        self,
        prompt: str,
        config: Optional[ImageConfig] = None,
        reference_images: Optional[List[str]] = None,
-       save_to: Optional[str] = None
-   ) -> Dict[str, Any]:
+       save_to: Optional[str] = None,
+       wait: bool = True
+   ) -> Union[Dict[str, Any], Future]:
        """
        Generate image(s) from text prompt
       
@@ -78,206 +339,401 @@ class ImageGenerationClient:
            config: Image generation configuration (uses default if None)
            reference_images: Optional list of reference image paths (max 3)
            save_to: Optional output path (auto-generated if None)
+           wait: If False, return a Future as soon as the API has answered;
+               with a post_processor the images are saved in the background
+               while the caller sends its next request
           
        Returns:
-           Dict with generation results
+           Dict with generation results (a Future of it if wait is False)
        """
        config = config or self.default_config
+       started = time.perf_counter()
+      
+       with self._call_tags(config, reference_images), self.profiler.profile("generate"):
+           # If num_images > 1, ask for several candidates (or fan out one call per image)
+           if config.num_images > 1:
+               result = self._generate_many(prompt, config, reference_images, save_to)
+           else:
+               # Single image generation
+               result = self._generate_single(prompt, config, reference_images, save_to, deferred=not wait)
+           self._record_generation(result, started)
+      
+       if wait or isinstance(result, Future):
+           return result
+       done = Future()
+       done.set_result(result)
+       return done
+  
+   def _generate_many(
+       self,
+       prompt: str,
+       config: ImageConfig,
+       reference_images: Optional[List[str]] = None,
+       save_to: Optional[str] = None
+   ) -> Dict[str, Any]:
+       """
+       Internal method to generate config.num_images images with bounded concurrency
       
-       # If num_images > 1, make multiple API calls
-       if config.num_images > 1:
-           print(f"📊 Generating {config.num_images} images (making {config.num_images} API calls)...")
-           all_generated = []
+       With config.multi_candidate, all images are first requested as
+       candidates of a single call; images that call does not deliver are
+       then fanned out. Up to config.max_concurrency fan-out calls are in
+       flight at once. Results are gathered in request order, partial
+       successes are kept, and every call reports its own wall-clock time.
+       With a post_processor, a call slot is freed as soon as its response
+       arrives and saving happens on the post-processing workers.
+       """
+       num_images = config.num_images
+       started_at: Dict[int, float] = {}
+      
+       def run(img_num: int) -> Union[Dict[str, Any], Future]:
+           # Determine save path for this image
+           current_save_to, name_suffix = self._variation_target(save_to, img_num)
           
-           for img_num in range(config.num_images):
-               print(f"  • Generating image {img_num + 1}/{config.num_images}...", end=" ", flush=True)
-              
-               # Determine save path for this image
-               current_save_to = None
-               if save_to:
-                   base, ext = os.path.splitext(save_to)
-                   current_save_to = f"{base}_{img_num + 1}{ext}"
-              
-               # Make single API call
-               single_result = self._generate_single(
-                   prompt=prompt,
-                   config=config,
-                   reference_images=reference_images,
-                   save_to=current_save_to
-               )
-              
-               if single_result.get("success"):
-                   all_generated.extend(single_result.get("generated_images", []))
-                   print("✅")
+           started_at[img_num] = time.perf_counter()
+           return self._generate_single(
+               prompt=prompt,
+               config=config,
+               reference_images=reference_images,
+               save_to=current_save_to,
+               name_suffix=name_suffix,
+               deferred=True
+           )
+      
+       def collect(img_num: int, outcome: Union[Dict[str, Any], Future]):
+           # Runs once the call (and its post-processing) has finished
+           try:
+               results[img_num] = resolve_result(outcome)
+           except Exception as e:
+               results[img_num] = {"success": False, "error": str(e)}
+           results[img_num]["elapsed_seconds"] = round(time.perf_counter() - started_at[img_num], 3)
+           report(img_num, results[img_num])
+      
+       def report(img_num: int, single_result: Dict[str, Any]):
+           label = f"  • Image {img_num + 1}/{num_images}"
+           if single_result.get("success"):
+               print(f"{label} ✅ ({single_result['elapsed_seconds']:.1f}s)")
+           else:
+               print(f"{label} ❌ {single_result.get('error')}")
+      
+       started = time.perf_counter()
+       results: List[Dict[str, Any]] = [{} for _ in range(num_images)]
+       # Post-processing jobs still running, by image number
+       saving: Dict[Future, int] = {}
+       remaining = list(range(num_images))
+      
+       if self._use_candidates(config):
+           print(f"📊 Generating {num_images} images (one API call, {num_images} candidates)...")
+           for img_num, single_result in self._generate_candidates(
+               prompt, config, reference_images, save_to
+           ).items():
+               results[img_num] = single_result
+               report(img_num, single_result)
+           remaining = [img_num for img_num in remaining if not results[img_num]]
+           if remaining:
+               print(f"  ↪ {len(remaining)} image(s) not returned as candidates, "
+                     f"falling back to one call each")
+       else:
+           print(f"📊 Generating {num_images} images "
+                 f"(making {num_images} API calls, "
+                 f"{min(config.max_concurrency, num_images)} at a time)...")
+      
+       max_workers = min(config.max_concurrency, max(len(remaining), 1))
+       if max_workers == 1:
+           for img_num in remaining:
+               outcome = run(img_num)
+               if isinstance(outcome, Future):
+                   saving[outcome] = img_num
                else:
-                   print(f"❌ {single_result.get('error')}")
-          
-           if all_generated:
-               return {
-                   "success": True,
-                   "prompt": prompt,
-                   "config": {
-                       "aspect_ratio": config.aspect_ratio,
-                       "num_images": config.num_images
-                   },
-                   "reference_images": reference_images or [],
-                   "generated_images": all_generated
+                   collect(img_num, outcome)
+       else:
+           with ThreadPoolExecutor(max_workers=max_workers) as executor:
+               # Each call carries this call's metric tags into its worker thread
+               futures = {
+                   executor.submit(contextvars.copy_context().run, run, img_num): img_num
+                   for img_num in remaining
                }
+               for future in as_completed(futures):
+                   img_num = futures[future]
+                   try:
+                       outcome = future.result()
+                   except Exception as e:
+                       outcome = {"success": False, "error": str(e)}
+                   if isinstance(outcome, Future):
+                       saving[outcome] = img_num
+                   else:
+                       collect(img_num, outcome)
+      
+       for future in as_completed(saving):
+           collect(saving[future], future)
+      
+       total_elapsed = round(time.perf_counter() - started, 3)
+      
+       return self._combine_results(prompt, config, reference_images, results, total_elapsed)
+  
+   def _combine_results(
+       self,
+       prompt: str,
+       config: ImageConfig,
+       reference_images: Optional[List[str]],
+       results: List[Dict[str, Any]],
+       total_elapsed: float
+   ) -> Dict[str, Any]:
+       """Merge per-variation results (in request order) into one result dict"""
+       all_generated = []
+       timings = []
+       failed = []
+       for img_num, single_result in enumerate(results):
+           timings.append({
+               "index": img_num + 1,
+               "success": bool(single_result.get("success")),
+               "elapsed_seconds": single_result.get("elapsed_seconds")
+           })
+           if single_result.get("success"):
+               for image in single_result.get("generated_images", []):
+                   image["elapsed_seconds"] = single_result.get("elapsed_seconds")
+                   all_generated.append(image)
            else:
-               return {
-                   "success": False,
-                   "error": "Failed to generate any images"
-               }
+               failed.append({"index": img_num + 1, "error": single_result.get("error")})
+      
+       if all_generated:
+           return GenerationResult(
+               prompt,
+               {
+                   "aspect_ratio": config.aspect_ratio,
+                   "num_images": config.num_images
+               },
+               reference_images,
+               all_generated,
+               failed=failed,
+               timings=timings,
+               total_elapsed_seconds=total_elapsed
+           )
        else:
-           # Single image generation
-           return self._generate_single(prompt, config, reference_images, save_to)
+           return {
+               "success": False,
+               "error": "Failed to generate any images",
+               "failed": failed,
+               "timings": timings,
+               "total_elapsed_seconds": total_elapsed
+           }
+  
+   def _variation_target(self, save_to: Optional[str], img_num: int) -> Tuple[Optional[str], str]:
+       """Output path and filename suffix for image img_num of a multi-image request"""
+       current_save_to = None
+       if save_to:
+           base, ext = os.path.splitext(save_to)
+           current_save_to = f"{base}_{img_num + 1}{ext}"
+       return current_save_to, str(img_num + 1)
+  
+   def _use_candidates(self, config: ImageConfig) -> bool:
+       """Whether to try one multi-candidate call (not if the model refused before)"""
+       with _single_candidate_lock:
+           return config.multi_candidate and self.model not in _single_candidate_models
+  
+   def _remember_single_candidate(self):
+       """Stop asking self.model for candidates, in every client of the process"""
+       with _single_candidate_lock:
+           _single_candidate_models.add(self.model)
+  
+   def _prepare_candidates(
+       self,
+       prompt: str,
+       config: ImageConfig,
+       reference_images: Optional[List[str]],
+       save_to: Optional[str]
+   ) -> Tuple[List[str], Dict[int, Dict[str, Any]], List[Tuple[int, Optional[str], str, Optional[str]]]]:
+       """
+       Validate references and serve cached variations before a multi-candidate call
+      
+       Returns:
+           Tuple of (image paths, cached results by image index, pending
+           variations as (image index, save_to, name_suffix, cache key))
+       """
+       image_paths = self._validate_references(reference_images)
+       cached: Dict[int, Dict[str, Any]] = {}
+       pending = []
+       for img_num in range(config.num_images):
+           current_save_to, name_suffix = self._variation_target(save_to, img_num)
+           cache_key, cached_result = self._lookup_cache(
+               prompt, config, image_paths, reference_images, current_save_to, name_suffix
+           )
+           if cached_result is not None:
+               cached[img_num] = cached_result
+           else:
+               pending.append((img_num, current_save_to, name_suffix, cache_key))
+       return image_paths, cached, pending
+  
+   def _candidates_payload(
+       self,
+       prompt: str,
+       config: ImageConfig,
+       image_paths: List[str],
+       count: int
+   ) -> Tuple[ImageConfig, Optional[Dict[str, Any]], Dict[str, Any]]:
+       """Budget-check and build a request asking for count candidates"""
+       config, budget_report = self._check_budget(prompt, config, image_paths)
+       payload = self._build_payload(prompt, config, image_paths)
+       payload["generationConfig"]["candidateCount"] = count
+       return config, budget_report, payload
+  
+   def _save_candidates(
+       self,
+       response_data: Dict[str, Any],
+       pending: List[Tuple[int, Optional[str], str, Optional[str]]],
+       prompt: str,
+       config: ImageConfig,
+       reference_images: Optional[List[str]],
+       budget_report: Optional[Dict[str, Any]]
+   ) -> Dict[int, Dict[str, Any]]:
+       """
+       Save each candidate of a multi-candidate response as one variation
+      
+       Candidate n is named and cached exactly like the n-th fan-out call
+       would have been. Candidates without images are left out so the caller
+       can fan them out.
+      
+       Returns:
+           Results by image index
+       """
+       candidates = sorted(response_data.get("candidates") or [], key=lambda c: c.get("index", 0))
+       if len(candidates) < 2:
+           # The model ignored candidateCount: do not ask it again
+           self._remember_single_candidate()
+      
+       results = {}
+       for (img_num, current_save_to, name_suffix, cache_key), candidate in zip(pending, candidates):
+           # A one-candidate view keeps the single-image helpers (layout, cache) working
+           candidate_data = dict(response_data, candidates=[candidate])
+           generated_files = [
+               self._save_image(
+                   base64_string,
+                   self._resolve_output_path(
+                       config, current_save_to, name_suffix, part_index, num_parts, num_image_parts
+                   ),
+                   config
+               )
+               for part_index, base64_string, num_parts, num_image_parts
+               in self._iter_inline_images(candidate_data)
+           ]
+           if generated_files:
+               results[img_num] = self._finish_result(
+                   candidate_data, generated_files, prompt, config, reference_images, cache_key, budget_report
+               )
+       return results
+  
+   def _candidate_request_failed(
+       self,
+       error: TransportError,
+       pending: List[Tuple[int, Optional[str], str, Optional[str]]],
+       prompt: str
+   ) -> Dict[int, Dict[str, Any]]:
+       """
+       Handle a failed multi-candidate call
+      
+       A 400 means the model does not take candidateCount: it is remembered
+       and nothing is returned, so every variation is fanned out. Any other
+       error fails all pending variations (fanning out would only multiply
+       requests against an unhealthy API).
+       """
+       if error.status_code == 400:
+           print(f"⚠️  {self.model} rejected candidateCount, using one call per image")
+           self._remember_single_candidate()
+           return {}
+       return {
+           img_num: {"success": False, "error": f"API request failed: {str(error)}", "prompt": prompt}
+           for img_num, _, _, _ in pending
+       }
+  
+   def _generate_candidates(
+       self,
+       prompt: str,
+       config: ImageConfig,
+       reference_images: Optional[List[str]],
+       save_to: Optional[str]
+   ) -> Dict[int, Dict[str, Any]]:
+       """
+       Request every uncached variation as a candidate of one call
+      
+       Returns:
+           Results by image index; missing indexes should be fanned out
+       """
+       started = time.perf_counter()
+       results: Dict[int, Dict[str, Any]] = {}
+       pending: List[Tuple[int, Optional[str], str, Optional[str]]] = []
+       try:
+           image_paths, results, pending = self._prepare_candidates(
+               prompt, config, reference_images, save_to
+           )
+           if len(pending) > 1:
+               request_config, budget_report, payload = self._candidates_payload(
+                   prompt, config, image_paths, len(pending)
+               )
+               response = self._post_generate_content(payload)
+               results.update(self._save_candidates(
+                   self._parse_response(response), pending, prompt, request_config, reference_images, budget_report
+               ))
+       except TransportError as e:
+           results.update(self._candidate_request_failed(e, pending, prompt))
+       except Exception:
+           # Invalid references, budget errors etc.: the fan-out reports them per image
+           return {}
+      
+       elapsed = round(time.perf_counter() - started, 3)
+       for single_result in results.values():
+           single_result["elapsed_seconds"] = elapsed
+       return results
   
    def _generate_single(
        self,
        prompt: str,
        config: ImageConfig,
        reference_images: Optional[List[str]] = None,
-       save_to: Optional[str] = None
-   ) -> Dict[str, Any]:
+       save_to: Optional[str] = None,
+       name_suffix: str = "",
+       deferred: bool = False
+   ) -> Union[Dict[str, Any], Future]:
        """
        Internal method to generate a single image
+      
+       name_suffix is appended to auto-generated filenames so parallel calls
+       started within the same second do not overwrite each other. With
+       deferred=True and a post_processor, a Future is returned once the
+       response has arrived and the images are saved in the background.
        """
        try:
            # Build request payload for Gemini API
-           contents = []
-          
-           # Add reference images if provided
-           if reference_images:
-               # Validate reference images
-               validation = validate_reference_images(reference_images)
-               if not validation["valid"]:
-                   return {
-                       "success": False,
-                       "error": f"Invalid reference images: {validation['errors']}"
-                   }
-              
-               # Build parts with images
-               parts = []
-              
-               # Add reference images as inline_data
-               for image_path in validation["valid_images"]:
-                   base64_data, mime_type = encode_image_to_base64(image_path)
-                   parts.append({
-                       "inline_data": {
-                           "mime_type": mime_type,
-                           "data": base64_data
-                       }
-                   })
-              
-               # Add text prompt
-               parts.append({"text": prompt})
-              
-               contents.append({"parts": parts})
-           else:
-               # Text-only prompt
-               contents.append({
-                   "parts": [{"text": prompt}]
-               })
+           image_paths = self._validate_references(reference_images)
           
-           # Build generation config with aspect ratio
-           generation_config = {
-               "imageConfig": {
-                   "aspectRatio": config.aspect_ratio
-               }
-           }
+           # Serve from the result cache when allowed
+           cache_key, cached_result = self._lookup_cache(
+               prompt, config, image_paths, reference_images, save_to, name_suffix
+           )
+           if cached_result is not None:
+               return cached_result
           
-           # Build full request payload
-           payload = {
-               "contents": contents,
-               "generationConfig": generation_config
-           }
-          
-           # Make API request
-           url = f"{self.base_url}/models/{self.model}:generateContent"
-           headers = {
-               "x-goog-api-key": self.api_key,
-               "Content-Type": "application/json"
-           }
-          
-           response = requests.post(url, json=payload, headers=headers)
-           response.raise_for_status()
-           response_data = response.json()
-          
-           # Extract generated images from response
-           generated_files = []
-          
-           if "candidates" in response_data and len(response_data["candidates"]) > 0:
-               candidate = response_data["candidates"][0]
-               if "content" in candidate and "parts" in candidate["content"]:
-                   for i, part in enumerate(candidate["content"]["parts"]):
-                       # Check for both camelCase and snake_case
-                       if "inlineData" in part or "inline_data" in part:
-                           # Get base64 data (try both naming conventions)
-                           inline_data = part.get("inlineData") or part.get("inline_data")
-                           base64_string = inline_data.get("data")
-                          
-                           # Generate output path
-                           if save_to:
-                               # Make sure save_to is an absolute path or in the output directory
-                               if os.path.isabs(save_to):
-                                   output_path = save_to
-                               else:
-                                   # Relative path - put it in the default output directory
-                                   output_dir = config.output_dir
-                                   if config.organize_by_date:
-                                       from datetime import datetime
-                                       date_folder = datetime.now().strftime("%Y%m%d")
-                                       output_dir = os.path.join(output_dir, date_folder)
-                                   os.makedirs(output_dir, exist_ok=True)
-                                   output_path = os.path.join(output_dir, save_to)
-                              
-                               # Handle multiple images
-                               parts_with_images = [p for p in candidate["content"]["parts"] if "inlineData" in p or "inline_data" in p]
-                               if len(parts_with_images) > 1:
-                                   base, ext = os.path.splitext(output_path)
-                                   output_path = f"{base}_{i+1}{ext}"
-                           else:
-                               filename = generate_filename(
-                                   prefix="generated",
-                                   suffix=f"{i+1}" if len(candidate["content"]["parts"]) > 1 else "",
-                                   extension=config.output_format
-                               )
-                               output_path = organize_output_path(
-                                   config.output_dir,
-                                   filename,
-                                   config.organize_by_date
-                               )
-                          
-                           # Decode and save
-                           saved_path = decode_base64_to_image(base64_string, output_path)
-                          
-                           # Get image info
-                           info = get_image_info(saved_path)
-                          
-                           generated_files.append({
-                               "file_path": saved_path,
-                               "info": info
-                           })
-          
-           if not generated_files:
-               return {
-                   "success": False,
-                   "error": "No images generated in response"
-               }
+           if self.single_flight is None:
+               return self._request_and_save(
+                   prompt, config, image_paths, reference_images, save_to, name_suffix, cache_key, deferred
+               )
           
-           return {
-               "success": True,
-               "prompt": prompt,
-               "config": {
-                   "aspect_ratio": config.aspect_ratio,
-                   "num_images": config.num_images
-               },
-               "reference_images": reference_images or [],
-               "generated_images": generated_files,
-               "response": response_data
-           }
+           # Identical requests already in flight share one API call
+           flight_key = cache_key or request_fingerprint(
+               self.model, prompt, image_paths, config, variant=name_suffix
+           )
+           result, shared = self.single_flight.do(
+               flight_key,
+               lambda: self._request_and_save(
+                   prompt, config, image_paths, reference_images, save_to, name_suffix, cache_key, deferred
+               )
+           )
+           if shared:
+               # Followers need the leader's files on disk before copying them
+               return self._shared_result(
+                   resolve_result(result), prompt, config, reference_images, save_to, name_suffix
+               )
+           return result
           
-       except requests.exceptions.RequestException as e:
+       except TransportError as e:
            return {
                "success": False,
                "error": f"API request failed: {str(e)}",
@@ -290,6 +746,181 @@ class ImageGenerationClient:
                "prompt": prompt
            }
   
+   def _request_and_save(
+       self,
+       prompt: str,
+       config: ImageConfig,
+       image_paths: List[str],
+       reference_images: Optional[List[str]],
+       save_to: Optional[str],
+       name_suffix: str,
+       cache_key: Optional[str],
+       deferred: bool = False
+   ) -> Union[Dict[str, Any], Future]:
+       """
+       Send one generateContent request and save the returned images
+      
+       The request runs on the calling thread. Saving (JSON parse, base64
+       decode, file write, image info, cache store) is handed to the
+       post_processor when deferred is True and one is configured; a Future
+       of the result is returned in that case. A streamed response is
+       decoded to disk on the calling thread as it downloads; moving the
+       files into place, transcoding and the rest are deferred.
+      
+       Raises:
+           TransportError: If the request fails
+           BudgetExceededError: If the request is over the input budget
+       """
+       config, budget_report = self._check_budget(prompt, config, image_paths)
+       payload = self._build_payload(prompt, config, image_paths)
+      
+       # Make API request
+       if self.stream_responses:
+           # Decode images to disk while the body downloads; moving them into
+           # place, transcoding and inspecting them is what can be deferred
+           response = self._post_generate_content(payload, stream=True)
+           response_data, temp_files = self._stream_to_temp_files(response, config.output_dir)
+          
+           def save_images() -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+               return response_data, self._place_streamed_images(
+                   response_data,
+                   temp_files,
+                   lambda part_index, num_parts, num_image_parts: self._resolve_output_path(
+                       config, save_to, name_suffix, part_index, num_parts, num_image_parts
+                   ),
+                   config
+               )
+       else:
+           response = self._post_generate_content(payload)
+          
+           def save_images() -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+               response_data = self._parse_response(response)
+              
+               # Extract generated images from response
+               generated_files = []
+               for part_index, base64_string, num_parts, num_image_parts in self._iter_inline_images(response_data):
+                   output_path = self._resolve_output_path(
+                       config, save_to, name_suffix, part_index, num_parts, num_image_parts
+                   )
+                   generated_files.append(self._save_image(base64_string, output_path, config))
+               return response_data, generated_files
+      
+       def finish() -> Dict[str, Any]:
+           try:
+               response_data, generated_files = save_images()
+               return self._finish_result(
+                   response_data, generated_files, prompt, config, reference_images, cache_key, budget_report
+               )
+           except Exception as e:
+               if not deferred:
+                   raise
+               return {
+                   "success": False,
+                   "error": str(e),
+                   "prompt": prompt
+               }
+      
+       if deferred and self.post_processor is not None:
+           return self.post_processor.submit(finish)
+       return finish()
+  
+   def _finish_result(
+       self,
+       response_data: Dict[str, Any],
+       generated_files: List[Dict[str, Any]],
+       prompt: str,
+       config: ImageConfig,
+       reference_images: Optional[List[str]],
+       cache_key: Optional[str],
+       budget_report: Optional[Dict[str, Any]] = None
+   ) -> Union[GenerationResult, Dict[str, Any]]:
+       """
+       Store saved images in the cache and build the result
+      
+       The result keeps the response's usage metadata and part layout; the
+       payload itself only as config.raw_response asks.
+       """
+       if not generated_files:
+           return {
+               "success": False,
+               "error": "No images generated in response"
+           }
+      
+       if cache_key is not None:
+           with self._span("cache_store"):
+               self._store_in_cache(cache_key, generated_files, response_data, prompt)
+      
+       result = GenerationResult(
+           prompt,
+           {
+               "aspect_ratio": config.aspect_ratio,
+               "num_images": config.num_images
+           },
+           reference_images,
+           generated_files,
+           usage_metadata=response_data.get("usageMetadata"),
+           budget=budget_report,
+           layout=self._part_layout(response_data)
+       )
+       result.attach_response(response_data, config.raw_response)
+       return result
+  
+   def _part_layout(self, response_data: Dict[str, Any]) -> List[Tuple[int, int, int]]:
+       """(part_index, num_parts, num_image_parts) of each image in a response"""
+       return [
+           (part_index, num_parts, num_image_parts)
+           for part_index, _, num_parts, num_image_parts in self._iter_inline_images(response_data)
+       ]
+  
+   def _shared_result(
+       self,
+       leader_result: Union[GenerationResult, Dict[str, Any]],
+       prompt: str,
+       config: ImageConfig,
+       reference_images: Optional[List[str]],
+       save_to: Optional[str],
+       name_suffix: str
+   ) -> Dict[str, Any]:
+       """Copy a coalesced call's images to the paths this caller would have written"""
+       if not leader_result.get("success"):
+           return dict(leader_result)
+      
+       entry = {
+           "images": [
+               {
+                   "file_path": image["file_path"],
+                   "info": image["info"],
+                   "part_index": part_index,
+                   "num_parts": num_parts,
+                   "num_image_parts": num_image_parts
+               }
+               for image, (part_index, num_parts, num_image_parts)
+               in zip(leader_result.generated_images, leader_result.layout)
+           ],
+           "usage_metadata": leader_result.usage_metadata
+       }
+       return self._cached_result(
+           entry, prompt, config, reference_images, save_to, name_suffix, source="coalesced"
+       )
+  
+   def submit_batch(
+       self,
+       requests: List[Dict[str, Any]],
+       display_name: Optional[str] = None
+   ) -> BatchJob:
+       """
+       Submit many generation requests as one batch job
+      
+       Args:
+           requests: Dicts with "prompt" and optionally "key", "config",
+               "reference_images" and "save_to"
+           display_name: Batch name shown by the API
+          
+       Returns:
+           BatchJob; job.wait() polls and saves images in the usual layout
+       """
+       return submit_batch(self, requests, display_name)
+  
    def generate_with_reference(
        self,
        prompt: str,
@@ -415,7 +1046,24 @@ class ImageGenerationClient:
            Dict with generation results
        """
        config = config or self.default_config
-      
+       with self._call_tags(config, reference_images, session.session_id):
+           with self.profiler.profile("generate_with_session"):
+               started = time.perf_counter()
+               result = self._generate_in_session(
+                   session, prompt, config, reference_images, use_session_history
+               )
+           self._record_generation(result, started)
+       return result
+  
+   def _generate_in_session(
+       self,
+       session: Session,
+       prompt: str,
+       config: ImageConfig,
+       reference_images: Optional[List[str]],
+       use_session_history: bool
+   ) -> Dict[str, Any]:
+       """Body of generate_with_session (run with the session's metric tags)"""
        # Add user message to session
        session.add_message("user", prompt)
       
@@ -429,114 +1077,56 @@ class ImageGenerationClient:
       
        try:
            # Build Gemini API request
-           contents = []
-          
-           # Add reference images if provided
-           if reference_images:
-               validation = validate_reference_images(reference_images)
-               if not validation["valid"]:
-                   return {
-                       "success": False,
-                       "error": f"Invalid reference images: {validation['errors']}"
-                   }
-              
-               # Add references to session
-               for image_path in validation["valid_images"]:
-                   session.add_reference_image(image_path)
-              
-               # Build parts with images
-               parts = []
-               for image_path in validation["valid_images"]:
-                   base64_data, mime_type = encode_image_to_base64(image_path)
-                   parts.append({
-                       "inline_data": {
-                           "mime_type": mime_type,
-                           "data": base64_data
-                       }
-                   })
-              
-               parts.append({"text": prompt})
-               contents.append({"parts": parts})
-           else:
-               contents.append({
-                   "parts": [{"text": prompt}]
-               })
+           image_paths = self._validate_references(reference_images)
           
-           # Build generation config
-           generation_config = {
-               "imageConfig": {
-                   "aspectRatio": config.aspect_ratio
-               }
-           }
+           # Add references to session
+           for image_path in image_paths:
+               session.add_reference_image(image_path)
           
-           payload = {
-               "contents": contents,
-               "generationConfig": generation_config
-           }
+           config, _ = self._check_budget(prompt, config, image_paths)
+           payload = self._build_payload(prompt, config, image_paths)
           
            # Make API request
-           url = f"{self.base_url}/models/{self.model}:generateContent"
-           headers = {
-               "x-goog-api-key": self.api_key,
-               "Content-Type": "application/json"
-           }
-          
-           response = requests.post(url, json=payload, headers=headers)
-           response.raise_for_status()
-           response_data = response.json()
+           if self.stream_responses:
+               response = self._post_generate_content(payload, stream=True)
+               response_data, streamed_files = self._stream_response_images(
+                   response,
+                   os.path.join(session.session_path, "images"),
+                   lambda part_index, num_parts, _: self._session_output_path(
+                       session, config, part_index, num_parts
+                   ),
+                   config
+               )
+           else:
+               response = self._post_generate_content(payload)
+               response_data = self._parse_response(response)
+               streamed_files = None
           
            # Extract and save images
            generated_files = []
           
-           if "candidates" in response_data and len(response_data["candidates"]) > 0:
-               candidate = response_data["candidates"][0]
-               if "content" in candidate and "parts" in candidate["content"]:
-                   for i, part in enumerate(candidate["content"]["parts"]):
-                       # Check for both camelCase and snake_case
-                       if "inlineData" in part or "inline_data" in part:
-                           inline_data = part.get("inlineData") or part.get("inline_data")
-                           base64_string = inline_data.get("data")
-                          
-                           # Generate filename in session folder
-                           filename = generate_filename(
-                               prefix=f"gen_{session.metadata['generation_count']+1}",
-                               suffix=f"{i+1}" if len(candidate["content"]["parts"]) > 1 else "",
-                               extension=config.output_format
-                           )
-                          
-                           # Save to session images folder
-                           output_path = os.path.join(session.session_path, "images", filename)
-                           os.makedirs(os.path.dirname(output_path), exist_ok=True)
-                          
-                           saved_path = decode_base64_to_image(base64_string, output_path)
-                          
-                           # Add to session
-                           session.add_generated_image(saved_path, copy_to_session=False)
-                          
-                           info = get_image_info(saved_path)
-                           generated_files.append({
-                               "file_path": saved_path,
-                               "info": info
-                           })
+           if response_data.get("candidates"):
+               if streamed_files is not None:
+                   saved_images = streamed_files
+               else:
+                   # Save to session images folder
+                   saved_images = [
+                       self._save_image(
+                           base64_string,
+                           self._session_output_path(session, config, part_index, num_parts),
+                           config
+                       )
+                       for part_index, base64_string, num_parts, _ in self._iter_inline_images(response_data)
+                   ]
               
-               # Add assistant message to session
-               session.add_message("assistant", f"Generated {len(generated_files)} image(s)")
-               session.increment_generation_count()
-               session.save()
+               for saved in saved_images:
+                   # Add to session
+                   session.add_generated_image(saved["file_path"], copy_to_session=False)
+                   generated_files.append(saved)
               
-               return {
-                   "success": True,
-                   "session_id": session.session_id,
-                   "prompt": prompt,
-                   "config": {
-                       "aspect_ratio": config.aspect_ratio,
-                       "num_images": config.num_images
-                   },
-                   "reference_images": reference_images or [],
-                   "generated_images": generated_files,
-                   "session_summary": session.get_summary(),
-                   "response": response
-               }
+               return self._finish_session_generation(
+                   session, prompt, config, reference_images, generated_files, response_data
+               )
            else:
                return {
                    "success": False,
@@ -568,9 +1158,438 @@ class ImageGenerationClient:
            Number of sessions deleted
        """
        return self.session_manager.cleanup_old_sessions(hours)
-
-
-
-
-
-
+  
+   # ========================================================================
+   # Request building and response handling (shared by all generation paths)
+   # ========================================================================
+  
+   def _validate_references(self, reference_images: Optional[List[str]]) -> List[str]:
+       """
+       Validate reference images
+      
+       Returns:
+           List of valid image paths (empty if no references)
+          
+       Raises:
+           ValueError: If any reference image is invalid
+       """
+       if not reference_images:
+           return []
+      
+       with self._span("validate"):
+           validation = validate_reference_images(reference_images)
+       if not validation["valid"]:
+           raise ValueError(f"Invalid reference images: {validation['errors']}")
+       return validation["valid_images"]
+  
+   def _check_budget(
+       self,
+       prompt: str,
+       config: ImageConfig,
+       image_paths: List[str]
+   ) -> Tuple[ImageConfig, Optional[Dict[str, Any]]]:
+       """
+       Run the pre-flight budget check (a no-op without a budget)
+      
+       Returns:
+           Tuple of (config to build the payload with, usage report or None)
+          
+       Raises:
+           BudgetExceededError: If the request cannot fit the budget
+       """
+       if self.budget is None:
+           return config, None
+       with self._span("budget"):
+           return self.budget.check(prompt, config, image_paths, inline=self.file_registry is None)
+  
+   def _build_payload(
+       self,
+       prompt: str,
+       config: ImageConfig,
+       image_paths: List[str]
+   ) -> Dict[str, Any]:
+       """
+       Build generateContent request payload
+      
+       Args:
+           prompt: Text prompt
+           config: Image generation configuration
+           image_paths: Validated reference image paths (sent before the prompt)
+          
+       Returns:
+           Request payload dict
+       """
+       # Add reference images as inline_data (or uploaded file_data URIs when
+       # a file registry is set), then the text prompt. Encodings come from
+       # the process-wide cache, so a character sheet reused across panels is
+       # read and encoded (or optimized) only once. The build span covers the
+       # whole payload, including the encode/upload spans nested in it.
+       with self._span("build"):
+           parts = []
+           for image_path in image_paths:
+               if self.file_registry is not None:
+                   with self._span("upload"):
+                       parts.append(self.file_registry.get_file_part(image_path, config.upload_options))
+                   continue
+               with self._span("encode"):
+                   encoded = optimize_reference(image_path, config.upload_options)
+               parts.append({
+                   "inline_data": {
+                       "mime_type": encoded.mime_type,
+                       "data": encoded.base64_data
+                   }
+               })
+           parts.append({"text": prompt})
+      
+           # Build generation config with aspect ratio
+           generation_config = {
+               "imageConfig": {
+                   "aspectRatio": config.aspect_ratio
+               }
+           }
+      
+           return {
+               "contents": [{"parts": parts}],
+               "generationConfig": generation_config
+           }
+  
+   def _iter_inline_images(self, response_data: Dict[str, Any]):
+       """
+       Iterate over images in a generateContent response
+      
+       Yields:
+           Tuples of (part_index, base64_string, num_parts, num_image_parts)
+       """
+       candidates = response_data.get("candidates") or []
+       if not candidates:
+           return
+      
+       parts = candidates[0].get("content", {}).get("parts", [])
+       # Check for both camelCase and snake_case
+       image_parts = [p for p in parts if "inlineData" in p or "inline_data" in p]
+       for i, part in enumerate(parts):
+           if "inlineData" in part or "inline_data" in part:
+               inline_data = part.get("inlineData") or part.get("inline_data")
+               yield i, inline_data.get("data"), len(parts), len(image_parts)
+  
+   def _resolve_output_path(
+       self,
+       config: ImageConfig,
+       save_to: Optional[str],
+       name_suffix: str,
+       part_index: int,
+       num_parts: int,
+       num_image_parts: int
+   ) -> str:
+       """Determine where to save the image found at part_index of a response"""
+       if save_to:
+           # Make sure save_to is an absolute path or in the output directory
+           if os.path.isabs(save_to):
+               output_path = save_to
+           else:
+               # Relative path - put it in the default output directory
+               output_dir = config.output_dir
+               if config.organize_by_date:
+                   date_folder = datetime.now().strftime("%Y%m%d")
+                   output_dir = os.path.join(output_dir, date_folder)
+               os.makedirs(output_dir, exist_ok=True)
+               output_path = os.path.join(output_dir, save_to)
+           # The file is transcoded to output_format, so name it that way
+           output_path = match_format_extension(output_path, config.output_format)
+          
+           # Handle multiple images
+           if num_image_parts > 1:
+               base, ext = os.path.splitext(output_path)
+               output_path = f"{base}_{part_index+1}{ext}"
+           return output_path
+      
+       part_suffix = f"{part_index+1}" if num_parts > 1 else ""
+       filename = generate_filename(
+           prefix="generated",
+           suffix="_".join(filter(None, [name_suffix, part_suffix])),
+           extension=config.output_format
+       )
+       return organize_output_path(
+           config.output_dir,
+           filename,
+           config.organize_by_date
+       )
+  
+   def _session_output_path(
+       self,
+       session: Session,
+       config: ImageConfig,
+       part_index: int,
+       num_parts: int
+   ) -> str:
+       """Determine where to save a session image (inside the session folder)"""
+       filename = generate_filename(
+           prefix=f"gen_{session.metadata['generation_count']+1}",
+           suffix=f"{part_index+1}" if num_parts > 1 else "",
+           extension=config.output_format
+       )
+       output_path = os.path.join(session.session_path, "images", filename)
+       os.makedirs(os.path.dirname(output_path), exist_ok=True)
+       return output_path
+  
+   def _finish_session_generation(
+       self,
+       session: Session,
+       prompt: str,
+       config: ImageConfig,
+       reference_images: Optional[List[str]],
+       generated_files: List[Dict[str, Any]],
+       response_data: Dict[str, Any]
+   ) -> GenerationResult:
+       """Record a completed generation in the session, save it and build the result"""
+       # Add assistant message to session
+       session.add_message("assistant", f"Generated {len(generated_files)} image(s)")
+       session.increment_generation_count()
+       session.save()
+      
+       result = GenerationResult(
+           prompt,
+           {
+               "aspect_ratio": config.aspect_ratio,
+               "num_images": config.num_images
+           },
+           reference_images,
+           generated_files,
+           usage_metadata=response_data.get("usageMetadata"),
+           layout=self._part_layout(response_data),
+           session_id=session.session_id,
+           session_summary=session.get_summary()
+       )
+       result.attach_response(response_data, config.raw_response)
+       return result
+  
+   def _lookup_cache(
+       self,
+       prompt: str,
+       config: ImageConfig,
+       image_paths: List[str],
+       reference_images: Optional[List[str]],
+       save_to: Optional[str],
+       name_suffix: str
+   ) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+       """
+       Consult the result cache according to config.cache_policy
+      
+       Returns:
+           Tuple of (cache key to store the fresh result under, or None;
+           cached result, or None on miss/refresh/bypass)
+       """
+       if self.cache is None or config.cache_policy == "bypass":
+           return None, None
+      
+       cache_key = request_fingerprint(self.model, prompt, image_paths, config, variant=name_suffix)
+       if config.cache_policy == "use":
+           with self._span("cache_lookup"):
+               cached = self.cache.get(cache_key)
+           if cached is not None:
+               return cache_key, self._cached_result(
+                   cached, prompt, config, reference_images, save_to, name_suffix
+               )
+       return cache_key, None
+  
+   def _store_in_cache(
+       self,
+       cache_key: str,
+       generated_files: List[Dict[str, Any]],
+       response_data: Dict[str, Any],
+       prompt: str
+   ):
+       """Copy freshly generated images into the result cache with their part layout"""
+       layout = self._part_layout(response_data)
+       self.cache.put(
+           cache_key,
+           [
+               {
+                   "file_path": image["file_path"],
+                   "info": image["info"],
+                   "part_index": part_index,
+                   "num_parts": num_parts,
+                   "num_image_parts": num_image_parts
+               }
+               for image, (part_index, num_parts, num_image_parts) in zip(generated_files, layout)
+           ],
+           extra={
+               "model": self.model,
+               "prompt": prompt,
+               "usage_metadata": response_data.get("usageMetadata")
+           }
+       )
+  
+   def _cached_result(
+       self,
+       entry: Dict[str, Any],
+       prompt: str,
+       config: ImageConfig,
+       reference_images: Optional[List[str]],
+       save_to: Optional[str],
+       name_suffix: str,
+       source: str = "cached"
+   ) -> GenerationResult:
+       """
+       Copy cached images to the paths this call would have written and build the result
+      
+       source names the flag set on the result ("cached" or "coalesced").
+       """
+       generated_files = []
+       layout = []
+       for image in entry["images"]:
+           output_path = self._resolve_output_path(
+               config,
+               save_to,
+               name_suffix,
+               image["part_index"],
+               image["num_parts"],
+               image["num_image_parts"]
+           )
+           os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+           if os.path.abspath(image["file_path"]) != os.path.abspath(output_path):
+               shutil.copy2(image["file_path"], output_path)
+           info = dict(image["info"])
+           info["path"] = output_path
+           generated_files.append({
+               "file_path": output_path,
+               "info": info
+           })
+           layout.append((image["part_index"], image["num_parts"], image["num_image_parts"]))
+      
+       return GenerationResult(
+           prompt,
+           {
+               "aspect_ratio": config.aspect_ratio,
+               "num_images": config.num_images
+           },
+           reference_images,
+           generated_files,
+           usage_metadata=entry.get("usage_metadata"),
+           layout=layout,
+           source=source
+       )
+  
+   def _stream_response_images(
+       self,
+       response: TransportResponse,
+       temp_dir: str,
+       resolve_path: Callable[[int, int, int], str],
+       config: Optional[ImageConfig] = None
+   ) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+       """
+       Stream-decode a response, then move each image to its final path
+      
+       Args:
+           response: Unread streaming response
+           temp_dir: Directory for in-progress files (same disk as the outputs)
+           resolve_path: Callable(part_index, num_parts, num_image_parts) -> output path
+           config: Image configuration whose output_format the files are converted to
+          
+       Returns:
+           Tuple of (response dict without image bytes, list of saved image dicts)
+       """
+       response_data, temp_files = self._stream_to_temp_files(response, temp_dir)
+       return response_data, self._place_streamed_images(response_data, temp_files, resolve_path, config)
+  
+   def _stream_to_temp_files(
+       self,
+       response: TransportResponse,
+       temp_dir: str
+   ) -> Tuple[Dict[str, Any], List[str]]:
+       """
+       Decode a streaming response's images chunk by chunk into temp files
+      
+       Returns:
+           Tuple of (response dict without image bytes, temp file paths)
+       """
+       try:
+           with self._span("stream"):
+               return stream_decode_response(response.iter_chunks(), temp_dir)
+       finally:
+           response.close()
+  
+   def _place_streamed_images(
+       self,
+       response_data: Dict[str, Any],
+       temp_files: List[str],
+       resolve_path: Callable[[int, int, int], str],
+       config: Optional[ImageConfig] = None
+   ) -> List[Dict[str, Any]]:
+       """
+       Rename stream-decoded images to their output paths
+      
+       Only once the whole response is parsed (and the number of parts
+       known) can the usual paths be resolved. Files are transcoded on disk
+       (see Transcoder.convert_file), so they are never read back in whole.
+      
+       Returns:
+           List of saved image dicts
+       """
+       generated_files = []
+       image_parts = list(self._iter_inline_images(response_data))
+       try:
+           for (part_index, _, num_parts, num_image_parts), temp_path in zip(image_parts, temp_files):
+               output_path = resolve_path(part_index, num_parts, num_image_parts)
+               os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+               shutil.move(temp_path, output_path)
+               if config is not None:
+                   self._transcode_file(output_path, config)
+               with self._span("info"):
+                   info = get_image_info(output_path)
+               generated_files.append(self._transform_image({
+                   "file_path": output_path,
+                   "info": info
+               }))
+       finally:
+           # Images from other candidates (or left by a failure) are not used
+           for temp_path in temp_files:
+               if os.path.exists(temp_path):
+                   os.remove(temp_path)
+      
+       return generated_files
+  
+   def _save_image(
+       self,
+       base64_string: str,
+       output_path: str,
+       config: Optional[ImageConfig] = None
+   ) -> Dict[str, Any]:
+       """
+       Decode base64 image data to disk and collect its info
+      
+       Args:
+           base64_string: Image data from the response
+           output_path: Destination path
+           config: Image configuration; the image is transcoded to its
+               output_format/output_quality (None writes the bytes as returned)
+          
+       Returns:
+           Dict with file_path and info
+       """
+       with self._span("decode"):
+           image_data = decode_base64_data(base64_string)
+       if config is not None:
+           with self._span("transcode"):
+               image_data = self.transcoder.convert(
+                   image_data, config.output_format, config.output_quality, config.lossless
+               )
+       with self._span("write"):
+           saved_path = write_image_bytes(image_data, output_path)
+       with self._span("info"):
+           info = get_image_info(saved_path)
+       return self._transform_image({
+           "file_path": saved_path,
+           "info": info
+       })
+  
+   def _transcode_file(self, path: str, config: ImageConfig):
+       """Rewrite a saved file in config.output_format if it is not already"""
+       with self._span("transcode"):
+           self.transcoder.convert_file(path, config.output_format, config.output_quality, config.lossless)
+  
+   def _transform_image(self, image: Dict[str, Any]) -> Dict[str, Any]:
+       """Apply the post_processor's transforms (if any) to a saved image"""
+       if self.post_processor is None:
+           return image
+       return self.post_processor.apply_transforms(image)
@@ -0,0 +1,274 @@
+"""
+Header-only image metadata for PNG, JPEG and WebP
+Dimensions, format and mode are read from the first bytes of a file, without decoding
+"""
+
+
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+from config import IMAGE_HEADER_READ_BYTES, IMAGE_METADATA_CACHE_SIZE
+
+
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+# PNG (color type, bit depth) -> PIL mode
+PNG_MODES = {
+   (0, 1): "1", (0, 2): "L", (0, 4): "L", (0, 8): "L", (0, 16): "I;16",
+   (2, 8): "RGB", (2, 16): "RGB",
+   (4, 8): "LA", (4, 16): "LA",
+   (6, 8): "RGBA", (6, 16): "RGBA"
+}
+
+
+# JPEG start-of-frame markers (baseline, progressive, lossless, arithmetic)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+JPEG_MODES = {1: "L", 3: "RGB", 4: "CMYK"}
+
+
+
+
+def _parse_png(data: bytes) -> Optional[Dict[str, Any]]:
+   # The IHDR chunk always comes first, right after the signature
+   if len(data) < 26 or data[12:16] != b"IHDR":
+       return None
+   width, height, bit_depth, color_type = struct.unpack(">IIBB", data[16:26])
+   if color_type == 3:
+       mode = "P"
+   else:
+       mode = PNG_MODES.get((color_type, bit_depth))
+   if mode is None:
+       return None
+   return {"width": width, "height": height, "format": "PNG", "mode": mode}
+
+
+
+
+def _parse_jpeg(data: bytes) -> Optional[Dict[str, Any]]:
+   # Walk the marker segments up to the first start-of-frame
+   offset = 2
+   while offset + 4 <= len(data):
+       if data[offset] != 0xFF:
+           return None
+       marker = data[offset + 1]
+       if marker == 0xFF:
+           # Fill byte
+           offset += 1
+           continue
+       if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+           # Standalone markers carry no length
+           offset += 2
+           continue
+       if marker in (0xD9, 0xDA):
+           # End of image / start of scan before any frame header
+           return None
+       length = struct.unpack(">H", data[offset + 2:offset + 4])[0]
+       if marker in JPEG_SOF_MARKERS:
+           if offset + 10 > len(data):
+               return None
+           height, width, components = struct.unpack(">HHB", data[offset + 5:offset + 10])
+           mode = JPEG_MODES.get(components)
+           if mode is None or height == 0:
+               # height 0 means it is defined later (DNL marker): let PIL handle it
+               return None
+           return {"width": width, "height": height, "format": "JPEG", "mode": mode}
+       offset += 2 + length
+   return None
+
+
+
+
+def _parse_webp(data: bytes) -> Optional[Dict[str, Any]]:
+   if len(data) < 30:
+       return None
+   chunk = data[12:16]
+   body = data[20:]
+   if chunk == b"VP8 ":
+       # Lossy: 3-byte frame tag, start code, then 14-bit dimensions
+       if body[3:6] != b"\x9d\x01\x2a":
+           return None
+       width, height = struct.unpack("<HH", body[6:10])
+       width, height, mode = width & 0x3FFF, height & 0x3FFF, "RGB"
+   elif chunk == b"VP8L":
+       # Lossless: signature byte, then 14-bit width-1, 14-bit height-1, alpha hint
+       if body[0] != 0x2F:
+           return None
+       bits = struct.unpack("<I", body[1:5])[0]
+       width = (bits & 0x3FFF) + 1
+       height = ((bits >> 14) & 0x3FFF) + 1
+       mode = "RGBA" if (bits >> 28) & 1 else "RGB"
+   elif chunk == b"VP8X":
+       # Extended: feature flags, then 24-bit canvas width-1 and height-1
+       flags = body[0]
+       width = int.from_bytes(body[4:7], "little") + 1
+       height = int.from_bytes(body[7:10], "little") + 1
+       mode = "RGBA" if flags & 0x10 else "RGB"
+   else:
+       return None
+   return {"width": width, "height": height, "format": "WEBP", "mode": mode}
+
+
+
+
+def parse_image_header(data: bytes) -> Optional[Dict[str, Any]]:
+   """
+   Read width, height, format and mode from the start of an image
+  
+   Args:
+       data: Leading bytes of a PNG, JPEG or WebP file (or the whole file)
+      
+   Returns:
+       Dict with width, height, format and mode (PIL naming), or None if the
+       format is not recognized or the header is not within data
+   """
+   if data.startswith(PNG_SIGNATURE):
+       return _parse_png(data)
+   if data.startswith(b"\xff\xd8"):
+       return _parse_jpeg(data)
+   if data.startswith(b"RIFF") and data[8:12] == b"WEBP":
+       return _parse_webp(data)
+   return None
+
+
+
+
+def _open_with_pil(path: str) -> Dict[str, Any]:
+   from PIL import Image
+  
+   with Image.open(path) as img:
+       width, height = img.size
+       return {"width": width, "height": height, "format": img.format, "mode": img.mode}
+
+
+
+
+class ImageMetadataCache:
+   """
+   Memoized header metadata keyed by (path, mtime, size)
+  
+   A file that is rewritten gets a new mtime/size and is read again.
+   Images the client has just decoded are remembered from their in-memory
+   bytes, so saving a generation never re-reads the file. Headers that
+   cannot be parsed (other formats, JPEGs with very large EXIF blocks)
+   fall back to PIL.
+   """
+  
+   def __init__(self, max_entries: int = IMAGE_METADATA_CACHE_SIZE):
+       """
+       Initialize cache
+      
+       Args:
+           max_entries: Entries kept (least recently used are evicted)
+       """
+       self.max_entries = max_entries
+       self._entries: "OrderedDict[Tuple[str, int, int], Dict[str, Any]]" = OrderedDict()
+       self._lock = threading.Lock()
+       self.stats = {
+           "hits": 0,
+           "misses": 0,
+           "pil_fallbacks": 0
+       }
+  
+   def _key(self, path: str, stat: os.stat_result) -> Tuple[str, int, int]:
+       return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+  
+   def _store(self, key: Tuple[str, int, int], metadata: Dict[str, Any]):
+       with self._lock:
+           self._entries[key] = metadata
+           self._entries.move_to_end(key)
+           while len(self._entries) > self.max_entries:
+               self._entries.popitem(last=False)
+  
+   def get(self, path: str) -> Dict[str, Any]:
+       """
+       Get metadata of an image file
+      
+       Args:
+           path: Image path
+          
+       Returns:
+           Dict with width, height, format, mode and size_bytes
+          
+       Raises:
+           OSError: If the file cannot be read
+           PIL.UnidentifiedImageError: If the file is not an image
+       """
+       stat = os.stat(path)
+       key = self._key(path, stat)
+       with self._lock:
+           metadata = self._entries.get(key)
+           if metadata is not None:
+               self._entries.move_to_end(key)
+               self.stats["hits"] += 1
+               return dict(metadata)
+           self.stats["misses"] += 1
+      
+       with open(path, 'rb') as f:
+           metadata = parse_image_header(f.read(IMAGE_HEADER_READ_BYTES))
+       if metadata is None:
+           with self._lock:
+               self.stats["pil_fallbacks"] += 1
+           metadata = _open_with_pil(path)
+       metadata["size_bytes"] = stat.st_size
+       self._store(key, metadata)
+       return dict(metadata)
+  
+   def remember(self, path: str, data: bytes):
+       """
+       Record metadata of a file just written from data
+      
+       Args:
+           path: Path the bytes were written to
+           data: The file's contents
+       """
+       metadata = parse_image_header(data)
+       if metadata is None:
+           return
+       stat = os.stat(path)
+       metadata["size_bytes"] = stat.st_size
+       self._store(self._key(path, stat), metadata)
+  
+   def clear(self):
+       """Forget all entries"""
+       with self._lock:
+           self._entries.clear()
+  
+   def get_stats(self) -> Dict[str, Any]:
+       """Get cache counters"""
+       with self._lock:
+           stats = dict(self.stats)
+           stats["entries"] = len(self._entries)
+       return stats
+
+
+
+
+_metadata_cache = ImageMetadataCache()
+
+
+
+
+def get_image_metadata(path: str) -> Dict[str, Any]:
+   """Get header metadata of an image file through the process-wide cache"""
+   return _metadata_cache.get(path)
+
+
+
+
+def remember_image_metadata(path: str, data: bytes):
+   """Prime the process-wide cache with the bytes just written to path"""
+   _metadata_cache.remember(path, data)
+
+
+
+
+def get_metadata_cache() -> ImageMetadataCache:
+   """Get the process-wide metadata cache"""
+   return _metadata_cache
@@ -0,0 +1,294 @@
+"""
+Per-stage timing spans for the generation path
+Spans go to pluggable sinks: in-memory histograms, a JSONL trace file, Prometheus text
+"""
+
+
+import abc
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+from config import LATENCY_BUCKETS, METRICS_LABELS, METRICS_SAMPLE_WINDOW
+from stats import percentile
+
+
+
+
+# Tags of the generation call the current thread/task is working on
+_call_tags: contextvars.ContextVar = contextvars.ContextVar("call_tags", default={})
+
+
+
+
+class MetricsSink(abc.ABC):
+   """
+   Receives finished spans
+  
+   A span is a dict with stage, start (unix time), seconds, ok and tags
+   (model, aspect_ratio, references, session_id). Subclasses must be
+   thread-safe: spans arrive from request, post-processing and executor
+   threads concurrently.
+   """
+  
+   @abc.abstractmethod
+   def record(self, span: Dict[str, Any]):
+       """Store or forward one finished span"""
+  
+   def close(self):
+       """Flush and release resources"""
+
+
+
+
+class HistogramSink(MetricsSink):
+   """
+   In-memory latency histograms per stage and label set
+  
+   Cumulative bucket counts feed the Prometheus exporter; a window of
+   recent samples per series gives exact percentiles for summary().
+   """
+  
+   def __init__(
+       self,
+       buckets: Optional[List[float]] = None,
+       labels: Optional[List[str]] = None,
+       window: int = METRICS_SAMPLE_WINDOW
+   ):
+       """
+       Initialize histogram sink
+      
+       Args:
+           buckets: Upper bounds in seconds (LATENCY_BUCKETS if None)
+           labels: Tags that split series (METRICS_LABELS if None); keep
+               high-cardinality tags such as session_id out of this list
+           window: Recent durations kept per series for percentiles
+       """
+       self.buckets = sorted(buckets or LATENCY_BUCKETS)
+       self.labels = labels if labels is not None else list(METRICS_LABELS)
+       self.window = window
+       self._series: Dict[Tuple[str, Tuple[str, ...]], Dict[str, Any]] = {}
+       self._lock = threading.Lock()
+  
+   def record(self, span: Dict[str, Any]):
+       seconds = span["seconds"]
+       key = (span["stage"], tuple(str(span["tags"].get(label, "")) for label in self.labels))
+       with self._lock:
+           series = self._series.get(key)
+           if series is None:
+               series = {
+                   "bucket_counts": [0] * len(self.buckets),
+                   "count": 0,
+                   "sum": 0.0,
+                   "errors": 0,
+                   "samples": deque(maxlen=self.window)
+               }
+               self._series[key] = series
+           for i, bound in enumerate(self.buckets):
+               if seconds <= bound:
+                   series["bucket_counts"][i] += 1
+                   break
+           series["count"] += 1
+           series["sum"] += seconds
+           series["errors"] += 0 if span["ok"] else 1
+           series["samples"].append(seconds)
+  
+   def summary(self, by_labels: bool = False) -> Dict[str, Dict[str, Any]]:
+       """
+       Latency statistics per stage
+      
+       Args:
+           by_labels: Split stages by label values ("stage{model=...,...}")
+          
+       Returns:
+           Dict of name -> count, errors, total/mean seconds and p50/p90/p99/max
+       """
+       groups: Dict[str, Dict[str, Any]] = {}
+       with self._lock:
+           for (stage, values), series in self._series.items():
+               name = stage
+               if by_labels:
+                   name += "{" + ",".join(f"{k}={v}" for k, v in zip(self.labels, values)) + "}"
+               group = groups.setdefault(name, {"count": 0, "errors": 0, "sum": 0.0, "samples": []})
+               group["count"] += series["count"]
+               group["errors"] += series["errors"]
+               group["sum"] += series["sum"]
+               group["samples"].extend(series["samples"])
+      
+       summary = {}
+       for name, group in sorted(groups.items()):
+           samples = group["samples"]
+           summary[name] = {
+               "count": group["count"],
+               "errors": group["errors"],
+               "total_seconds": round(group["sum"], 3),
+               "mean_seconds": round(group["sum"] / group["count"], 4),
+               "p50": round(percentile(samples, 0.5), 4),
+               "p90": round(percentile(samples, 0.9), 4),
+               "p99": round(percentile(samples, 0.99), 4),
+               "max": round(max(samples), 4)
+           }
+       return summary
+  
+   def prometheus_text(self, prefix: str = "imagegen") -> str:
+       """
+       Render the histograms in the Prometheus text exposition format
+      
+       Returns:
+           One {prefix}_stage_seconds histogram, labelled by stage and self.labels
+       """
+       name = f"{prefix}_stage_seconds"
+       lines = [
+           f"# HELP {name} Time spent per generation stage",
+           f"# TYPE {name} histogram"
+       ]
+       with self._lock:
+           series_items = sorted(self._series.items())
+           snapshot = [
+               (stage, values, list(series["bucket_counts"]), series["count"], series["sum"])
+               for (stage, values), series in series_items
+           ]
+       for stage, values, bucket_counts, count, total in snapshot:
+           labels = [f'stage="{_escape(stage)}"'] + [
+               f'{label}="{_escape(value)}"' for label, value in zip(self.labels, values)
+           ]
+           label_text = ",".join(labels)
+           cumulative = 0
+           for bound, bucket_count in zip(self.buckets, bucket_counts):
+               cumulative += bucket_count
+               lines.append(f'{name}_bucket{{{label_text},le="{bound:g}"}} {cumulative}')
+           lines.append(f'{name}_bucket{{{label_text},le="+Inf"}} {count}')
+           lines.append(f"{name}_sum{{{label_text}}} {total:.6f}")
+           lines.append(f"{name}_count{{{label_text}}} {count}")
+       return "\n".join(lines) + "\n"
+  
+   def write_prometheus(self, path: str, prefix: str = "imagegen"):
+       """Write prometheus_text() atomically (for a node_exporter textfile collector)"""
+       os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+       temp_path = f"{path}.tmp"
+       with open(temp_path, 'w', encoding='utf-8') as f:
+           f.write(self.prometheus_text(prefix))
+       os.replace(temp_path, path)
+  
+   def reset(self):
+       """Drop all series"""
+       with self._lock:
+           self._series.clear()
+
+
+
+
+def _escape(value: str) -> str:
+   return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+
+
+class JSONLTraceSink(MetricsSink):
+   """Appends every span as one JSON line (for offline analysis)"""
+  
+   def __init__(self, path: str):
+       """
+       Initialize trace sink
+      
+       Args:
+           path: Trace file (appended to; directories are created)
+       """
+       self.path = path
+       os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+       self._file = open(path, 'a', encoding='utf-8', buffering=1)
+       self._lock = threading.Lock()
+  
+   def record(self, span: Dict[str, Any]):
+       line = json.dumps(span, ensure_ascii=False)
+       with self._lock:
+           if not self._file.closed:
+               self._file.write(line + "\n")
+  
+   def close(self):
+       with self._lock:
+           self._file.close()
+
+
+
+
+class Metrics:
+   """
+   Span recorder handed to the clients
+  
+   Usage:
+       histograms = HistogramSink()
+       metrics = Metrics([histograms, JSONLTraceSink("generated/metrics/trace.jsonl")])
+       client = ImageGenerationClient(api_key, metrics=metrics)
+       ...
+       print(histograms.summary())
+       histograms.write_prometheus("generated/metrics/imagegen.prom")
+   """
+  
+   def __init__(self, sinks: Optional[List[MetricsSink]] = None):
+       """
+       Initialize metrics
+      
+       Args:
+           sinks: Sinks receiving every span (a HistogramSink if None)
+       """
+       self.sinks = sinks if sinks is not None else [HistogramSink()]
+  
+   def record(self, stage: str, seconds: float, ok: bool = True, start: Optional[float] = None, **tags):
+       """Record a span measured elsewhere; tags add to the current call's tags"""
+       span = {
+           "stage": stage,
+           "start": round(start if start is not None else time.time() - seconds, 6),
+           "seconds": round(seconds, 6),
+           "ok": ok,
+           "tags": {**_call_tags.get(), **tags}
+       }
+       for sink in self.sinks:
+           sink.record(span)
+  
+   @contextmanager
+   def span(self, stage: str, **tags) -> Iterator[None]:
+       """Time the enclosed block as one stage"""
+       start = time.time()
+       started = time.perf_counter()
+       ok = False
+       try:
+           yield
+           ok = True
+       finally:
+           self.record(stage, time.perf_counter() - started, ok, start, **tags)
+  
+   def close(self):
+       """Close every sink"""
+       for sink in self.sinks:
+           sink.close()
+
+
+
+
+@contextmanager
+def call_tags(**tags) -> Iterator[None]:
+   """
+   Tag every span recorded in this context (thread or asyncio task)
+  
+   Work handed to other threads keeps the tags only when run through
+   contextvars.copy_context(), as PostProcessor and the async client do.
+   """
+   token = _call_tags.set({**_call_tags.get(), **tags})
+   try:
+       yield
+   finally:
+       _call_tags.reset(token)
+
+
+
+
+def current_call_tags() -> Dict[str, Any]:
+   """Tags set by call_tags() in the current context"""
+   return dict(_call_tags.get())
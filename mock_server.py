@@ -0,0 +1,532 @@
+"""
+Local stand-in for the Gemini API
+Serves generateContent, batchGenerateContent and the Files endpoints for offline testing
+
+Usage:
+   python mock_server.py --port 8765 --file-ttl 3600
+   python mock_server.py --image-mb 1.5 --latency 8 --latency-distribution lognormal --error-rate 0.02
+   client = ImageGenerationClient("test-key", base_url="http://127.0.0.1:8765/v1beta")
+"""
+
+
+import argparse
+import base64
+import io
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+from PIL import Image
+
+
+
+
+DEFAULT_PORT = 8765
+DEFAULT_FILE_TTL_SECONDS = 48 * 3600
+DEFAULT_BATCH_DELAY_SECONDS = 1.0
+DEFAULT_MAX_CANDIDATES = 8
+DEFAULT_SEED = 1234
+LATENCY_DISTRIBUTIONS = ["fixed", "uniform", "lognormal"]
+
+
+
+
+def make_png(width: int = 64, height: int = 64, color: Tuple[int, int, int] = (90, 140, 200)) -> bytes:
+   """Render a solid-color PNG used as the generated image"""
+   buffer = io.BytesIO()
+   Image.new("RGB", (width, height), color).save(buffer, format="PNG")
+   return buffer.getvalue()
+
+
+
+
+def make_noise_png(size_mb: float, seed: int = DEFAULT_SEED) -> bytes:
+   """
+   Render a random-noise PNG of about size_mb megabytes
+  
+   Noise does not compress, so the file (and its base64 in responses) is as
+   large as a real generation. The same seed always gives the same image.
+   """
+   side = max(1, math.isqrt(int(size_mb * 1024 * 1024) // 3))
+   pixels = random.Random(seed).randbytes(side * side * 3)
+   buffer = io.BytesIO()
+   Image.frombytes("RGB", (side, side), pixels).save(buffer, format="PNG", compress_level=1)
+   return buffer.getvalue()
+
+
+
+
+class MockGeminiState:
+   """Uploaded files, pending upload sessions and request counters"""
+  
+   def __init__(
+       self,
+       file_ttl_seconds: float = DEFAULT_FILE_TTL_SECONDS,
+       batch_delay_seconds: float = DEFAULT_BATCH_DELAY_SECONDS,
+       max_candidates: int = DEFAULT_MAX_CANDIDATES,
+       latency_seconds: float = 0.0,
+       latency_distribution: str = "fixed",
+       latency_spread: float = 0.5,
+       error_rate: float = 0.0,
+       error_status: int = 503,
+       image_mb: Optional[float] = None,
+       seed: int = DEFAULT_SEED
+   ):
+       if latency_distribution not in LATENCY_DISTRIBUTIONS:
+           raise ValueError(f"Invalid latency distribution. Must be one of: {LATENCY_DISTRIBUTIONS}")
+       if not 0 <= error_rate <= 1:
+           raise ValueError("error_rate must be between 0 and 1")
+       self.file_ttl_seconds = file_ttl_seconds
+       self.batch_delay_seconds = batch_delay_seconds
+       self.max_candidates = max_candidates
+       self.latency_seconds = latency_seconds
+       self.latency_distribution = latency_distribution
+       self.latency_spread = latency_spread
+       self.error_rate = error_rate
+       self.error_status = error_status
+       self.image_bytes = make_noise_png(image_mb, seed) if image_mb else make_png()
+       # Latency and error draws are seeded so runs are repeatable
+       self.random = random.Random(seed)
+       self.files: Dict[str, Dict[str, Any]] = {}
+       self.files_by_name: Dict[str, bytes] = {}
+       self.upload_sessions: Dict[str, Dict[str, Any]] = {}
+       self.batches: Dict[str, Dict[str, Any]] = {}
+       self.lock = threading.Lock()
+       self.stats = {
+           "generate_requests": 0,
+           "generate_request_bytes": 0,
+           "uploads": 0,
+           "upload_bytes": 0,
+           "rejected_file_uris": 0,
+           "injected_errors": 0,
+           "batches": 0
+       }
+  
+   def count(self, key: str, amount: int = 1):
+       with self.lock:
+           self.stats[key] += amount
+  
+   def draw_latency(self) -> float:
+       """
+       Seconds to hold a generateContent response
+      
+       fixed always waits latency_seconds; uniform spreads it by
+       +/- latency_spread of itself; lognormal has latency_seconds as median
+       and latency_spread as sigma (the long tail of real generations).
+       """
+       if self.latency_seconds <= 0:
+           return 0.0
+       with self.lock:
+           if self.latency_distribution == "uniform":
+               return self.random.uniform(
+                   self.latency_seconds * (1 - self.latency_spread),
+                   self.latency_seconds * (1 + self.latency_spread)
+               )
+           if self.latency_distribution == "lognormal":
+               return self.random.lognormvariate(math.log(self.latency_seconds), self.latency_spread)
+       return self.latency_seconds
+  
+   def draw_error(self) -> bool:
+       """Whether to fail this generateContent request (with probability error_rate)"""
+       if self.error_rate <= 0:
+           return False
+       with self.lock:
+           failed = self.random.random() < self.error_rate
+           if failed:
+               self.stats["injected_errors"] += 1
+       return failed
+  
+   def expire_all_files(self):
+       """Expire every uploaded file (simulates handles outliving the server's TTL)"""
+       with self.lock:
+           for file_info in self.files.values():
+               file_info["expires_at"] = 0
+  
+   def file_is_valid(self, uri: str) -> bool:
+       with self.lock:
+           file_info = self.files.get(uri)
+           return file_info is not None and file_info["expires_at"] > time.time()
+  
+   def store_file(self, name: str, data: bytes):
+       with self.lock:
+           self.files_by_name[name] = data
+  
+   def generate_response(self, payload: Dict[str, Any], request_bytes: int) -> Tuple[int, Dict[str, Any]]:
+       """
+       Build a generateContent response for a request payload
+      
+       Returns:
+           Tuple of (HTTP status, response body)
+       """
+       for content in payload.get("contents", []):
+           for part in content.get("parts", []):
+               file_data = part.get("file_data") or part.get("fileData")
+               if file_data is None:
+                   continue
+               uri = file_data.get("file_uri") or file_data.get("fileUri")
+               if not self.file_is_valid(uri):
+                   self.count("rejected_file_uris")
+                   message = f"You do not have permission to access the File {uri} or it may not exist."
+                   return 403, {"error": {"code": 403, "message": message}}
+      
+       candidate_count = payload.get("generationConfig", {}).get("candidateCount", 1)
+       if candidate_count > self.max_candidates:
+           message = "Multiple candidates is not enabled for this model"
+           return 400, {"error": {"code": 400, "message": message, "status": "INVALID_ARGUMENT"}}
+      
+       image_data = base64.b64encode(self.image_bytes).decode("ascii")
+       return 200, {
+           "candidates": [
+               {
+                   "content": {
+                       "role": "model",
+                       "parts": [
+                           {"text": "Here is your image."},
+                           {"inlineData": {"mimeType": "image/png", "data": image_data}}
+                       ]
+                   },
+                   "finishReason": "STOP",
+                   "index": index
+               }
+               for index in range(candidate_count)
+           ],
+           "usageMetadata": {
+               "promptTokenCount": request_bytes // 4,
+               "candidatesTokenCount": 1290 * candidate_count,
+               "totalTokenCount": request_bytes // 4 + 1290 * candidate_count
+           }
+       }
+  
+   def run_batch(self, batch_name: str, input_file: str):
+       """Process a batch in the background after batch_delay_seconds"""
+       with self.lock:
+           self.batches[batch_name]["state"] = "BATCH_STATE_RUNNING"
+       time.sleep(self.batch_delay_seconds)
+      
+       with self.lock:
+           data = self.files_by_name.get(input_file)
+       if data is None:
+           with self.lock:
+               self.batches[batch_name].update(
+                   state="BATCH_STATE_FAILED",
+                   error={"code": 404, "message": f"Input file {input_file} not found"}
+               )
+           return
+      
+       lines = []
+       for line in data.splitlines():
+           if not line.strip():
+               continue
+           entry = json.loads(line)
+           status, body = self.generate_response(entry["request"], len(line))
+           result = {"key": entry.get("key")}
+           if status == 200:
+               result["response"] = body
+           else:
+               result["error"] = body["error"]
+           lines.append(json.dumps(result))
+      
+       output_name = f"files/batch-output-{uuid.uuid4().hex[:12]}"
+       self.store_file(output_name, ("\n".join(lines) + "\n").encode("utf-8"))
+       with self.lock:
+           self.batches[batch_name].update(state="BATCH_STATE_SUCCEEDED", responses_file=output_name)
+
+
+
+
+class MockGeminiHandler(BaseHTTPRequestHandler):
+   """Request handler; the server's state lives on self.server.state"""
+  
+   protocol_version = "HTTP/1.1"
+  
+   def log_message(self, format, *args):
+       pass
+  
+   @property
+   def state(self) -> MockGeminiState:
+       return self.server.state
+  
+   def _read_body(self) -> bytes:
+       length = int(self.headers.get("Content-Length", 0))
+       return self.rfile.read(length) if length else b""
+  
+   def _send_json(self, status: int, body: Any, headers: Optional[Dict[str, str]] = None):
+       data = json.dumps(body).encode("utf-8")
+       self.send_response(status)
+       self.send_header("Content-Type", "application/json")
+       self.send_header("Content-Length", str(len(data)))
+       for name, value in (headers or {}).items():
+           self.send_header(name, value)
+       self.end_headers()
+       self.wfile.write(data)
+  
+   def _send_error(self, status: int, message: str):
+       self._send_json(status, {"error": {"code": status, "message": message}})
+  
+   def do_POST(self):
+       parsed = urlparse(self.path)
+       body = self._read_body()
+       if parsed.path.endswith(":generateContent"):
+           self._generate_content(body)
+       elif parsed.path.endswith(":batchGenerateContent"):
+           self._create_batch(body)
+       elif parsed.path.startswith("/upload/") and parsed.path.endswith("/files"):
+           upload_id = parse_qs(parsed.query).get("upload_id", [None])[0]
+           if upload_id is None:
+               self._start_upload(body, parsed.path)
+           else:
+               self._finish_upload(upload_id, body)
+       else:
+           self._send_error(404, f"Unknown endpoint {parsed.path}")
+  
+   def _start_upload(self, body: bytes, path: str):
+       if self.headers.get("X-Goog-Upload-Command") != "start":
+           self._send_error(400, "Expected X-Goog-Upload-Command: start")
+           return
+       upload_id = uuid.uuid4().hex
+       metadata = json.loads(body or b"{}").get("file", {})
+       with self.state.lock:
+           self.state.upload_sessions[upload_id] = {
+               "display_name": metadata.get("display_name", upload_id),
+               "mime_type": self.headers.get("X-Goog-Upload-Header-Content-Type", "application/octet-stream")
+           }
+       host = self.headers.get("Host", "127.0.0.1")
+       self._send_json(200, {}, {
+           "X-Goog-Upload-URL": f"http://{host}{path}?upload_id={upload_id}",
+           "X-Goog-Upload-Status": "active"
+       })
+  
+   def _finish_upload(self, upload_id: str, body: bytes):
+       with self.state.lock:
+           session = self.state.upload_sessions.pop(upload_id, None)
+       if session is None:
+           self._send_error(404, "Unknown upload session")
+           return
+      
+       name = f"files/{upload_id[:12]}"
+       uri = f"http://{self.headers.get('Host', '127.0.0.1')}/v1beta/{name}"
+       expires_at = time.time() + self.state.file_ttl_seconds
+       with self.state.lock:
+           self.state.files[uri] = {
+               "name": name,
+               "size_bytes": len(body),
+               "mime_type": session["mime_type"],
+               "expires_at": expires_at
+           }
+       self.state.store_file(name, body)
+       self.state.count("uploads")
+       self.state.count("upload_bytes", len(body))
+       self._send_json(200, {
+           "file": {
+               "name": name,
+               "displayName": session["display_name"],
+               "mimeType": session["mime_type"],
+               "sizeBytes": str(len(body)),
+               "uri": uri,
+               "state": "ACTIVE",
+               "expirationTime": datetime.fromtimestamp(expires_at, timezone.utc).isoformat().replace("+00:00", "Z")
+           }
+       }, {"X-Goog-Upload-Status": "final"})
+  
+   def _generate_content(self, body: bytes):
+       self.state.count("generate_requests")
+       self.state.count("generate_request_bytes", len(body))
+       try:
+           payload = json.loads(body)
+       except ValueError:
+           self._send_error(400, "Invalid JSON payload")
+           return
+      
+       failed = self.state.draw_error()
+       if failed and self.state.error_status == 429:
+           # Quota rejections come back at once
+           self._send_error(429, "Resource has been exhausted (e.g. check quota).")
+           return
+       time.sleep(self.state.draw_latency())
+       if failed:
+           self._send_error(self.state.error_status, "The service is currently unavailable.")
+           return
+       self._send_json(*self.state.generate_response(payload, len(body)))
+  
+   def _create_batch(self, body: bytes):
+       try:
+           batch = json.loads(body)["batch"]
+           input_file = batch["input_config"]["file_name"]
+       except (ValueError, KeyError):
+           self._send_error(400, "Expected batch.input_config.file_name")
+           return
+      
+       batch_name = f"batches/{uuid.uuid4().hex[:12]}"
+       with self.state.lock:
+           self.state.batches[batch_name] = {
+               "display_name": batch.get("display_name", batch_name),
+               "state": "BATCH_STATE_PENDING"
+           }
+       self.state.count("batches")
+       threading.Thread(
+           target=self.state.run_batch, args=(batch_name, input_file), daemon=True
+       ).start()
+       self._send_json(200, self._batch_operation(batch_name))
+  
+   def _batch_operation(self, batch_name: str) -> Dict[str, Any]:
+       with self.state.lock:
+           batch = dict(self.state.batches[batch_name])
+       operation = {
+           "name": batch_name,
+           "metadata": {
+               "displayName": batch["display_name"],
+               "state": batch["state"]
+           },
+           "done": batch["state"] in ("BATCH_STATE_SUCCEEDED", "BATCH_STATE_FAILED")
+       }
+       if batch.get("responses_file"):
+           operation["metadata"]["output"] = {"responsesFile": batch["responses_file"]}
+           operation["response"] = {"responsesFile": batch["responses_file"]}
+       if batch.get("error"):
+           operation["error"] = batch["error"]
+       return operation
+  
+   def do_GET(self):
+       path = urlparse(self.path).path
+       if path == "/v1beta/models":
+           self._send_json(200, {"models": [{"name": "models/gemini-2.5-flash-image-preview"}]})
+       elif path == "/mock/stats":
+           with self.state.lock:
+               stats = dict(self.state.stats)
+           self._send_json(200, stats)
+       elif path.startswith("/v1beta/batches/"):
+           batch_name = path[len("/v1beta/"):]
+           with self.state.lock:
+               known = batch_name in self.state.batches
+           if known:
+               self._send_json(200, self._batch_operation(batch_name))
+           else:
+               self._send_error(404, f"Batch {batch_name} not found")
+       elif path.startswith("/download/") and path.endswith(":download"):
+           file_name = path.split("/", 3)[3][:-len(":download")]
+           with self.state.lock:
+               data = self.state.files_by_name.get(file_name)
+           if data is None:
+               self._send_error(404, f"File {file_name} not found")
+               return
+           self.send_response(200)
+           self.send_header("Content-Type", "application/octet-stream")
+           self.send_header("Content-Length", str(len(data)))
+           self.end_headers()
+           self.wfile.write(data)
+       else:
+           self._send_error(404, f"Unknown endpoint {path}")
+
+
+
+
+class MockGeminiServer(ThreadingHTTPServer):
+   """Threaded mock server; start() runs it in a daemon thread"""
+  
+   daemon_threads = True
+   request_queue_size = 256
+  
+   def __init__(
+       self,
+       port: int = 0,
+       file_ttl_seconds: float = DEFAULT_FILE_TTL_SECONDS,
+       batch_delay_seconds: float = DEFAULT_BATCH_DELAY_SECONDS,
+       max_candidates: int = DEFAULT_MAX_CANDIDATES,
+       **state_options
+   ):
+       """
+       Initialize server
+      
+       Args:
+           port: Port to listen on (0 picks a free one)
+           file_ttl_seconds: Seconds before uploaded files expire
+           batch_delay_seconds: Seconds a batch job stays running
+           max_candidates: Largest candidateCount accepted
+           **state_options: Response shaping passed to MockGeminiState
+               (latency_seconds, latency_distribution, latency_spread,
+               error_rate, error_status, image_mb, seed)
+       """
+       super().__init__(("127.0.0.1", port), MockGeminiHandler)
+       self.state = MockGeminiState(file_ttl_seconds, batch_delay_seconds, max_candidates, **state_options)
+       self._thread: Optional[threading.Thread] = None
+  
+   @property
+   def base_url(self) -> str:
+       """API base URL to pass to ImageGenerationClient"""
+       return f"http://127.0.0.1:{self.server_address[1]}/v1beta"
+  
+   def start(self) -> "MockGeminiServer":
+       self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+       self._thread.start()
+       return self
+  
+   def stop(self):
+       self.shutdown()
+       self.server_close()
+  
+   def __enter__(self):
+       return self.start()
+  
+   def __exit__(self, exc_type, exc_value, traceback):
+       self.stop()
+
+
+
+
+def main():
+   parser = argparse.ArgumentParser(description="Local stand-in for the Gemini API")
+   parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+   parser.add_argument("--file-ttl", type=float, default=DEFAULT_FILE_TTL_SECONDS,
+                       help="Seconds before uploaded files expire")
+   parser.add_argument("--batch-delay", type=float, default=DEFAULT_BATCH_DELAY_SECONDS,
+                       help="Seconds a batch job stays running")
+   parser.add_argument("--max-candidates", type=int, default=DEFAULT_MAX_CANDIDATES,
+                       help="Largest candidateCount accepted (1 rejects multi-candidate requests)")
+   parser.add_argument("--latency", type=float, default=0.0,
+                       help="Seconds before each generateContent response (median for lognormal)")
+   parser.add_argument("--latency-distribution", choices=LATENCY_DISTRIBUTIONS, default="fixed")
+   parser.add_argument("--latency-spread", type=float, default=0.5,
+                       help="Relative +/- range for uniform, sigma for lognormal")
+   parser.add_argument("--error-rate", type=float, default=0.0,
+                       help="Fraction of generateContent requests that fail")
+   parser.add_argument("--error-status", type=int, default=503,
+                       help="Status returned for injected failures")
+   parser.add_argument("--image-mb", type=float, default=None,
+                       help="Size of the returned image in MB (a tiny PNG if not set)")
+   parser.add_argument("--seed", type=int, default=DEFAULT_SEED,
+                       help="Seed for the image, latency and error draws")
+   args = parser.parse_args()
+  
+   server = MockGeminiServer(
+       args.port,
+       args.file_ttl,
+       args.batch_delay,
+       args.max_candidates,
+       latency_seconds=args.latency,
+       latency_distribution=args.latency_distribution,
+       latency_spread=args.latency_spread,
+       error_rate=args.error_rate,
+       error_status=args.error_status,
+       image_mb=args.image_mb,
+       seed=args.seed
+   )
+   print(f"Mock Gemini API at {server.base_url}", flush=True)
+   try:
+       server.serve_forever()
+   except KeyboardInterrupt:
+       print(f"\nStats: {server.state.stats}")
+       server.server_close()
+
+
+
+
+if __name__ == "__main__":
+   main()
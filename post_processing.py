@@ -0,0 +1,120 @@
+"""
+Post-processing pipeline stage for generated images
+Decode, write, info extraction and optional transforms run off the request thread
+"""
+
+
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Union
+
+
+from config import POST_PROCESS_WORKERS
+
+
+
+
+# A transform takes a saved image dict ({"file_path", "info"}) and returns the updated dict
+ImageTransform = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+
+
+
+def resolve_result(result: Union[Dict[str, Any], Future]) -> Dict[str, Any]:
+   """Wait for a deferred result (returns plain results unchanged)"""
+   if isinstance(result, Future):
+       return result.result()
+   return result
+
+
+
+
+class PostProcessor:
+   """
+   Worker pool for the CPU/disk half of a generation
+  
+   With a post processor attached, the client's request thread hands the
+   response to this pool (base64 decode, file write, image info, result
+   cache store, transforms) and is free to start the next request at
+   once. Callers get a Future for the finished result.
+  
+   Usage:
+       client = ImageGenerationClient(api_key, post_processor=PostProcessor())
+       futures = [client.generate(p, wait=False) for p in prompts]
+       results = [f.result() for f in futures]
+   """
+  
+   def __init__(
+       self,
+       max_workers: int = POST_PROCESS_WORKERS,
+       transforms: Optional[List[ImageTransform]] = None
+   ):
+       """
+       Initialize post processor
+      
+       Args:
+           max_workers: Worker threads (decode, zlib and file I/O release the GIL)
+           transforms: Optional callables applied to every saved image, in order
+       """
+       self.max_workers = max_workers
+       self.transforms = transforms or []
+       self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="post")
+       self._lock = threading.Lock()
+       self._pending = 0
+       self.stats = {
+           "submitted": 0,
+           "completed": 0,
+           "failed": 0,
+           "busy_seconds": 0.0,
+           "max_pending": 0
+       }
+  
+   def submit(self, func: Callable[[], Any]) -> Future:
+       """
+       Queue one post-processing job
+      
+       The job runs in a copy of the caller's context, so metric tags set
+       for the generation still apply on the worker.
+      
+       Returns:
+           Future resolving to func's result
+       """
+       with self._lock:
+           self.stats["submitted"] += 1
+           self._pending += 1
+           self.stats["max_pending"] = max(self.stats["max_pending"], self._pending)
+       return self._executor.submit(contextvars.copy_context().run, self._run, func)
+  
+   def _run(self, func: Callable[[], Any]) -> Any:
+       started = time.perf_counter()
+       failed = False
+       try:
+           return func()
+       except BaseException:
+           failed = True
+           raise
+       finally:
+           with self._lock:
+               self._pending -= 1
+               self.stats["failed" if failed else "completed"] += 1
+               self.stats["busy_seconds"] += time.perf_counter() - started
+  
+   def apply_transforms(self, image: Dict[str, Any]) -> Dict[str, Any]:
+       """Run every configured transform on a saved image"""
+       for transform in self.transforms:
+           image = transform(image)
+       return image
+  
+   def close(self, wait: bool = True):
+       """Finish queued jobs and stop the workers"""
+       self._executor.shutdown(wait=wait)
+  
+   def get_stats(self) -> Dict[str, Any]:
+       """Get job counters"""
+       with self._lock:
+           stats = dict(self.stats)
+           stats["pending"] = self._pending
+       stats["busy_seconds"] = round(stats["busy_seconds"], 3)
+       return stats
@@ -0,0 +1,282 @@
+"""
+Opt-in profiling of generation calls
+Wraps sampled calls with cProfile and/or tracemalloc and dumps per-call reports
+"""
+
+
+import functools
+import io
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Union
+
+
+from config import (
+   PROFILE_MODES,
+   PROFILE_MODE,
+   PROFILE_EVERY_N,
+   DEFAULT_PROFILES_DIR,
+   PROFILE_TOP_FUNCTIONS,
+   PROFILE_TOP_ALLOCATIONS
+)
+
+
+if TYPE_CHECKING:
+   # cProfile, pstats and tracemalloc are imported when a call is first profiled
+   import cProfile
+   import tracemalloc
+
+
+
+
+class Profiler:
+   """
+   Per-call cProfile and tracemalloc reports
+  
+   One call in every_n (counted per label) is profiled; the others run
+   untouched. For a profiled call:
+   - cpu: a cProfile of the calling thread is dumped as <name>.prof (for
+     snakeviz/pstats) plus <name>.txt with the top functions by cumulative
+     time. Work handed to other threads (fan-out, post-processing) is not
+     in it; those threads' own profiled helpers get their own reports.
+   - memory: tracemalloc snapshots before and after are compared and the
+     top allocation sites are written to <name>.memory.txt with the traced
+     peak. Tracing is process-wide, so concurrent calls show up in each
+     other's reports, and it slows everything while any call is traced.
+  
+   Calls made inside a profiled call on the same thread are not profiled
+   again. Enable with IMAGEGEN_PROFILE=cpu,memory and, to sample,
+   IMAGEGEN_PROFILE_EVERY=N.
+   """
+  
+   def __init__(
+       self,
+       modes: Union[str, List[str]] = PROFILE_MODE,
+       every_n: int = PROFILE_EVERY_N,
+       profiles_dir: str = DEFAULT_PROFILES_DIR,
+       top_functions: int = PROFILE_TOP_FUNCTIONS,
+       top_allocations: int = PROFILE_TOP_ALLOCATIONS
+   ):
+       """
+       Initialize profiler
+      
+       Args:
+           modes: "cpu", "memory", both (list or comma-separated), or empty to disable
+           every_n: Profile one call in every_n per label
+           profiles_dir: Directory for the reports
+           top_functions: Functions listed in each cProfile summary
+           top_allocations: Allocation sites listed in each memory report
+          
+       Raises:
+           ValueError: On an unknown mode or every_n < 1
+       """
+       if isinstance(modes, str):
+           modes = [mode.strip() for mode in modes.split(",") if mode.strip()]
+       for mode in modes:
+           if mode not in PROFILE_MODES:
+               raise ValueError(f"Invalid profile mode '{mode}'. Must be one of: {PROFILE_MODES}")
+       if every_n < 1:
+           raise ValueError("every_n must be at least 1")
+      
+       self.modes = set(modes)
+       self.every_n = every_n
+       self.profiles_dir = profiles_dir
+       self.top_functions = top_functions
+       self.top_allocations = top_allocations
+       self._counters: Dict[str, int] = {}
+       self._lock = threading.Lock()
+       self._local = threading.local()
+       # Profiled calls currently tracing memory (tracemalloc is process-wide)
+       self._tracing = 0
+       self._started_tracing = False
+       self.stats = {
+           "calls": 0,
+           "profiled": 0,
+           "reports": 0,
+           "cpu_skipped": 0
+       }
+  
+   @property
+   def enabled(self) -> bool:
+       """Whether any profiling mode is on"""
+       return bool(self.modes)
+  
+   def _sampled(self, label: str) -> bool:
+       with self._lock:
+           count = self._counters.get(label, 0)
+           self._counters[label] = count + 1
+           self.stats["calls"] += 1
+           sampled = count % self.every_n == 0
+           if sampled:
+               self.stats["profiled"] += 1
+       return sampled
+  
+   def _start_tracing(self):
+       import tracemalloc
+      
+       with self._lock:
+           if self._tracing == 0 and not tracemalloc.is_tracing():
+               tracemalloc.start()
+               self._started_tracing = True
+           self._tracing += 1
+  
+   def _stop_tracing(self):
+       import tracemalloc
+      
+       with self._lock:
+           self._tracing -= 1
+           if self._tracing == 0 and self._started_tracing:
+               tracemalloc.stop()
+               self._started_tracing = False
+  
+   def _enable_cpu(self) -> Optional["cProfile.Profile"]:
+       import cProfile
+      
+       profile = cProfile.Profile()
+       try:
+           profile.enable()
+       except ValueError:
+           # Python 3.12+ allows one active profiler per process, so a call
+           # sampled while another thread is profiling gets no CPU report
+           with self._lock:
+               self.stats["cpu_skipped"] += 1
+           return None
+       return profile
+  
+   def _report_path(self, label: str) -> str:
+       os.makedirs(self.profiles_dir, exist_ok=True)
+       with self._lock:
+           self.stats["reports"] += 1
+           sequence = self.stats["reports"]
+       timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+       safe_label = re.sub(r"[^A-Za-z0-9_.-]", "_", label)
+       return os.path.join(self.profiles_dir, f"{timestamp}_{sequence:05d}_{safe_label}")
+  
+   def _write_cpu(self, base_path: str, profile: "cProfile.Profile", label: str, seconds: float):
+       import pstats
+      
+       profile.dump_stats(f"{base_path}.prof")
+       buffer = io.StringIO()
+       stats = pstats.Stats(profile, stream=buffer)
+       stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top_functions)
+       with open(f"{base_path}.txt", 'w', encoding='utf-8') as f:
+           f.write(f"{label}: {seconds:.3f}s wall\n")
+           f.write(buffer.getvalue())
+  
+   def _write_memory(
+       self,
+       base_path: str,
+       before: "tracemalloc.Snapshot",
+       after: "tracemalloc.Snapshot",
+       peak_bytes: int,
+       label: str
+   ):
+       differences = after.compare_to(before, "lineno")
+       with open(f"{base_path}.memory.txt", 'w', encoding='utf-8') as f:
+           f.write(f"{label}: traced peak {peak_bytes / (1024 * 1024):.1f}MB\n")
+           f.write(f"Top {self.top_allocations} allocation sites (size change during the call):\n")
+           for difference in differences[:self.top_allocations]:
+               f.write(f"{difference}\n")
+  
+   @contextmanager
+   def profile(self, label: str) -> Iterator[Optional[str]]:
+       """
+       Profile the enclosed block if this call is sampled
+      
+       The CPU report is skipped (and counted in stats["cpu_skipped"]) when
+       another profiler is already active in the process.
+      
+       Yields:
+           Base path of the reports being written, or None if not profiled
+       """
+       if not self.enabled or getattr(self._local, "active", False) or not self._sampled(label):
+           yield None
+           return
+      
+       import tracemalloc
+      
+       base_path = self._report_path(label)
+       self._local.active = True
+       profile = None
+       tracing = False
+       before = None
+       started = time.perf_counter()
+       try:
+           if "memory" in self.modes:
+               self._start_tracing()
+               tracing = True
+               tracemalloc.reset_peak()
+               before = tracemalloc.take_snapshot()
+           if "cpu" in self.modes:
+               profile = self._enable_cpu()
+           started = time.perf_counter()
+           yield base_path
+       finally:
+           if profile is not None:
+               profile.disable()
+           seconds = time.perf_counter() - started
+           self._local.active = False
+           if before is not None:
+               after = tracemalloc.take_snapshot()
+               _, peak_bytes = tracemalloc.get_traced_memory()
+           if tracing:
+               self._stop_tracing()
+           if before is not None:
+               self._write_memory(base_path, before, after, peak_bytes, label)
+           if profile is not None:
+               self._write_cpu(base_path, profile, label, seconds)
+  
+   def get_stats(self) -> Dict[str, Any]:
+       """Get call/profile counters"""
+       with self._lock:
+           stats = dict(self.stats)
+       stats["modes"] = sorted(self.modes)
+       stats["every_n"] = self.every_n
+       return stats
+
+
+
+
+_profiler: Optional[Profiler] = None
+_profiler_lock = threading.Lock()
+
+
+
+
+def get_profiler() -> Profiler:
+   """Get the process-wide profiler (configured from IMAGEGEN_PROFILE*)"""
+   global _profiler
+   if _profiler is None:
+       with _profiler_lock:
+           if _profiler is None:
+               _profiler = Profiler()
+   return _profiler
+
+
+
+
+def set_profiler(profiler: Profiler):
+   """Replace the process-wide profiler (e.g. to turn profiling on at runtime)"""
+   global _profiler
+   with _profiler_lock:
+       _profiler = profiler
+
+
+
+
+def profiled(label: str) -> Callable[[Callable], Callable]:
+   """Decorator profiling a function through the process-wide profiler (a flag check when off)"""
+   def decorate(func: Callable) -> Callable:
+       @functools.wraps(func)
+       def wrapper(*args, **kwargs):
+           profiler = get_profiler()
+           if not profiler.enabled:
+               return func(*args, **kwargs)
+           with profiler.profile(label):
+               return func(*args, **kwargs)
+       return wrapper
+   return decorate
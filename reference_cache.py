@@ -0,0 +1,161 @@
+"""
+Process-wide LRU cache of base64-encoded reference images
+Character sheets reused across panels are read and encoded only once
+"""
+
+
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+
+from config import REFERENCE_CACHE_MAX_MB
+from utils import get_mime_type
+
+
+
+
+class EncodedImage(NamedTuple):
+   """A reference image ready to be sent inline"""
+   base64_data: str
+   mime_type: str
+   size_bytes: int
+   sha256: str
+
+
+
+
+class ReferenceImageCache:
+   """
+   Byte-capped LRU cache of encoded reference images
+  
+   Entries are keyed by (absolute path, mtime, size), so editing or
+   replacing a file on disk naturally misses. The cap applies to the
+   base64 text held in memory; least recently used entries are dropped
+   first. Safe to share between threads.
+   """
+  
+   def __init__(self, max_bytes: int = int(REFERENCE_CACHE_MAX_MB * 1024 * 1024)):
+       """
+       Initialize cache
+      
+       Args:
+           max_bytes: Maximum total size of cached base64 strings
+       """
+       self.max_bytes = max_bytes
+       self._entries: "OrderedDict[Tuple[str, int, int], EncodedImage]" = OrderedDict()
+       self._current_bytes = 0
+       self._lock = threading.Lock()
+       self.stats = {
+           "hits": 0,
+           "misses": 0,
+           "evictions": 0
+       }
+  
+   @staticmethod
+   def _key(image_path: str) -> Tuple[str, int, int]:
+       stat = os.stat(image_path)
+       return (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+  
+   def get(self, image_path: str) -> EncodedImage:
+       """
+       Get the encoded form of an image, reading and encoding it on a miss
+      
+       Args:
+           image_path: Path to image file
+          
+       Returns:
+           EncodedImage(base64_data, mime_type, size_bytes, sha256)
+       """
+       key = self._key(image_path)
+       with self._lock:
+           entry = self._entries.get(key)
+           if entry is not None:
+               self._entries.move_to_end(key)
+               self.stats["hits"] += 1
+               return entry
+           self.stats["misses"] += 1
+      
+       # Read and encode outside the lock
+       with open(image_path, 'rb') as f:
+           image_data = f.read()
+       entry = EncodedImage(
+           base64_data=base64.b64encode(image_data).decode('utf-8'),
+           mime_type=get_mime_type(image_path),
+           size_bytes=len(image_data),
+           sha256=hashlib.sha256(image_data).hexdigest()
+       )
+       self._insert(key, entry)
+       return entry
+  
+   def _insert(self, key: Tuple[str, int, int], entry: EncodedImage):
+       entry_bytes = len(entry.base64_data)
+       if entry_bytes > self.max_bytes:
+           return
+      
+       with self._lock:
+           previous = self._entries.pop(key, None)
+           if previous is not None:
+               self._current_bytes -= len(previous.base64_data)
+          
+           # Drop stale versions of the same path
+           for stale_key in [k for k in self._entries if k[0] == key[0]]:
+               self._current_bytes -= len(self._entries.pop(stale_key).base64_data)
+          
+           self._entries[key] = entry
+           self._current_bytes += entry_bytes
+           while self._current_bytes > self.max_bytes:
+               _, evicted = self._entries.popitem(last=False)
+               self._current_bytes -= len(evicted.base64_data)
+               self.stats["evictions"] += 1
+  
+   def clear(self):
+       """Drop all cached entries"""
+       with self._lock:
+           self._entries.clear()
+           self._current_bytes = 0
+  
+   def get_stats(self) -> Dict[str, Any]:
+       """Get cache counters and memory use"""
+       with self._lock:
+           stats = dict(self.stats)
+           stats["entries"] = len(self._entries)
+           stats["cached_bytes"] = self._current_bytes
+       stats["max_bytes"] = self.max_bytes
+       return stats
+
+
+
+
+_reference_cache: Optional[ReferenceImageCache] = None
+_reference_cache_lock = threading.Lock()
+
+
+
+
+def get_reference_cache() -> ReferenceImageCache:
+   """Get the process-wide reference image cache"""
+   global _reference_cache
+   if _reference_cache is None:
+       with _reference_cache_lock:
+           if _reference_cache is None:
+               _reference_cache = ReferenceImageCache()
+   return _reference_cache
+
+
+
+
+def encode_reference_image(image_path: str) -> EncodedImage:
+   """
+   Encode a reference image through the process-wide cache
+  
+   Args:
+       image_path: Path to image file
+      
+   Returns:
+       EncodedImage(base64_data, mime_type, size_bytes, sha256)
+   """
+   return get_reference_cache().get(image_path)
@@ -0,0 +1,306 @@
+"""
+Adaptive downscaling and recompression of reference images before upload
+Large PNG character sheets are shrunk in memory; originals are never touched
+"""
+
+
+import base64
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+
+from config import IMAGE_METADATA_CACHE_SIZE, REFERENCE_CACHE_MAX_MB, ReferenceUploadConfig
+from reference_cache import EncodedImage, encode_reference_image
+from utils import get_mime_type
+
+
+if TYPE_CHECKING:
+   # PIL is imported by the functions that use it, on first optimization
+   from PIL import Image
+
+
+
+
+UPLOAD_MIME_TYPES = {
+   "jpeg": "image/jpeg",
+   "webp": "image/webp",
+   "png": "image/png"
+}
+
+# Quality decrement and scale factor used while fitting a byte budget
+QUALITY_STEP = 10
+DOWNSCALE_STEP = 0.8
+MIN_LONG_EDGE = 256
+
+
+
+
+def _encode(image: "Image.Image", options: ReferenceUploadConfig, quality: int) -> bytes:
+   """Encode a PIL image in the upload format"""
+   buffer = io.BytesIO()
+   if options.format == "jpeg":
+       image.save(buffer, format="JPEG", quality=quality, optimize=True)
+   elif options.format == "webp":
+       image.save(buffer, format="WEBP", quality=quality, method=4)
+   else:
+       image.save(buffer, format="PNG", optimize=True)
+   return buffer.getvalue()
+
+
+
+
+def _prepare(image: "Image.Image", options: ReferenceUploadConfig) -> "Image.Image":
+   """Convert to a mode the upload format supports (alpha flattened on white for JPEG)"""
+   from PIL import Image
+  
+   if options.format == "jpeg":
+       if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+           image = image.convert("RGBA")
+           background = Image.new("RGB", image.size, (255, 255, 255))
+           background.paste(image, mask=image.split()[-1])
+           return background
+       return image.convert("RGB") if image.mode != "RGB" else image
+   if image.mode not in ("RGB", "RGBA"):
+       return image.convert("RGBA" if "transparency" in image.info or "A" in image.mode else "RGB")
+   return image
+
+
+
+
+def _resize_to(image: "Image.Image", long_edge: int) -> "Image.Image":
+   """Downscale so the longer side is at most long_edge (never upscales)"""
+   from PIL import Image
+  
+   if max(image.size) <= long_edge:
+       return image
+   resized = image.copy()
+   resized.thumbnail((long_edge, long_edge), Image.LANCZOS)
+   return resized
+
+
+
+
+def optimize_image(image_path: str, options: ReferenceUploadConfig) -> Tuple[bytes, str, bool]:
+   """
+   Build the upload bytes for one reference image
+  
+   Args:
+       image_path: Path to the original image (opened read-only)
+       options: Upload settings
+      
+   Returns:
+       Tuple of (image bytes, mime type, whether the image was resized)
+   """
+   from PIL import Image
+  
+   with Image.open(image_path) as original:
+       original.load()
+       image = _prepare(original, options)
+  
+   resized = False
+   if options.max_long_edge is not None and max(image.size) > options.max_long_edge:
+       image = _resize_to(image, options.max_long_edge)
+       resized = True
+  
+   quality = options.quality
+   data = _encode(image, options, quality)
+   if options.max_bytes is not None:
+       # Lower quality first, then shrink dimensions until the budget fits
+       while len(data) > options.max_bytes and options.format != "png" and quality > options.min_quality:
+           quality = max(options.min_quality, quality - QUALITY_STEP)
+           data = _encode(image, options, quality)
+       while len(data) > options.max_bytes and max(image.size) > MIN_LONG_EDGE:
+           image = _resize_to(image, max(MIN_LONG_EDGE, int(max(image.size) * DOWNSCALE_STEP)))
+           resized = True
+           data = _encode(image, options, quality)
+  
+   return data, UPLOAD_MIME_TYPES[options.format], resized
+
+
+
+
+class ReferenceOptimizer:
+   """
+   Byte-capped LRU cache of optimized reference images
+  
+   Entries are keyed by the original's content hash plus the upload
+   settings, so the same sheet reused across panels is only resized and
+   re-encoded once per setting. When re-encoding would not make an
+   unresized image smaller, the original encoding is sent instead.
+  
+   Content hashes are memoized per (path, mtime, size), so a hit reads
+   nothing but a stat; originals are never base64-encoded unless they are
+   what gets sent.
+   """
+  
+   def __init__(self, max_bytes: int = int(REFERENCE_CACHE_MAX_MB * 1024 * 1024)):
+       """
+       Initialize optimizer
+      
+       Args:
+           max_bytes: Maximum total size of cached base64 strings
+       """
+       self.max_bytes = max_bytes
+       self._entries: "OrderedDict[Tuple[str, Tuple], EncodedImage]" = OrderedDict()
+       self._digests: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+       self._current_bytes = 0
+       self._lock = threading.Lock()
+       self.stats = {
+           "hits": 0,
+           "misses": 0,
+           "original_bytes": 0,
+           "upload_bytes": 0
+       }
+  
+   def get(self, image_path: str, options: ReferenceUploadConfig) -> EncodedImage:
+       """
+       Get the upload-ready encoding of a reference image
+      
+       Args:
+           image_path: Path to image file
+           options: Upload settings
+          
+       Returns:
+           EncodedImage(base64_data, mime_type, size_bytes, sha256); sha256
+           identifies the original file's content
+       """
+       stat = os.stat(image_path)
+       sha256, original_data = self._digest(image_path, stat)
+      
+       key = (sha256, tuple(sorted(options.to_dict().items())))
+       with self._lock:
+           entry = self._entries.get(key)
+           if entry is not None:
+               self._entries.move_to_end(key)
+               self.stats["hits"] += 1
+               return entry
+           self.stats["misses"] += 1
+      
+       # Decode and re-encode outside the lock
+       data, mime_type, resized = optimize_image(image_path, options)
+       if not resized and len(data) >= stat.st_size:
+           # Re-encoding did not help: send the original file
+           if original_data is None:
+               with open(image_path, 'rb') as f:
+                   original_data = f.read()
+           data, mime_type = original_data, get_mime_type(image_path)
+       entry = EncodedImage(
+           base64_data=base64.b64encode(data).decode('utf-8'),
+           mime_type=mime_type,
+           size_bytes=len(data),
+           sha256=sha256
+       )
+       self._insert(key, entry, stat.st_size)
+       return entry
+  
+   def digest(self, image_path: str) -> str:
+       """
+       Get the SHA-256 of a file's content, memoized per (path, mtime, size)
+      
+       Args:
+           image_path: Path to image file
+          
+       Returns:
+           Hex SHA-256 of the file content
+       """
+       sha256, _ = self._digest(image_path, os.stat(image_path))
+       return sha256
+  
+   def _digest(self, image_path: str, stat: os.stat_result) -> Tuple[str, Optional[bytes]]:
+       """Return the content hash and, when the file had to be read, its bytes"""
+       file_key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+       with self._lock:
+           sha256 = self._digests.get(file_key)
+       if sha256 is not None:
+           return sha256, None
+       with open(image_path, 'rb') as f:
+           original_data = f.read()
+       sha256 = hashlib.sha256(original_data).hexdigest()
+       with self._lock:
+           self._digests[file_key] = sha256
+           while len(self._digests) > IMAGE_METADATA_CACHE_SIZE:
+               self._digests.popitem(last=False)
+       return sha256, original_data
+  
+   def _insert(self, key: Tuple[str, Tuple], entry: EncodedImage, original_bytes: int):
+       entry_bytes = len(entry.base64_data)
+       with self._lock:
+           self.stats["original_bytes"] += original_bytes
+           self.stats["upload_bytes"] += entry.size_bytes
+           if entry_bytes > self.max_bytes or key in self._entries:
+               return
+           self._entries[key] = entry
+           self._current_bytes += entry_bytes
+           while self._current_bytes > self.max_bytes:
+               _, evicted = self._entries.popitem(last=False)
+               self._current_bytes -= len(evicted.base64_data)
+  
+   def clear(self):
+       """Drop all cached entries"""
+       with self._lock:
+           self._entries.clear()
+           self._current_bytes = 0
+  
+   def get_stats(self) -> Dict[str, Any]:
+       """Get cache counters and bytes saved by optimization"""
+       with self._lock:
+           stats = dict(self.stats)
+           stats["entries"] = len(self._entries)
+           stats["cached_bytes"] = self._current_bytes
+       stats["bytes_saved"] = stats["original_bytes"] - stats["upload_bytes"]
+       return stats
+
+
+
+
+_optimizer: Optional[ReferenceOptimizer] = None
+_optimizer_lock = threading.Lock()
+
+
+
+
+def get_reference_optimizer() -> ReferenceOptimizer:
+   """Get the process-wide reference optimizer"""
+   global _optimizer
+   if _optimizer is None:
+       with _optimizer_lock:
+           if _optimizer is None:
+               _optimizer = ReferenceOptimizer()
+   return _optimizer
+
+
+
+
+def optimize_reference(image_path: str, options: Optional[ReferenceUploadConfig]) -> EncodedImage:
+   """
+   Encode a reference image for upload, optimizing it when options are given
+  
+   Args:
+       image_path: Path to image file
+       options: Upload settings (None sends the original file)
+      
+   Returns:
+       EncodedImage(base64_data, mime_type, size_bytes, sha256)
+   """
+   if options is None:
+       return encode_reference_image(image_path)
+   return get_reference_optimizer().get(image_path, options)
+
+
+
+
+def reference_digest(image_path: str) -> str:
+   """
+   Get the content hash of a reference image without encoding it
+  
+   Args:
+       image_path: Path to image file
+      
+   Returns:
+       Hex SHA-256 of the file content (memoized per path, mtime and size)
+   """
+   return get_reference_optimizer().digest(image_path)
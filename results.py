@@ -0,0 +1,249 @@
+"""
+Lean result objects for generation calls
+Paths, image info, usage metadata and timings; the raw payload only on request
+"""
+
+
+import json
+import os
+import uuid
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+from config import DEFAULT_SPILL_DIR
+
+
+
+
+# Part layout of one saved image: (part_index, num_parts, num_image_parts)
+PartLayout = Tuple[int, int, int]
+
+
+
+
+class GenerationResult:
+   """
+   Result of a successful generation
+  
+   Holds what callers use (output paths, image info, usage metadata,
+   timings, session details) and nothing of the response body, so a batch
+   can collect any number of results in flat memory. The raw payload is
+   only reachable when the call asked for it (ImageConfig.raw_response):
+   "keep" holds it in memory, "spill" writes it to a file that
+   load_response() reads back on demand.
+  
+   Supports the dict interface of earlier versions (result["success"],
+   result.get("generated_images"), "cached" in result, ...); failures are
+   still plain {"success": False, "error": ...} dicts.
+   """
+  
+   __slots__ = (
+       "prompt",
+       "config",
+       "reference_images",
+       "generated_images",
+       "usage_metadata",
+       "budget",
+       "elapsed_seconds",
+       "total_elapsed_seconds",
+       "timings",
+       "failed",
+       "session_id",
+       "session_summary",
+       "source",
+       "layout",
+       "_response",
+       "_spill_path"
+   )
+  
+   # Fields exposed through the dict interface (None values are absent keys)
+   FIELDS = (
+       "prompt",
+       "config",
+       "reference_images",
+       "generated_images",
+       "usage_metadata",
+       "budget",
+       "elapsed_seconds",
+       "total_elapsed_seconds",
+       "timings",
+       "failed",
+       "session_id",
+       "session_summary"
+   )
+  
+   def __init__(
+       self,
+       prompt: str,
+       config: Dict[str, Any],
+       reference_images: Optional[List[str]],
+       generated_images: List[Dict[str, Any]],
+       usage_metadata: Optional[Dict[str, Any]] = None,
+       budget: Optional[Dict[str, Any]] = None,
+       layout: Optional[List[PartLayout]] = None,
+       source: Optional[str] = None,
+       **fields
+   ):
+       """
+       Initialize result
+      
+       Args:
+           prompt: Prompt of the call
+           config: Summary of the call's configuration (aspect_ratio, num_images)
+           reference_images: Reference paths as passed by the caller
+           generated_images: Saved images as {"file_path", "info"} dicts
+           usage_metadata: usageMetadata of the response
+           budget: Pre-flight budget report
+           layout: Part layout of each generated image (for cache/coalescing copies)
+           source: "cached" or "coalesced" when no request of its own was made
+           **fields: Other FIELDS (timings, session_id, ...)
+       """
+       self.prompt = prompt
+       self.config = config
+       self.reference_images = reference_images or []
+       self.generated_images = generated_images
+       self.usage_metadata = usage_metadata
+       self.budget = budget
+       self.layout = layout
+       self.source = source
+       self.elapsed_seconds = None
+       self.total_elapsed_seconds = None
+       self.timings = None
+       self.failed = None
+       self.session_id = None
+       self.session_summary = None
+       self._response = None
+       self._spill_path = None
+       for key, value in fields.items():
+           self[key] = value
+  
+   @property
+   def success(self) -> bool:
+       return True
+  
+   # ========================================================================
+   # Raw payload
+   # ========================================================================
+  
+   def attach_response(self, response_data: Dict[str, Any], mode: str, spill_dir: str = DEFAULT_SPILL_DIR):
+       """
+       Keep the raw payload as ImageConfig.raw_response asks
+      
+       Args:
+           response_data: Parsed generateContent response
+           mode: "discard", "spill" or "keep"
+           spill_dir: Directory for spill files
+       """
+       if mode == "keep":
+           self._response = response_data
+       elif mode == "spill":
+           os.makedirs(spill_dir, exist_ok=True)
+           path = os.path.join(spill_dir, f"response_{uuid.uuid4().hex}.json")
+           with open(path, 'w', encoding='utf-8') as f:
+               json.dump(response_data, f, ensure_ascii=False)
+           self._spill_path = path
+  
+   @property
+   def spill_path(self) -> Optional[str]:
+       """File holding the raw payload (raw_response="spill"), if any"""
+       return self._spill_path
+  
+   def load_response(self) -> Optional[Dict[str, Any]]:
+       """
+       Get the raw payload (read from the spill file each time, not retained)
+      
+       Returns:
+           Response dict, or None if the call did not keep it
+       """
+       if self._response is not None:
+           return self._response
+       if self._spill_path is not None:
+           with open(self._spill_path, 'r', encoding='utf-8') as f:
+               return json.load(f)
+       return None
+  
+   def discard_response(self):
+       """Drop the raw payload and delete its spill file"""
+       self._response = None
+       if self._spill_path is not None:
+           try:
+               os.remove(self._spill_path)
+           except FileNotFoundError:
+               pass
+           self._spill_path = None
+  
+   @property
+   def response(self) -> Dict[str, Any]:
+       """Raw payload if kept, else just {"usageMetadata": ...}"""
+       response = self.load_response()
+       if response is None:
+           return {"usageMetadata": self.usage_metadata}
+       return response
+  
+   # ========================================================================
+   # Dict interface
+   # ========================================================================
+  
+   def keys(self) -> List[str]:
+       keys = ["success"]
+       keys.extend(field for field in self.FIELDS if getattr(self, field) is not None)
+       keys.append("response")
+       if self.source is not None:
+           keys.append(self.source)
+       return keys
+  
+   def __getitem__(self, key: str) -> Any:
+       if key == "success":
+           return True
+       if key == "response":
+           return self.response
+       if key in self.FIELDS:
+           value = getattr(self, key)
+           if value is not None:
+               return value
+       elif self.source is not None and key == self.source:
+           return True
+       raise KeyError(key)
+  
+   def __setitem__(self, key: str, value: Any):
+       if key not in self.FIELDS:
+           raise KeyError(f"{key} is not a GenerationResult field")
+       setattr(self, key, value)
+  
+   def __contains__(self, key: str) -> bool:
+       if key == "response":
+           # Without reading a spill file
+           return True
+       try:
+           self[key]
+       except KeyError:
+           return False
+       return True
+  
+   def __iter__(self) -> Iterator[str]:
+       return iter(self.keys())
+  
+   def get(self, key: str, default: Any = None) -> Any:
+       try:
+           return self[key]
+       except KeyError:
+           return default
+  
+   def items(self) -> List[Tuple[str, Any]]:
+       return [(key, self[key]) for key in self.keys()]
+  
+   def to_dict(self, include_response: bool = False) -> Dict[str, Any]:
+       """
+       Plain dict of the result (JSON-serializable)
+      
+       Args:
+           include_response: Add the raw payload under "response" (loaded
+               from the spill file if needed) instead of the usage stub
+       """
+       data = {key: self[key] for key in self.keys() if key != "response"}
+       data["response"] = self.response if include_response else {"usageMetadata": self.usage_metadata}
+       return data
+  
+   def __repr__(self) -> str:
+       paths = [image["file_path"] for image in self.generated_images]
+       return f"GenerationResult(prompt={self.prompt[:40]!r}, images={paths})"
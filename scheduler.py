@@ -0,0 +1,299 @@
+"""
+Rate-limit-aware request scheduler
+Token-bucket admission per model plus jittered exponential backoff retries
+"""
+
+
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+from config import (
+   DEFAULT_REQUESTS_PER_MINUTE,
+   DEFAULT_REQUEST_BURST,
+   MAX_RETRIES,
+   RETRY_BASE_DELAY,
+   RETRY_MAX_DELAY,
+   RETRYABLE_STATUS_CODES
+)
+from transport import TransportError
+
+
+
+
+class TokenBucket:
+   """
+   Thread-safe token bucket
+  
+   Tokens refill continuously at rate_per_minute up to burst. reserve()
+   takes a token immediately (the balance may go negative) and returns how
+   long the caller must wait before using it, so waiting happens outside
+   the lock and works for both threads and coroutines.
+   """
+  
+   def __init__(self, rate_per_minute: float, burst: int):
+       """
+       Initialize bucket
+      
+       Args:
+           rate_per_minute: Sustained admission rate
+           burst: Maximum tokens that can accumulate
+       """
+       self.rate = rate_per_minute / 60.0
+       self.burst = burst
+       self._tokens = float(burst)
+       self._updated = time.monotonic()
+       self._lock = threading.Lock()
+  
+   def reserve(self) -> float:
+       """
+       Reserve one token
+      
+       Returns:
+           Seconds to wait before the token may be used
+       """
+       with self._lock:
+           now = time.monotonic()
+           self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+           self._updated = now
+           self._tokens -= 1
+           if self._tokens >= 0:
+               return 0.0
+           return -self._tokens / self.rate
+
+
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+   """
+   Parse a Retry-After header (delta-seconds or HTTP-date)
+  
+   Returns:
+       Seconds to wait, or None if missing/invalid
+   """
+   if not value:
+       return None
+   try:
+       return max(0.0, float(value))
+   except ValueError:
+       pass
+   # HTTP-dates are rare; email.utils is only loaded for them
+   from email.utils import parsedate_to_datetime
+  
+   try:
+       retry_at = parsedate_to_datetime(value)
+   except (TypeError, ValueError):
+       return None
+   if retry_at.tzinfo is None:
+       retry_at = retry_at.replace(tzinfo=timezone.utc)
+   return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+
+
+class RequestScheduler:
+   """
+   Admission control and retries for API requests
+  
+   - One token bucket per model caps the request rate
+   - 429 / 5xx responses and connection errors are retried with full-jitter
+     exponential backoff, honoring Retry-After when the server sends it
+   - A 429 sets a cooldown shared by every worker using this scheduler, so
+     parallel callers back off together instead of stampeding
+  
+   Share one scheduler across all clients/threads hitting the same quota.
+   """
+  
+   def __init__(
+       self,
+       requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+       burst: int = DEFAULT_REQUEST_BURST,
+       max_retries: int = MAX_RETRIES,
+       base_delay: float = RETRY_BASE_DELAY,
+       max_delay: float = RETRY_MAX_DELAY,
+       model_limits: Optional[Dict[str, float]] = None
+   ):
+       """
+       Initialize scheduler
+      
+       Args:
+           requests_per_minute: Default per-model rate limit
+           burst: Requests allowed back-to-back before the rate applies
+           max_retries: Retries after the first attempt (0 disables retrying)
+           base_delay: Backoff base in seconds
+           max_delay: Backoff cap in seconds
+           model_limits: Optional per-model requests_per_minute overrides
+       """
+       self.requests_per_minute = requests_per_minute
+       self.burst = burst
+       self.max_retries = max_retries
+       self.base_delay = base_delay
+       self.max_delay = max_delay
+       self.model_limits = model_limits or {}
+      
+       self._buckets: Dict[str, TokenBucket] = {}
+       self._cooldown_until = 0.0
+       self._lock = threading.Lock()
+       self.stats = {
+           "requests": 0,
+           "attempts": 0,
+           "retries": 0,
+           "rate_limited": 0,
+           "server_errors": 0,
+           "connection_errors": 0,
+           "gave_up": 0,
+           "throttle_wait_seconds": 0.0,
+           "backoff_wait_seconds": 0.0
+       }
+  
+   def _bucket(self, model: str) -> TokenBucket:
+       with self._lock:
+           bucket = self._buckets.get(model)
+           if bucket is None:
+               rate = self.model_limits.get(model, self.requests_per_minute)
+               bucket = TokenBucket(rate, self.burst)
+               self._buckets[model] = bucket
+           return bucket
+  
+   def _count(self, key: str, amount: float = 1):
+       with self._lock:
+           self.stats[key] += amount
+  
+   def _cooldown_remaining(self) -> float:
+       """Seconds left in the shared rate-limit cooldown"""
+       with self._lock:
+           return max(0.0, self._cooldown_until - time.monotonic())
+  
+   def _retry_delay(self, error: TransportError, attempt: int) -> Optional[float]:
+       """
+       Decide whether to retry a failed attempt
+      
+       Returns:
+           Seconds to wait before retrying, or None to give up
+       """
+       status = error.status_code
+       if status is None:
+           self._count("connection_errors")
+       elif status == 429:
+           self._count("rate_limited")
+       elif status >= 500:
+           self._count("server_errors")
+      
+       if status is not None and status not in RETRYABLE_STATUS_CODES:
+           return None
+       if attempt >= self.max_retries:
+           return None
+      
+       retry_after = parse_retry_after(error.headers.get("Retry-After"))
+       if retry_after is not None:
+           delay = min(retry_after, self.max_delay)
+       else:
+           # Full jitter: uniform over [0, base * 2^attempt], capped
+           delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+      
+       if status == 429 or retry_after is not None:
+           # Make every worker sharing this scheduler wait it out
+           with self._lock:
+               self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+       return delay
+  
+   def call(self, model: str, send: Callable[[], Any]) -> Any:
+       """
+       Run send() under rate limiting with retries
+      
+       Args:
+           model: Model name (selects the token bucket)
+           send: Callable performing one HTTP attempt; raises TransportError on failure
+          
+       Returns:
+           Whatever send() returns
+          
+       Raises:
+           TransportError: If the request is not retryable or retries are exhausted
+       """
+       self._count("requests")
+       attempt = 0
+       while True:
+           # Wait out any shared cooldown (re-checked: it may be extended meanwhile)
+           cooldown = self._cooldown_remaining()
+           while cooldown > 0:
+               self._count("throttle_wait_seconds", cooldown)
+               time.sleep(cooldown)
+               cooldown = self._cooldown_remaining()
+          
+           wait = self._bucket(model).reserve()
+           if wait > 0:
+               self._count("throttle_wait_seconds", wait)
+               time.sleep(wait)
+          
+           self._count("attempts")
+           try:
+               return send()
+           except TransportError as e:
+               delay = self._retry_delay(e, attempt)
+               if delay is None:
+                   self._count("gave_up")
+                   if attempt == 0:
+                       raise
+                   raise TransportError(
+                       f"{e} (gave up after {attempt + 1} attempts)",
+                       e.status_code,
+                       e.headers,
+                       e.body
+                   ) from e
+          
+           attempt += 1
+           self._count("retries")
+           self._count("backoff_wait_seconds", delay)
+           time.sleep(delay)
+  
+   async def call_async(self, model: str, send: Callable[[], Awaitable[Any]]) -> Any:
+       """Coroutine version of call() for AsyncImageGenerationClient"""
+       import asyncio
+      
+       self._count("requests")
+       attempt = 0
+       while True:
+           # Wait out any shared cooldown (re-checked: it may be extended meanwhile)
+           cooldown = self._cooldown_remaining()
+           while cooldown > 0:
+               self._count("throttle_wait_seconds", cooldown)
+               await asyncio.sleep(cooldown)
+               cooldown = self._cooldown_remaining()
+          
+           wait = self._bucket(model).reserve()
+           if wait > 0:
+               self._count("throttle_wait_seconds", wait)
+               await asyncio.sleep(wait)
+          
+           self._count("attempts")
+           try:
+               return await send()
+           except TransportError as e:
+               delay = self._retry_delay(e, attempt)
+               if delay is None:
+                   self._count("gave_up")
+                   if attempt == 0:
+                       raise
+                   raise TransportError(
+                       f"{e} (gave up after {attempt + 1} attempts)",
+                       e.status_code,
+                       e.headers,
+                       e.body
+                   ) from e
+          
+           attempt += 1
+           self._count("retries")
+           self._count("backoff_wait_seconds", delay)
+           await asyncio.sleep(delay)
+  
+   def get_stats(self) -> Dict[str, Any]:
+       """Get scheduler counters"""
+       with self._lock:
+           stats = dict(self.stats)
+       stats["throttle_wait_seconds"] = round(stats["throttle_wait_seconds"], 3)
+       stats["backoff_wait_seconds"] = round(stats["backoff_wait_seconds"], 3)
+       return stats
@@ -0,0 +1,194 @@
+"""
+Indexed catalog of session summaries
+One SQLite table kept up to date on save, so listing, counting and cleanup never open session folders
+"""
+
+
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional
+
+
+from config import SESSION_CATALOG_FILE
+
+
+if TYPE_CHECKING:
+   # sqlite3 is imported when the catalog is first queried
+   import sqlite3
+
+
+
+
+# Summary fields stored per session (session_path is derived from the directory)
+SUMMARY_FIELDS = (
+   "session_id",
+   "created_at",
+   "last_updated",
+   "generation_count",
+   "message_count",
+   "generated_images_count",
+   "reference_images_count"
+)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+   session_id TEXT PRIMARY KEY,
+   created_at TEXT,
+   last_updated TEXT,
+   generation_count INTEGER NOT NULL DEFAULT 0,
+   message_count INTEGER NOT NULL DEFAULT 0,
+   generated_images_count INTEGER NOT NULL DEFAULT 0,
+   reference_images_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS sessions_last_updated ON sessions (last_updated);
+"""
+
+
+
+
+class SessionCatalog:
+   """
+   Summary row per session in <session_dir>/catalog.sqlite3
+  
+   Session.save() upserts the session's summary, so list/count/cleanup
+   are index queries instead of loading every session. The catalog is
+   derived data: it runs in WAL mode without fsync on every write, and
+   rebuild() recreates it from the session folders (done automatically
+   when the file is new, e.g. for sessions saved by older versions).
+   Safe to share across threads; other processes see committed rows.
+   """
+  
+   def __init__(self, session_dir: str, filename: str = SESSION_CATALOG_FILE):
+       """
+       Initialize catalog
+      
+       Args:
+           session_dir: Directory holding the session folders
+           filename: Catalog file name inside session_dir
+       """
+       self.session_dir = session_dir
+       self.path = os.path.join(session_dir, filename)
+       self._connection: Optional["sqlite3.Connection"] = None
+       self._lock = threading.Lock()
+  
+   @property
+   def connection(self) -> "sqlite3.Connection":
+       """SQLite connection (opened on first use; a new catalog is built from the session folders)"""
+       with self._lock:
+           if self._connection is None:
+               import sqlite3
+              
+               os.makedirs(self.session_dir, exist_ok=True)
+               is_new = not os.path.exists(self.path)
+               connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+               connection.execute("PRAGMA journal_mode=WAL")
+               connection.execute("PRAGMA synchronous=NORMAL")
+               connection.executescript(SCHEMA)
+               self._connection = connection
+               if is_new:
+                   self._rebuild_locked()
+           return self._connection
+  
+   def _row_to_summary(self, row: Iterable[Any]) -> Dict[str, Any]:
+       summary = dict(zip(SUMMARY_FIELDS, row))
+       summary["session_path"] = os.path.join(self.session_dir, summary["session_id"])
+       return summary
+  
+   def upsert(self, summary: Dict[str, Any]):
+       """Insert or replace a session's row from Session.get_summary()"""
+       values = tuple(summary.get(field) for field in SUMMARY_FIELDS)
+       connection = self.connection
+       with self._lock, connection:
+           connection.execute(
+               f"INSERT OR REPLACE INTO sessions ({', '.join(SUMMARY_FIELDS)}) "
+               f"VALUES ({', '.join('?' for _ in SUMMARY_FIELDS)})",
+               values
+           )
+  
+   def delete(self, session_ids: Iterable[str]):
+       """Remove rows"""
+       connection = self.connection
+       with self._lock, connection:
+           connection.executemany("DELETE FROM sessions WHERE session_id = ?", [(sid,) for sid in session_ids])
+  
+   def list_summaries(self, limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+       """
+       Session summaries, most recently updated first
+      
+       Args:
+           limit: Maximum rows (all if None)
+           offset: Rows to skip (for paging)
+       """
+       connection = self.connection
+       with self._lock:
+           rows = connection.execute(
+               f"SELECT {', '.join(SUMMARY_FIELDS)} FROM sessions "
+               "ORDER BY last_updated DESC LIMIT ? OFFSET ?",
+               (-1 if limit is None else limit, offset)
+           ).fetchall()
+       return [self._row_to_summary(row) for row in rows]
+  
+   def count(self) -> int:
+       """Number of sessions"""
+       connection = self.connection
+       with self._lock:
+           return connection.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+  
+   def updated_before(self, cutoff: str) -> List[str]:
+       """
+       Sessions last updated before cutoff
+      
+       Args:
+           cutoff: ISO timestamp (same format as metadata["last_updated"])
+          
+       Returns:
+           Session IDs (sessions without last_updated are never included)
+       """
+       connection = self.connection
+       with self._lock:
+           rows = connection.execute(
+               "SELECT session_id FROM sessions WHERE last_updated < ?", (cutoff,)
+           ).fetchall()
+       return [row[0] for row in rows]
+  
+   def rebuild(self) -> int:
+       """
+       Recreate the catalog from the session folders (loads every session once)
+      
+       Returns:
+           Number of sessions catalogued
+       """
+       self.connection
+       with self._lock:
+           return self._rebuild_locked()
+  
+   def _rebuild_locked(self) -> int:
+       # Imported here: session_manager imports this module
+       from session_manager import Session, SNAPSHOT_FILE
+      
+       summaries = []
+       for session_id in os.listdir(self.session_dir):
+           session_path = os.path.join(self.session_dir, session_id)
+           if not os.path.exists(os.path.join(session_path, SNAPSHOT_FILE)):
+               continue
+           try:
+               summaries.append(Session.load(session_id, self.session_dir).get_summary())
+           except Exception:
+               continue
+      
+       with self._connection:
+           self._connection.execute("DELETE FROM sessions")
+           self._connection.executemany(
+               f"INSERT INTO sessions ({', '.join(SUMMARY_FIELDS)}) "
+               f"VALUES ({', '.join('?' for _ in SUMMARY_FIELDS)})",
+               [tuple(summary.get(field) for field in SUMMARY_FIELDS) for summary in summaries]
+           )
+       return len(summaries)
+  
+   def close(self):
+       """Close the connection"""
+       with self._lock:
+           if self._connection is not None:
+               self._connection.close()
+               self._connection = None
@@ -1,34 +1,100 @@
 """
 Session Manager for maintaining context across image generations
 Enables character consistency and multi-step workflows
+
+Each session folder holds a session.json snapshot and append-only
+journal-<first sequence>.jsonl segments of the changes made since.
+Saving appends the new events; the journal is folded into the snapshot
+in the background every SESSION_JOURNAL_COMPACT_EVENTS events.
 """
 
 
 import json
 import os
 import shutil
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import Deque, List, Dict, Any, Optional
 from uuid import uuid4
 
 
 from config import (
    DEFAULT_SESSIONS_DIR,
    SESSION_ID_LENGTH,
+   SESSION_JOURNAL_COMPACT_EVENTS,
+   SESSION_JOURNAL_FSYNC,
+   USE_SESSION_CATALOG,
    SessionConfig
 )
+from session_catalog import SessionCatalog
+
+
+
+
+SNAPSHOT_FILE = "session.json"
+JOURNAL_PREFIX = "journal-"
+JOURNAL_SUFFIX = ".jsonl"
+
+
+_compaction_executor: Optional[ThreadPoolExecutor] = None
+_compaction_lock = threading.Lock()
+
+
+
+
+def _get_compaction_executor() -> ThreadPoolExecutor:
+   """Single background thread folding journals into snapshots (started on first use)"""
+   global _compaction_executor
+   if _compaction_executor is None:
+       with _compaction_lock:
+           if _compaction_executor is None:
+               _compaction_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-compact")
+   return _compaction_executor
+
+
+
+
+def _journal_name(first_sequence: int) -> str:
+   return f"{JOURNAL_PREFIX}{first_sequence:010d}{JOURNAL_SUFFIX}"
+
+
+
+
+def _journal_segments(session_path: str) -> List[str]:
+   """Journal segment paths of a session, oldest first"""
+   try:
+       names = os.listdir(session_path)
+   except FileNotFoundError:
+       return []
+   return [
+       os.path.join(session_path, name)
+       for name in sorted(names)
+       if name.startswith(JOURNAL_PREFIX) and name.endswith(JOURNAL_SUFFIX)
+   ]
 
 
 
 
 class Session:
-   """Represents a generation session with history and context"""
+   """
+   Represents a generation session with history and context
+  
+   Changes are recorded as events (message, image, reference, metadata)
+   and save() appends the ones not yet persisted to the session journal
+   in a single O_APPEND write, so saving costs the same however long the
+   session is and a crash can at worst lose the line being written.
+   History is a deque bounded to max_history * 2 messages (unbounded
+   when max_history is 0).
+   """
   
    def __init__(
        self,
        session_id: str,
        config: Optional[SessionConfig] = None,
-       session_dir: str = DEFAULT_SESSIONS_DIR
+       session_dir: str = DEFAULT_SESSIONS_DIR,
+       catalog: Optional[SessionCatalog] = None
    ):
        """
        Initialize a session
@@ -37,14 +103,17 @@ class Session:
            session_id: Unique session identifier
            config: Session configuration
            session_dir: Base directory for sessions
+           catalog: Optional SessionCatalog updated on every save
        """
        self.session_id = session_id
+       self.catalog = catalog
        self.config = config or SessionConfig()
        self.session_dir = session_dir
        self.session_path = os.path.join(session_dir, session_id)
       
        # Session data
-       self.messages: List[Dict[str, Any]] = []
+       # *2 for user+assistant pairs; max_history=0 keeps every message
+       self.messages: Deque[Dict[str, Any]] = deque(maxlen=self.config.max_history * 2 or None)
        self.generated_images: List[str] = []
        self.reference_images: List[str] = []
        self.metadata: Dict[str, Any] = {
@@ -53,25 +122,31 @@ class Session:
            "generation_count": 0
        }
       
-       # Create session directory
+       # Journal state
+       self._lock = threading.RLock()
+       self._pending: List[Dict[str, Any]] = []
+       self._saved_metadata: Dict[str, Any] = {}
+       self._sequence = 0              # Last event written to the journal
+       self._journal_events = 0        # Events written since the last compaction
+       self._journal_path: Optional[str] = None
+       self._has_snapshot = False
+       self._compaction: Optional[Future] = None
+      
+       # Create session directory (its images and references folders are
+       # created when the first file is copied into them)
        os.makedirs(self.session_path, exist_ok=True)
-       os.makedirs(os.path.join(self.session_path, "images"), exist_ok=True)
-       os.makedirs(os.path.join(self.session_path, "references"), exist_ok=True)
   
    def add_message(self, role: str, content: str):
-       """Add message to conversation history"""
+       """Add message to conversation history (the oldest drops out past max_history)"""
        message = {
            "role": role,
            "content": content,
            "timestamp": datetime.now().isoformat()
        }
-       self.messages.append(message)
-      
-       # Trim history if needed
-       if len(self.messages) > self.config.max_history * 2:  # *2 for user+assistant pairs
-           self.messages = self.messages[-(self.config.max_history * 2):]
-      
-       self.metadata["last_updated"] = datetime.now().isoformat()
+       with self._lock:
+           self.messages.append(message)
+           self._pending.append({"type": "message", **message})
+           self.metadata["last_updated"] = message["timestamp"]
   
    def add_generated_image(self, image_path: str, copy_to_session: bool = True) -> str:
        """
@@ -88,12 +163,14 @@ class Session:
            # Copy to session images folder
            filename = os.path.basename(image_path)
            session_image_path = os.path.join(self.session_path, "images", filename)
+           os.makedirs(os.path.dirname(session_image_path), exist_ok=True)
            shutil.copy2(image_path, session_image_path)
-           self.generated_images.append(session_image_path)
-           return session_image_path
-       else:
+           image_path = session_image_path
+      
+       with self._lock:
            self.generated_images.append(image_path)
-           return image_path
+           self._pending.append({"type": "image", "path": image_path})
+       return image_path
   
    def add_reference_image(self, image_path: str) -> str:
        """
@@ -114,12 +191,14 @@ class Session:
                "references",
                f"{timestamp}_{filename}"
            )
+           os.makedirs(os.path.dirname(session_ref_path), exist_ok=True)
            shutil.copy2(image_path, session_ref_path)
-           self.reference_images.append(session_ref_path)
-           return session_ref_path
-       else:
+           image_path = session_ref_path
+      
+       with self._lock:
            self.reference_images.append(image_path)
-           return image_path
+           self._pending.append({"type": "reference", "path": image_path})
+       return image_path
   
    def get_messages_for_api(self) -> List[Dict[str, str]]:
        """
@@ -139,48 +218,228 @@ class Session:
   
    def increment_generation_count(self):
        """Increment generation counter"""
-       self.metadata["generation_count"] += 1
-       self.metadata["last_updated"] = datetime.now().isoformat()
+       with self._lock:
+           self.metadata["generation_count"] += 1
+           self.metadata["last_updated"] = datetime.now().isoformat()
   
-   def save(self):
-       """Save session data to disk"""
-       session_data = {
+   # ========================================================================
+   # Persistence
+   # ========================================================================
+  
+   def _config_data(self) -> Dict[str, Any]:
+       return {
+           "max_history": self.config.max_history,
+           "save_references": self.config.save_references,
+           "auto_cleanup": self.config.auto_cleanup,
+           "timeout_hours": self.config.timeout_hours
+       }
+  
+   def _snapshot_data(self) -> Dict[str, Any]:
+       """Full session state as of self._sequence (call with the lock held)"""
+       return {
            "session_id": self.session_id,
-           "messages": self.messages,
-           "generated_images": self.generated_images,
-           "reference_images": self.reference_images,
-           "metadata": self.metadata,
-           "config": {
-               "max_history": self.config.max_history,
-               "save_references": self.config.save_references,
-               "auto_cleanup": self.config.auto_cleanup,
-               "timeout_hours": self.config.timeout_hours
-           }
+           "messages": list(self.messages),
+           "generated_images": list(self.generated_images),
+           "reference_images": list(self.reference_images),
+           "metadata": dict(self.metadata),
+           "config": self._config_data(),
+           "journal_sequence": self._sequence
        }
-      
-       session_file = os.path.join(self.session_path, "session.json")
-       with open(session_file, 'w') as f:
+  
+   def _write_snapshot(self, session_data: Dict[str, Any]):
+       """Replace session.json atomically (never leaves a truncated file)"""
+       session_file = os.path.join(self.session_path, SNAPSHOT_FILE)
+       temp_file = f"{session_file}.{uuid4().hex[:8]}.tmp"
+       with open(temp_file, 'w', encoding='utf-8') as f:
            json.dump(session_data, f, indent=2)
+           f.flush()
+           os.fsync(f.fileno())
+       os.replace(temp_file, session_file)
+  
+   def _metadata_changes(self) -> Dict[str, Any]:
+       """Metadata keys changed since the last save (call with the lock held)"""
+       return {
+           key: value
+           for key, value in self.metadata.items()
+           if key not in self._saved_metadata or self._saved_metadata[key] != value
+       }
+  
+   def save(self):
+       """
+       Persist changes made since the last save
+      
+       A new session writes its session.json snapshot; afterwards only the
+       new events are appended to the journal. Once the journal holds
+       SESSION_JOURNAL_COMPACT_EVENTS events it is compacted in the
+       background. The catalog row, if any, is updated.
+       """
+       with self._lock:
+           self._flush()
+           if self._journal_events >= SESSION_JOURNAL_COMPACT_EVENTS:
+               self.compact(background=True)
+           summary = self.get_summary()
+       if self.catalog is not None:
+           self.catalog.upsert(summary)
+  
+   def _flush(self):
+       """Write pending events (call with the lock held)"""
+       if not self._has_snapshot:
+           self._pending.clear()
+           self._write_snapshot(self._snapshot_data())
+           self._saved_metadata = dict(self.metadata)
+           self._has_snapshot = True
+           return
+      
+       changes = self._metadata_changes()
+       if changes:
+           self._pending.append({"type": "metadata", "values": changes})
+           self._saved_metadata = dict(self.metadata)
+       if not self._pending:
+           return
+      
+       lines = []
+       for event in self._pending:
+           self._sequence += 1
+           lines.append(json.dumps({"seq": self._sequence, **event}, ensure_ascii=False))
+       if self._journal_path is None:
+           self._journal_path = os.path.join(
+               self.session_path,
+               _journal_name(self._sequence - len(lines) + 1)
+           )
+       self._append(("\n".join(lines) + "\n").encode("utf-8"))
+       self._journal_events += len(lines)
+       self._pending.clear()
+  
+   def _append(self, data: bytes):
+       """Append whole lines with one write to an O_APPEND descriptor"""
+       fd = os.open(self._journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+       try:
+           written = os.write(fd, data)
+           while written < len(data):
+               written += os.write(fd, data[written:])
+           if SESSION_JOURNAL_FSYNC:
+               os.fsync(fd)
+       finally:
+           os.close(fd)
+  
+   def compact(self, background: bool = False) -> Optional[Future]:
+       """
+       Fold the journal into the session.json snapshot
+      
+       Unsaved changes are saved first. The state is captured and later
+       events go to a new journal segment; the snapshot is written
+       (atomically) and the folded segments are deleted afterwards, so a
+       crash at any point leaves a loadable session.
+      
+       Args:
+           background: Write the snapshot on the compaction thread
+          
+       Returns:
+           Future of the background compaction (None if run inline or
+           if a compaction of this session is already running)
+       """
+       with self._lock:
+           if self._compaction is not None and not self._compaction.done():
+               return None
+           self._flush()
+           session_data = self._snapshot_data()
+           folded = self._sequence
+           # Later events start a new segment
+           self._journal_path = None
+           self._journal_events = 0
+           if background:
+               self._compaction = _get_compaction_executor().submit(self._finish_compaction, session_data, folded)
+               self._compaction.add_done_callback(self._compaction_done)
+               return self._compaction
+       self._finish_compaction(session_data, folded)
+       return None
+  
+   def _finish_compaction(self, session_data: Dict[str, Any], folded: int):
+       """Write the snapshot, then drop the segments whose events it includes"""
+       self._write_snapshot(session_data)
+       for path in _journal_segments(self.session_path):
+           first = int(os.path.basename(path)[len(JOURNAL_PREFIX):-len(JOURNAL_SUFFIX)])
+           if first <= folded:
+               try:
+                   os.remove(path)
+               except FileNotFoundError:
+                   pass
+  
+   def _compaction_done(self, compaction: Future):
+       """Report a failed background compaction and retry it on the next save"""
+       if compaction.cancelled() or compaction.exception() is None:
+           return
+       print(f"⚠️  Compaction of session {self.session_id} failed: {compaction.exception()}")
+       with self._lock:
+           # The segments it would have folded are still on disk, so the
+           # session loads as before; the next save compacts again
+           self._journal_events = max(self._journal_events, SESSION_JOURNAL_COMPACT_EVENTS)
+  
+   def wait_for_compaction(self):
+       """Block until a background compaction of this session has finished"""
+       compaction = self._compaction
+       if compaction is not None:
+           compaction.result()
+  
+   def _apply(self, event: Dict[str, Any]):
+       """Replay one journal event"""
+       event_type = event.get("type")
+       if event_type == "message":
+           self.messages.append({
+               "role": event["role"],
+               "content": event["content"],
+               "timestamp": event["timestamp"]
+           })
+       elif event_type == "image":
+           self.generated_images.append(event["path"])
+       elif event_type == "reference":
+           self.reference_images.append(event["path"])
+       elif event_type == "metadata":
+           self.metadata.update(event["values"])
+  
+   def _replay(self):
+       """Apply journal events newer than the snapshot, continuing in the last segment"""
+       for path in _journal_segments(self.session_path):
+           with open(path, 'rb') as f:
+               data = f.read()
+           complete = data.rfind(b"\n") + 1
+           if complete < len(data):
+               # Drop a line cut short by a crash mid-append
+               os.truncate(path, complete)
+           for line in data[:complete].splitlines():
+               event = json.loads(line)
+               if event["seq"] <= self._sequence:
+                   continue
+               self._apply(event)
+               self._sequence = event["seq"]
+               self._journal_events += 1
+           self._journal_path = path
   
    @classmethod
-   def load(cls, session_id: str, session_dir: str = DEFAULT_SESSIONS_DIR) -> 'Session':
+   def load(
+       cls,
+       session_id: str,
+       session_dir: str = DEFAULT_SESSIONS_DIR,
+       catalog: Optional[SessionCatalog] = None
+   ) -> 'Session':
        """
-       Load session from disk
+       Load session from disk (snapshot plus journal replay)
       
        Args:
            session_id: Session identifier
            session_dir: Base directory for sessions
+           catalog: Optional SessionCatalog updated on every save
           
        Returns:
            Loaded Session object
        """
        session_path = os.path.join(session_dir, session_id)
-       session_file = os.path.join(session_path, "session.json")
+       session_file = os.path.join(session_path, SNAPSHOT_FILE)
       
        if not os.path.exists(session_file):
            raise FileNotFoundError(f"Session not found: {session_id}")
       
-       with open(session_file, 'r') as f:
+       with open(session_file, 'r', encoding='utf-8') as f:
            data = json.load(f)
       
        # Recreate config
@@ -188,11 +447,15 @@ class Session:
        config = SessionConfig(**config_data)
       
        # Create session
-       session = cls(session_id, config, session_dir)
-       session.messages = data.get("messages", [])
+       session = cls(session_id, config, session_dir, catalog)
+       session.messages.extend(data.get("messages", []))
        session.generated_images = data.get("generated_images", [])
        session.reference_images = data.get("reference_images", [])
        session.metadata = data.get("metadata", session.metadata)
+       session._sequence = data.get("journal_sequence", 0)
+       session._has_snapshot = True
+       session._replay()
+       session._saved_metadata = dict(session.metadata)
       
        return session
   
@@ -213,17 +476,26 @@ class Session:
 
 
 class SessionManager:
-   """Manages multiple sessions"""
+   """
+   Manages multiple sessions
   
-   def __init__(self, session_dir: str = DEFAULT_SESSIONS_DIR):
+   With the catalog on (USE_SESSION_CATALOG), every save updates the
+   session's row in <session_dir>/catalog.sqlite3, and listing, counting
+   and age-based cleanup query it instead of loading each session.
+   Sessions changed by other tools can be picked up with rebuild_catalog().
+   """
+  
+   def __init__(self, session_dir: str = DEFAULT_SESSIONS_DIR, use_catalog: bool = USE_SESSION_CATALOG):
        """
        Initialize session manager
       
        Args:
            session_dir: Base directory for sessions
+           use_catalog: Keep session summaries in an SQLite catalog
        """
        self.session_dir = session_dir
        os.makedirs(session_dir, exist_ok=True)
+       self.catalog = SessionCatalog(session_dir) if use_catalog else None
   
    def create_session(
        self,
@@ -244,7 +516,7 @@ class SessionManager:
            # Generate unique session ID
            session_id = str(uuid4())[:SESSION_ID_LENGTH]
       
-       session = Session(session_id, config, self.session_dir)
+       session = Session(session_id, config, self.session_dir, self.catalog)
        session.save()
       
        return session
@@ -259,15 +531,10 @@ class SessionManager:
        Returns:
            Loaded Session object
        """
-       return Session.load(session_id, self.session_dir)
+       return Session.load(session_id, self.session_dir, self.catalog)
   
-   def list_sessions(self) -> List[Dict[str, Any]]:
-       """
-       List all available sessions
-      
-       Returns:
-           List of session summaries
-       """
+   def _scan_sessions(self) -> List[Dict[str, Any]]:
+       """Summaries of every session folder (loads each session)"""
        sessions = []
       
        if not os.path.exists(self.session_dir):
@@ -275,20 +542,35 @@ class SessionManager:
       
        for session_id in os.listdir(self.session_dir):
            session_path = os.path.join(self.session_dir, session_id)
-           session_file = os.path.join(session_path, "session.json")
+           session_file = os.path.join(session_path, SNAPSHOT_FILE)
           
            if os.path.isdir(session_path) and os.path.exists(session_file):
                try:
-                   session = self.load_session(session_id)
+                   session = Session.load(session_id, self.session_dir)
                    sessions.append(session.get_summary())
                except Exception:
                    continue
       
        # Sort by last updated
-       sessions.sort(key=lambda x: x.get("last_updated", ""), reverse=True)
+       sessions.sort(key=lambda x: x.get("last_updated") or "", reverse=True)
       
        return sessions
   
+   def list_sessions(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+       """
+       List available sessions, most recently updated first
+      
+       Args:
+           limit: Maximum sessions returned (all if None)
+          
+       Returns:
+           List of session summaries
+       """
+       if self.catalog is not None:
+           return self.catalog.list_summaries(limit)
+       sessions = self._scan_sessions()
+       return sessions if limit is None else sessions[:limit]
+  
    def delete_session(self, session_id: str):
        """
        Delete session and all associated files
@@ -300,6 +582,8 @@ class SessionManager:
       
        if os.path.exists(session_path):
            shutil.rmtree(session_path)
+       if self.catalog is not None:
+           self.catalog.delete([session_id])
   
    def cleanup_old_sessions(self, hours: int = 24):
        """
@@ -309,24 +593,42 @@ class SessionManager:
            hours: Age threshold in hours
        """
        cutoff_time = datetime.now() - timedelta(hours=hours)
-       deleted_count = 0
       
-       for session_summary in self.list_sessions():
-           last_updated_str = session_summary.get("last_updated")
-           if last_updated_str:
-               last_updated = datetime.fromisoformat(last_updated_str)
-               if last_updated < cutoff_time:
-                   self.delete_session(session_summary["session_id"])
-                   deleted_count += 1
+       if self.catalog is not None:
+           session_ids = self.catalog.updated_before(cutoff_time.isoformat())
+       else:
+           session_ids = [
+               summary["session_id"]
+               for summary in self._scan_sessions()
+               if summary.get("last_updated")
+               and datetime.fromisoformat(summary["last_updated"]) < cutoff_time
+           ]
+      
+       for session_id in session_ids:
+           session_path = os.path.join(self.session_dir, session_id)
+           if os.path.exists(session_path):
+               shutil.rmtree(session_path)
+       if self.catalog is not None:
+           self.catalog.delete(session_ids)
       
-       return deleted_count
+       return len(session_ids)
   
    def get_session_count(self) -> int:
        """Get total number of sessions"""
-       return len(self.list_sessions())
-
-
-
-
-
-
+       if self.catalog is not None:
+           return self.catalog.count()
+       return len(self._scan_sessions())
+  
+   def rebuild_catalog(self) -> int:
+       """
+       Rebuild the catalog from the session folders
+      
+       Returns:
+           Number of sessions catalogued (0 without a catalog)
+       """
+       return self.catalog.rebuild() if self.catalog is not None else 0
+  
+   def close(self):
+       """Close the catalog connection"""
+       if self.catalog is not None:
+           self.catalog.close()
@@ -0,0 +1,140 @@
+"""
+Single-flight de-duplication of identical in-flight requests
+Concurrent callers with the same key share one execution and its result
+"""
+
+
+import threading
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Tuple
+
+
+if TYPE_CHECKING:
+   # asyncio is imported by the async methods when first used
+   import asyncio
+
+
+
+
+class _Call:
+   """One in-flight execution that followers wait on"""
+  
+   def __init__(self):
+       self.done = threading.Event()
+       self.result: Any = None
+       self.error: BaseException = None
+
+
+
+
+class SingleFlight:
+   """
+   Coalesce concurrent calls that share a key
+  
+   The first caller for a key (the leader) runs the function; callers
+   arriving while it is in flight wait and receive the same result, or
+   the same exception. Once the call finishes the key is forgotten, so
+   later calls run again. Thread and asyncio callers are tracked
+   separately; share one instance between clients to coalesce across them.
+   """
+  
+   def __init__(self):
+       self._calls: Dict[str, _Call] = {}
+       self._async_calls: Dict[str, "asyncio.Future"] = {}
+       self._lock = threading.Lock()
+       self.stats = {
+           "calls": 0,
+           "executions": 0,
+           "coalesced": 0
+       }
+  
+   def do(self, key: str, func: Callable[[], Any]) -> Tuple[Any, bool]:
+       """
+       Run func once for all concurrent callers with the same key
+      
+       Args:
+           key: Request fingerprint
+           func: Callable performing the request
+          
+       Returns:
+           Tuple of (result, shared) where shared is True for followers
+          
+       Raises:
+           Whatever func raised, in the leader and every follower
+       """
+       with self._lock:
+           self.stats["calls"] += 1
+           call = self._calls.get(key)
+           if call is not None:
+               self.stats["coalesced"] += 1
+               leader = False
+           else:
+               call = _Call()
+               self._calls[key] = call
+               self.stats["executions"] += 1
+               leader = True
+      
+       if not leader:
+           call.done.wait()
+           if call.error is not None:
+               raise call.error
+           return call.result, True
+      
+       try:
+           call.result = func()
+       except BaseException as e:
+           call.error = e
+           raise
+       finally:
+           with self._lock:
+               del self._calls[key]
+           call.done.set()
+       return call.result, False
+  
+   async def do_async(self, key: str, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+       """Coroutine version of do() for AsyncImageGenerationClient"""
+       import asyncio
+      
+       with self._lock:
+           self.stats["calls"] += 1
+           future = self._async_calls.get(key)
+           leader = future is None
+           if leader:
+               future = asyncio.get_running_loop().create_future()
+               self._async_calls[key] = future
+               self.stats["executions"] += 1
+           else:
+               self.stats["coalesced"] += 1
+      
+       if not leader:
+           # Shield so a cancelled follower does not cancel the shared call
+           try:
+               return await asyncio.shield(future), True
+           except asyncio.CancelledError:
+               if not future.cancelled():
+                   raise
+           # The leader itself was cancelled: run again instead of failing
+           return await self.do_async(key, func)
+      
+       try:
+           result = await func()
+       except asyncio.CancelledError:
+           future.cancel()
+           raise
+       except BaseException as e:
+           future.set_exception(e)
+           # Mark retrieved so a future nobody awaited does not log a warning
+           future.exception()
+           raise
+       else:
+           future.set_result(result)
+       finally:
+           with self._lock:
+               del self._async_calls[key]
+       return result, False
+  
+   def get_stats(self) -> Dict[str, Any]:
+       """Get coalescing counters"""
+       with self._lock:
+           stats = dict(self.stats)
+           stats["in_flight"] = len(self._calls) + len(self._async_calls)
+       return stats
@@ -0,0 +1,16 @@
+"""
+Small statistics helpers shared by hedging, metrics and benchmarks
+"""
+
+
+import math
+from typing import List
+
+
+
+
+def percentile(values: List[float], fraction: float) -> float:
+   """Nearest-rank percentile of a non-empty list"""
+   ordered = sorted(values)
+   index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+   return ordered[index]
@@ -0,0 +1,239 @@
+"""
+Streaming decoder for generateContent responses
+Writes inlineData images straight to disk while the response downloads
+"""
+
+
+import base64
+import json
+import os
+import tempfile
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+
+
+# Keys whose object value holds image bytes in "data"
+INLINE_DATA_KEYS = ("inlineData", "inline_data")
+
+# Bytes buffered at the start of a data value to detect a data URL prefix
+_DATA_URL_PROBE = 64
+
+
+
+
+class InlineDataStreamDecoder:
+   """
+   Incremental scanner that pulls inlineData images out of a JSON body
+  
+   Feed raw response chunks with feed(). Every
+   candidates[].content.parts[].inlineData.data string is base64-decoded
+   in blocks directly into its own temp file, so only one chunk of the
+   image is held in memory at a time. Everything else in the body is kept
+   as a small "skeleton" (data strings replaced by "") that finish()
+   parses into the usual response dict.
+  
+   Usage:
+       decoder = InlineDataStreamDecoder(temp_dir)
+       for chunk in response.iter_chunks():
+           decoder.feed(chunk)
+       response_data, image_files = decoder.finish()
+   """
+  
+   def __init__(self, temp_dir: str):
+       """
+       Initialize decoder
+      
+       Args:
+           temp_dir: Directory for the decoded image files (use the output
+               directory so files can later be renamed into place)
+       """
+       self.temp_dir = temp_dir
+       self.image_files: List[str] = []
+      
+       self._skeleton = bytearray()
+       self._key_stack: List[Optional[str]] = []
+       self._in_string = False
+       self._escape = False
+       self._string_buf = bytearray()
+       self._last_string: Optional[str] = None
+       self._current_key: Optional[str] = None
+       self._await_data_value = False
+      
+       # Data-value state
+       self._in_data = False
+       self._data_file = None
+       self._carry = b""
+       self._pending_backslash = False
+       self._probing = False
+  
+   def feed(self, chunk: bytes):
+       """Consume the next chunk of the response body"""
+       pos = 0
+       length = len(chunk)
+       while pos < length:
+           if self._in_data:
+               pos = self._feed_data(chunk, pos)
+           else:
+               pos = self._feed_json(chunk, pos)
+  
+   def finish(self) -> Tuple[Dict[str, Any], List[str]]:
+       """
+       Complete decoding
+      
+       Returns:
+           Tuple of (response dict without image bytes, decoded image file paths
+           in document order)
+          
+       Raises:
+           ValueError: If the body ended in the middle of an image or is not valid JSON
+       """
+       if self._in_data:
+           self.abort()
+           raise ValueError("Response ended inside inlineData")
+       try:
+           response_data = json.loads(bytes(self._skeleton))
+       except ValueError:
+           self.abort()
+           raise
+       return response_data, self.image_files
+  
+   def abort(self):
+       """Close and remove any partially written files"""
+       if self._data_file is not None:
+           self._data_file.close()
+           self._data_file = None
+       for path in self.image_files:
+           if os.path.exists(path):
+               os.remove(path)
+  
+   def _feed_json(self, chunk: bytes, pos: int) -> int:
+       """Tokenize non-image JSON until an inlineData.data value starts"""
+       skeleton = self._skeleton
+       for index in range(pos, len(chunk)):
+           byte = chunk[index]
+           skeleton.append(byte)
+          
+           if self._in_string:
+               if self._escape:
+                   self._escape = False
+                   self._string_buf.append(byte)
+               elif byte == 0x5C:  # backslash
+                   self._escape = True
+                   self._string_buf.append(byte)
+               elif byte == 0x22:  # closing quote
+                   self._in_string = False
+                   self._last_string = self._string_buf.decode("utf-8", "replace")
+               else:
+                   self._string_buf.append(byte)
+               continue
+          
+           if byte == 0x22:  # opening quote
+               if self._await_data_value:
+                   # Start of inlineData.data: stream the value to disk
+                   self._await_data_value = False
+                   self._start_data()
+                   return index + 1
+               self._in_string = True
+               self._string_buf = bytearray()
+               self._last_string = None
+           elif byte == 0x3A:  # colon: last string was a key
+               self._current_key = self._last_string
+               parent = self._key_stack[-1] if self._key_stack else None
+               self._await_data_value = self._current_key == "data" and parent in INLINE_DATA_KEYS
+           elif byte == 0x7B:  # {
+               self._key_stack.append(self._current_key)
+               self._current_key = None
+           elif byte == 0x7D:  # }
+               if self._key_stack:
+                   self._key_stack.pop()
+               self._current_key = None
+           elif byte == 0x5B:  # [ (array elements inherit the array's key)
+               self._key_stack.append(self._current_key)
+           elif byte == 0x5D:  # ]
+               if self._key_stack:
+                   self._current_key = self._key_stack.pop()
+           elif byte not in b" \t\r\n,":
+               self._await_data_value = False
+       return len(chunk)
+  
+   def _start_data(self):
+       """Open a temp file for the next image"""
+       fd, path = tempfile.mkstemp(dir=self.temp_dir, prefix=".stream_", suffix=".part")
+       self._data_file = os.fdopen(fd, "wb")
+       self.image_files.append(path)
+       self._in_data = True
+       self._carry = b""
+       self._pending_backslash = False
+       self._probing = True
+  
+   def _feed_data(self, chunk: bytes, pos: int) -> int:
+       """Decode base64 bytes of the current data value up to its closing quote"""
+       end = chunk.find(b'"', pos)
+       segment = chunk[pos:] if end == -1 else chunk[pos:end]
+       self._write_base64(segment)
+      
+       if end == -1:
+           return len(chunk)
+      
+       # Closing quote: flush, record an empty string in the skeleton
+       self._write_base64(b"", final=True)
+       self._data_file.close()
+       self._data_file = None
+       self._in_data = False
+       self._skeleton.extend(b'"')
+       return end + 1
+  
+   def _write_base64(self, segment: bytes, final: bool = False):
+       """Decode whole 4-char groups of base64 and keep the remainder for the next chunk"""
+       if self._pending_backslash:
+           segment = b"\\" + segment
+           self._pending_backslash = False
+       if segment.endswith(b"\\") and not final:
+           self._pending_backslash = True
+           segment = segment[:-1]
+       if b"\\" in segment:
+           # JSON escapes that may appear inside base64 text
+           segment = segment.replace(b"\\/", b"/").replace(b"\\n", b"").replace(b"\\r", b"")
+      
+       data = self._carry + segment
+       if self._probing:
+           # Hold the first bytes until a data URL prefix (data:image/png;base64,) can be ruled out
+           if len(data) < _DATA_URL_PROBE and not final:
+               self._carry = data
+               return
+           self._probing = False
+           if data.startswith(b"data:") and b"," in data:
+               data = data.split(b",", 1)[1]
+      
+       usable = len(data) if final else len(data) - len(data) % 4
+       if usable:
+           self._data_file.write(base64.b64decode(data[:usable]))
+       self._carry = data[usable:]
+
+
+
+
+def stream_decode_response(
+   chunks: Iterable[bytes],
+   temp_dir: str
+) -> Tuple[Dict[str, Any], List[str]]:
+   """
+   Decode a streamed generateContent response
+  
+   Args:
+       chunks: Iterable of raw response body chunks
+       temp_dir: Directory for decoded image files
+      
+   Returns:
+       Tuple of (response dict without image bytes, decoded image file paths)
+   """
+   os.makedirs(temp_dir, exist_ok=True)
+   decoder = InlineDataStreamDecoder(temp_dir)
+   try:
+       for chunk in chunks:
+           decoder.feed(chunk)
+   except BaseException:
+       decoder.abort()
+       raise
+   return decoder.finish()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Tests for AsyncImageGenerationClient against the mock server.
+Run with: python -m pytest test_async_client.py
+"""
+
+
+import asyncio
+import os
+
+
+from async_client import AsyncImageGenerationClient
+from config import ImageConfig
+from profiling import Profiler
+
+
+
+
+def make_client(mock_api, **options):
+   options.setdefault("profiler", Profiler(modes=""))
+   return AsyncImageGenerationClient("test-key", base_url=mock_api.base_url, **options)
+
+
+
+
+def run(client, coroutine_function):
+   """Run one coroutine with the client, closing it afterwards"""
+   async def main():
+       async with client:
+           return await coroutine_function(client)
+   return asyncio.run(main())
+
+
+
+
+# =============================================================================
+# GENERATION
+# =============================================================================
+
+
+def test_generate_saves_image(mock_api, tmp_path):
+   client = make_client(mock_api)
+   config = ImageConfig(output_dir=str(tmp_path), organize_by_date=False)
+  
+   result = run(client, lambda c: c.generate("a cat", config=config))
+  
+   assert result["success"], result.get("error")
+   assert os.path.exists(result.generated_images[0]["file_path"])
+   assert mock_api.state.stats["generate_requests"] == 1
+
+
+
+
+def test_concurrent_generates_share_the_loop(mock_api, tmp_path):
+   client = make_client(mock_api)
+   config = ImageConfig(output_dir=str(tmp_path), organize_by_date=False)
+  
+   async def generate_all(c):
+       return await asyncio.gather(*(
+           c.generate(f"panel {i}", config=config, save_to=f"panel_{i}.png") for i in range(4)
+       ))
+  
+   results = run(client, generate_all)
+  
+   assert all(result["success"] for result in results)
+   paths = {result.generated_images[0]["file_path"] for result in results}
+   assert len(paths) == 4
+   assert mock_api.state.stats["generate_requests"] == 4
+
+
+
+
+def test_multi_image_as_candidates(mock_api, tmp_path):
+   client = make_client(mock_api)
+   config = ImageConfig(output_dir=str(tmp_path), organize_by_date=False, num_images=3, multi_candidate=True)
+  
+   result = run(client, lambda c: c.generate("three cats", config=config))
+  
+   assert result["success"]
+   assert len(result.generated_images) == 3
+   assert mock_api.state.stats["generate_requests"] == 1
+
+
+
+
+def test_multi_image_fan_out(mock_api, tmp_path):
+   client = make_client(mock_api)
+   config = ImageConfig(output_dir=str(tmp_path), organize_by_date=False, num_images=3, multi_candidate=False)
+  
+   result = run(client, lambda c: c.generate("three cats", config=config))
+  
+   assert result["success"]
+   assert len(result.generated_images) == 3
+   assert mock_api.state.stats["generate_requests"] == 3
+
+
+
+
+def test_failed_request_is_reported(mock_api, tmp_path):
+   mock_api.state.error_rate = 1.0
+   client = make_client(mock_api)
+   config = ImageConfig(output_dir=str(tmp_path), organize_by_date=False)
+  
+   result = run(client, lambda c: c.generate("a cat", config=config))
+  
+   assert not result["success"]
+   assert "API request failed" in result["error"]
+
+
+
+
+def test_generate_is_profiled(mock_api, tmp_path):
+   profiler = Profiler(modes="cpu", profiles_dir=str(tmp_path / "profiles"))
+   client = make_client(mock_api, profiler=profiler)
+   config = ImageConfig(output_dir=str(tmp_path), organize_by_date=False)
+  
+   run(client, lambda c: c.generate("a cat", config=config))
+  
+   assert profiler.get_stats()["profiled"] == 1
+   assert any(name.endswith(".prof") for name in os.listdir(tmp_path / "profiles"))
+
+
+
+
+# =============================================================================
+# SESSIONS AND THE WRAPPED SYNC CLIENT
+# =============================================================================
+
+
+def test_generate_with_session_records_turn(mock_api, tmp_path):
+   from session_manager import SessionManager
+  
+   manager = SessionManager(str(tmp_path / "sessions"), use_catalog=False)
+   client = make_client(mock_api, session_manager=manager)
+   session = client.create_session()
+  
+   result = run(client, lambda c: c.generate_with_session(session, "a cat", use_session_history=False))
+  
+   assert result["success"], result.get("error")
+   assert result["session_id"] == session.session_id
+   loaded = client.client.load_session(session.session_id)
+   assert [message["role"] for message in loaded.messages] == ["user", "assistant"]
+   assert loaded.metadata["generation_count"] == 1
+
+
+
+
+def test_wrapped_sync_client_still_returns_results(mock_api, tmp_path):
+   client = make_client(mock_api)
+   config = ImageConfig(output_dir=str(tmp_path), organize_by_date=False)
+  
+   # The sync front-end is not shadowed by the coroutines
+   result = client.client.generate("a cat", config=config)
+  
+   assert result["success"]
+   assert os.path.exists(result.generated_images[0]["file_path"])
+   client.client.close()
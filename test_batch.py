@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Tests for batch job submission, polling and result saving against the mock server.
+Run with: python -m pytest test_batch.py
+"""
+
+
+import json
+import os
+
+
+import pytest
+
+
+from batch import BatchJob, files_download_url, iter_jsonl_lines, submit_batch
+from config import ImageConfig
+from image_client import ImageGenerationClient
+from profiling import Profiler
+from transcode import Transcoder
+
+
+
+
+def make_client(mock_api, tmp_path):
+   mock_api.state.batch_delay_seconds = 0.05
+   return ImageGenerationClient(
+       "test-key",
+       base_url=mock_api.base_url,
+       default_config=ImageConfig(output_dir=str(tmp_path / "out"), organize_by_date=False),
+       profiler=Profiler(modes=""),
+       transcoder=Transcoder(max_workers=0)
+   )
+
+
+
+
+# =============================================================================
+# HELPERS
+# =============================================================================
+
+
+def test_jsonl_lines_are_reassembled_across_chunks():
+   chunks = [b'{"a": 1}\n{"b"', b': 2}\n', b'\n{"c": 3}']
+  
+   assert [json.loads(line) for line in iter_jsonl_lines(chunks)] == [{"a": 1}, {"b": 2}, {"c": 3}]
+
+
+
+
+def test_download_url_is_derived_from_the_base_url():
+   assert (
+       files_download_url("https://host/v1beta", "files/abc")
+       == "https://host/download/v1beta/files/abc:download?alt=media"
+   )
+
+
+
+
+# =============================================================================
+# JOBS
+# =============================================================================
+
+
+def test_batch_results_are_saved_by_key(mock_api, tmp_path):
+   client = make_client(mock_api, tmp_path)
+   job = submit_batch(client, [
+       {"key": "cover", "prompt": "a cover", "save_to": "cover.png"},
+       {"key": "panel", "prompt": "a panel"}
+   ], batches_dir=str(tmp_path / "batches"))
+  
+   results = job.wait(poll_interval=0.02, timeout=5)
+  
+   assert sorted(results) == ["cover", "panel"]
+   assert all(result["success"] for result in results.values())
+   assert os.path.basename(results["cover"].generated_images[0]["file_path"]) == "cover.png"
+   assert os.path.exists(results["panel"].generated_images[0]["file_path"])
+   # The whole submission was one batch and no interactive calls
+   assert mock_api.state.stats["batches"] == 1
+   assert mock_api.state.stats["generate_requests"] == 0
+   client.close()
+
+
+
+
+def test_multi_image_requests_expand_to_one_line_each(mock_api, tmp_path):
+   client = make_client(mock_api, tmp_path)
+   config = ImageConfig(output_dir=str(tmp_path / "out"), organize_by_date=False, num_images=2)
+  
+   job = submit_batch(
+       client,
+       [{"key": "panel", "prompt": "a panel", "config": config, "save_to": "panel.png"}],
+       batches_dir=str(tmp_path / "batches")
+   )
+   results = job.wait(poll_interval=0.02, timeout=5)
+  
+   assert sorted(results) == ["panel#1", "panel#2"]
+   names = sorted(os.path.basename(result.generated_images[0]["file_path"]) for result in results.values())
+   assert names == ["panel_1.png", "panel_2.png"]
+   client.close()
+
+
+
+
+def test_job_can_be_resumed_from_its_manifest(mock_api, tmp_path):
+   client = make_client(mock_api, tmp_path)
+   job = submit_batch(client, [{"key": "cover", "prompt": "a cover"}], batches_dir=str(tmp_path / "batches"))
+  
+   resumed = BatchJob.load(client, job.manifest_path)
+   results = resumed.wait(poll_interval=0.02, timeout=5)
+  
+   assert resumed.name == job.name
+   assert results["cover"]["success"]
+   client.close()
+
+
+
+
+def test_duplicate_keys_and_missing_prompts_are_rejected(mock_api, tmp_path):
+   client = make_client(mock_api, tmp_path)
+   batches_dir = str(tmp_path / "batches")
+  
+   with pytest.raises(ValueError, match="Duplicate batch key"):
+       submit_batch(client, [{"key": "a", "prompt": "x"}, {"key": "a", "prompt": "y"}], batches_dir=batches_dir)
+   with pytest.raises(ValueError, match="no prompt"):
+       submit_batch(client, [{"key": "a"}], batches_dir=batches_dir)
+   assert mock_api.state.stats["batches"] == 0
+   client.close()
+
+
+
+
+def test_wait_times_out_while_the_job_runs(mock_api, tmp_path):
+   client = make_client(mock_api, tmp_path)
+   mock_api.state.batch_delay_seconds = 30
+   job = submit_batch(client, [{"prompt": "a cover"}], batches_dir=str(tmp_path / "batches"))
+  
+   with pytest.raises(TimeoutError):
+       job.wait(poll_interval=0.02, timeout=0.1)
+   client.close()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Tests for the mock generateContent server and the offline benchmark suite.
+Run with: python -m pytest test_benchmark.py
+"""
+
+
+import io
+import json
+import statistics
+
+
+import pytest
+from PIL import Image
+
+
+from benchmark import check_startup, run_scenario, server_stats, summarize, synthetic_plan
+from config import ImageConfig
+from image_client import ImageGenerationClient
+from mock_server import MockGeminiState, make_noise_png
+from profiling import Profiler
+from transcode import Transcoder
+
+
+
+
+def scenario_options(tmp_path, **options):
+   defaults = {
+       "iterations": 4,
+       "concurrency": 2,
+       "fanout_images": 2,
+       "session_turns": 2,
+       "output_dir": str(tmp_path)
+   }
+   return dict(defaults, **options)
+
+
+
+
+# =============================================================================
+# MOCK SERVER
+# =============================================================================
+
+
+def test_noise_images_are_realistic_in_size_and_repeatable():
+   data = make_noise_png(1.0)
+  
+   assert len(data) >= 1024 * 1024
+   assert Image.open(io.BytesIO(data)).format == "PNG"
+   assert make_noise_png(1.0) == data
+   assert make_noise_png(1.0, seed=7) != data
+
+
+
+
+@pytest.mark.parametrize("distribution", ["fixed", "uniform", "lognormal"])
+def test_latency_draws_are_seeded(distribution):
+   def draws(seed):
+       state = MockGeminiState(latency_seconds=1.0, latency_distribution=distribution, seed=seed)
+       return [state.draw_latency() for _ in range(5)]
+  
+   state = MockGeminiState(latency_seconds=1.0, latency_distribution=distribution, latency_spread=0.5)
+  
+   samples = [state.draw_latency() for _ in range(500)]
+  
+   assert draws(3) == draws(3)
+   assert statistics.median(samples) == pytest.approx(1.0, rel=0.15)
+   if distribution == "uniform":
+       assert 0.5 <= min(samples) and max(samples) <= 1.5
+
+
+
+
+def test_invalid_state_options_are_rejected():
+   with pytest.raises(ValueError):
+       MockGeminiState(latency_distribution="pareto")
+   with pytest.raises(ValueError):
+       MockGeminiState(error_rate=1.5)
+
+
+
+
+def test_injected_errors_reach_the_client(mock_api, tmp_path):
+   mock_api.state.error_rate = 1.0
+   mock_api.state.error_status = 400
+   client = ImageGenerationClient(
+       "test-key",
+       base_url=mock_api.base_url,
+       profiler=Profiler(modes=""),
+       transcoder=Transcoder(max_workers=0)
+   )
+   config = ImageConfig(output_dir=str(tmp_path), organize_by_date=False)
+  
+   result = client.generate("a cat", config=config)
+  
+   assert not result["success"]
+   assert server_stats(mock_api.base_url)["injected_errors"] == 1
+   client.close()
+
+
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+
+@pytest.mark.parametrize("scenario, requests", [("single", 4), ("fanout", 4), ("session", 2)])
+def test_scenarios_run_against_the_mock(mock_api, tmp_path, scenario, requests):
+   run = run_scenario(scenario, mock_api.base_url, scenario_options(tmp_path))
+  
+   report = summarize(run, server_stats(mock_api.base_url)["generate_requests"])
+  
+   assert report["requests"] == requests
+   assert report["failed_images"] == 0
+   assert report["images_per_second"] > 0
+   assert report["p50_seconds"] <= report["p95_seconds"] <= report["p99_seconds"]
+   # Scenario output is removed unless keep_output is set
+   assert list(tmp_path.iterdir()) == []
+
+
+
+
+def test_comic_scenario_runs_the_whole_plan(mock_api, tmp_path):
+   plan_path = tmp_path.parent / f"{tmp_path.name}_plan.json"
+   plan_path.write_text(json.dumps(synthetic_plan(pages=2, panels_per_page=3, characters=2)), encoding="utf-8")
+  
+   run = run_scenario("comic", mock_api.base_url, scenario_options(tmp_path, plan=str(plan_path)))
+  
+   # Two character sheets, then every panel
+   assert len(run["samples"]) == 2 + 2 * 3
+   assert all(returned == 1 for _, _, returned in run["samples"])
+   assert mock_api.state.stats["generate_requests"] == 8
+
+
+
+
+def test_summary_counts_failed_images():
+   run = {
+       "samples": [(0.1, 1, 1), (0.3, 2, 1), (0.2, 1, 0)],
+       "wall_seconds": 2.0,
+       "cpu_seconds": 0.5,
+       "peak_rss_mb": 100.0,
+       "rss_growth_mb": 10.0
+   }
+  
+   report = summarize(run, requests=4)
+  
+   assert (report["images"], report["failed_images"]) == (2, 2)
+   assert report["requests_per_second"] == 2.0
+   assert report["p50_seconds"] == 0.2
+   assert report["cpu_ms_per_image"] == 250.0
+
+
+
+
+def test_startup_guard_reports_regressions():
+   startup = {
+       "utils": {"lazy_loaded": [], "created": [], "import_ms": 20.0},
+       "image_client": {"lazy_loaded": ["PIL"], "created": ["generated"], "import_ms": 300.0}
+   }
+  
+   assert check_startup(startup, max_import_ms=100) == [
+       "importing image_client loads PIL",
+       "starting image_client creates generated",
+       "importing image_client takes 300.0ms (limit 100ms)"
+   ]
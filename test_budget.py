@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Tests for pre-flight token and size budgeting of generateContent requests.
+Run with: python -m pytest test_budget.py
+"""
+
+
+import pytest
+from PIL import Image
+
+
+from budget import BudgetExceededError, RequestBudget, estimate_image_tokens, estimate_text_tokens
+from config import IMAGE_TOKENS_PER_TILE, ImageConfig, ReferenceUploadConfig
+from image_client import ImageGenerationClient
+from mock_server import make_noise_png
+from profiling import Profiler
+from reference_cache import get_reference_cache
+from reference_optimizer import get_reference_optimizer
+from transcode import Transcoder
+
+
+
+
+def write_image(path, size=(64, 64)):
+   Image.new("RGB", size, (90, 140, 200)).save(path)
+   return str(path)
+
+
+
+
+def encoder_stats():
+   """Misses of the caches every inline encoding goes through"""
+   return get_reference_cache().get_stats()["misses"], get_reference_optimizer().get_stats()["misses"]
+
+
+
+
+# =============================================================================
+# ESTIMATES
+# =============================================================================
+
+
+def test_text_tokens_count_non_ascii_more_densely():
+   assert estimate_text_tokens("abcd" * 10) == 10
+   assert estimate_text_tokens("chú mèo") == 4
+
+
+
+
+def test_image_tokens_are_one_tile_when_small_else_per_tile():
+   assert estimate_image_tokens(384, 384) == IMAGE_TOKENS_PER_TILE
+   assert estimate_image_tokens(1024, 1024) == 4 * IMAGE_TOKENS_PER_TILE
+   assert estimate_image_tokens(1536, 700) == 2 * IMAGE_TOKENS_PER_TILE
+
+
+
+
+def test_inline_estimate_counts_base64_in_the_body(tmp_path):
+   path = write_image(tmp_path / "ref.png", (1024, 1024))
+   budget = RequestBudget()
+  
+   report = budget.estimate("a cat", [path])
+  
+   image = report["images"][0]
+   assert image["tokens"] == 4 * IMAGE_TOKENS_PER_TILE
+   assert report["request_bytes"] > image["base64_bytes"] > image["size_bytes"]
+   assert report["input_tokens"] == report["text_tokens"] + report["image_tokens"]
+
+
+
+
+def test_uploaded_references_are_estimated_without_encoding(tmp_path):
+   path = write_image(tmp_path / "sheet.png", (2048, 1024))
+   budget = RequestBudget()
+   before = encoder_stats()
+  
+   report = budget.estimate("a cat", [path], ReferenceUploadConfig(max_long_edge=768), inline=False)
+  
+   assert encoder_stats() == before
+   image = report["images"][0]
+   # Sized from the header, scaled to the upload's long edge (768 x 384)
+   assert image["tokens"] == estimate_image_tokens(768, 384)
+   assert image["size_bytes"] == (tmp_path / "sheet.png").stat().st_size
+   # Only the prompt travels in the body
+   assert report["request_bytes"] < 1024
+
+
+
+
+# =============================================================================
+# LIMITS
+# =============================================================================
+
+
+def test_over_budget_request_raises_with_its_report(tmp_path):
+   path = write_image(tmp_path / "ref.png", (1536, 1536))
+   budget = RequestBudget(max_input_tokens=1000)
+  
+   with pytest.raises(BudgetExceededError) as error:
+       budget.check("a cat", ImageConfig(), [path])
+  
+   assert "input tokens" in str(error.value)
+   assert error.value.report["image_tokens"] == 4 * IMAGE_TOKENS_PER_TILE
+
+
+
+
+def test_too_many_images_is_a_problem(tmp_path):
+   paths = [write_image(tmp_path / f"{i}.png") for i in range(3)]
+   budget = RequestBudget(max_images=2)
+  
+   assert budget.problems(budget.estimate("a cat", paths)) == ["3 reference images (max 2)"]
+
+
+
+
+def test_auto_shrink_tightens_upload_options_to_fit(tmp_path):
+   path = write_image(tmp_path / "ref.png", (1536, 1536))
+   budget = RequestBudget(max_input_tokens=1000, auto_shrink=True)
+   config = ImageConfig()
+  
+   shrunk_config, report = budget.check("a cat", config, [path])
+  
+   assert report["shrunk"]
+   assert report["input_tokens"] <= 1000
+   assert shrunk_config.upload_options.max_long_edge == 768
+   # The caller's config is left alone
+   assert config.upload_options is None
+
+
+
+
+def test_auto_shrink_fits_the_request_body(tmp_path):
+   path = tmp_path / "noise.png"
+   path.write_bytes(make_noise_png(0.3))
+   budget = RequestBudget(max_request_mb=0.1, auto_shrink=True)
+  
+   _, report = budget.check("a cat", ImageConfig(), [str(path)])
+  
+   assert report["shrunk"]
+   assert report["request_bytes"] <= budget.max_request_bytes
+
+
+
+
+# =============================================================================
+# CLIENT
+# =============================================================================
+
+
+def test_client_rejects_over_budget_requests_locally(mock_api, tmp_path):
+   client = ImageGenerationClient(
+       "test-key",
+       base_url=mock_api.base_url,
+       budget=RequestBudget(max_input_tokens=1000),
+       profiler=Profiler(modes=""),
+       transcoder=Transcoder(max_workers=0)
+   )
+   config = ImageConfig(output_dir=str(tmp_path / "out"), organize_by_date=False)
+   reference = write_image(tmp_path / "ref.png", (1536, 1536))
+  
+   rejected = client.generate("a cat", config=config, reference_images=[reference])
+   accepted = client.generate("a cat", config=config, save_to="cat.png")
+  
+   assert not rejected["success"]
+   assert "exceeds input budget" in rejected["error"]
+   assert accepted["success"]
+   assert accepted["budget"]["input_tokens"] == estimate_text_tokens("a cat")
+   assert mock_api.state.stats["generate_requests"] == 1
+   client.close()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Tests for the content-addressed generation result cache.
+Run with: python -m pytest test_cache.py
+"""
+
+
+import json
+import os
+import time
+
+
+from cache import ENTRY_FILE, GenerationCache, normalize_prompt, request_fingerprint
+from config import ImageConfig
+
+
+
+
+def make_image(tmp_path, name, size=1024):
+   path = tmp_path / name
+   path.write_bytes(os.urandom(size))
+   return {"file_path": str(path), "info": {"format": "PNG"}, "part_index": 1, "num_parts": 2, "num_image_parts": 1}
+
+
+
+
+def disk_bytes(cache):
+   total = 0
+   for root, _, files in os.walk(cache.cache_dir):
+       total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+   return total
+
+
+
+
+def backdate(cache, key, seconds):
+   """Move an entry's created_at back by seconds"""
+   entry_file = os.path.join(cache._entry_path(key), ENTRY_FILE)
+   with open(entry_file, 'r') as f:
+       entry = json.load(f)
+   entry["created_at"] -= seconds
+   with open(entry_file, 'w') as f:
+       json.dump(entry, f)
+
+
+
+
+# =============================================================================
+# FINGERPRINTS
+# =============================================================================
+
+
+def test_fingerprint_ignores_whitespace_and_line_endings():
+   config = ImageConfig()
+   assert normalize_prompt("  a cat  \r\non a mat \n") == "a cat\non a mat"
+   assert (
+       request_fingerprint("model", "a cat\r\non a mat", [], config)
+       == request_fingerprint("model", "  a cat\non a mat  ", [], config)
+   )
+
+
+
+
+def test_fingerprint_changes_with_output_fields_and_variant():
+   base = request_fingerprint("model", "a cat", [], ImageConfig())
+   assert request_fingerprint("model", "a cat", [], ImageConfig(aspect_ratio="16:9")) != base
+   assert request_fingerprint("model", "a cat", [], ImageConfig(output_format="jpeg")) != base
+   assert request_fingerprint("model", "a cat", [], ImageConfig(), variant="2") != base
+   assert request_fingerprint("other-model", "a cat", [], ImageConfig()) != base
+   # Fields that do not change the output do not change the key
+   assert request_fingerprint("model", "a cat", [], ImageConfig(max_concurrency=1)) == base
+
+
+
+
+# =============================================================================
+# GET / PUT
+# =============================================================================
+
+
+def test_put_then_get_returns_copies_with_layout(tmp_path):
+   cache = GenerationCache(str(tmp_path / "cache"))
+   image = make_image(tmp_path, "out.png")
+  
+   cache.put("ab" * 32, [image], extra={"prompt": "a cat"})
+   os.remove(image["file_path"])
+   entry = cache.get("ab" * 32)
+  
+   assert entry["prompt"] == "a cat"
+   assert entry["images"][0]["part_index"] == 1
+   assert os.path.exists(entry["images"][0]["file_path"])
+   assert cache.get_stats()["hits"] == 1
+   assert cache.get("cd" * 32) is None
+   assert cache.get_stats()["misses"] == 1
+
+
+
+
+def test_expired_entry_is_a_miss_and_counted_as_expiration(tmp_path):
+   cache = GenerationCache(str(tmp_path / "cache"), max_age_hours=1)
+   cache.put("ab" * 32, [make_image(tmp_path, "out.png")])
+   backdate(cache, "ab" * 32, 2 * 3600)
+  
+   assert cache.get("ab" * 32) is None
+   stats = cache.get_stats()
+   assert stats["expirations"] == 1
+   assert stats["evictions"] == 0
+   assert not os.path.exists(cache._entry_path("ab" * 32))
+
+
+
+
+# =============================================================================
+# EVICTION
+# =============================================================================
+
+
+def test_evict_uses_created_at_and_counts_expirations(tmp_path):
+   cache = GenerationCache(str(tmp_path / "cache"), max_age_hours=1)
+   cache.put("ab" * 32, [make_image(tmp_path, "old.png")])
+   cache.put("cd" * 32, [make_image(tmp_path, "new.png")])
+   backdate(cache, "ab" * 32, 2 * 3600)
+   # A recently touched directory does not keep an old entry alive
+   os.utime(cache._entry_path("ab" * 32))
+  
+   assert cache.evict() == 1
+   stats = cache.get_stats()
+   assert stats["expirations"] == 1
+   assert stats["evictions"] == 0
+   assert cache.get("cd" * 32) is not None
+
+
+
+
+def test_size_cap_evicts_least_recently_used(tmp_path):
+   # Room for about three 100 KB entries
+   cache = GenerationCache(str(tmp_path / "cache"), max_size_mb=0.3)
+   keys = [f"{i:02d}" * 32 for i in range(3)]
+   for key in keys:
+       cache.put(key, [make_image(tmp_path, f"{key[:2]}.png", size=100 * 1024)])
+       time.sleep(0.01)
+   # Use the oldest entry so the second one is least recently used
+   assert cache.get(keys[0]) is not None
+  
+   cache.put("99" * 32, [make_image(tmp_path, "new.png", size=100 * 1024)])
+  
+   assert cache.get(keys[1]) is None
+   assert cache.get(keys[0]) is not None
+   assert cache.get_stats()["evictions"] >= 1
+   assert cache._total_bytes == disk_bytes(cache)
+   assert cache._total_bytes <= cache.max_size_bytes
+
+
+
+
+def test_running_total_tracks_writes_and_replacements(tmp_path):
+   cache = GenerationCache(str(tmp_path / "cache"))
+   cache.put("ab" * 32, [make_image(tmp_path, "a.png", size=4000)])
+   cache.put("cd" * 32, [make_image(tmp_path, "b.png", size=2000)])
+   cache.put("ab" * 32, [make_image(tmp_path, "c.png", size=1000)])
+  
+   assert cache._total_bytes == disk_bytes(cache)
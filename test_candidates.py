@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Tests for asking for several images as candidates of one generateContent call.
+Run with: python -m pytest test_candidates.py
+"""
+
+
+import uuid
+
+
+from config import ImageConfig
+from image_client import ImageGenerationClient
+from profiling import Profiler
+from transcode import Transcoder
+
+
+
+
+def make_client(mock_api, model=None):
+   # A fresh model name keeps the process-wide refusals of other tests out
+   return ImageGenerationClient(
+       "test-key",
+       base_url=mock_api.base_url,
+       model=model or f"candidates-{uuid.uuid4().hex[:8]}",
+       profiler=Profiler(modes=""),
+       transcoder=Transcoder(max_workers=0)
+   )
+
+
+
+
+def make_config(tmp_path, **options):
+   return ImageConfig(output_dir=str(tmp_path), organize_by_date=False, num_images=3, **options)
+
+
+
+
+# =============================================================================
+# CANDIDATES
+# =============================================================================
+
+
+def test_default_is_one_call_per_image(mock_api, tmp_path):
+   client = make_client(mock_api)
+  
+   result = client.generate("three cats", config=make_config(tmp_path), save_to="cat.png")
+  
+   assert result["success"]
+   assert len(result.generated_images) == 3
+   assert mock_api.state.stats["generate_requests"] == 3
+   client.close()
+
+
+
+
+def test_candidates_come_back_from_one_call(mock_api, tmp_path):
+   client = make_client(mock_api)
+  
+   result = client.generate("three cats", config=make_config(tmp_path, multi_candidate=True), save_to="cat.png")
+  
+   assert result["success"]
+   assert sorted(image["file_path"] for image in result.generated_images) == [
+       str(tmp_path / f"cat_{n}.png") for n in (1, 2, 3)
+   ]
+   assert mock_api.state.stats["generate_requests"] == 1
+   client.close()
+
+
+
+
+def test_refusal_is_remembered_across_clients(mock_api, tmp_path):
+   mock_api.state.max_candidates = 1
+   model = f"single-{uuid.uuid4().hex[:8]}"
+   config = make_config(tmp_path, multi_candidate=True)
+   first = make_client(mock_api, model)
+  
+   refused = first.generate("three cats", config=config, save_to="first.png")
+  
+   # The refused call, then one call per image
+   assert refused["success"]
+   assert mock_api.state.stats["generate_requests"] == 4
+   first.close()
+  
+   second = make_client(mock_api, model)
+   assert second.generate("three cats", config=config, save_to="second.png")["success"]
+   assert mock_api.state.stats["generate_requests"] == 7
+   second.close()
+
+
+
+
+def test_other_models_still_ask_for_candidates(mock_api, tmp_path):
+   mock_api.state.max_candidates = 1
+   config = make_config(tmp_path, multi_candidate=True)
+   refused = make_client(mock_api)
+   refused.generate("three cats", config=config, save_to="refused.png")
+   mock_api.state.max_candidates = 8
+   requests_before = mock_api.state.stats["generate_requests"]
+   client = make_client(mock_api)
+  
+   assert client.generate("three cats", config=config, save_to="cat.png")["success"]
+  
+   assert mock_api.state.stats["generate_requests"] == requests_before + 1
+   refused.close()
+   client.close()
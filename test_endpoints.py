@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Tests for multi-endpoint failover and the per-endpoint circuit breaker.
+Run with: python -m pytest test_endpoints.py
+"""
+
+
+import socket
+import time
+
+
+import pytest
+
+
+from config import ImageConfig
+from endpoints import CLOSED, OPEN, Endpoint, EndpointPool
+from image_client import ImageGenerationClient
+from profiling import Profiler
+from transcode import Transcoder
+from transport import TransportError
+
+
+
+
+def dead_url():
+   """A base URL nothing listens on"""
+   with socket.socket() as sock:
+       sock.bind(("127.0.0.1", 0))
+       port = sock.getsockname()[1]
+   return f"http://127.0.0.1:{port}/v1beta"
+
+
+
+
+def failing_send(failing_urls, status=503):
+   """A send(endpoint) that fails for the given base URLs and records the order of attempts"""
+   attempts = []
+  
+   def send(endpoint):
+       attempts.append(endpoint.base_url)
+       if endpoint.base_url in failing_urls:
+           raise TransportError("failed", status)
+       return endpoint.base_url
+  
+   send.attempts = attempts
+   return send
+
+
+
+
+def make_pool(*urls, **options):
+   options.setdefault("probe_interval", 0.02)
+   options.setdefault("open_seconds", 0.0)
+   return EndpointPool([Endpoint(url) for url in urls], **options)
+
+
+
+
+# =============================================================================
+# FAILOVER AND BREAKER
+# =============================================================================
+
+
+def test_server_errors_fail_over_to_the_next_endpoint():
+   pool = make_pool("http://a/v1beta", "http://b/v1beta", failure_threshold=5)
+   send = failing_send({"http://a/v1beta"})
+   try:
+       results = [pool.call(send) for _ in range(4)]
+      
+       assert set(results) == {"http://b/v1beta"}
+       assert pool.get_stats()["failovers"] == send.attempts.count("http://a/v1beta")
+   finally:
+       pool.close()
+
+
+
+
+def test_client_errors_are_raised_without_failover():
+   pool = make_pool("http://a/v1beta", "http://b/v1beta")
+   send = failing_send({"http://a/v1beta", "http://b/v1beta"}, status=400)
+   try:
+       with pytest.raises(TransportError):
+           pool.call(send)
+       assert len(send.attempts) == 1
+       assert all(endpoint.consecutive_failures == 0 for endpoint in pool.endpoints)
+   finally:
+       pool.close()
+
+
+
+
+def test_consecutive_failures_trip_the_breaker():
+   # A huge open time keeps the prober from touching the tripped endpoint
+   pool = make_pool("http://a/v1beta", "http://b/v1beta", failure_threshold=2, open_seconds=3600)
+   first, second = pool.endpoints
+   try:
+       for _ in range(2):
+           pool._release(pool.choose(exclude=[second]), None, TransportError("down", 503))
+      
+       assert first.state == OPEN
+       assert first.stats["trips"] == 1
+       # Tripped endpoints get no traffic while another is healthy
+       assert {pool.call(failing_send(set())) for _ in range(5)} == {"http://b/v1beta"}
+   finally:
+       pool.close()
+
+
+
+
+def test_all_tripped_still_tries_the_oldest_and_readmits_it():
+   pool = make_pool("http://a/v1beta", failure_threshold=1, open_seconds=3600)
+   endpoint = pool.endpoints[0]
+   try:
+       with pytest.raises(TransportError):
+           pool.call(failing_send({"http://a/v1beta"}))
+       assert endpoint.state == OPEN
+      
+       assert pool.call(failing_send(set())) == "http://a/v1beta"
+       assert endpoint.state == CLOSED
+       assert pool.get_stats()["readmitted"] == 1
+   finally:
+       pool.close()
+
+
+
+
+# =============================================================================
+# PROBES
+# =============================================================================
+
+
+def test_probe_readmits_only_on_success(mock_api):
+   pool = make_pool(mock_api.base_url, f"{mock_api.base_url}/missing", dead_url())
+   healthy, not_found, dead = pool.endpoints
+   try:
+       for endpoint in pool.endpoints:
+           endpoint.state = OPEN
+      
+       assert pool.probe(healthy)
+       # A 4xx answer is not a healthy endpoint
+       assert not pool.probe(not_found)
+       assert not pool.probe(dead)
+      
+       assert healthy.state == CLOSED
+       assert not_found.state == OPEN
+       assert dead.state == OPEN
+       assert pool.get_stats()["readmitted"] == 1
+   finally:
+       pool.close()
+
+
+
+
+def test_background_prober_readmits_a_recovered_endpoint(mock_api):
+   pool = make_pool(mock_api.base_url, failure_threshold=1)
+   endpoint = pool.endpoints[0]
+   try:
+       pool._release(pool.choose(), None, TransportError("down", 503))
+       assert endpoint.state == OPEN
+      
+       pool._probe_thread.join(timeout=5)
+      
+       assert endpoint.state == CLOSED
+       assert pool.get_stats()["probes"] >= 1
+   finally:
+       pool.close()
+
+
+
+
+def test_close_joins_the_prober_and_closes_its_transport():
+   pool = make_pool(dead_url(), failure_threshold=1)
+   try:
+       pool._release(pool.choose(), None, TransportError("down", 503))
+       probe_thread = pool._probe_thread
+       assert probe_thread.is_alive()
+       deadline = time.monotonic() + 5
+       while pool.get_stats()["probes"] == 0 and time.monotonic() < deadline:
+           time.sleep(0.01)
+       assert pool.probe_transport is not None
+   finally:
+       pool.close()
+  
+   assert not probe_thread.is_alive()
+   assert pool.probe_transport is None
+   # A closed pool does not start probing again
+   pool._release(pool.choose(), None, TransportError("down", 503))
+   assert pool._probe_thread is None
+
+
+
+
+# =============================================================================
+# CLIENT
+# =============================================================================
+
+
+def test_client_fails_over_from_a_dead_endpoint(mock_api, tmp_path):
+   pool = make_pool(dead_url(), mock_api.base_url, failure_threshold=1)
+   client = ImageGenerationClient(
+       "test-key",
+       base_url=mock_api.base_url,
+       endpoints=pool,
+       profiler=Profiler(modes=""),
+       transcoder=Transcoder(max_workers=0)
+   )
+   config = ImageConfig(output_dir=str(tmp_path), organize_by_date=False)
+  
+   results = [client.generate(f"cat {i}", config=config, save_to=f"cat_{i}.png") for i in range(3)]
+  
+   assert all(result["success"] for result in results)
+   assert mock_api.state.stats["generate_requests"] == 3
+   client.close()
+   assert pool._probe_thread is None
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Tests for the concurrent num_images > 1 fan-out in ImageGenerationClient.generate.
+Run with: python -m pytest test_fan_out.py
+"""
+
+
+import os
+import time
+
+
+from config import ImageConfig
+from image_client import ImageGenerationClient
+from profiling import Profiler
+from transcode import Transcoder
+
+
+
+
+def make_client(mock_api):
+   return ImageGenerationClient(
+       "test-key",
+       base_url=mock_api.base_url,
+       profiler=Profiler(modes=""),
+       transcoder=Transcoder(max_workers=0)
+   )
+
+
+
+
+def fan_out_config(tmp_path, num_images, max_concurrency):
+   return ImageConfig(
+       output_dir=str(tmp_path),
+       organize_by_date=False,
+       num_images=num_images,
+       max_concurrency=max_concurrency,
+       multi_candidate=False
+   )
+
+
+
+
+def timed_generate(client, config, **options):
+   started = time.perf_counter()
+   result = client.generate("a cat", config=config, **options)
+   return result, time.perf_counter() - started
+
+
+
+
+# =============================================================================
+# CONCURRENCY
+# =============================================================================
+
+
+def test_calls_overlap_up_to_max_concurrency(mock_api, tmp_path):
+   mock_api.state.latency_seconds = 0.3
+   client = make_client(mock_api)
+  
+   result, elapsed = timed_generate(client, fan_out_config(tmp_path, 4, 4), save_to="cat.png")
+  
+   assert result["success"]
+   assert mock_api.state.stats["generate_requests"] == 4
+   # Four 0.3 s calls in parallel take well under the 1.2 s a sequential run needs
+   assert elapsed < 0.9
+   client.close()
+
+
+
+
+def test_max_concurrency_one_runs_sequentially(mock_api, tmp_path):
+   mock_api.state.latency_seconds = 0.15
+   client = make_client(mock_api)
+  
+   result, elapsed = timed_generate(client, fan_out_config(tmp_path, 3, 1), save_to="cat.png")
+  
+   assert result["success"]
+   assert elapsed >= 0.45
+   client.close()
+
+
+
+
+# =============================================================================
+# RESULTS
+# =============================================================================
+
+
+def test_images_come_back_in_request_order(mock_api, tmp_path):
+   mock_api.state.latency_seconds = 0.2
+   mock_api.state.latency_distribution = "uniform"
+   client = make_client(mock_api)
+  
+   result = client.generate("a cat", config=fan_out_config(tmp_path, 4, 4), save_to="cat.png")
+  
+   paths = [image["file_path"] for image in result.generated_images]
+   assert [os.path.basename(path) for path in paths] == [f"cat_{i}.png" for i in range(1, 5)]
+   assert [timing["index"] for timing in result["timings"]] == [1, 2, 3, 4]
+   assert all(timing["elapsed_seconds"] > 0 for timing in result["timings"])
+   assert result["total_elapsed_seconds"] > 0
+   client.close()
+
+
+
+
+def test_partial_failures_are_kept_alongside_successes(mock_api, tmp_path):
+   mock_api.state.error_rate = 0.5
+   client = make_client(mock_api)
+  
+   result = client.generate("a cat", config=fan_out_config(tmp_path, 6, 1), save_to="cat.png")
+  
+   failures = mock_api.state.stats["injected_errors"]
+   # The seeded draws fail some but not all of the six calls
+   assert 0 < failures < 6
+   assert result["success"]
+   assert len(result.generated_images) == 6 - failures
+   assert len(result["failed"]) == failures
+   failed_indexes = {failure["index"] for failure in result["failed"]}
+   assert failed_indexes == {timing["index"] for timing in result["timings"] if not timing["success"]}
+   client.close()
+
+
+
+
+def test_all_failures_report_every_call(mock_api, tmp_path):
+   mock_api.state.error_rate = 1.0
+   client = make_client(mock_api)
+  
+   result = client.generate("a cat", config=fan_out_config(tmp_path, 3, 3))
+  
+   assert not result["success"]
+   assert result["error"] == "Failed to generate any images"
+   assert [failure["index"] for failure in result["failed"]] == [1, 2, 3]
+   client.close()
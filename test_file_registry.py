@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Tests for upload-once reference handles, their expiry and refresh.
+Run with: python -m pytest test_file_registry.py
+"""
+
+
+from config import ImageConfig
+from file_registry import (
+   ReferenceFileRegistry,
+   files_upload_url,
+   is_expired_handle_error,
+   parse_expiration_time
+)
+from image_client import ImageGenerationClient
+from mock_server import make_png
+from profiling import Profiler
+from transcode import Transcoder
+from transport import TransportError
+
+
+
+
+def make_registry(mock_api, tmp_path, **options):
+   options.setdefault("registry_path", str(tmp_path / "file_handles.json"))
+   return ReferenceFileRegistry("test-key", upload_url=None, base_url=mock_api.base_url, **options)
+
+
+
+
+def write_reference(path):
+   path.write_bytes(make_png())
+   return str(path)
+
+
+
+
+def file_payload(*uris):
+   parts = [{"file_data": {"mime_type": "image/png", "file_uri": uri}} for uri in uris]
+   return {"contents": [{"parts": parts + [{"text": "a cat"}]}]}
+
+
+
+
+# =============================================================================
+# HELPERS
+# =============================================================================
+
+
+def test_upload_url_is_derived_from_the_base_url():
+   assert files_upload_url("https://host/v1beta/") == "https://host/upload/v1beta/files"
+   assert files_upload_url("http://127.0.0.1:1/proxy/v1beta") == "http://127.0.0.1:1/proxy/upload/v1beta/files"
+
+
+
+
+def test_expiration_time_with_nanoseconds():
+   assert parse_expiration_time("2025-10-27T10:00:00.123456789Z") == parse_expiration_time(
+       "2025-10-27T10:00:00.123456+00:00"
+   )
+   assert parse_expiration_time("not a time") is None
+   assert parse_expiration_time(None) is None
+
+
+
+
+def test_only_file_errors_count_as_expired_handles():
+   uri = "https://host/v1beta/files/abc123"
+   payload = file_payload(uri)
+  
+   assert is_expired_handle_error(TransportError("gone", 403), payload)
+   assert is_expired_handle_error(TransportError("bad", 400, body="File files/abc123 not found"), payload)
+   assert not is_expired_handle_error(TransportError("bad", 400, body="Invalid prompt"), payload)
+   assert not is_expired_handle_error(TransportError("busy", 503), payload)
+   assert not is_expired_handle_error(TransportError("gone", 403), {"contents": [{"parts": [{"text": "x"}]}]})
+
+
+
+
+# =============================================================================
+# REGISTRY
+# =============================================================================
+
+
+def test_each_image_is_uploaded_once(mock_api, tmp_path):
+   registry = make_registry(mock_api, tmp_path)
+   first = write_reference(tmp_path / "sheet.png")
+   copy = write_reference(tmp_path / "copy.png")
+  
+   part = registry.get_file_part(first)
+  
+   assert registry.get_file_part(first) == part
+   assert registry.get_file_part(copy) == part
+   assert mock_api.state.stats["uploads"] == 1
+   assert registry.get_stats()["hits"] == 2
+   assert part["file_data"]["mime_type"] == "image/png"
+
+
+
+
+def test_handles_persist_across_registries(mock_api, tmp_path):
+   path = write_reference(tmp_path / "sheet.png")
+   part = make_registry(mock_api, tmp_path).get_file_part(path)
+  
+   reloaded = make_registry(mock_api, tmp_path)
+  
+   assert reloaded.get_file_part(path) == part
+   assert mock_api.state.stats["uploads"] == 1
+
+
+
+
+def test_handles_near_expiry_are_uploaded_again(mock_api, tmp_path):
+   mock_api.state.file_ttl_seconds = 60
+   registry = make_registry(mock_api, tmp_path, refresh_margin_minutes=5)
+   path = write_reference(tmp_path / "sheet.png")
+  
+   first = registry.get_file_part(path)
+   second = registry.get_file_part(path)
+  
+   assert first != second
+   assert registry.get_stats()["refreshes"] == 1
+   assert mock_api.state.stats["uploads"] == 2
+
+
+
+
+def test_refresh_payload_swaps_in_new_uris(mock_api, tmp_path):
+   registry = make_registry(mock_api, tmp_path, registry_path=None)
+   path = write_reference(tmp_path / "sheet.png")
+   old_uri = registry.get_file_part(path)["file_data"]["file_uri"]
+   payload = file_payload(old_uri)
+  
+   assert registry.refresh_payload(payload)
+  
+   new_uri = payload["contents"][0]["parts"][0]["file_data"]["file_uri"]
+   assert new_uri != old_uri
+   assert registry.get_stats()["refreshes"] == 1
+   assert not registry.refresh_payload(file_payload("https://elsewhere/files/unknown"))
+
+
+
+
+# =============================================================================
+# CLIENT
+# =============================================================================
+
+
+def test_expired_handles_are_refreshed_and_the_request_retried(mock_api, tmp_path):
+   registry = make_registry(mock_api, tmp_path)
+   client = ImageGenerationClient(
+       "test-key",
+       base_url=mock_api.base_url,
+       file_registry=registry,
+       profiler=Profiler(modes=""),
+       transcoder=Transcoder(max_workers=0)
+   )
+   config = ImageConfig(output_dir=str(tmp_path / "out"), organize_by_date=False)
+   reference = write_reference(tmp_path / "sheet.png")
+  
+   assert client.generate("a cat", config=config, reference_images=[reference], save_to="one.png")["success"]
+   # The server forgets the upload before the handle's advertised expiry
+   mock_api.state.expire_all_files()
+   result = client.generate("a dog", config=config, reference_images=[reference], save_to="two.png")
+  
+   assert result["success"], result.get("error")
+   assert mock_api.state.stats["rejected_file_uris"] == 1
+   assert mock_api.state.stats["uploads"] == 2
+   assert registry.get_stats()["refreshes"] == 1
+   client.close()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Tests for hedged requests on threads and asyncio.
+Run with: python -m pytest test_hedging.py
+"""
+
+
+import asyncio
+import threading
+import time
+
+
+import pytest
+
+
+from hedging import HedgingPolicy
+
+
+
+
+class FakeResponse:
+   """Stands in for a TransportResponse; records whether it was released"""
+  
+   def __init__(self, name):
+       self.name = name
+       self.closed = threading.Event()
+  
+   def close(self):
+       self.closed.set()
+
+
+
+
+def slow_then_fast(first_delay, later_delay=0.0):
+   """A send() whose first call takes first_delay and later calls later_delay"""
+   calls = []
+   lock = threading.Lock()
+  
+   def send():
+       with lock:
+           number = len(calls)
+           response = FakeResponse("primary" if number == 0 else f"call{number}")
+           calls.append(response)
+       time.sleep(first_delay if number == 0 else later_delay)
+       return response
+  
+   send.calls = calls
+   return send
+
+
+
+
+def warmed_policy(latency=0.05, samples=5, **options):
+   options.setdefault("max_rate", 1.0)
+   policy = HedgingPolicy(min_samples=samples, min_delay=0.0, **options)
+   for _ in range(samples):
+       policy.record(latency)
+   return policy
+
+
+
+
+# =============================================================================
+# POLICY
+# =============================================================================
+
+
+def test_no_hedging_until_enough_samples():
+   policy = HedgingPolicy(min_samples=3, min_delay=0.0)
+   send = slow_then_fast(0.05)
+  
+   assert policy.hedge_delay() is None
+   assert policy.call(send).name == "primary"
+   assert len(send.calls) == 1
+   assert policy.get_stats()["hedged"] == 0
+
+
+
+
+def test_delay_is_the_window_percentile_but_never_below_min_delay():
+   policy = HedgingPolicy(percentile=0.9, min_samples=10, min_delay=0.0)
+   for latency in range(1, 11):
+       policy.record(latency / 10)
+  
+   assert policy.hedge_delay() == pytest.approx(0.9)
+   policy.min_delay = 5.0
+   assert policy.hedge_delay() == 5.0
+
+
+
+
+def test_invalid_settings_are_rejected():
+   with pytest.raises(ValueError):
+       HedgingPolicy(percentile=1.5)
+   with pytest.raises(ValueError):
+       HedgingPolicy(max_rate=2)
+
+
+
+
+# =============================================================================
+# THREADS
+# =============================================================================
+
+
+def test_slow_call_is_hedged_and_the_loser_released():
+   policy = warmed_policy()
+   send = slow_then_fast(0.5)
+   try:
+       started = time.perf_counter()
+       winner = policy.call(send)
+       elapsed = time.perf_counter() - started
+      
+       assert winner.name == "call1"
+       assert elapsed < 0.4
+       # The slow primary is closed once it lands
+       assert send.calls[0].closed.wait(2)
+       stats = policy.get_stats()
+       assert stats["hedged"] == 1
+       assert stats["hedge_wins"] == 1
+       assert stats["latency_saved_seconds"] > 0
+   finally:
+       policy.close()
+
+
+
+
+def test_fast_call_is_not_hedged():
+   policy = warmed_policy(latency=0.5)
+   send = slow_then_fast(0.01)
+   try:
+       assert policy.call(send).name == "primary"
+       assert len(send.calls) == 1
+   finally:
+       policy.close()
+
+
+
+
+def test_hedge_rate_is_capped():
+   policy = warmed_policy(max_rate=0.5)
+   try:
+       # The first slow call would make the hedge rate 1/1, above the cap
+       assert policy.call(slow_then_fast(0.15)).name == "primary"
+       assert policy.get_stats()["rate_capped"] == 1
+       policy.call(slow_then_fast(0.0))
+       assert policy.call(slow_then_fast(0.3)).name == "call1"
+       stats = policy.get_stats()
+       assert stats["hedged"] == 1
+       assert stats["hedge_rate"] <= 0.5
+   finally:
+       policy.close()
+
+
+
+
+def test_failed_primary_falls_back_to_the_hedge():
+   policy = warmed_policy()
+   calls = []
+  
+   def send():
+       calls.append(1)
+       if len(calls) == 1:
+           time.sleep(0.2)
+           raise RuntimeError("primary failed")
+       time.sleep(0.3)
+       return FakeResponse("hedge")
+  
+   try:
+       assert policy.call(send).name == "hedge"
+   finally:
+       policy.close()
+
+
+
+
+# =============================================================================
+# ASYNCIO
+# =============================================================================
+
+
+def test_async_loser_is_cancelled():
+   policy = warmed_policy()
+   cancelled = []
+   calls = []
+  
+   async def send():
+       calls.append(1)
+       try:
+           await asyncio.sleep(1.0 if len(calls) == 1 else 0.0)
+       except asyncio.CancelledError:
+           cancelled.append(1)
+           raise
+       return f"call{len(calls)}"
+  
+   async def main():
+       result = await policy.call_async(send)
+       await asyncio.sleep(0)
+       return result
+  
+   started = time.perf_counter()
+   assert asyncio.run(main()) == "call2"
+   assert time.perf_counter() - started < 0.5
+   assert cancelled == [1]
+   assert policy.get_stats()["hedge_wins"] == 1
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Tests for header-only PNG/JPEG/WebP metadata and its cache.
+Run with: python -m pytest test_image_metadata.py
+"""
+
+
+import io
+
+
+import pytest
+from PIL import Image
+
+
+from image_metadata import ImageMetadataCache, parse_image_header
+
+
+
+
+def encode(mode, size, format, **options):
+   buffer = io.BytesIO()
+   color = 128 if mode in ("L", "1", "P") else tuple([128] * len(mode))
+   Image.new(mode, size, color).save(buffer, format=format, **options)
+   return buffer.getvalue()
+
+
+
+
+def pil_metadata(data):
+   with Image.open(io.BytesIO(data)) as image:
+       return {"width": image.width, "height": image.height, "format": image.format, "mode": image.mode}
+
+
+
+
+# =============================================================================
+# HEADER PARSERS
+# =============================================================================
+
+
+@pytest.mark.parametrize("mode, format, options", [
+   ("RGB", "PNG", {}),
+   ("RGBA", "PNG", {}),
+   ("L", "PNG", {}),
+   ("P", "PNG", {}),
+   ("RGB", "JPEG", {}),
+   ("L", "JPEG", {}),
+   ("RGB", "JPEG", {"progressive": True}),
+   ("RGB", "JPEG", {"exif": b"Exif\x00\x00" + b"\x00" * 2000}),
+   ("RGB", "WEBP", {"quality": 80}),
+   ("RGB", "WEBP", {"lossless": True}),
+   ("RGBA", "WEBP", {"lossless": True}),
+   ("RGBA", "WEBP", {"quality": 80})
+])
+def test_headers_match_pil(mode, format, options):
+   data = encode(mode, (321, 123), format, **options)
+  
+   assert parse_image_header(data) == pil_metadata(data)
+
+
+
+
+def test_header_alone_is_enough():
+   data = encode("RGB", (2000, 1500), "PNG")
+  
+   assert parse_image_header(data[:64]) == {"width": 2000, "height": 1500, "format": "PNG", "mode": "RGB"}
+
+
+
+
+def test_unknown_or_truncated_data_is_not_parsed():
+   assert parse_image_header(b"GIF89a" + b"\x00" * 64) is None
+   assert parse_image_header(encode("RGB", (8, 8), "PNG")[:20]) is None
+   assert parse_image_header(encode("RGB", (8, 8), "JPEG")[:4]) is None
+   assert parse_image_header(b"") is None
+
+
+
+
+# =============================================================================
+# CACHE
+# =============================================================================
+
+
+def test_cached_metadata_is_reused_until_the_file_changes(tmp_path):
+   cache = ImageMetadataCache()
+   path = tmp_path / "image.png"
+   path.write_bytes(encode("RGB", (40, 30), "PNG"))
+  
+   first = cache.get(str(path))
+   assert cache.get(str(path)) == first
+   assert first["size_bytes"] == path.stat().st_size
+  
+   path.write_bytes(encode("RGBA", (80, 60), "PNG"))
+   changed = cache.get(str(path))
+  
+   assert (changed["width"], changed["mode"]) == (80, "RGBA")
+   stats = cache.get_stats()
+   assert (stats["hits"], stats["misses"]) == (1, 2)
+
+
+
+
+def test_remembered_bytes_skip_reading_the_file(tmp_path):
+   cache = ImageMetadataCache()
+   path = tmp_path / "image.jpeg"
+   data = encode("RGB", (64, 48), "JPEG")
+   path.write_bytes(data)
+  
+   cache.remember(str(path), data)
+  
+   assert cache.get(str(path))["width"] == 64
+   assert cache.get_stats()["misses"] == 0
+
+
+
+
+def test_unparsed_formats_fall_back_to_pil(tmp_path):
+   cache = ImageMetadataCache()
+   path = tmp_path / "image.gif"
+   path.write_bytes(encode("P", (20, 10), "GIF"))
+  
+   metadata = cache.get(str(path))
+  
+   assert (metadata["width"], metadata["height"], metadata["format"]) == (20, 10, "GIF")
+   assert cache.get_stats()["pil_fallbacks"] == 1
+
+
+
+
+def test_least_recently_used_entries_are_dropped(tmp_path):
+   cache = ImageMetadataCache(max_entries=2)
+   for i in range(3):
+       (tmp_path / f"{i}.png").write_bytes(encode("RGB", (8, 8), "PNG"))
+       cache.get(str(tmp_path / f"{i}.png"))
+  
+   assert cache.get_stats()["entries"] == 2
+   cache.get(str(tmp_path / "0.png"))
+   assert cache.get_stats()["misses"] == 4
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Tests for per-stage timing spans and their sinks.
+Run with: python -m pytest test_metrics.py
+"""
+
+
+import json
+import threading
+
+
+import pytest
+
+
+from config import ImageConfig
+from image_client import ImageGenerationClient
+from metrics import HistogramSink, JSONLTraceSink, Metrics, MetricsSink, call_tags, current_call_tags
+from profiling import Profiler
+from stats import percentile
+from transcode import Transcoder
+
+
+
+
+class ListSink(MetricsSink):
+   def __init__(self):
+       self.spans = []
+  
+   def record(self, span):
+       self.spans.append(span)
+
+
+
+
+# =============================================================================
+# PERCENTILE
+# =============================================================================
+
+
+def test_percentile_is_nearest_rank():
+   values = [0.5, 0.1, 0.4, 0.2, 0.3]
+  
+   assert percentile(values, 0.5) == 0.3
+   assert percentile(values, 0.9) == 0.5
+   assert percentile(values, 0.0) == 0.1
+   assert percentile([7.0], 0.99) == 7.0
+
+
+
+
+# =============================================================================
+# SINKS
+# =============================================================================
+
+
+def test_sinks_must_implement_record():
+   with pytest.raises(TypeError):
+       MetricsSink()
+  
+   class NoRecord(MetricsSink):
+       pass
+  
+   with pytest.raises(TypeError):
+       NoRecord()
+
+
+
+
+def test_spans_carry_the_call_tags():
+   sink = ListSink()
+   metrics = Metrics([sink])
+  
+   with call_tags(model="m", session_id="s1"):
+       with metrics.span("encode", references=2):
+           assert current_call_tags() == {"model": "m", "session_id": "s1"}
+       with pytest.raises(RuntimeError):
+           with metrics.span("request"):
+               raise RuntimeError("boom")
+  
+   assert current_call_tags() == {}
+   assert [(span["stage"], span["ok"]) for span in sink.spans] == [("encode", True), ("request", False)]
+   assert sink.spans[0]["tags"] == {"model": "m", "session_id": "s1", "references": 2}
+
+
+
+
+def test_histogram_summary_and_prometheus_text():
+   histograms = HistogramSink(buckets=[0.1, 1.0], labels=["model"])
+   metrics = Metrics([histograms])
+   for seconds in (0.05, 0.5, 2.0):
+       metrics.record("request", seconds, model="m")
+   metrics.record("request", 0.2, ok=False, model="other")
+  
+   summary = histograms.summary()
+   text = histograms.prometheus_text()
+  
+   assert summary["request"]["count"] == 4
+   assert summary["request"]["errors"] == 1
+   assert summary["request"]["max"] == 2.0
+   assert set(histograms.summary(by_labels=True)) == {"request{model=m}", "request{model=other}"}
+   assert 'imagegen_stage_seconds_bucket{stage="request",model="m",le="0.1"} 1' in text
+   assert 'imagegen_stage_seconds_bucket{stage="request",model="m",le="1"} 2' in text
+   assert 'imagegen_stage_seconds_count{stage="request",model="m"} 3' in text
+
+
+
+
+def test_histogram_is_safe_across_threads():
+   histograms = HistogramSink(labels=[])
+   metrics = Metrics([histograms])
+  
+   def work():
+       for _ in range(500):
+           metrics.record("write", 0.01)
+  
+   threads = [threading.Thread(target=work) for _ in range(4)]
+   for thread in threads:
+       thread.start()
+   for thread in threads:
+       thread.join()
+  
+   assert histograms.summary()["write"]["count"] == 2000
+
+
+
+
+def test_trace_sink_appends_json_lines(tmp_path):
+   path = tmp_path / "metrics" / "trace.jsonl"
+   metrics = Metrics([JSONLTraceSink(str(path))])
+  
+   metrics.record("decode", 0.25, model="m")
+   metrics.close()
+   # Spans after close are dropped, not raised
+   metrics.record("decode", 0.25)
+  
+   lines = path.read_text(encoding="utf-8").splitlines()
+   assert len(lines) == 1
+   assert json.loads(lines[0])["tags"] == {"model": "m"}
+
+
+
+
+# =============================================================================
+# CLIENT
+# =============================================================================
+
+
+def test_client_records_its_stages(mock_api, tmp_path):
+   histograms = HistogramSink()
+   client = ImageGenerationClient(
+       "test-key",
+       base_url=mock_api.base_url,
+       metrics=Metrics([histograms]),
+       profiler=Profiler(modes=""),
+       transcoder=Transcoder(max_workers=0)
+   )
+   config = ImageConfig(output_dir=str(tmp_path), organize_by_date=False)
+  
+   assert client.generate("a cat", config=config)["success"]
+  
+   summary = histograms.summary()
+   assert {"request", "decode", "write"} <= set(summary)
+   assert all(stats["errors"] == 0 for stats in summary.values())
+   client.close()
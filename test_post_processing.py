@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Tests for the post-processing stage that saves images off the request thread.
+Run with: python -m pytest test_post_processing.py
+"""
+
+
+import contextvars
+import os
+import threading
+from concurrent.futures import Future
+
+
+import pytest
+
+
+from config import ImageConfig
+from image_client import ImageGenerationClient
+from post_processing import PostProcessor, resolve_result
+from profiling import Profiler
+from transcode import Transcoder
+
+
+
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+
+
+def make_client(mock_api, post_processor):
+   return ImageGenerationClient(
+       "test-key",
+       base_url=mock_api.base_url,
+       post_processor=post_processor,
+       profiler=Profiler(modes=""),
+       transcoder=Transcoder(max_workers=0)
+   )
+
+
+
+
+# =============================================================================
+# POST PROCESSOR
+# =============================================================================
+
+
+def test_jobs_run_on_workers_with_the_callers_context():
+   processor = PostProcessor(max_workers=2)
+   token = request_id.set("panel-1")
+   try:
+       future = processor.submit(lambda: (request_id.get(), threading.current_thread().name))
+      
+       value, thread_name = future.result()
+       assert value == "panel-1"
+       assert thread_name.startswith("post")
+   finally:
+       request_id.reset(token)
+       processor.close()
+
+
+
+
+def test_failed_jobs_are_counted_and_raise_from_the_future():
+   processor = PostProcessor()
+   try:
+       def boom():
+           raise RuntimeError("disk full")
+      
+       future = processor.submit(boom)
+      
+       with pytest.raises(RuntimeError, match="disk full"):
+           future.result()
+       processor.submit(lambda: None).result()
+       stats = processor.get_stats()
+       assert (stats["failed"], stats["completed"], stats["pending"]) == (1, 1, 0)
+   finally:
+       processor.close()
+
+
+
+
+def test_resolve_result_accepts_plain_results_and_futures():
+   future = Future()
+   future.set_result({"success": True})
+  
+   assert resolve_result({"success": False}) == {"success": False}
+   assert resolve_result(future) == {"success": True}
+
+
+
+
+# =============================================================================
+# CLIENT
+# =============================================================================
+
+
+def test_generate_without_waiting_returns_a_future(mock_api, tmp_path):
+   client = make_client(mock_api, PostProcessor())
+   config = ImageConfig(output_dir=str(tmp_path), organize_by_date=False)
+  
+   pending = [
+       client.generate(f"panel {i}", config=config, save_to=f"panel_{i}.png", wait=False)
+       for i in range(3)
+   ]
+  
+   assert all(isinstance(future, Future) for future in pending)
+   results = [future.result() for future in pending]
+   assert all(result["success"] for result in results)
+   assert all(os.path.exists(result.generated_images[0]["file_path"]) for result in results)
+   assert client.post_processor.get_stats()["completed"] == 3
+   client.close()
+
+
+
+
+def test_transforms_run_on_every_saved_image(mock_api, tmp_path):
+   seen = []
+  
+   def tag(image):
+       seen.append(threading.current_thread().name)
+       return dict(image, tagged=True)
+  
+   client = make_client(mock_api, PostProcessor(transforms=[tag]))
+   config = ImageConfig(output_dir=str(tmp_path), organize_by_date=False, num_images=2, multi_candidate=False)
+  
+   result = client.generate("two cats", config=config, save_to="cat.png")
+  
+   assert result["success"]
+   assert all(image["tagged"] for image in result.generated_images)
+   assert len(seen) == 2
+   assert all(name.startswith("post") for name in seen)
+   client.close()
+
+
+
+
+def test_waiting_generate_still_returns_a_plain_result(mock_api, tmp_path):
+   client = make_client(mock_api, PostProcessor())
+   config = ImageConfig(output_dir=str(tmp_path), organize_by_date=False)
+  
+   result = client.generate("a cat", config=config)
+  
+   assert not isinstance(result, Future)
+   assert result["success"]
+   client.close()
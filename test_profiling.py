@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Tests for opt-in cProfile/tracemalloc profiling of generation calls.
+Run with: python -m pytest test_profiling.py
+"""
+
+
+import os
+import tracemalloc
+
+
+import pytest
+
+
+from config import ImageConfig
+from image_client import ImageGenerationClient
+from profiling import Profiler, get_profiler, profiled, set_profiler
+from transcode import Transcoder
+
+
+
+
+def reports(profiles_dir):
+   return sorted(os.listdir(profiles_dir)) if os.path.isdir(profiles_dir) else []
+
+
+
+
+# =============================================================================
+# PROFILER
+# =============================================================================
+
+
+def test_disabled_profiler_writes_nothing(tmp_path):
+   profiler = Profiler(modes="", profiles_dir=str(tmp_path / "profiles"))
+  
+   with profiler.profile("generate") as base_path:
+       pass
+  
+   assert base_path is None
+   assert not profiler.enabled
+   assert profiler.get_stats()["calls"] == 0
+   assert reports(tmp_path / "profiles") == []
+
+
+
+
+def test_invalid_settings_are_rejected():
+   with pytest.raises(ValueError):
+       Profiler(modes="cpu,disk")
+   with pytest.raises(ValueError):
+       Profiler(modes="cpu", every_n=0)
+
+
+
+
+def test_cpu_profile_is_dumped_with_a_summary(tmp_path):
+   profiler = Profiler(modes="cpu", profiles_dir=str(tmp_path))
+  
+   with profiler.profile("generate") as base_path:
+       sorted(range(10000), key=lambda n: -n)
+  
+   assert os.path.exists(f"{base_path}.prof")
+   with open(f"{base_path}.txt", encoding="utf-8") as f:
+       summary = f.read()
+   assert summary.startswith("generate: ")
+   assert "cumulative" in summary
+
+
+
+
+def test_memory_report_lists_allocation_sites(tmp_path):
+   profiler = Profiler(modes="memory", profiles_dir=str(tmp_path), top_allocations=5)
+  
+   with profiler.profile("decode") as base_path:
+       blocks = [bytearray(64 * 1024) for _ in range(16)]
+  
+   assert len(blocks) == 16
+   with open(f"{base_path}.memory.txt", encoding="utf-8") as f:
+       lines = f.read().splitlines()
+   assert lines[0].startswith("decode: traced peak")
+   assert any("test_profiling.py" in line for line in lines[2:])
+   # Tracing stops with the last traced call
+   assert not tracemalloc.is_tracing()
+
+
+
+
+def test_one_call_in_every_n_per_label_is_profiled(tmp_path):
+   profiler = Profiler(modes="cpu", every_n=3, profiles_dir=str(tmp_path))
+  
+   sampled = []
+   for label in ["generate"] * 6 + ["generate_with_session"]:
+       with profiler.profile(label) as base_path:
+           sampled.append(base_path is not None)
+  
+   assert sampled == [True, False, False, True, False, False, True]
+   stats = profiler.get_stats()
+   assert (stats["calls"], stats["profiled"], stats["reports"]) == (7, 3, 3)
+   assert len(reports(tmp_path)) == 6
+
+
+
+
+def test_nested_calls_are_not_profiled_again(tmp_path):
+   profiler = Profiler(modes="cpu", profiles_dir=str(tmp_path))
+  
+   with profiler.profile("generate") as outer:
+       with profiler.profile("utils.write_image_bytes") as inner:
+           pass
+  
+   assert outer is not None
+   assert inner is None
+   assert profiler.get_stats()["calls"] == 1
+
+
+
+
+def test_profiled_helpers_use_the_process_wide_profiler(tmp_path):
+   @profiled("helpers.double")
+   def double(value):
+       return value * 2
+  
+   previous = get_profiler()
+   set_profiler(Profiler(modes="cpu", profiles_dir=str(tmp_path)))
+   try:
+       assert double(21) == 42
+       assert get_profiler().get_stats()["profiled"] == 1
+   finally:
+       set_profiler(previous)
+  
+   assert any(name.endswith("helpers.double.prof") for name in reports(tmp_path))
+
+
+
+
+# =============================================================================
+# CLIENT
+# =============================================================================
+
+
+def test_client_profiles_generate_calls(mock_api, tmp_path):
+   profiles_dir = tmp_path / "profiles"
+   client = ImageGenerationClient(
+       "test-key",
+       base_url=mock_api.base_url,
+       profiler=Profiler(modes="cpu,memory", profiles_dir=str(profiles_dir)),
+       transcoder=Transcoder(max_workers=0)
+   )
+   config = ImageConfig(output_dir=str(tmp_path / "out"), organize_by_date=False)
+  
+   assert client.generate("a cat", config=config)["success"]
+  
+   names = reports(profiles_dir)
+   assert len(names) == 3
+   assert all("_generate." in name for name in names)
+   client.close()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Tests for the process-wide LRU cache of encoded reference images.
+Run with: python -m pytest test_reference_cache.py
+"""
+
+
+import base64
+import hashlib
+import os
+
+
+from reference_cache import ReferenceImageCache, encode_reference_image, get_reference_cache
+
+
+
+
+def write_file(path, size):
+   data = os.urandom(size)
+   path.write_bytes(data)
+   return data
+
+
+
+
+# =============================================================================
+# HITS AND MISSES
+# =============================================================================
+
+
+def test_second_get_is_a_hit_with_the_same_encoding(tmp_path):
+   cache = ReferenceImageCache()
+   path = tmp_path / "ref.png"
+   data = write_file(path, 1000)
+  
+   first = cache.get(str(path))
+   second = cache.get(str(path))
+  
+   assert second is first
+   assert base64.b64decode(first.base64_data) == data
+   assert first.mime_type == "image/png"
+   assert first.size_bytes == 1000
+   assert first.sha256 == hashlib.sha256(data).hexdigest()
+   stats = cache.get_stats()
+   assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+
+
+def test_changed_file_misses_and_replaces_the_stale_entry(tmp_path):
+   cache = ReferenceImageCache()
+   path = tmp_path / "ref.png"
+   write_file(path, 1000)
+   cache.get(str(path))
+  
+   data = write_file(path, 1200)
+   entry = cache.get(str(path))
+  
+   assert base64.b64decode(entry.base64_data) == data
+   stats = cache.get_stats()
+   assert stats["misses"] == 2
+   assert stats["entries"] == 1
+   assert stats["cached_bytes"] == len(entry.base64_data)
+
+
+
+
+# =============================================================================
+# EVICTION
+# =============================================================================
+
+
+def test_least_recently_used_entry_is_evicted_at_the_cap(tmp_path):
+   # Each 3000-byte file encodes to 4000 base64 characters
+   cache = ReferenceImageCache(max_bytes=10000)
+   paths = [tmp_path / f"ref{i}.png" for i in range(3)]
+   for path in paths:
+       write_file(path, 3000)
+   cache.get(str(paths[0]))
+   cache.get(str(paths[1]))
+   cache.get(str(paths[0]))
+  
+   cache.get(str(paths[2]))
+  
+   stats = cache.get_stats()
+   assert stats["evictions"] == 1
+   assert stats["cached_bytes"] == 8000
+   cache.get(str(paths[0]))
+   assert cache.get_stats()["hits"] == 2
+   cache.get(str(paths[1]))
+   assert cache.get_stats()["misses"] == 4
+
+
+
+
+def test_entries_larger_than_the_cap_are_not_kept(tmp_path):
+   cache = ReferenceImageCache(max_bytes=100)
+   path = tmp_path / "big.png"
+   data = write_file(path, 1000)
+  
+   assert base64.b64decode(cache.get(str(path)).base64_data) == data
+   assert cache.get_stats()["entries"] == 0
+
+
+
+
+def test_encode_reference_image_uses_the_shared_cache(tmp_path):
+   path = tmp_path / "ref.jpg"
+   write_file(path, 500)
+   before = get_reference_cache().get_stats()["hits"]
+  
+   encode_reference_image(str(path))
+   entry = encode_reference_image(str(path))
+  
+   assert entry.mime_type == "image/jpeg"
+   assert get_reference_cache().get_stats()["hits"] == before + 1
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Tests for downscaling and recompressing reference images before upload.
+Run with: python -m pytest test_reference_optimizer.py
+"""
+
+
+import base64
+import io
+
+
+from PIL import Image
+
+
+from config import ReferenceUploadConfig
+from mock_server import make_noise_png
+from reference_optimizer import ReferenceOptimizer, optimize_image, optimize_reference
+
+
+
+
+def decode(entry):
+   return Image.open(io.BytesIO(base64.b64decode(entry.base64_data)))
+
+
+
+
+def write_sheet(path, size_mb=0.5):
+   data = make_noise_png(size_mb)
+   path.write_bytes(data)
+   return data
+
+
+
+
+# =============================================================================
+# OPTIMIZE IMAGE
+# =============================================================================
+
+
+def test_large_sheet_is_downscaled_and_recompressed(tmp_path):
+   path = tmp_path / "sheet.png"
+   original = write_sheet(path)
+  
+   data, mime_type, resized = optimize_image(str(path), ReferenceUploadConfig(max_long_edge=128))
+  
+   assert resized
+   assert mime_type == "image/jpeg"
+   with Image.open(io.BytesIO(data)) as image:
+       assert max(image.size) == 128
+       assert image.format == "JPEG"
+   # The original file is never modified
+   assert path.read_bytes() == original
+
+
+
+
+def test_alpha_is_flattened_for_jpeg(tmp_path):
+   path = tmp_path / "alpha.png"
+   Image.new("RGBA", (64, 32), (255, 0, 0, 0)).save(path)
+  
+   data, _, resized = optimize_image(str(path), ReferenceUploadConfig(format="jpeg"))
+  
+   assert not resized
+   with Image.open(io.BytesIO(data)) as image:
+       assert image.mode == "RGB"
+       # Transparent pixels become the white background
+       assert all(channel > 240 for channel in image.getpixel((10, 10)))
+
+
+
+
+def test_byte_budget_lowers_quality_then_size(tmp_path):
+   path = tmp_path / "sheet.png"
+   write_sheet(path)
+   options = ReferenceUploadConfig(max_bytes=20 * 1024, quality=90, min_quality=50)
+  
+   data, _, resized = optimize_image(str(path), options)
+  
+   assert len(data) <= 20 * 1024
+   assert resized
+
+
+
+
+# =============================================================================
+# OPTIMIZER CACHE
+# =============================================================================
+
+
+def test_same_settings_hit_and_new_settings_miss(tmp_path):
+   optimizer = ReferenceOptimizer()
+   path = tmp_path / "sheet.png"
+   write_sheet(path)
+  
+   first = optimizer.get(str(path), ReferenceUploadConfig(max_long_edge=128))
+   again = optimizer.get(str(path), ReferenceUploadConfig(max_long_edge=128))
+   other = optimizer.get(str(path), ReferenceUploadConfig(max_long_edge=64))
+  
+   assert again is first
+   assert max(decode(other).size) == 64
+   stats = optimizer.get_stats()
+   assert (stats["hits"], stats["misses"]) == (1, 2)
+   assert stats["bytes_saved"] > 0
+
+
+
+
+def test_copies_of_a_file_share_one_entry(tmp_path):
+   optimizer = ReferenceOptimizer()
+   data = make_noise_png(0.2)
+   (tmp_path / "a.png").write_bytes(data)
+   (tmp_path / "b.png").write_bytes(data)
+   options = ReferenceUploadConfig(max_long_edge=64)
+  
+   first = optimizer.get(str(tmp_path / "a.png"), options)
+   second = optimizer.get(str(tmp_path / "b.png"), options)
+  
+   assert second is first
+   assert optimizer.get_stats()["entries"] == 1
+
+
+
+
+def test_original_is_sent_when_reencoding_does_not_help(tmp_path):
+   optimizer = ReferenceOptimizer()
+   path = tmp_path / "flat.png"
+   # Already saved the way the optimizer would encode it
+   Image.new("RGB", (32, 32), (90, 140, 200)).save(path, format="PNG", optimize=True)
+   original = path.read_bytes()
+  
+   entry = optimizer.get(str(path), ReferenceUploadConfig(format="png"))
+  
+   assert base64.b64decode(entry.base64_data) == original
+   assert entry.mime_type == "image/png"
+
+
+
+
+def test_no_options_sends_the_original_encoding(tmp_path):
+   path = tmp_path / "sheet.png"
+   original = write_sheet(path, 0.1)
+  
+   entry = optimize_reference(str(path), None)
+  
+   assert base64.b64decode(entry.base64_data) == original
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Tests for lean result objects and their opt-in raw payload.
+Run with: python -m pytest test_results.py
+"""
+
+
+import json
+import os
+
+
+import pytest
+
+
+from config import ImageConfig
+from image_client import ImageGenerationClient
+from profiling import Profiler
+from results import GenerationResult
+from session_manager import SessionManager
+from transcode import Transcoder
+
+
+
+
+RESPONSE = {
+   "candidates": [{"content": {"parts": [{"inlineData": {"mimeType": "image/png", "data": "aGVsbG8="}}]}}],
+   "usageMetadata": {"promptTokenCount": 12}
+}
+
+
+
+
+def make_result(**fields):
+   return GenerationResult(
+       "a cat",
+       {"aspect_ratio": "1:1", "num_images": 1},
+       None,
+       [{"file_path": "/tmp/cat.png", "info": {"width": 64}}],
+       usage_metadata=RESPONSE["usageMetadata"],
+       **fields
+   )
+
+
+
+
+def make_client(mock_api, tmp_path):
+   return ImageGenerationClient(
+       "test-key",
+       base_url=mock_api.base_url,
+       session_manager=SessionManager(str(tmp_path / "sessions")),
+       profiler=Profiler(modes=""),
+       transcoder=Transcoder(max_workers=0)
+   )
+
+
+
+
+# =============================================================================
+# RESULT OBJECT
+# =============================================================================
+
+
+def test_result_has_slots_and_the_old_dict_interface():
+   result = make_result(timings={"request": 0.5})
+  
+   assert not hasattr(result, "__dict__")
+   assert result["success"] and result.success
+   assert result["timings"] == {"request": 0.5}
+   assert result.get("session_id") is None
+   assert "session_id" not in result
+   assert "response" in result
+   with pytest.raises(KeyError):
+       result["nonsense"] = 1
+
+
+
+
+def test_source_is_exposed_as_a_flag():
+   result = make_result(source="cached")
+  
+   assert result["cached"] is True
+   assert "coalesced" not in result
+   assert "cached" in result.keys()
+
+
+
+
+def test_discarded_payload_leaves_only_usage():
+   result = make_result()
+  
+   result.attach_response(RESPONSE, "discard")
+  
+   assert result.load_response() is None
+   assert result["response"] == {"usageMetadata": {"promptTokenCount": 12}}
+
+
+
+
+def test_kept_payload_is_returned_as_is():
+   result = make_result()
+  
+   result.attach_response(RESPONSE, "keep")
+  
+   assert result.load_response() is RESPONSE
+   assert result.to_dict(include_response=True)["response"] is RESPONSE
+   assert result.to_dict()["response"] == {"usageMetadata": {"promptTokenCount": 12}}
+
+
+
+
+def test_spilled_payload_is_loaded_on_demand_and_deleted_on_discard(tmp_path):
+   result = make_result()
+  
+   result.attach_response(RESPONSE, "spill", spill_dir=str(tmp_path))
+  
+   assert os.path.dirname(result.spill_path) == str(tmp_path)
+   assert result.load_response() == RESPONSE
+   # Every load reads the file again: nothing is retained
+   assert result.load_response() is not result.load_response()
+   result.discard_response()
+   assert result.spill_path is None
+   assert os.listdir(tmp_path) == []
+
+
+
+
+def test_to_dict_is_json_serializable():
+   result = make_result(timings={"request": 0.5}, session_id="s1")
+  
+   data = json.loads(json.dumps(result.to_dict()))
+  
+   assert data["success"] is True
+   assert data["session_id"] == "s1"
+   assert data["generated_images"][0]["file_path"] == "/tmp/cat.png"
+
+
+
+
+# =============================================================================
+# CLIENT
+# =============================================================================
+
+
+@pytest.mark.parametrize("mode, kept", [("discard", False), ("keep", True)])
+def test_client_results_hold_the_payload_only_on_request(mock_api, tmp_path, mode, kept):
+   client = make_client(mock_api, tmp_path)
+   config = ImageConfig(output_dir=str(tmp_path / "out"), organize_by_date=False, raw_response=mode)
+  
+   result = client.generate("a cat", config=config)
+  
+   assert isinstance(result, GenerationResult)
+   assert result["usage_metadata"] is not None
+   assert (result.load_response() is not None) == kept
+   client.close()
+
+
+
+
+def test_session_results_do_not_hold_the_http_response(mock_api, tmp_path):
+   client = make_client(mock_api, tmp_path)
+   session = client.create_session()
+   config = ImageConfig(output_dir=str(tmp_path / "out"), organize_by_date=False)
+  
+   result = client.generate_with_session(session, "a cat", config=config)
+  
+   assert isinstance(result, GenerationResult)
+   assert result["session_id"] == session.session_id
+   assert result.load_response() is None
+   assert os.path.exists(result.generated_images[0]["file_path"])
+   client.close()
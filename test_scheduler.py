@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Tests for RequestScheduler admission, backoff and Retry-After handling.
+Run with: python -m pytest test_scheduler.py
+"""
+
+
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+
+import pytest
+
+
+from scheduler import RequestScheduler, TokenBucket, parse_retry_after
+from transport import TransportError
+
+
+
+
+def failing(errors, result="ok"):
+   """A send() that raises the given errors in turn, then returns result"""
+   remaining = list(errors)
+   calls = []
+  
+   def send():
+       calls.append(time.monotonic())
+       if remaining:
+           raise remaining.pop(0)
+       return result
+  
+   send.calls = calls
+   return send
+
+
+
+
+def status_error(status, retry_after=None):
+   headers = {"Retry-After": retry_after} if retry_after is not None else {}
+   return TransportError(f"{status} Error", status, headers)
+
+
+
+
+# =============================================================================
+# RETRY-AFTER AND TOKEN BUCKET
+# =============================================================================
+
+
+def test_parse_retry_after_seconds_and_dates():
+   assert parse_retry_after("3") == 3.0
+   assert parse_retry_after("-1") == 0.0
+   assert parse_retry_after(None) is None
+   assert parse_retry_after("soon") is None
+   retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+   assert 25 < parse_retry_after(format_datetime(retry_at, usegmt=True)) <= 30
+   past = datetime.now(timezone.utc) - timedelta(seconds=30)
+   assert parse_retry_after(format_datetime(past, usegmt=True)) == 0.0
+
+
+
+
+def test_token_bucket_allows_burst_then_spaces_requests():
+   bucket = TokenBucket(rate_per_minute=600, burst=2)
+  
+   assert bucket.reserve() == 0.0
+   assert bucket.reserve() == 0.0
+   # Ten tokens a second: the third waits about 0.1 s, the fourth about 0.2 s
+   assert bucket.reserve() == pytest.approx(0.1, abs=0.02)
+   assert bucket.reserve() == pytest.approx(0.2, abs=0.02)
+
+
+
+
+# =============================================================================
+# RETRIES
+# =============================================================================
+
+
+def test_server_errors_are_retried_with_capped_backoff():
+   scheduler = RequestScheduler(requests_per_minute=6000, burst=10, base_delay=0.02, max_delay=0.05)
+   send = failing([status_error(503), status_error(500), status_error(502)])
+  
+   assert scheduler.call("model", send) == "ok"
+  
+   stats = scheduler.get_stats()
+   assert stats["attempts"] == 4
+   assert stats["retries"] == 3
+   assert stats["server_errors"] == 3
+   # Full jitter never waits longer than the cap
+   assert stats["backoff_wait_seconds"] <= 0.02 + 0.04 + 0.05
+
+
+
+
+def test_client_errors_are_not_retried():
+   scheduler = RequestScheduler(burst=10)
+   send = failing([status_error(400)])
+  
+   with pytest.raises(TransportError) as error:
+       scheduler.call("model", send)
+  
+   assert error.value.status_code == 400
+   assert len(send.calls) == 1
+   assert scheduler.get_stats()["gave_up"] == 1
+
+
+
+
+def test_gives_up_after_max_retries():
+   scheduler = RequestScheduler(burst=10, max_retries=2, base_delay=0.001)
+   send = failing([status_error(503)] * 5)
+  
+   with pytest.raises(TransportError) as error:
+       scheduler.call("model", send)
+  
+   assert "gave up after 3 attempts" in str(error.value)
+   assert error.value.status_code == 503
+   assert len(send.calls) == 3
+
+
+
+
+def test_connection_errors_are_retried():
+   scheduler = RequestScheduler(burst=10, base_delay=0.001)
+   send = failing([TransportError("connection reset")])
+  
+   assert scheduler.call("model", send) == "ok"
+   assert scheduler.get_stats()["connection_errors"] == 1
+
+
+
+
+# =============================================================================
+# RATE LIMITS
+# =============================================================================
+
+
+def test_retry_after_sets_the_wait_before_the_next_attempt():
+   scheduler = RequestScheduler(burst=10, base_delay=10)
+   send = failing([status_error(429, retry_after="0.2")])
+  
+   assert scheduler.call("model", send) == "ok"
+  
+   first, second = send.calls
+   assert second - first >= 0.19
+   stats = scheduler.get_stats()
+   assert stats["rate_limited"] == 1
+   assert stats["backoff_wait_seconds"] == pytest.approx(0.2)
+
+
+
+
+def test_rate_limit_cooldown_is_shared_by_other_callers():
+   scheduler = RequestScheduler(burst=10)
+   limited = threading.Event()
+  
+   def rate_limited_once():
+       if not limited.is_set():
+           limited.set()
+           raise status_error(429, retry_after="0.3")
+       return "ok"
+  
+   worker = threading.Thread(target=scheduler.call, args=("model", rate_limited_once))
+   worker.start()
+   limited.wait(5)
+   # Give the worker a moment to record the 429
+   time.sleep(0.05)
+   started = time.monotonic()
+   assert scheduler.call("other-model", lambda: "ok") == "ok"
+   worker.join()
+  
+   # The second caller waited out the first caller's Retry-After
+   assert time.monotonic() - started >= 0.2
+   assert scheduler.get_stats()["throttle_wait_seconds"] > 0
+
+
+
+
+def test_each_model_has_its_own_bucket():
+   scheduler = RequestScheduler(requests_per_minute=60, burst=1, model_limits={"fast": 6000})
+  
+   started = time.monotonic()
+   for _ in range(3):
+       scheduler.call("fast", lambda: "ok")
+   scheduler.call("slow", lambda: "ok")
+  
+   # Only the per-model override's short waits were paid
+   assert time.monotonic() - started < 0.5
+
+
+
+
+def test_async_calls_retry_the_same_way():
+   scheduler = RequestScheduler(burst=10, base_delay=0.001)
+   errors = [status_error(503), status_error(429, retry_after="0.05")]
+  
+   async def send():
+       if errors:
+           raise errors.pop(0)
+       return "ok"
+  
+   assert asyncio.run(scheduler.call_async("model", send)) == "ok"
+   stats = scheduler.get_stats()
+   assert stats["retries"] == 2
+   assert stats["rate_limited"] == 1
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Tests for the SQLite session catalog used by SessionManager.
+Run with: python -m pytest test_session_catalog.py
+"""
+
+
+import os
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+
+# Add parent directory to path to import session_manager
+sys.path.insert(0, str(Path(__file__).parent))
+
+
+from config import SESSION_CATALOG_FILE
+from session_catalog import SessionCatalog
+from session_manager import SessionManager
+
+
+
+
+def make_sessions(session_dir, count):
+   """Create sessions with a few messages each through a manager without a catalog"""
+   manager = SessionManager(session_dir, use_catalog=False)
+   for i in range(count):
+       session = manager.create_session(f"s{i}")
+       for j in range(i + 1):
+           session.add_message("user", f"message {j}")
+       session.save()
+   return manager
+
+
+
+
+def age_session(manager, session_id, hours):
+   """Move a session's last_updated back by hours and save it"""
+   session = manager.load_session(session_id)
+   session.metadata["last_updated"] = (datetime.now() - timedelta(hours=hours)).isoformat()
+   session.save()
+
+
+
+
+# =============================================================================
+# REBUILD
+# =============================================================================
+
+
+def test_new_catalog_is_built_from_session_folders(tmp_path):
+   make_sessions(str(tmp_path), 3)
+   assert not os.path.exists(tmp_path / SESSION_CATALOG_FILE)
+  
+   manager = SessionManager(str(tmp_path))
+   try:
+       assert manager.get_session_count() == 3
+       summaries = {summary["session_id"]: summary for summary in manager.list_sessions()}
+       assert sorted(summaries) == ["s0", "s1", "s2"]
+       assert summaries["s2"]["message_count"] == 3
+       assert summaries["s2"]["session_path"] == os.path.join(str(tmp_path), "s2")
+   finally:
+       manager.close()
+
+
+
+
+def test_rebuild_picks_up_sessions_saved_without_catalog(tmp_path):
+   manager = SessionManager(str(tmp_path))
+   try:
+       manager.create_session("tracked")
+       assert manager.get_session_count() == 1
+      
+       make_sessions(str(tmp_path), 2)
+       assert manager.get_session_count() == 1
+       assert manager.rebuild_catalog() == 3
+       assert manager.get_session_count() == 3
+   finally:
+       manager.close()
+
+
+
+
+def test_save_updates_row_and_listing_order(tmp_path):
+   manager = SessionManager(str(tmp_path))
+   try:
+       first = manager.create_session("first")
+       manager.create_session("second")
+       first.add_message("user", "hello")
+       first.save()
+      
+       summaries = manager.list_sessions()
+       assert [summary["session_id"] for summary in summaries] == ["first", "second"]
+       assert summaries[0]["message_count"] == 1
+       assert [summary["session_id"] for summary in manager.list_sessions(limit=1)] == ["first"]
+   finally:
+       manager.close()
+
+
+
+
+# =============================================================================
+# CLEANUP AND DELETE
+# =============================================================================
+
+
+def test_updated_before_returns_only_older_sessions(tmp_path):
+   manager = SessionManager(str(tmp_path))
+   try:
+       make_sessions(str(tmp_path), 3)
+       manager.rebuild_catalog()
+       age_session(manager, "s0", 48)
+       age_session(manager, "s1", 30)
+      
+       cutoff = (datetime.now() - timedelta(hours=24)).isoformat()
+       assert sorted(manager.catalog.updated_before(cutoff)) == ["s0", "s1"]
+      
+       assert manager.cleanup_old_sessions(hours=24) == 2
+       assert [summary["session_id"] for summary in manager.list_sessions()] == ["s2"]
+       assert not os.path.exists(tmp_path / "s0")
+       assert not os.path.exists(tmp_path / "s1")
+   finally:
+       manager.close()
+
+
+
+
+def test_delete_session_removes_folder_and_row(tmp_path):
+   manager = SessionManager(str(tmp_path))
+   try:
+       manager.create_session("keep")
+       manager.create_session("drop")
+       manager.delete_session("drop")
+      
+       assert manager.get_session_count() == 1
+       assert not os.path.exists(tmp_path / "drop")
+      
+       # A fresh connection sees the committed rows
+       catalog = SessionCatalog(str(tmp_path))
+       try:
+           assert [summary["session_id"] for summary in catalog.list_summaries()] == ["keep"]
+       finally:
+           catalog.close()
+   finally:
+       manager.close()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Tests for the session journal: replay, torn-line recovery and compaction.
+Run with: python -m pytest test_session_journal.py
+"""
+
+
+import json
+import os
+import sys
+from pathlib import Path
+
+
+# Add parent directory to path to import session_manager
+sys.path.insert(0, str(Path(__file__).parent))
+
+
+import session_manager
+from config import SessionConfig, SESSION_JOURNAL_COMPACT_EVENTS
+from session_manager import Session, SNAPSHOT_FILE
+
+
+
+
+def read_snapshot(session):
+   with open(os.path.join(session.session_path, SNAPSHOT_FILE), 'r', encoding='utf-8') as f:
+       return json.load(f)
+
+
+
+
+def contents(session):
+   return [message["content"] for message in session.messages]
+
+
+
+
+# =============================================================================
+# REPLAY
+# =============================================================================
+
+
+def test_load_replays_journal_after_snapshot(tmp_path):
+   session = Session("replay", SessionConfig(save_references=False), str(tmp_path))
+   session.save()
+   session.add_message("user", "first")
+   session.add_message("assistant", "second")
+   session.add_generated_image("image.png", copy_to_session=False)
+   session.add_reference_image("reference.png")
+   session.increment_generation_count()
+   session.save()
+  
+   # The snapshot is only written once; the changes are journal lines
+   assert read_snapshot(session)["messages"] == []
+   assert len(session_manager._journal_segments(session.session_path)) == 1
+  
+   loaded = Session.load("replay", str(tmp_path))
+   assert contents(loaded) == ["first", "second"]
+   assert loaded.generated_images == ["image.png"]
+   assert loaded.reference_images == ["reference.png"]
+   assert loaded.metadata["generation_count"] == 1
+   assert loaded.metadata["last_updated"] == session.metadata["last_updated"]
+  
+   # A loaded session keeps appending to the same journal
+   loaded.add_message("user", "third")
+   loaded.save()
+   assert contents(Session.load("replay", str(tmp_path))) == ["first", "second", "third"]
+   assert len(session_manager._journal_segments(session.session_path)) == 1
+
+
+
+
+def test_save_without_changes_writes_nothing(tmp_path):
+   session = Session("idle", None, str(tmp_path))
+   session.add_message("user", "hello")
+   session.save()
+   session.add_message("user", "again")
+   session.save()
+   segment = session_manager._journal_segments(session.session_path)[0]
+   size = os.path.getsize(segment)
+  
+   session.save()
+   assert os.path.getsize(segment) == size
+
+
+
+
+def test_history_limit_applies_on_replay(tmp_path):
+   session = Session("bounded", SessionConfig(max_history=1), str(tmp_path))
+   session.save()
+   for i in range(5):
+       session.add_message("user", f"m{i}")
+   session.save()
+  
+   assert contents(Session.load("bounded", str(tmp_path))) == ["m3", "m4"]
+
+
+
+
+def test_zero_max_history_keeps_every_message(tmp_path):
+   session = Session("unbounded", SessionConfig(max_history=0), str(tmp_path))
+   session.save()
+   for i in range(30):
+       session.add_message("user", f"m{i}")
+   session.save()
+  
+   assert len(session.messages) == 30
+   assert len(Session.load("unbounded", str(tmp_path)).messages) == 30
+
+
+
+
+# =============================================================================
+# TORN LINES
+# =============================================================================
+
+
+def test_torn_last_line_is_truncated(tmp_path):
+   session = Session("torn", None, str(tmp_path))
+   session.save()
+   session.add_message("user", "kept")
+   session.save()
+   segment = session_manager._journal_segments(session.session_path)[0]
+   size = os.path.getsize(segment)
+  
+   # Simulate a crash part-way through the next append
+   with open(segment, 'ab') as f:
+       f.write(b'{"seq": 2, "type": "message", "role": "us')
+  
+   loaded = Session.load("torn", str(tmp_path))
+   assert contents(loaded) == ["kept"]
+   assert os.path.getsize(segment) == size
+  
+   # The next event reuses the torn line's sequence number in the same segment
+   loaded.add_message("user", "after crash")
+   loaded.save()
+   assert session_manager._journal_segments(session.session_path) == [segment]
+   assert contents(Session.load("torn", str(tmp_path))) == ["kept", "after crash"]
+
+
+
+
+# =============================================================================
+# COMPACTION
+# =============================================================================
+
+
+def test_compaction_folds_and_deletes_segments(tmp_path):
+   session = Session("compact", None, str(tmp_path))
+   session.save()
+   for i in range(3):
+       session.add_message("user", f"m{i}")
+   session.save()
+   assert len(session_manager._journal_segments(session.session_path)) == 1
+  
+   # Unsaved changes are flushed before folding
+   session.add_message("user", "unsaved")
+   session.compact()
+   assert session_manager._journal_segments(session.session_path) == []
+   snapshot = read_snapshot(session)
+   assert [message["content"] for message in snapshot["messages"]] == ["m0", "m1", "m2", "unsaved"]
+   folded = snapshot["journal_sequence"]
+   assert folded == session._sequence
+  
+   # Later events go to a new segment numbered after the folded ones
+   session.add_message("user", "later")
+   session.save()
+   segments = session_manager._journal_segments(session.session_path)
+   assert [os.path.basename(path) for path in segments] == [session_manager._journal_name(folded + 1)]
+   assert contents(Session.load("compact", str(tmp_path))) == ["m0", "m1", "m2", "unsaved", "later"]
+
+
+
+
+def test_save_compacts_in_background_past_threshold(tmp_path):
+   session = Session("threshold", SessionConfig(max_history=0), str(tmp_path))
+   session.save()
+   for i in range(SESSION_JOURNAL_COMPACT_EVENTS):
+       session.add_message("user", f"m{i}")
+   session.save()
+   session.wait_for_compaction()
+  
+   assert session_manager._journal_segments(session.session_path) == []
+   assert len(read_snapshot(session)["messages"]) == SESSION_JOURNAL_COMPACT_EVENTS
+   assert len(Session.load("threshold", str(tmp_path)).messages) == SESSION_JOURNAL_COMPACT_EVENTS
+
+
+
+
+def test_failed_background_compaction_is_retried(tmp_path, monkeypatch):
+   session = Session("retry", None, str(tmp_path))
+   session.save()
+   session.add_message("user", "first")
+  
+   write_snapshot = Session._write_snapshot
+   def fail_once(self, session_data):
+       monkeypatch.setattr(Session, "_write_snapshot", write_snapshot)
+       raise OSError("disk full")
+   monkeypatch.setattr(Session, "_write_snapshot", fail_once)
+  
+   compaction = session.compact(background=True)
+   assert isinstance(compaction.exception(), OSError)
+   # The done-callback runs on the compaction thread before its next task
+   session_manager._get_compaction_executor().submit(lambda: None).result()
+  
+   # The journal still loads, and the next save compacts again
+   assert contents(Session.load("retry", str(tmp_path))) == ["first"]
+   session.add_message("user", "second")
+   session.save()
+   session.wait_for_compaction()
+   assert session_manager._journal_segments(session.session_path) == []
+   assert contents(Session.load("retry", str(tmp_path))) == ["first", "second"]
+
+
+
+
+# =============================================================================
+# SESSION FOLDERS
+# =============================================================================
+
+
+def test_image_folders_are_created_on_first_copy(tmp_path):
+   source = tmp_path / "cat.png"
+   source.write_bytes(b"\x89PNG")
+   session = Session("folders", SessionConfig(save_references=True), str(tmp_path / "sessions"))
+   
+   assert os.listdir(session.session_path) == []
+   
+   image_path = session.add_generated_image(str(source))
+   reference_path = session.add_reference_image(str(source))
+   
+   assert image_path == os.path.join(session.session_path, "images", "cat.png")
+   assert os.path.dirname(reference_path) == os.path.join(session.session_path, "references")
+   assert os.path.exists(image_path) and os.path.exists(reference_path)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Tests for single-flight coalescing and the request fingerprints it keys on.
+Run with: python -m pytest test_single_flight.py
+"""
+
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+from cache import request_fingerprint
+from config import ImageConfig
+from image_client import ImageGenerationClient
+from mock_server import make_png
+from profiling import Profiler
+from reference_optimizer import get_reference_optimizer, reference_digest
+from single_flight import SingleFlight
+from transcode import Transcoder
+
+
+
+
+def run_together(count, func):
+   """Call func(i) from count threads that start at the same time"""
+   barrier = threading.Barrier(count)
+  
+   def call(i):
+       barrier.wait()
+       return func(i)
+  
+   with ThreadPoolExecutor(max_workers=count) as pool:
+       return list(pool.map(call, range(count)))
+
+
+
+
+# =============================================================================
+# SINGLE FLIGHT
+# =============================================================================
+
+
+def test_concurrent_callers_share_one_execution():
+   group = SingleFlight()
+   release = threading.Event()
+   executions = []
+  
+   def work():
+       executions.append(1)
+       release.wait(5)
+       return "result"
+  
+   def call(i):
+       if i == 0:
+           # Let the followers queue up behind the leader
+           threading.Timer(0.2, release.set).start()
+       return group.do("key", work)
+  
+   results = run_together(4, call)
+  
+   assert len(executions) == 1
+   assert sorted(shared for _, shared in results) == [False, True, True, True]
+   assert all(result == "result" for result, _ in results)
+   stats = group.get_stats()
+   assert stats["executions"] == 1
+   assert stats["coalesced"] == 3
+   assert stats["in_flight"] == 0
+
+
+
+
+def test_followers_receive_the_leaders_exception():
+   group = SingleFlight()
+   release = threading.Event()
+  
+   def work():
+       release.wait(5)
+       raise RuntimeError("boom")
+  
+   def call(i):
+       if i == 0:
+           threading.Timer(0.2, release.set).start()
+       try:
+           group.do("key", work)
+       except RuntimeError as e:
+           return str(e)
+  
+   assert run_together(3, call) == ["boom"] * 3
+
+
+
+
+def test_key_is_forgotten_after_the_call():
+   group = SingleFlight()
+  
+   assert group.do("key", lambda: 1) == (1, False)
+   assert group.do("key", lambda: 2) == (2, False)
+   assert group.get_stats()["executions"] == 2
+
+
+
+
+def test_async_callers_share_one_execution():
+   group = SingleFlight()
+   executions = []
+  
+   async def work():
+       executions.append(1)
+       await asyncio.sleep(0.05)
+       return "result"
+  
+   async def main():
+       return await asyncio.gather(*(group.do_async("key", work) for _ in range(3)))
+  
+   results = asyncio.run(main())
+  
+   assert len(executions) == 1
+   assert sorted(shared for _, shared in results) == [False, True, True]
+
+
+
+
+# =============================================================================
+# FINGERPRINTS
+# =============================================================================
+
+
+def test_references_are_keyed_by_content_not_path(tmp_path):
+   first = tmp_path / "first.png"
+   second = tmp_path / "second.png"
+   first.write_bytes(make_png())
+   second.write_bytes(make_png())
+   config = ImageConfig()
+  
+   key = request_fingerprint("model", "a cat", [str(first)], config)
+  
+   assert request_fingerprint("model", "a cat", [str(second)], config) == key
+   second.write_bytes(make_png(color=(0, 0, 255)))
+   assert request_fingerprint("model", "a cat", [str(second)], config) != key
+
+
+
+
+def test_reference_digest_is_memoized_without_encoding(tmp_path):
+   path = tmp_path / "ref.png"
+   path.write_bytes(make_png())
+   optimizer = get_reference_optimizer()
+   before = optimizer.get_stats()
+  
+   digest = reference_digest(str(path))
+  
+   stat = os.stat(path)
+   assert optimizer._digests[(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)] == digest
+   # Hashing alone encodes nothing
+   after = optimizer.get_stats()
+   assert after["misses"] == before["misses"]
+   assert after["upload_bytes"] == before["upload_bytes"]
+
+
+
+
+# =============================================================================
+# CLIENT
+# =============================================================================
+
+
+def make_client(mock_api, **options):
+   return ImageGenerationClient(
+       "test-key",
+       base_url=mock_api.base_url,
+       profiler=Profiler(modes=""),
+       transcoder=Transcoder(max_workers=0),
+       **options
+   )
+
+
+
+
+def test_coalescing_is_off_by_default(mock_api):
+   client = make_client(mock_api)
+  
+   assert client.single_flight is None
+   client.close()
+
+
+
+
+def test_identical_concurrent_requests_share_one_call(mock_api, tmp_path):
+   mock_api.state.latency_seconds = 0.3
+   client = make_client(mock_api, single_flight=SingleFlight())
+  
+   def call(i):
+       config = ImageConfig(output_dir=str(tmp_path / f"out{i}"), organize_by_date=False)
+       return client.generate("a cat", config=config, save_to=f"cat_{i}.png")
+  
+   results = run_together(3, call)
+  
+   assert all(result["success"] for result in results)
+   assert mock_api.state.stats["generate_requests"] == 1
+   # Every caller gets its own file
+   paths = {result.generated_images[0]["file_path"] for result in results}
+   assert len(paths) == 3
+   assert all(os.path.exists(path) for path in paths)
+   client.close()
+
+
+
+
+def test_different_requests_are_not_coalesced(mock_api, tmp_path):
+   prompts = ["a cat", "a dog"]
+   mock_api.state.latency_seconds = 0.2
+   client = make_client(mock_api, single_flight=SingleFlight())
+   config = ImageConfig(output_dir=str(tmp_path), organize_by_date=False)
+  
+   results = run_together(2, lambda i: client.generate(prompts[i], config=config, save_to=f"{i}.png"))
+  
+   assert all(result["success"] for result in results)
+   assert mock_api.state.stats["generate_requests"] == 2
+   client.close()
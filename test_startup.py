@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Tests for lazy imports and a side-effect-free client constructor.
+Run with: python -m pytest test_startup.py
+"""
+
+
+import json
+import os
+import subprocess
+import sys
+
+
+import pytest
+
+
+from benchmark import STARTUP_MODULES, measure_startup
+from mock_server import make_png
+
+
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+
+
+def run_probe(code, cwd):
+   """Run code in a fresh interpreter and return the JSON it prints last"""
+   env = dict(os.environ, PYTHONPATH=HERE)
+   output = subprocess.run(
+       [sys.executable, "-c", code], cwd=cwd, env=env, capture_output=True, text=True, check=True
+   ).stdout
+   return json.loads(output.strip().splitlines()[-1])
+
+
+
+
+# =============================================================================
+# STARTUP
+# =============================================================================
+
+
+@pytest.mark.parametrize("module", STARTUP_MODULES)
+def test_import_loads_no_heavy_modules_and_writes_nothing(module):
+   startup = measure_startup(module, runs=1)
+  
+   assert startup["lazy_loaded"] == []
+   assert startup["created"] == []
+
+
+
+
+def test_pil_loads_on_first_use(tmp_path):
+   (tmp_path / "cat.png").write_bytes(make_png(64, 64))
+   code = (
+       "import json, sys\n"
+       "import utils\n"
+       "info = utils.get_image_info('cat.png')\n"
+       "header_only = 'PIL' not in sys.modules\n"
+       "utils.create_thumbnail('cat.png', (16, 16))\n"
+       "print(json.dumps({'header_only': header_only, 'loaded': 'PIL' in sys.modules, 'width': info['width']}))\n"
+   )
+  
+   probe = run_probe(code, str(tmp_path))
+  
+   assert probe == {"header_only": True, "loaded": True, "width": 64}
+
+
+
+
+def test_sessions_directory_is_created_on_first_session(tmp_path):
+   code = (
+       "import json, os\n"
+       "from image_client import ImageGenerationClient\n"
+       "client = ImageGenerationClient('test-key')\n"
+       "before = sorted(os.listdir('.'))\n"
+       "client.create_session()\n"
+       "print(json.dumps({'before': before, 'after': sorted(os.listdir('.'))}))\n"
+   )
+  
+   probe = run_probe(code, str(tmp_path))
+  
+   assert probe["before"] == []
+   assert probe["after"] == ["generated"]
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Tests for the streaming inlineData decoder and the client's streamed save path.
+Run with: python -m pytest test_streaming.py
+"""
+
+
+import base64
+import json
+import os
+from concurrent.futures import Future
+
+
+import pytest
+
+
+from config import ImageConfig
+from image_client import ImageGenerationClient
+from mock_server import make_png
+from post_processing import PostProcessor
+from profiling import Profiler
+from streaming import InlineDataStreamDecoder, stream_decode_response
+from transcode import Transcoder
+
+
+
+
+def response_body(images, key="inlineData"):
+   """A generateContent body with one text part and the given images"""
+   parts = [{"text": "Here you go."}]
+   for data in images:
+       parts.append({key: {"mimeType": "image/png", "data": data}})
+   return json.dumps({
+       "candidates": [{"content": {"role": "model", "parts": parts}, "index": 0}],
+       "usageMetadata": {"totalTokenCount": 42}
+   }).encode("utf-8")
+
+
+
+
+def chunked(body, size):
+   return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+
+
+def read(path):
+   with open(path, 'rb') as f:
+       return f.read()
+
+
+
+
+# =============================================================================
+# DECODER
+# =============================================================================
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64, 4096])
+def test_images_decode_across_any_chunking(tmp_path, chunk_size):
+   first = os.urandom(300)
+   second = os.urandom(1000)
+   body = response_body([base64.b64encode(first).decode(), base64.b64encode(second).decode()])
+  
+   response_data, files = stream_decode_response(chunked(body, chunk_size), str(tmp_path))
+  
+   assert [read(path) for path in files] == [first, second]
+   parts = response_data["candidates"][0]["content"]["parts"]
+   assert parts[0]["text"] == "Here you go."
+   assert parts[1]["inlineData"]["data"] == ""
+   assert response_data["usageMetadata"]["totalTokenCount"] == 42
+
+
+
+
+def test_snake_case_key_escaped_slashes_and_data_url(tmp_path):
+   payload = os.urandom(600)
+   encoded = "data:image/png;base64," + base64.b64encode(payload).decode()
+   body = response_body([encoded], key="inline_data").replace(b"/", b"\\/")
+  
+   _, files = stream_decode_response(chunked(body, 5), str(tmp_path))
+  
+   assert [read(path) for path in files] == [payload]
+
+
+
+
+def test_other_data_keys_stay_in_the_skeleton(tmp_path):
+   body = json.dumps({"data": "not an image", "candidates": []}).encode("utf-8")
+  
+   response_data, files = stream_decode_response(chunked(body, 4), str(tmp_path))
+  
+   assert files == []
+   assert response_data["data"] == "not an image"
+
+
+
+
+def test_truncated_body_raises_and_removes_files(tmp_path):
+   body = response_body([base64.b64encode(os.urandom(2000)).decode()])
+   decoder = InlineDataStreamDecoder(str(tmp_path))
+   decoder.feed(body[:len(body) // 2])
+  
+   with pytest.raises(ValueError):
+       decoder.finish()
+   assert os.listdir(tmp_path) == []
+
+
+
+
+# =============================================================================
+# CLIENT
+# =============================================================================
+
+
+def make_client(mock_api, **options):
+   return ImageGenerationClient(
+       "test-key",
+       base_url=mock_api.base_url,
+       stream_responses=True,
+       transcoder=Transcoder(max_workers=0),
+       profiler=Profiler(modes=""),
+       **options
+   )
+
+
+
+
+def test_streamed_image_is_saved_and_transcoded(mock_api, tmp_path):
+   client = make_client(mock_api)
+   config = ImageConfig(output_dir=str(tmp_path), organize_by_date=False, output_format="jpeg")
+  
+   result = client.generate("a cat", config=config)
+  
+   assert result["success"], result.get("error")
+   path = result.generated_images[0]["file_path"]
+   assert path.endswith(".jpeg")
+   assert read(path)[:3] == b"\xff\xd8\xff"
+   assert result.generated_images[0]["info"]["format"] == "JPEG"
+   # No temp files are left next to the output
+   assert os.listdir(tmp_path) == [os.path.basename(path)]
+   client.close()
+
+
+
+
+def test_streamed_save_is_deferred_to_the_post_processor(mock_api, tmp_path):
+   client = make_client(mock_api, post_processor=PostProcessor())
+   config = ImageConfig(output_dir=str(tmp_path), organize_by_date=False)
+  
+   pending = client.generate("a cat", config=config, wait=False)
+  
+   assert isinstance(pending, Future)
+   result = pending.result()
+   assert result["success"], result.get("error")
+   assert read(result.generated_images[0]["file_path"]) == make_png()
+   client.close()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Tests for transcoding returned images to the configured output format.
+Run with: python -m pytest test_transcode.py
+"""
+
+
+import io
+import os
+
+
+import pytest
+from PIL import Image
+
+
+from config import ImageConfig
+from image_client import ImageGenerationClient
+from mock_server import make_png
+from profiling import Profiler
+from transcode import Transcoder
+from utils import match_format_extension
+
+
+
+
+def make_client(mock_api):
+   return ImageGenerationClient(
+       "test-key",
+       base_url=mock_api.base_url,
+       profiler=Profiler(modes=""),
+       transcoder=Transcoder(max_workers=0)
+   )
+
+
+
+
+def image_format(path):
+   with Image.open(path) as image:
+       return image.format
+
+
+
+
+# =============================================================================
+# TRANSCODER
+# =============================================================================
+
+
+@pytest.mark.parametrize("output_format, pil_format", [("jpeg", "JPEG"), ("webp", "WEBP")])
+def test_convert_re_encodes_in_the_target_format(output_format, pil_format):
+   transcoder = Transcoder(max_workers=0)
+   data = make_png(64, 64, (200, 30, 30))
+  
+   converted = transcoder.convert(data, output_format, 90)
+  
+   assert Image.open(io.BytesIO(converted)).format == pil_format
+   assert transcoder.stats["transcoded"] == 1
+   assert transcoder.stats["bytes_in"] == len(data)
+
+
+
+
+def test_data_already_in_the_format_is_returned_as_is():
+   transcoder = Transcoder(max_workers=0)
+   data = make_png(64, 64, (200, 30, 30))
+  
+   assert transcoder.convert(data, "png", 90) is data
+   assert transcoder.stats == {"transcoded": 0, "unchanged": 1, "bytes_in": 0, "bytes_out": 0}
+
+
+
+
+def test_convert_file_rewrites_in_place(tmp_path):
+   transcoder = Transcoder(max_workers=0)
+   path = tmp_path / "image.png"
+   path.write_bytes(make_png(64, 64, (200, 30, 30)))
+  
+   assert transcoder.convert_file(str(path), "jpeg", 80)
+   assert not transcoder.convert_file(str(path), "jpeg", 80)
+  
+   assert image_format(path) == "JPEG"
+   assert os.listdir(tmp_path) == ["image.png"]
+
+
+
+
+# =============================================================================
+# FILE NAMES
+# =============================================================================
+
+
+def test_extension_follows_the_output_format():
+   assert match_format_extension("out/cat.png", "jpeg") == "out/cat.jpeg"
+   assert match_format_extension("out/cat", "webp") == "out/cat.webp"
+   assert match_format_extension("out/cat.JPG", "jpeg") == "out/cat.JPG"
+   assert match_format_extension("out/cat.png", "png") == "out/cat.png"
+
+
+
+
+def test_save_to_is_renamed_to_the_output_format(mock_api, tmp_path):
+   client = make_client(mock_api)
+   config = ImageConfig(output_dir=str(tmp_path), organize_by_date=False, output_format="jpeg")
+  
+   result = client.generate("a cat", config=config, save_to="cat.png")
+  
+   assert result["success"], result.get("error")
+   path = result.generated_images[0]["file_path"]
+   assert path == str(tmp_path / "cat.jpeg")
+   assert image_format(path) == "JPEG"
+   assert os.listdir(tmp_path) == ["cat.jpeg"]
+   client.close()
+
+
+
+
+def test_variations_keep_the_output_format_extension(mock_api, tmp_path):
+   client = make_client(mock_api)
+   config = ImageConfig(
+       output_dir=str(tmp_path), organize_by_date=False, output_format="webp", num_images=2
+   )
+  
+   result = client.generate("a cat", config=config, save_to=str(tmp_path / "cat.png"))
+  
+   assert result["success"], result.get("error")
+   assert sorted(os.listdir(tmp_path)) == ["cat_1.webp", "cat_2.webp"]
+   assert all(image_format(image["file_path"]) == "WEBP" for image in result.generated_images)
+   client.close()
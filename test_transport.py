@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Tests for the pooled keep-alive HTTP transports against the mock server.
+Run with: python -m pytest test_transport.py
+"""
+
+
+import asyncio
+import json
+import socket
+
+
+import pytest
+
+
+from config import ImageConfig
+from image_client import ImageGenerationClient
+from profiling import Profiler
+from transcode import Transcoder
+from transport import AsyncHTTPTransport, HTTPTransport, TransportError, create_transport
+
+
+
+
+def free_port():
+   with socket.socket() as sock:
+       sock.bind(("127.0.0.1", 0))
+       return sock.getsockname()[1]
+
+
+
+
+def open_connections(transport):
+   """Connections the requests.Session pool has opened so far"""
+   pools = transport._session.get_adapter("http://").poolmanager.pools
+   return sum(pools[key].num_connections for key in pools.keys())
+
+
+
+
+# =============================================================================
+# SYNC TRANSPORT
+# =============================================================================
+
+
+def test_sequential_requests_reuse_one_connection(mock_api):
+   transport = HTTPTransport(pool_size=2)
+   try:
+       for _ in range(5):
+           response = transport.get(f"{mock_api.base_url}/models")
+           assert response.json()["models"]
+       assert open_connections(transport) == 1
+   finally:
+       transport.close()
+
+
+
+
+def test_error_status_raises_with_status_and_body(mock_api):
+   transport = create_transport()
+   try:
+       with pytest.raises(TransportError) as error:
+           transport.post(f"{mock_api.base_url}/models/x:unknown", json_body={})
+       assert error.value.status_code == 404
+       assert json.loads(error.value.body)["error"]["code"] == 404
+       # The connection is returned to the pool and works afterwards
+       assert transport.get(f"{mock_api.base_url}/models").status_code == 200
+   finally:
+       transport.close()
+
+
+
+
+def test_connection_error_raises_transport_error():
+   transport = HTTPTransport()
+   try:
+       with pytest.raises(TransportError) as error:
+           transport.get(f"http://127.0.0.1:{free_port()}/v1beta/models")
+       assert error.value.status_code is None
+   finally:
+       transport.close()
+
+
+
+
+def test_streamed_body_arrives_in_chunks(mock_api):
+   transport = HTTPTransport()
+   try:
+       response = transport.post(
+           f"{mock_api.base_url}/models/test:generateContent",
+           json_body={"contents": [{"parts": [{"text": "a cat"}]}]},
+           stream=True
+       )
+       body = b"".join(response.iter_chunks(chunk_size=256))
+       response.close()
+       assert json.loads(body)["candidates"]
+       assert response.wait_seconds is not None
+   finally:
+       transport.close()
+
+
+
+
+# =============================================================================
+# ASYNC TRANSPORT
+# =============================================================================
+
+
+def test_async_transport_reads_responses_and_raises_on_errors(mock_api):
+   async def main():
+       transport = AsyncHTTPTransport(pool_size=4)
+       try:
+           responses = await asyncio.gather(*(
+               transport.get(f"{mock_api.base_url}/models") for _ in range(4)
+           ))
+           with pytest.raises(TransportError) as error:
+               await transport.get(f"{mock_api.base_url}/batches/missing")
+           return responses, error.value
+       finally:
+           await transport.close()
+  
+   responses, error = asyncio.run(main())
+  
+   assert all(response.json()["models"] for response in responses)
+   assert error.status_code == 404
+
+
+
+
+# =============================================================================
+# CLIENT
+# =============================================================================
+
+
+def test_client_sends_every_call_through_one_transport(mock_api, tmp_path):
+   client = ImageGenerationClient(
+       "test-key",
+       base_url=mock_api.base_url,
+       default_config=ImageConfig(max_concurrency=3),
+       profiler=Profiler(modes=""),
+       transcoder=Transcoder(max_workers=0)
+   )
+   config = ImageConfig(output_dir=str(tmp_path), organize_by_date=False)
+  
+   client.generate("a cat", config=config, save_to="one.png")
+   transport = client.transport
+   client.generate("a dog", config=config, save_to="two.png")
+  
+   assert client.transport is transport
+   assert transport.pool_size == 3
+   assert open_connections(transport) == 1
+   client.close()
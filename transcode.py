@@ -0,0 +1,231 @@
+"""
+Output transcoding for generated images
+Returned images are re-encoded to ImageConfig.output_format on a process pool
+"""
+
+
+import io
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+
+from config import IMAGE_HEADER_READ_BYTES, TRANSCODE_WORKERS
+from image_metadata import parse_image_header
+
+
+if TYPE_CHECKING:
+   from concurrent.futures import ProcessPoolExecutor
+   from PIL import Image
+
+
+
+
+# output_format -> PIL format name
+PIL_FORMATS = {
+   "png": "PNG",
+   "jpeg": "JPEG",
+   "webp": "WEBP"
+}
+
+
+
+
+def _encode(image: "Image.Image", target: Any, output_format: str, quality: int, lossless: bool):
+   """Save an open PIL image to target (path or file object) in output_format"""
+   if output_format == "jpeg":
+       if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+           # JPEG has no alpha: flatten on white
+           from PIL import Image
+          
+           image = image.convert("RGBA")
+           background = Image.new("RGB", image.size, (255, 255, 255))
+           background.paste(image, mask=image.split()[-1])
+           image = background
+       elif image.mode != "RGB":
+           image = image.convert("RGB")
+       image.save(target, format="JPEG", quality=quality, optimize=True)
+   elif output_format == "webp":
+       if image.mode not in ("RGB", "RGBA"):
+           image = image.convert("RGBA" if "transparency" in image.info or "A" in image.mode else "RGB")
+       image.save(target, format="WEBP", quality=quality, lossless=lossless, method=4)
+   else:
+       image.save(target, format="PNG")
+
+
+
+
+def transcode_image(data: bytes, output_format: str, quality: int, lossless: bool = False) -> bytes:
+   """
+   Re-encode an image (runs in a worker process)
+  
+   Args:
+       data: Encoded source image
+       output_format: Target format (png, jpeg, webp)
+       quality: JPEG/WebP quality (WebP compression effort when lossless)
+       lossless: Encode WebP losslessly
+      
+   Returns:
+       Encoded image bytes
+   """
+   from PIL import Image
+  
+   buffer = io.BytesIO()
+   with Image.open(io.BytesIO(data)) as image:
+       _encode(image, buffer, output_format, quality, lossless)
+   return buffer.getvalue()
+
+
+
+
+def transcode_file(path: str, output_format: str, quality: int, lossless: bool = False) -> int:
+   """
+   Re-encode an image file in place (runs in a worker process)
+  
+   The file is decoded from disk and the new encoding written next to it,
+   then swapped in, so the caller never holds the image bytes.
+  
+   Returns:
+       Size of the new file in bytes
+   """
+   from PIL import Image
+  
+   temp_path = f"{path}.transcode"
+   try:
+       with Image.open(path) as image:
+           _encode(image, temp_path, output_format, quality, lossless)
+       os.replace(temp_path, path)
+   finally:
+       if os.path.exists(temp_path):
+           os.remove(temp_path)
+   return os.path.getsize(path)
+
+
+
+
+class Transcoder:
+   """
+   Converts returned images to the requested output format
+  
+   The API answers with PNG regardless of the file extension asked for.
+   Images already in the target format are written untouched; others are
+   decoded and re-encoded in a process pool (created on first use), so
+   several panels transcode in parallel without holding the GIL. With
+   max_workers=0 encoding runs in the calling thread instead.
+   """
+  
+   def __init__(self, max_workers: Optional[int] = TRANSCODE_WORKERS):
+       """
+       Initialize transcoder
+      
+       Args:
+           max_workers: Worker processes (None = CPU count, 0 = in-process)
+       """
+       self.max_workers = max_workers
+       self._pool: Optional["ProcessPoolExecutor"] = None
+       self._lock = threading.Lock()
+       self.stats = {
+           "transcoded": 0,
+           "unchanged": 0,
+           "bytes_in": 0,
+           "bytes_out": 0
+       }
+  
+   @property
+   def pool(self) -> "ProcessPoolExecutor":
+       """Worker processes (started on first use)"""
+       with self._lock:
+           if self._pool is None:
+               from concurrent.futures import ProcessPoolExecutor
+              
+               self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+           return self._pool
+  
+   def convert(self, data: bytes, output_format: str, quality: int, lossless: bool = False) -> bytes:
+       """
+       Encode image bytes in output_format
+      
+       Args:
+           data: Encoded image as returned by the API
+           output_format: Target format (png, jpeg, webp)
+           quality: JPEG/WebP quality
+           lossless: Encode WebP losslessly
+          
+       Returns:
+           Bytes in the target format (data itself if already in it)
+       """
+       header = parse_image_header(data)
+       if header is not None and header["format"] == PIL_FORMATS[output_format]:
+           with self._lock:
+               self.stats["unchanged"] += 1
+           return data
+      
+       if self.max_workers == 0:
+           converted = transcode_image(data, output_format, quality, lossless)
+       else:
+           converted = self.pool.submit(transcode_image, data, output_format, quality, lossless).result()
+       with self._lock:
+           self.stats["transcoded"] += 1
+           self.stats["bytes_in"] += len(data)
+           self.stats["bytes_out"] += len(converted)
+       return converted
+  
+   def convert_file(self, path: str, output_format: str, quality: int, lossless: bool = False) -> bool:
+       """
+       Re-encode an image file in place unless it is already in output_format
+      
+       Only the file's header is read here; a worker decodes it from disk,
+       so a streamed image is never loaded into this process.
+      
+       Returns:
+           Whether the file was rewritten
+       """
+       with open(path, 'rb') as f:
+           header = parse_image_header(f.read(IMAGE_HEADER_READ_BYTES))
+       if header is not None and header["format"] == PIL_FORMATS[output_format]:
+           with self._lock:
+               self.stats["unchanged"] += 1
+           return False
+      
+       size_in = os.path.getsize(path)
+       if self.max_workers == 0:
+           size_out = transcode_file(path, output_format, quality, lossless)
+       else:
+           size_out = self.pool.submit(transcode_file, path, output_format, quality, lossless).result()
+       with self._lock:
+           self.stats["transcoded"] += 1
+           self.stats["bytes_in"] += size_in
+           self.stats["bytes_out"] += size_out
+       return True
+  
+   def close(self):
+       """Shut down the worker processes"""
+       with self._lock:
+           if self._pool is not None:
+               self._pool.shutdown()
+               self._pool = None
+  
+   def get_stats(self) -> Dict[str, Any]:
+       """Get transcoding counters and bytes saved"""
+       with self._lock:
+           stats = dict(self.stats)
+       stats["bytes_saved"] = stats["bytes_in"] - stats["bytes_out"]
+       return stats
+
+
+
+
+_transcoder: Optional[Transcoder] = None
+_transcoder_lock = threading.Lock()
+
+
+
+
+def get_transcoder() -> Transcoder:
+   """Get the process-wide transcoder"""
+   global _transcoder
+   if _transcoder is None:
+       with _transcoder_lock:
+           if _transcoder is None:
+               _transcoder = Transcoder()
+   return _transcoder
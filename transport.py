@@ -0,0 +1,415 @@
+"""
+HTTP transport layer for the image generation client
+Owns a pooled, keep-alive connection pool shared across all API calls
+"""
+
+
+import json
+import time
+from typing import Any, Dict, Iterator, Optional
+
+
+from config import (
+   DEFAULT_MAX_CONCURRENCY,
+   DEFAULT_CONNECT_TIMEOUT,
+   DEFAULT_READ_TIMEOUT
+)
+
+
+
+
+# Leading bytes of an error response body kept on TransportError
+ERROR_BODY_MAX_CHARS = 8192
+
+
+
+
+class TransportError(Exception):
+   """Raised when an HTTP request fails (connection error, timeout or non-2xx status)"""
+  
+   def __init__(
+       self,
+       message: str,
+       status_code: Optional[int] = None,
+       headers: Optional[Dict[str, str]] = None,
+       body: str = ""
+   ):
+       super().__init__(message)
+       self.status_code = status_code
+       self.headers = headers or {}
+       # Start of the error response body (the API's JSON error message)
+       self.body = body[:ERROR_BODY_MAX_CHARS]
+
+
+
+
+class TransportResponse:
+   """
+   Minimal response wrapper so callers do not depend on the HTTP library
+  
+   wait_seconds is the time from sending the request to receiving the
+   response headers (upload plus server processing, before the body).
+   """
+  
+   def __init__(
+       self,
+       status_code: int,
+       headers: Dict[str, str],
+       raw: Any,
+       stream: bool = False,
+       wait_seconds: Optional[float] = None
+   ):
+       self.status_code = status_code
+       self.headers = headers
+       self._raw = raw
+       self._stream = stream
+       self.wait_seconds = wait_seconds
+  
+   @property
+   def content(self) -> bytes:
+       """Full response body (reads the stream if needed)"""
+       return self._raw.content
+  
+   def json(self) -> Any:
+       """Parse response body as JSON"""
+       return json.loads(self.content)
+  
+   def iter_chunks(self, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+       """Iterate over the response body as it downloads"""
+       if hasattr(self._raw, "iter_content"):
+           return self._raw.iter_content(chunk_size=chunk_size)
+       return self._raw.iter_bytes(chunk_size=chunk_size)
+  
+   def close(self):
+       """Release the underlying connection back to the pool"""
+       self._raw.close()
+
+
+
+
+class HTTPTransport:
+   """
+   Pooled HTTP/1.1 transport backed by requests.Session
+  
+   Connections are kept alive and reused across calls, so only the first
+   request to a host pays the TCP+TLS handshake. The pool is sized to the
+   number of concurrent requests the client may issue.
+   """
+  
+   def __init__(
+       self,
+       pool_size: int = DEFAULT_MAX_CONCURRENCY,
+       connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+       read_timeout: float = DEFAULT_READ_TIMEOUT
+   ):
+       """
+       Initialize transport
+      
+       Args:
+           pool_size: Max pooled connections per host
+           connect_timeout: Seconds to wait for a connection
+           read_timeout: Seconds to wait between bytes of the response
+       """
+       # Imported here so importing the client does not load requests/urllib3
+       import requests
+       from requests.adapters import HTTPAdapter
+      
+       self._requests = requests
+       self.pool_size = pool_size
+       self.timeout = (connect_timeout, read_timeout)
+       self._session = requests.Session()
+       adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+       self._session.mount("https://", adapter)
+       self._session.mount("http://", adapter)
+  
+   def request(
+       self,
+       method: str,
+       url: str,
+       json_body: Optional[Any] = None,
+       data: Optional[bytes] = None,
+       headers: Optional[Dict[str, str]] = None,
+       stream: bool = False
+   ) -> TransportResponse:
+       """
+       Send a request and return the response
+      
+       Raises:
+           TransportError: On connection errors, timeouts or non-2xx status
+       """
+       try:
+           response = self._session.request(
+               method,
+               url,
+               json=json_body,
+               data=data,
+               headers=headers,
+               timeout=self.timeout,
+               stream=stream
+           )
+       except self._requests.exceptions.RequestException as e:
+           raise TransportError(str(e) or type(e).__name__) from e
+      
+       if response.status_code >= 400:
+           message = f"{response.status_code} Error: {response.reason} for url: {response.url}"
+           headers = response.headers
+           try:
+               body = response.text
+           except self._requests.exceptions.RequestException:
+               body = ""
+           response.close()
+           raise TransportError(message, response.status_code, headers, body)
+      
+       return TransportResponse(
+           response.status_code,
+           response.headers,
+           response,
+           stream,
+           wait_seconds=response.elapsed.total_seconds()
+       )
+  
+   def post(
+       self,
+       url: str,
+       json_body: Optional[Any] = None,
+       headers: Optional[Dict[str, str]] = None,
+       stream: bool = False
+   ) -> TransportResponse:
+       """Send a POST request with a JSON body"""
+       return self.request("POST", url, json_body=json_body, headers=headers, stream=stream)
+  
+   def get(
+       self,
+       url: str,
+       headers: Optional[Dict[str, str]] = None,
+       stream: bool = False
+   ) -> TransportResponse:
+       """Send a GET request"""
+       return self.request("GET", url, headers=headers, stream=stream)
+  
+   def close(self):
+       """Close all pooled connections"""
+       self._session.close()
+
+
+
+
+class HTTP2Transport(HTTPTransport):
+   """
+   HTTP/2 transport backed by httpx (requires: pip install "httpx[http2]")
+  
+   Concurrent requests to the same host are multiplexed over a single
+   connection instead of opening one connection per in-flight request.
+   """
+  
+   def __init__(
+       self,
+       pool_size: int = DEFAULT_MAX_CONCURRENCY,
+       connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+       read_timeout: float = DEFAULT_READ_TIMEOUT
+   ):
+       try:
+           import httpx
+       except ImportError as e:
+           raise ImportError(
+               "HTTP/2 transport requires httpx. Install with: pip install \"httpx[http2]\""
+           ) from e
+      
+       self.pool_size = pool_size
+       self.timeout = (connect_timeout, read_timeout)
+       self._httpx = httpx
+       self._client = httpx.Client(
+           http2=True,
+           timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+           limits=httpx.Limits(
+               max_connections=pool_size,
+               max_keepalive_connections=pool_size
+           )
+       )
+  
+   def request(
+       self,
+       method: str,
+       url: str,
+       json_body: Optional[Any] = None,
+       data: Optional[bytes] = None,
+       headers: Optional[Dict[str, str]] = None,
+       stream: bool = False
+   ) -> TransportResponse:
+       """
+       Send a request and return the response
+      
+       Raises:
+           TransportError: On connection errors, timeouts or non-2xx status
+       """
+       try:
+           request = self._client.build_request(
+               method,
+               url,
+               json=json_body,
+               content=data,
+               headers=headers
+           )
+           # Always send streaming so the wait for headers is timed apart from the body download
+           started = time.perf_counter()
+           response = self._client.send(request, stream=True)
+           wait_seconds = time.perf_counter() - started
+       except self._httpx.HTTPError as e:
+           raise TransportError(str(e) or type(e).__name__) from e
+      
+       if response.status_code >= 400:
+           message = f"{response.status_code} Error: {response.reason_phrase} for url: {response.url}"
+           headers = response.headers
+           try:
+               body = response.read().decode("utf-8", errors="replace")
+           except self._httpx.HTTPError:
+               body = ""
+           response.close()
+           raise TransportError(message, response.status_code, headers, body)
+      
+       if not stream:
+           try:
+               response.read()
+           except self._httpx.HTTPError as e:
+               response.close()
+               raise TransportError(str(e) or type(e).__name__) from e
+       return TransportResponse(response.status_code, response.headers, response, stream, wait_seconds)
+  
+   def close(self):
+       """Close all pooled connections"""
+       self._client.close()
+
+
+
+
+class AsyncHTTPTransport:
+   """
+   Pooled asyncio transport backed by httpx.AsyncClient (requires: pip install httpx)
+  
+   Used by AsyncImageGenerationClient so one event loop can keep many
+   requests in flight without a thread per request.
+   """
+  
+   def __init__(
+       self,
+       pool_size: int = DEFAULT_MAX_CONCURRENCY,
+       http2: bool = False,
+       connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+       read_timeout: float = DEFAULT_READ_TIMEOUT
+   ):
+       """
+       Initialize async transport
+      
+       Args:
+           pool_size: Max pooled connections
+           http2: Use HTTP/2 multiplexing (requires httpx[http2])
+           connect_timeout: Seconds to wait for a connection
+           read_timeout: Seconds to wait between bytes of the response
+       """
+       try:
+           import httpx
+       except ImportError as e:
+           raise ImportError(
+               "Async transport requires httpx. Install with: pip install httpx"
+           ) from e
+      
+       self.pool_size = pool_size
+       self.timeout = (connect_timeout, read_timeout)
+       self._httpx = httpx
+       self._client = httpx.AsyncClient(
+           http2=http2,
+           timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+           limits=httpx.Limits(
+               max_connections=pool_size,
+               max_keepalive_connections=pool_size
+           )
+       )
+  
+   async def request(
+       self,
+       method: str,
+       url: str,
+       json_body: Optional[Any] = None,
+       data: Optional[bytes] = None,
+       headers: Optional[Dict[str, str]] = None
+   ) -> TransportResponse:
+       """
+       Send a request and return the fully read response
+      
+       Raises:
+           TransportError: On connection errors, timeouts or non-2xx status
+       """
+       try:
+           request = self._client.build_request(
+               method,
+               url,
+               json=json_body,
+               content=data,
+               headers=headers
+           )
+           started = time.perf_counter()
+           response = await self._client.send(request, stream=True)
+           wait_seconds = time.perf_counter() - started
+       except self._httpx.HTTPError as e:
+           raise TransportError(str(e) or type(e).__name__) from e
+      
+       if response.status_code >= 400:
+           message = f"{response.status_code} Error: {response.reason_phrase} for url: {response.url}"
+           try:
+               body = (await response.aread()).decode("utf-8", errors="replace")
+           except self._httpx.HTTPError:
+               body = ""
+           await response.aclose()
+           raise TransportError(message, response.status_code, response.headers, body)
+      
+       try:
+           await response.aread()
+       except self._httpx.HTTPError as e:
+           await response.aclose()
+           raise TransportError(str(e) or type(e).__name__) from e
+       return TransportResponse(response.status_code, response.headers, response, wait_seconds=wait_seconds)
+  
+   async def post(
+       self,
+       url: str,
+       json_body: Optional[Any] = None,
+       headers: Optional[Dict[str, str]] = None
+   ) -> TransportResponse:
+       """Send a POST request with a JSON body"""
+       return await self.request("POST", url, json_body=json_body, headers=headers)
+  
+   async def get(self, url: str, headers: Optional[Dict[str, str]] = None) -> TransportResponse:
+       """Send a GET request"""
+       return await self.request("GET", url, headers=headers)
+  
+   async def close(self):
+       """Close all pooled connections"""
+       await self._client.aclose()
+
+
+
+
+def create_transport(
+   pool_size: int = DEFAULT_MAX_CONCURRENCY,
+   http2: bool = False,
+   connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+   read_timeout: float = DEFAULT_READ_TIMEOUT
+) -> HTTPTransport:
+   """
+   Create a pooled transport
+  
+   Args:
+       pool_size: Max pooled connections (match the client's concurrency)
+       http2: Use HTTP/2 multiplexing (requires httpx[http2])
+       connect_timeout: Seconds to wait for a connection
+       read_timeout: Seconds to wait between bytes of the response
+      
+   Returns:
+       Transport instance
+   """
+   transport_class = HTTP2Transport if http2 else HTTPTransport
+   return transport_class(
+       pool_size=pool_size,
+       connect_timeout=connect_timeout,
+       read_timeout=read_timeout
+   )
@@ -7,8 +7,6 @@ import os
 import base64
 from datetime import datetime
 from typing import List, Optional, Dict, Any
-from PIL import Image
-import io
 
 
 from config import (
@@ -17,21 +15,22 @@ from config import (
    MAX_IMAGE_SIZE_MB,
    get_image_size_mb
 )
+from image_metadata import get_image_metadata, remember_image_metadata
+from profiling import profiled
 
 
 
 
-def encode_image_to_base64(image_path: str) -> tuple[str, str]:
+def get_mime_type(image_path: str) -> str:
    """
-   Encode image file to base64 string
+   Determine image MIME type from file extension
   
    Args:
        image_path: Path to image file
       
    Returns:
-       Tuple of (base64_string, mime_type)
+       MIME type string (defaults to image/jpeg)
    """
-   # Determine MIME type from extension
    ext = os.path.splitext(image_path)[1].lower()
    mime_type_map = {
        '.png': 'image/png',
@@ -39,7 +38,24 @@ def encode_image_to_base64(image_path: str) -> tuple[str, str]:
        '.jpeg': 'image/jpeg',
        '.webp': 'image/webp'
    }
-   mime_type = mime_type_map.get(ext, 'image/jpeg')
+   return mime_type_map.get(ext, 'image/jpeg')
+
+
+
+
+@profiled("utils.encode_image_to_base64")
+def encode_image_to_base64(image_path: str) -> tuple[str, str]:
+   """
+   Encode image file to base64 string
+  
+   Args:
+       image_path: Path to image file
+      
+   Returns:
+       Tuple of (base64_string, mime_type)
+   """
+   # Determine MIME type from extension
+   mime_type = get_mime_type(image_path)
   
    # Read and encode
    with open(image_path, 'rb') as f:
@@ -51,37 +67,71 @@ def encode_image_to_base64(image_path: str) -> tuple[str, str]:
 
 
 
-def decode_base64_to_image(base64_string: str, output_path: str) -> str:
+@profiled("utils.decode_base64_data")
+def decode_base64_data(base64_string: str) -> bytes:
    """
-   Decode base64 string to image file
+   Decode base64 image data (plain or data URL) to bytes
   
    Args:
        base64_string: Base64 encoded image data
-       output_path: Path to save decoded image
       
    Returns:
-       Path to saved image file
+       Decoded bytes
    """
    # Handle data URL format (data:image/png;base64,...)
    if ',' in base64_string:
        header, encoded = base64_string.split(',', 1)
    else:
        encoded = base64_string
+   return base64.b64decode(encoded)
+
+
+
+
+@profiled("utils.decode_base64_to_image")
+def decode_base64_to_image(base64_string: str, output_path: str) -> str:
+   """
+   Decode base64 string to image file
   
-   # Decode and save
-   image_data = base64.b64decode(encoded)
+   Args:
+       base64_string: Base64 encoded image data
+       output_path: Path to save decoded image
+      
+   Returns:
+       Path to saved image file
+   """
+   return write_image_bytes(decode_base64_data(base64_string), output_path)
+
+
+
+
+@profiled("utils.write_image_bytes")
+def write_image_bytes(image_data: bytes, output_path: str) -> str:
+   """
+   Write encoded image bytes to a file
   
+   Args:
+       image_data: Encoded image (PNG, JPEG, WebP)
+       output_path: Path to save the image
+      
+   Returns:
+       Path to saved image file
+   """
    # Ensure directory exists
    os.makedirs(os.path.dirname(output_path), exist_ok=True)
   
    with open(output_path, 'wb') as f:
        f.write(image_data)
   
+   # The header is in memory now: get_image_info() will not re-read the file
+   remember_image_metadata(output_path, image_data)
+  
    return output_path
 
 
 
 
+@profiled("utils.validate_reference_images")
 def validate_reference_images(image_paths: List[str]) -> Dict[str, Any]:
    """
    Validate reference images before sending to API
@@ -105,8 +155,10 @@ def validate_reference_images(image_paths: List[str]) -> Dict[str, Any]:
   
    # Check each image
    for image_path in image_paths:
-       # Check existence
-       if not os.path.exists(image_path):
+       # Check existence (a single stat also gives the size)
+       try:
+           size_bytes = os.stat(image_path).st_size
+       except OSError:
            errors.append(f"File not found: {image_path}")
            continue
       
@@ -117,7 +169,7 @@ def validate_reference_images(image_paths: List[str]) -> Dict[str, Any]:
            continue
       
        # Check size
-       size_mb = get_image_size_mb(image_path)
+       size_mb = size_bytes / (1024 * 1024)
        if size_mb > MAX_IMAGE_SIZE_MB:
            errors.append(f"Image too large: {image_path} ({size_mb:.2f}MB, max: {MAX_IMAGE_SIZE_MB}MB)")
            continue
@@ -169,6 +221,26 @@ def generate_filename(
 
 
 
+def match_format_extension(path: str, output_format: str) -> str:
+   """
+   Give path the file extension of output_format
+  
+   Args:
+       path: Output path whose extension may name another format
+       output_format: Format the file is written in (png, jpeg, webp)
+      
+   Returns:
+       path with its extension replaced (".jpg" is kept for jpeg)
+   """
+   base, ext = os.path.splitext(path)
+   extension = ext.lower().lstrip(".")
+   if extension == output_format or (extension == "jpg" and output_format == "jpeg"):
+       return path
+   return f"{base}.{output_format}"
+
+
+
+
 def organize_output_path(
    base_dir: str,
    filename: str,
@@ -199,29 +271,28 @@ def organize_output_path(
 
 
 
+@profiled("utils.get_image_info")
 def get_image_info(image_path: str) -> Dict[str, Any]:
    """
    Get information about an image file
   
+   Dimensions, format and mode come from the file header (cached by path,
+   mtime and size), so this does not decode the image.
+  
    Args:
        image_path: Path to image file
       
    Returns:
        Dict with image information
    """
-   if not os.path.exists(image_path):
-       return {"error": "File not found"}
-  
    try:
-       # Get file info
-       size_bytes = os.path.getsize(image_path)
+       # Get file info and dimensions (from the header)
+       metadata = get_image_metadata(image_path)
+       size_bytes = metadata["size_bytes"]
        size_mb = size_bytes / (1024 * 1024)
-      
-       # Get image dimensions
-       with Image.open(image_path) as img:
-           width, height = img.size
-           format_name = img.format
-           mode = img.mode
+       width, height = metadata["width"], metadata["height"]
+       format_name = metadata["format"]
+       mode = metadata["mode"]
       
        # Calculate aspect ratio
        from math import gcd
@@ -238,12 +309,15 @@ def get_image_info(image_path: str) -> Dict[str, Any]:
            "format": format_name,
            "mode": mode
        }
+   except FileNotFoundError:
+       return {"error": "File not found"}
    except Exception as e:
        return {"error": str(e)}
 
 
 
 
+@profiled("utils.resize_image_if_needed")
 def resize_image_if_needed(
    image_path: str,
    max_size_mb: float = MAX_IMAGE_SIZE_MB,
@@ -265,6 +339,8 @@ def resize_image_if_needed(
    if size_mb <= max_size_mb:
        return None  # No resize needed
   
+   from PIL import Image
+  
    # Open image
    with Image.open(image_path) as img:
        # Calculate scale factor
@@ -292,6 +368,7 @@ def resize_image_if_needed(
 
 
 
+@profiled("utils.create_thumbnail")
 def create_thumbnail(
    image_path: str,
    thumbnail_size: tuple = (256, 256),
@@ -308,6 +385,8 @@ def create_thumbnail(
    Returns:
        Path to thumbnail
    """
+   from PIL import Image
+  
    with Image.open(image_path) as img:
        img.thumbnail(thumbnail_size, Image.Resampling.LANCZOS)
       